@@ -203,8 +203,9 @@ class CachingAuthenticator(object):
 
             log.msg('otter.auth.cache.expired', age=now - created)
 
-        def when_authenticated(result):
+        def when_authenticated((token, catalog)):
             log.msg('otter.auth.cache.populate')
+            result = (token, ServiceCatalog(catalog))
             self._cache[tenant_id] = (self._reactor.seconds(), result)
             return result
 
@@ -498,6 +499,36 @@ def endpoints(service_catalog, service_name, region):
             yield endpoint
 
 
+class ServiceCatalog(list):
+    """
+    A service catalog, as returned by the authentication API, that also
+    carries an index of the first public endpoint URL of every
+    (service name, region) pair.
+
+    The index is built once when the catalog is cached by
+    :class:`CachingAuthenticator`, so that :func:`public_endpoint_url` does not
+    need to scan the whole catalog for every request made with the same token.
+    It still compares equal to, and can be used anywhere as, the plain list of
+    services it was built from.
+
+    :ivar dict public_urls: Mapping of ``(service_name, region)`` to the
+        ``publicURL`` of the first matching endpoint. Endpoints without a
+        region or ``publicURL`` are left out.
+    """
+    def __init__(self, services=()):
+        super(ServiceCatalog, self).__init__(services)
+        self.public_urls = {}
+        for service in self:
+            for endpoint in service.get('endpoints', ()):
+                # Endpoints of global services have no region, and can not be
+                # looked up by region anyway
+                region = endpoint.get('region')
+                url = endpoint.get('publicURL')
+                if region is not None and url is not None:
+                    self.public_urls.setdefault(
+                        (service['name'], region), url)
+
+
 @attributes(['service_name', 'region'])
 class NoSuchEndpoint(Exception):
     """
@@ -512,12 +543,18 @@ def public_endpoint_url(service_catalog, service_name, region):
     """
     Return the first publicURL for a given service in a given region.
 
-    :param list service_catalog: List of services.
+    :param list service_catalog: List of services, or a
+        :class:`ServiceCatalog` whose index will be used instead of scanning.
     :param str service_name: Name of service.  Example: 'cloudServersOpenStack'
     :param str region: Region of service.  Example: 'ORD'
 
     :return: URL as a string.
     """
+    if isinstance(service_catalog, ServiceCatalog):
+        try:
+            return service_catalog.public_urls[(service_name, region)]
+        except KeyError:
+            raise NoSuchEndpoint(service_name=service_name, region=region)
     try:
         first_endpoint = next(endpoints(service_catalog, service_name, region))
     except StopIteration:
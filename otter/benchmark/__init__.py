@@ -0,0 +1,5 @@
+"""
+Benchmarks of otter's hot paths, run against in-process fakes of its
+upstream services so that throughput regressions can be caught before
+deploying.
+"""
@@ -0,0 +1,288 @@
+"""
+Load benchmark of the cloud client stack.
+
+Convergence gathers and step executions are performed within
+:obj:`TenantScope`, through :func:`concretize_service_request`, throttling,
+:mod:`otter.util.pure_http` and treq, against the in-process fake upstream
+services of :mod:`otter.benchmark.upstream` served over a local TCP port.
+Requests per second, latency and CPU time are reported per operation and
+for the HTTP requests made to each service. The fake services run in the
+same process, so the CPU time includes theirs.
+
+Example::
+
+    python -m otter.benchmark.convergence --tenants 10 --servers 100 \\
+        --latency 0.05 --jitter 0.05 --error-rate 0.01 --gathers 500
+
+The ``cloud_client`` section of an otter config file can be given with
+``--config`` to benchmark throttling, circuit breaking or compression
+settings.
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+from argparse import ArgumentParser
+from collections import defaultdict
+from random import Random
+
+from effect import Effect
+
+from pyrsistent import freeze, pset
+
+from twisted.internet.task import react
+from twisted.web.server import Site
+
+from txeffect import perform
+
+from otter.auth import generate_authenticator
+from otter.benchmark.measure import format_summary, run_load
+from otter.benchmark.upstream import FakeUpstream, ServiceBehavior
+from otter.cloud_client import TenantScope
+from otter.constants import get_service_configs
+from otter.convergence.effecting import steps_to_effect
+from otter.convergence.gathering import (
+    get_all_launch_server_data, get_all_scaling_group_servers)
+from otter.convergence.model import CLBDescription
+from otter.convergence.steps import (
+    AddNodesToCLB,
+    BulkAddToRCv3,
+    BulkRemoveFromRCv3,
+    CreateServer,
+    DeleteServer,
+    RemoveNodesFromCLB,
+    SetMetadataItemOnServer)
+from otter.effect_dispatcher import get_legacy_dispatcher
+from otter.log import log as default_log
+from otter.util.config import set_config_data
+from otter.util.metrics import Histogram, registry as default_registry
+
+
+GROUP_ID = 'benchmark-group'
+
+
+def get_dispatcher(reactor, url, region, log):
+    """
+    Get a dispatcher performing cloud client effects against the fake
+    upstream services at ``url``, authenticating by impersonation like otter.
+    """
+    identity = url + '/identity/v2.0'
+    authenticator = generate_authenticator(reactor, {
+        'username': 'admin', 'password': 'password', 'url': identity,
+        'admin_url': identity, 'max_retries': 3, 'retry_interval': 1})
+    service_configs = get_service_configs({
+        'cloudServersOpenStack': 'cloudServersOpenStack',
+        'cloudLoadBalancers': 'cloudLoadBalancers',
+        'cloudOrchestration': 'cloudOrchestration',
+        'rackconnect': 'rackconnect',
+        'region': region})
+    return get_legacy_dispatcher(reactor, authenticator, log, service_configs)
+
+
+def _group_servers(tenant_id, group_id, now):
+    """
+    Get the servers of a group from Nova, as done when the servers cache of
+    the group is empty.
+    """
+    return get_all_scaling_group_servers().on(
+        lambda servers: servers.get(group_id, []))
+
+
+def gather(tenant_id, now):
+    """
+    Gather the servers and load balancer nodes of the benchmark group of a
+    tenant.
+    """
+    return Effect(TenantScope(
+        get_all_launch_server_data(
+            tenant_id, GROUP_ID, now,
+            get_scaling_group_servers=_group_servers),
+        tenant_id))
+
+
+def converge_steps(tenant, random):
+    """
+    Pick steps like those executed when converging a group, based on the
+    current resources of a tenant in the fake upstream services. Servers and
+    nodes are both added and removed, so that the number of resources stays
+    roughly the same.
+
+    :param FakeTenant tenant: The tenant.
+    :param Random random: Used to pick the resources to change.
+    :return: ``list`` of :obj:`IStep` providers.
+    """
+    steps = [CreateServer(server_config=freeze({'server': {
+        'name': 'as', 'imageRef': 'image', 'flavorRef': 'flavor',
+        'metadata': {'rax:autoscale:group:id': GROUP_ID}}}))]
+    if tenant.servers:
+        server_id = random.choice(list(tenant.servers))
+        steps.extend([
+            SetMetadataItemOnServer(server_id=server_id, key='benchmark',
+                                    value='true'),
+            DeleteServer(server_id=server_id)])
+    if tenant.clbs:
+        lb_id = random.choice(list(tenant.clbs))
+        address = '10.255.{}.{}'.format(random.randint(0, 255),
+                                        random.randint(1, 254))
+        steps.append(AddNodesToCLB(
+            lb_id=lb_id,
+            address_configs=pset([(address,
+                                   CLBDescription(lb_id=lb_id, port=80))])))
+        if tenant.clbs[lb_id]:
+            steps.append(RemoveNodesFromCLB(
+                lb_id=lb_id,
+                node_ids=pset([random.choice(list(tenant.clbs[lb_id]))])))
+    if tenant.pools and tenant.servers:
+        pool_id = random.choice(list(tenant.pools))
+        pair = (pool_id, random.choice(list(tenant.servers)))
+        steps.extend([BulkAddToRCv3(lb_node_pairs=pset([pair])),
+                      BulkRemoveFromRCv3(lb_node_pairs=pset([pair]))])
+    return steps
+
+
+def converge(tenant_id, tenant, random):
+    """Execute the steps picked by :func:`converge_steps` on a tenant."""
+    return Effect(TenantScope(
+        steps_to_effect(converge_steps(tenant, random)), tenant_id))
+
+
+def http_summaries(registry, elapsed, cpu):
+    """
+    Summarize the HTTP requests recorded in a metrics registry, per service.
+
+    Latency percentiles are estimated from the buckets of the
+    ``http.request_time`` histograms.
+
+    :return: ``list`` of ``dict`` like :meth:`LoadResult.summary`, with the
+        number of responses per status code added.
+    """
+    services = defaultdict(lambda: {'codes': defaultdict(int),
+                                    'errors': defaultdict(int),
+                                    'time': Histogram()})
+    for entry in registry.snapshot()['counters']:
+        labels = entry['labels']
+        if entry['name'] == 'http.responses':
+            services[labels['service']]['codes'][labels['code']] += (
+                entry['value'])
+        elif entry['name'] == 'http.errors':
+            services[labels['service']]['errors'][labels['error']] += (
+                entry['value'])
+    for labels, histogram in registry.histograms('http.request_time'):
+        services[dict(labels)['service']]['time'].update(histogram)
+
+    total = sum(sum(s['codes'].values()) + sum(s['errors'].values())
+                for s in services.values())
+    summaries = []
+    for service, stats in sorted(services.items()):
+        calls = sum(stats['codes'].values()) + sum(stats['errors'].values())
+        time = stats['time']
+        summaries.append({
+            'name': 'http {}'.format(service),
+            'calls': calls,
+            'codes': dict(stats['codes']),
+            'errors': dict(stats['errors']),
+            'calls_per_second': calls / elapsed if elapsed else None,
+            'p50': time.percentile(50), 'p90': time.percentile(90),
+            'p99': time.percentile(99), 'max': time.max,
+            'cpu_ms_per_call': 1000 * cpu / total if total else None})
+    return summaries
+
+
+def make_parser():
+    """Return the command line argument parser."""
+    parser = ArgumentParser(
+        description='Benchmark convergence gathers and steps against fake '
+                    'upstream services.')
+    add = parser.add_argument
+    add('--tenants', type=int, default=10, help='Number of tenants')
+    add('--servers', type=int, default=100, help='Servers per tenant')
+    add('--clbs', type=int, default=2, help='CLBs per tenant')
+    add('--nodes', type=int, default=50, help='Nodes per CLB')
+    add('--pools', type=int, default=1, help='RCv3 pools per tenant')
+    add('--pool-nodes', type=int, default=50, help='Nodes per RCv3 pool')
+    add('--gathers', type=int, default=200, help='Number of gathers')
+    add('--converges', type=int, default=200,
+        help='Number of step executions')
+    add('--concurrency', type=int, default=10,
+        help='Maximum operations in progress')
+    add('--latency', type=float, default=0, help='Seconds per response')
+    add('--jitter', type=float, default=0,
+        help='Maximum random seconds added to latency')
+    add('--error-rate', type=float, default=0,
+        help='Proportion of 500 responses')
+    add('--rate-limit', type=int, default=None,
+        help='Maximum requests per second per service')
+    add('--seed', type=int, default=0, help='Random seed')
+    add('--config', default=None,
+        help='Otter config file whose cloud_client section is used')
+    add('--json', action='store_true', help='Print summaries as JSON')
+    return parser
+
+
+def main(reactor, *argv):
+    """
+    Run the benchmark and print its results.
+    """
+    options = make_parser().parse_args(argv)
+    config = {}
+    if options.config is not None:
+        with open(options.config) as f:
+            config = {'cloud_client': json.load(f).get('cloud_client', {})}
+    set_config_data(config)
+
+    behavior = ServiceBehavior(
+        latency=options.latency, jitter=options.jitter,
+        error_rate=options.error_rate, rate_limit=options.rate_limit)
+    upstream = FakeUpstream(
+        reactor, behaviors={'nova': behavior, 'clb': behavior,
+                            'rcv3': behavior},
+        seed=options.seed)
+    tenant_ids = ['{}'.format(900000 + i) for i in range(options.tenants)]
+    for tenant_id in tenant_ids:
+        upstream.add_tenant(
+            tenant_id, GROUP_ID, servers=options.servers, clbs=options.clbs,
+            nodes_per_clb=options.nodes, pools=options.pools,
+            nodes_per_pool=options.pool_nodes)
+    port = reactor.listenTCP(0, Site(upstream), interface='127.0.0.1')
+    url = 'http://127.0.0.1:{}'.format(port.getHost().port)
+    log = default_log.bind(system='otter.benchmark')
+    dispatcher = get_dispatcher(reactor, url, upstream.region, log)
+    random = Random(options.seed)
+
+    def run_gather(index):
+        return perform(dispatcher, gather(tenant_ids[index % len(tenant_ids)],
+                                          reactor.seconds()))
+
+    def run_converge(index):
+        tenant_id = tenant_ids[index % len(tenant_ids)]
+        return perform(dispatcher, converge(
+            tenant_id, upstream.tenants[tenant_id], random))
+
+    def report(results):
+        elapsed = sum(result.elapsed for result in results)
+        cpu = sum(result.cpu for result in results)
+        summaries = ([result.summary() for result in results] +
+                     http_summaries(default_registry, elapsed, cpu))
+        if options.json:
+            print(json.dumps(summaries, indent=2, sort_keys=True))
+        else:
+            for summary in summaries:
+                print(format_summary(summary))
+        return port.stopListening()
+
+    # Warm up the authentication cache of every tenant, which is not measured
+    d = run_load(reactor, 'warmup', run_gather, len(tenant_ids),
+                 options.concurrency)
+    d.addCallback(lambda _: default_registry.clear())
+    d.addCallback(lambda _: run_load(reactor, 'gather', run_gather,
+                                     options.gathers, options.concurrency))
+    d.addCallback(lambda gathers: run_load(
+        reactor, 'converge', run_converge, options.converges,
+        options.concurrency).addCallback(lambda converges: [gathers,
+                                                            converges]))
+    return d.addCallback(report)
+
+
+if __name__ == '__main__':
+    react(main, sys.argv[1:])
@@ -0,0 +1,155 @@
+"""
+Benchmark of computing the next occurrences of the cron entries of
+scheduled events, as the scheduler does after executing them.
+
+Events are given cron entries drawn from a realistic distribution: most
+policies use a handful of common entries, and the others use entries of
+their own. Batches of events are computed by parsing every entry, as was
+done before parsed entries were cached, by computing every event from the
+cache, and by computing each distinct entry of a batch once from the cache.
+
+Example::
+
+    python -m otter.benchmark.cron --events 10000 --batchsize 100
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+from argparse import ArgumentParser
+from datetime import datetime
+from random import Random
+
+from croniter import croniter
+
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.task import react
+
+from otter.benchmark.measure import format_summary, run_load
+from otter.models.interface import (
+    next_cron_occurrence, next_cron_occurrences)
+
+
+COMMON_CRONS = [
+    ('0 * * * *', 40),
+    ('*/5 * * * *', 15),
+    ('0 0 * * *', 15),
+    ('30 8 * * 1-5', 10),
+    ('0 18 * * 1-5', 10),
+    ('*/15 9-17 * * mon-fri', 5),
+    ('0 6 1 * *', 5)]
+"""Common cron entries with their weight among the common entries."""
+
+
+def cron_entries(events, unique, random):
+    """
+    Return cron entries of events.
+
+    :param int events: Number of entries.
+    :param float unique: Proportion of entries not among the common ones,
+        each used by a few events.
+    :param random: :obj:`Random` used to pick the entries.
+    """
+    common = [cron for cron, weight in COMMON_CRONS for _ in range(weight)]
+    entries = []
+    for _ in range(events):
+        if random.random() < unique:
+            entries.append('{} {} * * *'.format(random.randint(0, 59),
+                                                random.randint(0, 23)))
+        else:
+            entries.append(random.choice(common))
+    return entries
+
+
+def parse_each(entries, now):
+    """
+    Compute next occurrences by parsing every entry.
+    """
+    return [croniter(cron, start_time=now).get_next(ret_type=datetime)
+            for cron in entries]
+
+
+def cached_each(entries, now):
+    """
+    Compute next occurrences of every entry from the cache.
+    """
+    return [next_cron_occurrence(cron, now) for cron in entries]
+
+
+def cached_distinct(entries, now):
+    """
+    Compute next occurrences of each distinct entry once from the cache.
+    """
+    triggers = next_cron_occurrences(entries, now)
+    return [triggers[cron] for cron in entries]
+
+
+METHODS = [('parse_each', parse_each), ('cached_each', cached_each),
+           ('cached_distinct', cached_distinct)]
+
+
+@inlineCallbacks
+def run_methods(clock, entries, batchsize, now):
+    """
+    Compute the next occurrences of entries in batches with each method.
+
+    :return: Deferred that fires with a list of :meth:`LoadResult.summary`,
+        whose calls are batches.
+    :raise AssertionError: if the methods do not compute the same
+        occurrences.
+    """
+    batches = [entries[i:i + batchsize]
+               for i in range(0, len(entries), batchsize)]
+    summaries = []
+    expected = None
+    for name, method in METHODS:
+        triggers = []
+        result = yield run_load(
+            clock, name,
+            lambda index: triggers.extend(method(batches[index], now)),
+            len(batches), 1)
+        if expected is None:
+            expected = triggers
+        elif triggers != expected:
+            raise AssertionError('{} computed other occurrences'.format(name))
+        summaries.append(result.summary())
+    returnValue(summaries)
+
+
+def make_parser():
+    """Return the command line argument parser."""
+    parser = ArgumentParser(
+        description='Benchmark computing next occurrences of cron entries.')
+    add = parser.add_argument
+    add('--events', type=int, default=10000, help='Number of events')
+    add('--batchsize', type=int, default=100,
+        help='Events computed at a time, as fetched by the scheduler')
+    add('--unique', type=float, default=0.1,
+        help='Proportion of events with an uncommon cron entry')
+    add('--seed', type=int, default=0, help='Random seed')
+    add('--json', action='store_true', help='Print summaries as JSON')
+    return parser
+
+
+def main(reactor, *argv):
+    """
+    Run the benchmark and print its results.
+    """
+    options = make_parser().parse_args(argv)
+    entries = cron_entries(options.events, options.unique,
+                           Random(options.seed))
+
+    def report(summaries):
+        if options.json:
+            print(json.dumps(summaries, indent=2, sort_keys=True))
+        else:
+            for summary in summaries:
+                print(format_summary(summary))
+
+    d = run_methods(reactor, entries, options.batchsize, datetime.utcnow())
+    return d.addCallback(report)
+
+
+if __name__ == '__main__':
+    react(main, sys.argv[1:])
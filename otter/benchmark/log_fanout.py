@@ -0,0 +1,145 @@
+"""
+Benchmark of fanning out convergence log events to the observers of the
+global fanout: the observer formatting events for output, and the Cloud
+Feeds observer, which ignores events that are not meant for Cloud Feeds.
+
+Events are fanned out by copying them for each observer, as was done before,
+and by sharing them between the observers. The JSON encoding of formatted
+events is left out, as it is done by the background writer.
+
+Example::
+
+    python -m otter.benchmark.log_fanout --events 100000 --servers 50
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+import time
+from argparse import ArgumentParser
+
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.task import react
+
+from otter.benchmark.measure import format_summary, run_load
+from otter.log.cloudfeeds import CloudFeedsObserver
+from otter.log.formatters import FanoutObserver, ObserverWrapper
+
+
+def convergence_events(servers):
+    """
+    Return the events logged by a convergence cycle of a group, as given to
+    the fanout. None of them are meant for Cloud Feeds.
+
+    :param int servers: Number of servers in the group.
+    """
+    base = {'time': time.time(), 'system': 'otter.convergence',
+            'level': 6, 'tenant_id': 'tid', 'scaling_group_id': 'gid',
+            'cloud_feed': False}
+    server_list = [
+        {'id': 'server{}'.format(i), 'state': 'ACTIVE',
+         'servicenet_address': '10.0.0.{}'.format(i % 256),
+         'desired_lbs': [{'lb_id': 'lb', 'port': 80}]}
+        for i in range(servers)]
+
+    def event(message, **fields):
+        return dict(base, message=(message,), otter_msg_type=message,
+                    **fields)
+
+    return [
+        event('begin-convergence'),
+        event('gather-convergence-data', servers=server_list,
+              lb_nodes=[{'address': s['servicenet_address'], 'port': 80}
+                        for s in server_list]),
+        event('execute-convergence', steps=['CreateServer'] * 3,
+              desired={'desired': servers + 3}, servers=server_list),
+        event('execute-convergence-results', worst_status='SUCCESS',
+              results=[]),
+        event('group-converged', desired_capacity=servers + 3),
+        event('mark-clean-success')]
+
+
+class CopyingFanoutObserver(FanoutObserver):
+    """
+    Fanout observer copying the event for each observer.
+    """
+    def __call__(self, event_dict):
+        for ob in self.subobservers:
+            ob(event_dict.copy())
+
+
+def make_fanout(factory):
+    """
+    Return a fanout created with ``factory`` to a formatting observer and a
+    Cloud Feeds observer, neither of which do anything with the events.
+    """
+    fanout = factory(ObserverWrapper(lambda event: None, hostname='host'))
+    fanout.add_observer(CloudFeedsObserver(
+        reactor=None, authenticator=None, tenant_id='tid', region='ord',
+        service_configs={}))
+    return fanout
+
+
+FANOUTS = [('copying', CopyingFanoutObserver), ('shared', FanoutObserver)]
+
+
+@inlineCallbacks
+def run_fanouts(clock, events, cycles):
+    """
+    Fan out the events of each convergence cycle with each fanout.
+
+    :return: Deferred that fires with a list of :meth:`LoadResult.summary`,
+        whose calls are cycles, with the CPU microseconds per event in
+        ``cpu_us_per_event``.
+    """
+    summaries = []
+    for name, factory in FANOUTS:
+        fanout = make_fanout(factory)
+
+        def cycle(index):
+            for event in events:
+                fanout(event)
+
+        result = yield run_load(clock, name, cycle, cycles, 1)
+        summary = result.summary()
+        summary['cpu_us_per_event'] = (
+            1000 * summary['cpu_ms_per_call'] / len(events))
+        summaries.append(summary)
+    returnValue(summaries)
+
+
+def make_parser():
+    """Return the command line argument parser."""
+    parser = ArgumentParser(
+        description='Benchmark fanning out convergence log events.')
+    add = parser.add_argument
+    add('--events', type=int, default=100000,
+        help='Number of events, rounded to whole convergence cycles')
+    add('--servers', type=int, default=50, help='Servers in the group')
+    add('--json', action='store_true', help='Print summaries as JSON')
+    return parser
+
+
+def main(reactor, *argv):
+    """
+    Run the benchmark and print its results.
+    """
+    options = make_parser().parse_args(argv)
+    events = convergence_events(options.servers)
+
+    def report(summaries):
+        if options.json:
+            print(json.dumps(summaries, indent=2, sort_keys=True))
+        else:
+            for summary in summaries:
+                print('{}, {:.2f} us CPU/event'.format(
+                    format_summary(summary), summary['cpu_us_per_event']))
+
+    d = run_fanouts(reactor, events,
+                    max(options.events // len(events), 1))
+    return d.addCallback(report)
+
+
+if __name__ == '__main__':
+    react(main, sys.argv[1:])
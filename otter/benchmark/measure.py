@@ -0,0 +1,133 @@
+"""
+Running operations under load and summarizing their throughput, latency and
+CPU usage.
+"""
+import math
+import resource
+from collections import defaultdict
+
+import attr
+
+from twisted.internet.defer import gatherResults, inlineCallbacks, returnValue
+
+
+def cpu_time():
+    """Return the user and system CPU seconds used by this process."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of sorted values.
+
+    :param list values: Sorted values.
+    :param float pct: Percentile between 0 and 100.
+    :return: the value, or None if there are no values.
+    """
+    if not values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+@attr.s
+class LoadResult(object):
+    """
+    Outcome of calling an operation under load.
+
+    :ivar str name: Name of the operation.
+    :ivar list latencies: Sorted durations in seconds of the calls that
+        succeeded.
+    :ivar dict errors: Number of failed calls by exception type name.
+    :ivar float elapsed: Wall clock seconds taken by all the calls.
+    :ivar float cpu: CPU seconds used by the process during the calls.
+    """
+    name = attr.ib()
+    latencies = attr.ib()
+    errors = attr.ib()
+    elapsed = attr.ib()
+    cpu = attr.ib()
+
+    @property
+    def calls(self):
+        """Number of calls made."""
+        return len(self.latencies) + sum(self.errors.values())
+
+    def summary(self):
+        """
+        :return: ``dict`` of the number of calls and errors, calls per second,
+            latency percentiles and maximum, and CPU milliseconds per call.
+        """
+        calls = self.calls
+        return {
+            'name': self.name,
+            'calls': calls,
+            'errors': dict(self.errors),
+            'calls_per_second': calls / self.elapsed if self.elapsed else None,
+            'p50': percentile(self.latencies, 50),
+            'p90': percentile(self.latencies, 90),
+            'p99': percentile(self.latencies, 99),
+            'max': self.latencies[-1] if self.latencies else None,
+            'cpu_ms_per_call': 1000 * self.cpu / calls if calls else None}
+
+
+@inlineCallbacks
+def run_load(clock, name, operation, calls, concurrency):
+    """
+    Call an operation a number of times, keeping up to ``concurrency`` calls
+    in progress, and time each call.
+
+    :param IReactorTime clock: Used to time calls.
+    :param str name: Name of the operation, for the result.
+    :param callable operation: Called with the index of the call, and returns
+        a Deferred.
+    :param int calls: Number of calls to make.
+    :param int concurrency: Maximum number of calls in progress.
+    :return: Deferred that fires with a :obj:`LoadResult`.
+    """
+    indexes = iter(range(calls))
+    latencies = []
+    errors = defaultdict(int)
+
+    @inlineCallbacks
+    def worker():
+        for index in indexes:
+            start = clock.seconds()
+            try:
+                yield operation(index)
+            except Exception as e:
+                errors[type(e).__name__] += 1
+            else:
+                latencies.append(clock.seconds() - start)
+
+    start, start_cpu = clock.seconds(), cpu_time()
+    yield gatherResults([worker() for _ in range(concurrency)])
+    returnValue(LoadResult(
+        name=name, latencies=sorted(latencies), errors=dict(errors),
+        elapsed=clock.seconds() - start, cpu=cpu_time() - start_cpu))
+
+
+def format_summary(summary):
+    """
+    Format a :meth:`LoadResult.summary` as a line of text.
+    """
+    def seconds(value):
+        return '-' if value is None else '{:.4f}s'.format(value)
+
+    def counts(name, values):
+        return ', {} {}'.format(name, ' '.join(
+            '{}={}'.format(k, v) for k, v in sorted(values.items())))
+
+    return (
+        '{name}: {calls} calls, {rate} calls/s, latency p50 {p50} p90 {p90} '
+        'p99 {p99} max {max}, {cpu} ms CPU/call{codes}{errors}'.format(
+            name=summary['name'], calls=summary['calls'],
+            rate='{:.1f}'.format(summary['calls_per_second'] or 0),
+            p50=seconds(summary['p50']), p90=seconds(summary['p90']),
+            p99=seconds(summary['p99']), max=seconds(summary['max']),
+            cpu='{:.3f}'.format(summary['cpu_ms_per_call'] or 0),
+            codes=counts('codes', summary['codes'])
+            if summary.get('codes') else '',
+            errors=counts('errors', summary['errors'])
+            if summary['errors'] else ''))
@@ -0,0 +1,177 @@
+"""
+Benchmark of modifying the state of scaling groups with ZooKeeper locks and
+with Cassandra compare-and-set.
+
+Unlike the other benchmarks, this one needs the Cassandra cluster and
+ZooKeeper ensemble given in the ``cassandra`` and ``zookeeper`` sections of
+an otter config file. Groups are created under a new tenant, their desired
+capacity is incremented concurrently through several simulated otter nodes
+with each engine, and the groups are deleted afterwards. Increments that
+succeeded but were not kept are reported as lost updates.
+
+Example::
+
+    python -m otter.benchmark.modify_state --config config.json \\
+        --groups 5 --nodes 3 --calls 2000 --concurrency 50
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+import uuid
+from argparse import ArgumentParser
+
+from kazoo.client import KazooClient
+
+from silverberg.client import ConsistencyLevel
+
+from twisted.internet.defer import gatherResults, inlineCallbacks, returnValue
+from twisted.internet.endpoints import clientFromString
+from twisted.internet.task import react
+from twisted.python.threadpool import ThreadPool
+
+from txkazoo import TxKazooClient
+
+from otter.benchmark.measure import format_summary, run_load
+from otter.log import log as default_log
+from otter.models.cass import CassScalingGroupCollection
+from otter.util.cqlprepared import PreparingCassandraCluster
+
+
+def bump_desired(group, state):
+    """
+    Modifier incrementing the desired capacity of a group.
+    """
+    state.desired += 1
+    return state
+
+
+def total_desired(collection, log, tenant_id, group_ids):
+    """
+    Get the sum of the desired capacities of groups.
+
+    :return: Deferred that fires with an ``int``.
+    """
+    d = gatherResults([
+        collection.get_scaling_group(log, tenant_id, group_id).view_state(
+            ConsistencyLevel.QUORUM)
+        for group_id in group_ids])
+    return d.addCallback(lambda states: sum(s.desired for s in states))
+
+
+@inlineCallbacks
+def run_engine(clock, name, collections, log, tenant_id, group_ids, calls,
+               concurrency):
+    """
+    Increment the desired capacity of groups through several collections,
+    each standing for an otter node.
+
+    :param list collections: :obj:`CassScalingGroupCollection` used in turn.
+    :param list group_ids: Groups modified in turn.
+    :return: Deferred that fires with a :meth:`LoadResult.summary`, with
+        the number of lost updates added.
+    """
+    def modify(index):
+        collection = collections[index % len(collections)]
+        group = collection.get_scaling_group(
+            log, tenant_id, group_ids[index % len(group_ids)])
+        return group.modify_state(bump_desired,
+                                  modify_state_reason='benchmark')
+
+    before = yield total_desired(collections[0], log, tenant_id, group_ids)
+    result = yield run_load(clock, name, modify, calls, concurrency)
+    after = yield total_desired(collections[0], log, tenant_id, group_ids)
+    summary = result.summary()
+    summary['lost_updates'] = len(result.latencies) - (after - before)
+    returnValue(summary)
+
+
+def make_parser():
+    """Return the command line argument parser."""
+    parser = ArgumentParser(
+        description='Benchmark modifying group states with ZooKeeper locks '
+                    'and with Cassandra compare-and-set.')
+    add = parser.add_argument
+    add('--config', required=True,
+        help='Otter config file whose cassandra and zookeeper sections are '
+             'used')
+    add('--groups', type=int, default=5, help='Number of groups modified')
+    add('--nodes', type=int, default=3, help='Number of simulated nodes')
+    add('--calls', type=int, default=1000,
+        help='Number of state modifications per engine')
+    add('--concurrency', type=int, default=20,
+        help='Maximum modifications in progress')
+    add('--cas-retries', type=int, default=10,
+        help='Retries of conflicting compare-and-set modifications')
+    add('--engines', default='lock,cas',
+        help='Comma separated engines to benchmark, among lock and cas')
+    add('--json', action='store_true', help='Print summaries as JSON')
+    return parser
+
+
+@inlineCallbacks
+def main(reactor, *argv):
+    """
+    Run the benchmark and print its results.
+    """
+    options = make_parser().parse_args(argv)
+    with open(options.config) as f:
+        config = json.load(f)
+    log = default_log.bind(system='otter.benchmark')
+
+    connection = PreparingCassandraCluster(
+        [clientFromString(reactor, str(host))
+         for host in config['cassandra']['seed_hosts']],
+        config['cassandra']['keyspace'])
+    threadpool = ThreadPool(maxthreads=config['zookeeper'].get('threads', 10))
+    kz_client = TxKazooClient(
+        reactor, threadpool, KazooClient(hosts=config['zookeeper']['hosts']))
+    yield kz_client.start()
+
+    def collections(cas_retries):
+        nodes = []
+        for _ in range(options.nodes):
+            collection = CassScalingGroupCollection(
+                connection, reactor, options.groups, cas_retries=cas_retries)
+            collection.kz_client = kz_client
+            nodes.append(collection)
+        return nodes
+
+    tenant_id = 'benchmark-{}'.format(uuid.uuid4().hex[:8])
+    store = collections(None)[0]
+    group_ids = []
+    for i in range(options.groups):
+        manifest = yield store.create_scaling_group(
+            log, tenant_id,
+            {'name': 'benchmark-{}'.format(i), 'cooldown': 0,
+             'minEntities': 0, 'maxEntities': None, 'metadata': {}},
+            {'type': 'launch_server',
+             'args': {'server': {'imageRef': 'image', 'flavorRef': 'flavor'}}})
+        group_ids.append(manifest['id'])
+
+    summaries = []
+    try:
+        for engine in options.engines.split(','):
+            cas_retries = options.cas_retries if engine == 'cas' else None
+            summary = yield run_engine(
+                reactor, engine, collections(cas_retries), log, tenant_id,
+                group_ids, options.calls, options.concurrency)
+            summaries.append(summary)
+    finally:
+        for group_id in group_ids:
+            yield store.get_scaling_group(
+                log, tenant_id, group_id).delete_group()
+        yield kz_client.stop()
+        yield connection.disconnect()
+
+    if options.json:
+        print(json.dumps(summaries, indent=2, sort_keys=True))
+    else:
+        for summary in summaries:
+            print('{}, {} lost updates'.format(format_summary(summary),
+                                               summary['lost_updates']))
+
+
+if __name__ == '__main__':
+    react(main, sys.argv[1:])
@@ -0,0 +1,437 @@
+"""
+An in-process fake of the Identity, Nova, CLB and RackConnect v3 APIs used by
+convergence, with configurable latency, errors and rate limits per service.
+
+The fake only implements the requests otter makes, and only as faithfully as
+needed for otter to parse the responses. It is served as a single
+:obj:`Resource` under these paths:
+
+- ``/identity/v2.0`` and ``/identity/v1.1``: the identity (admin) API used by
+  :obj:`otter.auth.ImpersonatingAuthenticator`.
+- ``/nova/<tenant_id>``, ``/clb/<tenant_id>``, ``/rcv3/<tenant_id>``: the
+  public endpoints returned in the service catalog of a tenant.
+"""
+import json
+import re
+from collections import OrderedDict, defaultdict
+from itertools import count
+from random import Random
+from urllib import urlencode
+
+import attr
+
+from twisted.internet.task import deferLater
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+
+from otter.util.timestamp import epoch_to_utctimestr
+
+
+SERVICES = ('identity', 'nova', 'clb', 'rcv3')
+"""Names of the faked services, as used for their behaviors."""
+
+
+@attr.s
+class ServiceBehavior(object):
+    """
+    How a fake service responds.
+
+    :ivar float latency: Seconds to wait before responding.
+    :ivar float jitter: Up to this many more seconds, picked uniformly at
+        random, are waited before responding.
+    :ivar float error_rate: Proportion of requests that get a 500 response.
+    :ivar int rate_limit: Maximum number of requests accepted per second,
+        over which requests get a 413 response. None for no limit.
+    """
+    latency = attr.ib(default=0)
+    jitter = attr.ib(default=0)
+    error_rate = attr.ib(default=0)
+    rate_limit = attr.ib(default=None)
+
+
+@attr.s
+class FakeTenant(object):
+    """
+    Resources of a tenant in the fake services.
+
+    :ivar OrderedDict servers: Nova server JSON by server ID, in creation
+        order.
+    :ivar dict clbs: CLB node JSON by node ID, by CLB ID.
+    :ivar dict pools: RCv3 node JSON by server ID, by pool ID.
+    """
+    servers = attr.ib(default=attr.Factory(OrderedDict))
+    clbs = attr.ib(default=attr.Factory(OrderedDict))
+    pools = attr.ib(default=attr.Factory(OrderedDict))
+
+
+def _error(code, kind, message):
+    """Response with an error body in the Nova style."""
+    return code, {kind: {'code': code, 'message': message}}
+
+
+class FakeUpstream(Resource):
+    """
+    The fake services, as a :obj:`Resource` to be served over HTTP.
+
+    :ivar dict tenants: :obj:`FakeTenant` by tenant ID.
+    :ivar dict requests: Number of requests received by each service.
+    :ivar dict behaviors: :obj:`ServiceBehavior` by service name.
+    """
+    isLeaf = True
+
+    def __init__(self, clock, region='ORD', behaviors=None, seed=0):
+        """
+        :param IReactorTime clock: Used to delay responses and to timestamp
+            resources and rate limit windows.
+        :param str region: Region of the endpoints in service catalogs.
+        :param dict behaviors: :obj:`ServiceBehavior` by service name. Missing
+            services respond immediately and never fail.
+        :param seed: Seed of the random numbers used for jitter and errors.
+        """
+        Resource.__init__(self)
+        self.clock = clock
+        self.region = region
+        self.behaviors = dict((service, ServiceBehavior())
+                              for service in SERVICES)
+        self.behaviors.update(behaviors or {})
+        self.tenants = {}
+        self.requests = defaultdict(int)
+        self._random = Random(seed)
+        self._ids = count(1)
+        self._windows = {}
+        self._routes = [
+            (method, re.compile('^/{}$'.format(pattern)), service,
+             getattr(self, handler))
+            for method, service, pattern, handler in [
+                ('POST', 'identity', r'identity/v2\.0/tokens', 'auth'),
+                ('GET', 'identity', r'identity/v1\.1/mosso/([^/]+)',
+                 'user_for_tenant'),
+                ('POST', 'identity',
+                 r'identity/v2\.0/RAX-AUTH/impersonation-tokens',
+                 'impersonate'),
+                ('GET', 'identity', r'identity/v2\.0/tokens/([^/]+)/endpoints',
+                 'endpoints'),
+                ('GET', 'nova', r'nova/([^/]+)/servers/detail',
+                 'list_servers'),
+                ('POST', 'nova', r'nova/([^/]+)/servers', 'create_server'),
+                ('GET', 'nova', r'nova/([^/]+)/servers/([^/]+)', 'get_server'),
+                ('DELETE', 'nova', r'nova/([^/]+)/servers/([^/]+)',
+                 'delete_server'),
+                ('PUT', 'nova', r'nova/([^/]+)/servers/([^/]+)/metadata/(.+)',
+                 'set_metadata_item'),
+                ('GET', 'clb', r'clb/([^/]+)/loadbalancers', 'list_clbs'),
+                ('GET', 'clb', r'clb/([^/]+)/loadbalancers/([^/]+)/nodes',
+                 'list_clb_nodes'),
+                ('POST', 'clb', r'clb/([^/]+)/loadbalancers/([^/]+)/nodes',
+                 'add_clb_nodes'),
+                ('DELETE', 'clb', r'clb/([^/]+)/loadbalancers/([^/]+)/nodes',
+                 'remove_clb_nodes'),
+                ('GET', 'rcv3', r'rcv3/([^/]+)/load_balancer_pools',
+                 'list_pools'),
+                ('POST', 'rcv3', r'rcv3/([^/]+)/load_balancer_pools/nodes',
+                 'add_pool_nodes'),
+                ('DELETE', 'rcv3', r'rcv3/([^/]+)/load_balancer_pools/nodes',
+                 'remove_pool_nodes'),
+                ('GET', 'rcv3', r'rcv3/([^/]+)/load_balancer_pools/([^/]+)/'
+                 r'nodes', 'list_pool_nodes')]]
+
+    def _id(self):
+        """Generate a new resource ID."""
+        return str(next(self._ids))
+
+    def add_tenant(self, tenant_id, group_id, servers=0, clbs=0,
+                   nodes_per_clb=0, pools=0, nodes_per_pool=0):
+        """
+        Create a tenant with servers in a scaling group, and CLBs and RCv3
+        pools whose nodes are those servers.
+
+        :return: the :obj:`FakeTenant`.
+        """
+        tenant = self.tenants[tenant_id] = FakeTenant()
+        for _ in range(servers):
+            self._add_server(tenant, {
+                'name': 'server', 'imageRef': 'image', 'flavorRef': 'flavor',
+                'metadata': {'rax:autoscale:group:id': group_id}})
+        server_ids = list(tenant.servers)
+        for _ in range(clbs):
+            nodes = tenant.clbs[self._id()] = OrderedDict()
+            for server_id in server_ids[:nodes_per_clb]:
+                self._add_clb_node(nodes, {
+                    'address': self._address(tenant.servers[server_id]),
+                    'port': 80, 'condition': 'ENABLED', 'type': 'PRIMARY',
+                    'weight': 1})
+        for _ in range(pools):
+            pool_id = self._id()
+            tenant.pools[pool_id] = OrderedDict(
+                (server_id, self._pool_node(pool_id, server_id))
+                for server_id in server_ids[:nodes_per_pool])
+        return tenant
+
+    def _address(self, server):
+        """The servicenet address of a server."""
+        return server['addresses']['private'][0]['addr']
+
+    def _add_server(self, tenant, server_args):
+        """Create a server from the arguments of a create server request."""
+        server_id = self._id()
+        server = tenant.servers[server_id] = {
+            'id': server_id,
+            'name': server_args.get('name', server_id),
+            'status': 'ACTIVE',
+            'created': epoch_to_utctimestr(self.clock.seconds()),
+            'updated': epoch_to_utctimestr(self.clock.seconds()),
+            'image': {'id': server_args.get('imageRef')},
+            'flavor': {'id': server_args.get('flavorRef')},
+            'metadata': dict(server_args.get('metadata', {})),
+            'addresses': {'private': [{
+                'addr': '10.{}.{}.{}'.format(
+                    int(server_id) >> 16 & 255, int(server_id) >> 8 & 255,
+                    int(server_id) & 255),
+                'version': 4}]},
+            'links': [{'href': 'http://nova/servers/' + server_id,
+                       'rel': 'self'}]}
+        return server
+
+    def _add_clb_node(self, nodes, node):
+        """Add a node to the nodes of a CLB."""
+        node = dict(node, id=int(self._id()), status='ONLINE')
+        nodes[str(node['id'])] = node
+        return node
+
+    def _pool_node(self, pool_id, server_id):
+        """Node JSON of a server in an RCv3 pool."""
+        return {'id': self._id(), 'status': 'ACTIVE',
+                'cloud_server': {'id': server_id},
+                'load_balancer_pool': {'id': pool_id}}
+
+    def _limited(self, service):
+        """Tell if a request to the service is over its rate limit."""
+        limit = self.behaviors[service].rate_limit
+        if limit is None:
+            return False
+        second = int(self.clock.seconds())
+        window, requests = self._windows.get(service, (second, 0))
+        if window != second:
+            window, requests = second, 0
+        self._windows[service] = (window, requests + 1)
+        return requests >= limit
+
+    def render(self, request):
+        """
+        Route the request to its handler, and write the response after the
+        latency of the service unless it is rate limited or fails.
+        """
+        path = '/' + '/'.join(request.postpath)
+        for method, pattern, service, handler in self._routes:
+            match = pattern.match(path)
+            if match is not None and method == request.method:
+                break
+        else:
+            return self._respond(
+                request, *_error(404, 'itemNotFound', 'No such resource'))
+
+        self.requests[service] += 1
+        behavior = self.behaviors[service]
+        if self._limited(service):
+            response = _error(413, 'overLimit', 'OverLimit Retry...')
+        elif self._random.random() < behavior.error_rate:
+            response = _error(500, 'computeFault', 'Fake failure')
+        else:
+            body = request.content.read()
+            response = handler(request, json.loads(body) if body else None,
+                               *match.groups())
+
+        delay = behavior.latency + self._random.uniform(0, behavior.jitter)
+        if delay <= 0:
+            return self._respond(request, *response)
+
+        disconnected = []
+        request.notifyFinish().addErrback(disconnected.append)
+
+        def respond():
+            if not disconnected:
+                request.write(self._respond(request, *response))
+                request.finish()
+
+        deferLater(self.clock, delay, respond)
+        return NOT_DONE_YET
+
+    def _respond(self, request, code, body):
+        """Set the response code and return the JSON body."""
+        request.setResponseCode(code)
+        if body is None:
+            return ''
+        request.setHeader('content-type', 'application/json')
+        return json.dumps(body)
+
+    def _tenant(self, tenant_id):
+        """Get a tenant, creating it if it does not exist."""
+        tenant = self.tenants.get(tenant_id)
+        if tenant is None:
+            tenant = self.tenants[tenant_id] = FakeTenant()
+        return tenant
+
+    # Identity
+
+    def auth(self, request, body):
+        """Authenticate the identity admin user."""
+        username = body['auth']['passwordCredentials']['username']
+        return 200, {'access': {'token': {'id': 'token-' + username},
+                                'serviceCatalog': []}}
+
+    def user_for_tenant(self, request, body, tenant_id):
+        """Get the user of a tenant."""
+        return 301, {'user': {'id': 'user-' + tenant_id}}
+
+    def impersonate(self, request, body):
+        """Get a token for a user of a tenant."""
+        username = body['RAX-AUTH:impersonation']['user']['username']
+        return 200, {'access': {'token': {'id': 'token-' + username}}}
+
+    def endpoints(self, request, body, token):
+        """Get the endpoints of the tenant of a token."""
+        tenant_id = token[len('token-user-'):]
+        root = 'http://{}:{}'.format(request.getRequestHostname(),
+                                     request.getHost().port)
+        return 200, {'endpoints': [
+            {'name': name, 'type': type_, 'region': self.region,
+             'tenantId': tenant_id,
+             'publicURL': '{}/{}/{}'.format(root, path, tenant_id)}
+            for name, type_, path in [
+                ('cloudServersOpenStack', 'compute', 'nova'),
+                ('cloudLoadBalancers', 'rax:load-balancer', 'clb'),
+                ('rackconnect', 'rax:rackconnect', 'rcv3')]]}
+
+    # Nova
+
+    def list_servers(self, request, body, tenant_id):
+        """
+        List a page of server details, after the ``marker`` server if any.
+        ``changes-since`` is ignored.
+        """
+        servers = self._tenant(tenant_id).servers
+        limit = int(request.args.get('limit', ['1000'])[0])
+        ids = list(servers)
+        start = 0
+        marker = request.args.get('marker', [None])[0]
+        if marker in servers:
+            start = ids.index(marker) + 1
+        page = [servers[server_id] for server_id in ids[start:start + limit]]
+        body = {'servers': page}
+        if len(page) == limit and start + limit < len(ids):
+            query = urlencode([('limit', limit), ('marker', page[-1]['id'])])
+            body['servers_links'] = [
+                {'rel': 'next',
+                 'href': 'http://nova/servers/detail?' + query}]
+        return 200, body
+
+    def create_server(self, request, body, tenant_id):
+        """Create a server, which is immediately active."""
+        server = self._add_server(self._tenant(tenant_id), body['server'])
+        return 202, {'server': {'id': server['id'], 'links': server['links'],
+                                'adminPass': 'password'}}
+
+    def get_server(self, request, body, tenant_id, server_id):
+        """Get the details of a server."""
+        server = self._tenant(tenant_id).servers.get(server_id)
+        if server is None:
+            return _error(404, 'itemNotFound', 'Instance could not be found')
+        return 200, {'server': server}
+
+    def delete_server(self, request, body, tenant_id, server_id):
+        """Delete a server."""
+        tenant = self._tenant(tenant_id)
+        if tenant.servers.pop(server_id, None) is None:
+            return _error(404, 'itemNotFound', 'Instance could not be found')
+        return 204, None
+
+    def set_metadata_item(self, request, body, tenant_id, server_id, key):
+        """Set a metadata item on a server."""
+        server = self._tenant(tenant_id).servers.get(server_id)
+        if server is None:
+            return _error(404, 'itemNotFound', 'Server does not exist')
+        server['metadata'].update(body['meta'])
+        return 200, body
+
+    # CLB
+
+    def list_clbs(self, request, body, tenant_id):
+        """List the load balancers of a tenant."""
+        return 200, {'loadBalancers': [
+            {'id': int(lb_id), 'name': 'lb-' + lb_id, 'status': 'ACTIVE'}
+            for lb_id in self._tenant(tenant_id).clbs]}
+
+    def _clb_nodes(self, tenant_id, lb_id):
+        """Get the nodes of a CLB, or None if it does not exist."""
+        return self._tenant(tenant_id).clbs.get(lb_id)
+
+    def list_clb_nodes(self, request, body, tenant_id, lb_id):
+        """List the nodes of a load balancer."""
+        nodes = self._clb_nodes(tenant_id, lb_id)
+        if nodes is None:
+            return 404, {'message': 'Load balancer not found', 'code': 404}
+        return 200, {'nodes': nodes.values()}
+
+    def add_clb_nodes(self, request, body, tenant_id, lb_id):
+        """Add nodes to a load balancer."""
+        nodes = self._clb_nodes(tenant_id, lb_id)
+        if nodes is None:
+            return 404, {'message': 'Load balancer not found', 'code': 404}
+        return 202, {'nodes': [self._add_clb_node(nodes, node)
+                               for node in body['nodes']]}
+
+    def remove_clb_nodes(self, request, body, tenant_id, lb_id):
+        """
+        Remove nodes from a load balancer. If some of them do not exist,
+        nothing is removed and the missing nodes are reported.
+        """
+        nodes = self._clb_nodes(tenant_id, lb_id)
+        if nodes is None:
+            return 404, {'message': 'Load balancer not found', 'code': 404}
+        node_ids = request.args.get('id', [])
+        missing = [node_id for node_id in node_ids if node_id not in nodes]
+        if missing:
+            return 400, {
+                'validationErrors': {'messages': [
+                    'Node ids {} are not a part of your loadbalancer'.format(
+                        ','.join(missing))]},
+                'message': 'Validation Failure', 'code': 400}
+        for node_id in node_ids:
+            del nodes[node_id]
+        return 202, None
+
+    # RCv3
+
+    def list_pools(self, request, body, tenant_id):
+        """List the load balancer pools of a tenant."""
+        return 200, [{'id': pool_id, 'name': 'pool-' + pool_id,
+                      'status': 'ACTIVE'}
+                     for pool_id in self._tenant(tenant_id).pools]
+
+    def list_pool_nodes(self, request, body, tenant_id, pool_id):
+        """List the nodes of a load balancer pool."""
+        nodes = self._tenant(tenant_id).pools.get(pool_id)
+        if nodes is None:
+            return 404, None
+        return 200, nodes.values()
+
+    def add_pool_nodes(self, request, body, tenant_id):
+        """Add servers to load balancer pools, ignoring existing ones."""
+        pools = self._tenant(tenant_id).pools
+        added = []
+        for pair in body:
+            pool_id = pair['load_balancer_pool']['id']
+            server_id = pair['cloud_server']['id']
+            nodes = pools.setdefault(pool_id, OrderedDict())
+            if server_id not in nodes:
+                nodes[server_id] = self._pool_node(pool_id, server_id)
+            added.append(nodes[server_id])
+        return 201, added
+
+    def remove_pool_nodes(self, request, body, tenant_id):
+        """Remove servers from load balancer pools, ignoring missing ones."""
+        pools = self._tenant(tenant_id).pools
+        for pair in body:
+            pools.get(pair['load_balancer_pool']['id'], {}).pop(
+                pair['cloud_server']['id'], None)
+        return 204, None
@@ -28,10 +28,14 @@ from txeffect import deferred_performer, perform as twisted_perform
 
 from otter.auth import Authenticate, InvalidateToken, public_endpoint_url
 from otter.constants import ServiceType
+from otter.log import log as otter_log
 from otter.log.intents import msg as msg_effect
+from otter.util.circuitbreaker import CircuitBreaker
 from otter.util.config import config_value
-from otter.util.http import APIError, append_segments, try_json_with_keys
+from otter.util.http import (
+    APIError, UpstreamError, append_segments, try_json_with_keys)
 from otter.util.http import headers as otter_headers
+from otter.util.metrics import http_labels
 from otter.util.pure_http import (
     add_bind_root,
     add_effect_on_response,
@@ -138,6 +142,14 @@ class ServiceRequest(object):
                 isinstance(result[1],
                            (dict, list) if self.json_response else str))
 
+    @property
+    def metric_labels(self):
+        """
+        The labels under which this request is recorded in the metrics
+        registry: the service type, the method and the templated URL.
+        """
+        return http_labels(self.service_type.name, self.method, self.url)
+
 
 @attributes(['effect', 'tenant_id'], apply_with_init=False)
 class TenantScope(object):
@@ -176,6 +188,10 @@ def concretize_service_request(
         Deferred bracketer or None, used to throttle requests. See
         :obj:`_Throttle`.
     :param tenant_id: tenant ID.
+
+    If the ``cloud_client.compressed_services`` config is set, only responses
+    from the services whose :obj:`ServiceType` names are listed in it are
+    asked to be compressed.
     """
     auth_eff = Effect(Authenticate(authenticator, tenant_id, log))
     invalidate_eff = Effect(InvalidateToken(authenticator, tenant_id))
@@ -185,6 +201,9 @@ def concretize_service_request(
     service_config = service_configs[service_request.service_type]
     region = service_config['region']
     service_name = service_config['name']
+    compressed = config_value('cloud_client.compressed_services')
+    compress = (compressed is None or
+                service_request.service_type.name in compressed)
 
     def got_auth((token, catalog)):
         request_ = add_headers(otter_headers(token), request)
@@ -207,7 +226,9 @@ def concretize_service_request(
             headers=service_request.headers,
             data=service_request.data,
             params=service_request.params,
-            log=log)
+            log=log,
+            metric_labels=service_request.metric_labels,
+            compress=compress)
 
     eff = auth_eff.on(got_auth)
     bracket = throttler(service_request.service_type,
@@ -289,6 +310,75 @@ def _default_throttler(locks, clock, stype, method, tenant_id):
             return partial(lock.run, deferLater, clock, delay)
 
 
+def _is_service_failure(failure):
+    """
+    Tell if a failed request counts against the health of the service. Errors
+    of HTTP responses only count if they are 5xx, and authentication errors
+    do not count since they are not caused by the service.
+    """
+    if failure.check(APIError):
+        return failure.value.code >= 500
+    return not failure.check(UpstreamError)
+
+
+_breakers = {}
+"""
+Circuit breakers of this process, keyed by service type and region. They are
+shared by every dispatcher, including those created for a single request, so
+that the failures seen through all of them can open the circuit.
+"""
+
+
+def _circuit_breaker(breakers, clock, log, service_configs, stype):
+    """
+    Get the circuit breaker of a service in its configured region, creating
+    it if needed, based on the ``cloud_client.circuit_breaker`` configuration.
+
+    :param dict breakers: Existing circuit breakers, keyed by service type
+        and region.
+    :return: :obj:`CircuitBreaker`, or None if circuit breaking is not
+        configured.
+    """
+    config = config_value('cloud_client.circuit_breaker')
+    if config is None:
+        return None
+    region = service_configs[stype]['region']
+    breaker = breakers.get((stype, region))
+    if breaker is None:
+        breaker = breakers[(stype, region)] = CircuitBreaker(
+            clock, '{}.{}'.format(stype.name, region),
+            window=config.get('window', 20),
+            min_calls=config.get('min_requests', 10),
+            error_rate=config.get('error_rate', 0.5),
+            slow_call_time=config.get('slow_request_time', 20),
+            reset_timeout=config.get('reset_timeout', 30),
+            probes=config.get('probes', 1),
+            is_failure=_is_service_failure,
+            log=log)
+    return breaker
+
+
+def _circuit_breaking_throttler(get_breaker, throttler, stype, method,
+                                tenant_id):
+    """
+    A throttler that runs requests through the circuit breaker of their
+    service, if any, inside the bracket returned by another throttler, so that
+    time spent waiting to be throttled is not counted as request latency.
+
+    :param callable get_breaker: function of service type ->
+        :obj:`CircuitBreaker` or None.
+    :param callable throttler: throttler as taken by
+        :func:`concretize_service_request`.
+    """
+    bracket = throttler(stype, method, tenant_id)
+    breaker = get_breaker(stype)
+    if breaker is None:
+        return bracket
+    if bracket is None:
+        return breaker.run
+    return partial(bracket, breaker.run)
+
+
 def perform_tenant_scope(
         authenticator, log, service_configs, throttler,
         dispatcher, tenant_scope, box,
@@ -321,7 +411,12 @@ def get_cloud_client_dispatcher(reactor, authenticator, log, service_configs):
     """
     # this throttler could be parameterized but for now it's basically a hack
     # that we want to keep private to this module
-    throttler = partial(_default_throttler, WeakLocks(), reactor)
+    throttler = partial(
+        _circuit_breaking_throttler,
+        partial(_circuit_breaker, _breakers, reactor,
+                otter_log.bind(system='otter.circuit_breaker'),
+                service_configs),
+        partial(_default_throttler, WeakLocks(), reactor))
     return TypeDispatcher({
         TenantScope: partial(perform_tenant_scope, authenticator, log,
                              service_configs, throttler),
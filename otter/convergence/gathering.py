@@ -30,17 +30,23 @@ from otter.convergence.model import (
     group_id_from_metadata)
 from otter.indexer import atom
 from otter.models.cass import CassScalingGroupServersCache
+from otter.util.circuitbreaker import CircuitOpenError
 from otter.util.fp import assoc_obj
 from otter.util.http import append_segments
 from otter.util.retry import (
-    exponential_backoff_interval, retry_effect, retry_times)
+    RetryExcept, exponential_backoff_interval, retry_effect, retry_times)
 from otter.util.timestamp import timestamp_to_epoch
 
 
 def _retry(eff):
-    """Retry an effect with a common policy."""
+    """
+    Retry an effect with a common policy. Requests to a service whose circuit
+    is open are not retried.
+    """
     return retry_effect(
-        eff, retry_times(5), exponential_backoff_interval(2))
+        eff, RetryExcept(exceptions=(CircuitOpenError,),
+                         can_retry=retry_times(5)),
+        exponential_backoff_interval(2))
 
 
 def get_all_server_details(changes_since=None, batch_size=100):
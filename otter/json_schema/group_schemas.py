@@ -6,8 +6,6 @@ scaling group configuration, and policies.
 from copy import deepcopy
 from datetime import datetime
 
-from croniter import croniter
-
 from iso8601 import ParseError
 
 from jsonschema import ValidationError
@@ -15,6 +13,7 @@ from jsonschema import ValidationError
 from toolz import get_in
 
 from otter.json_schema import format_checker
+from otter.models.interface import parsed_cron
 from otter.util.timestamp import timestamp_to_epoch
 
 # This is built using union types which may not be available in Draft 4
@@ -463,7 +462,7 @@ def validate_cron(cron):
     Validate cron string in json. Return True if valid and raise ValueError if invalid
     """
     try:
-        croniter(cron)
+        parsed_cron(cron)
     except:
         # It is checking for any exception since croniter throws KeyError with some invalid inputs.
         # This issue has been raised in https://github.com/taichino/croniter/issues/25.
@@ -9,6 +9,8 @@ from effect import Effect
 
 from toolz.dicttoolz import keyfilter
 
+from twisted.internet.defer import DeferredSemaphore
+
 from txeffect import perform
 
 from otter.cloud_client import TenantScope
@@ -18,6 +20,7 @@ from otter.log import log as otter_log
 from otter.log.formatters import LogLevel
 from otter.log.intents import err as err_effect, msg as msg_effect
 from otter.util.http import APIError
+from otter.util.metrics import registry as default_registry
 from otter.util.retry import (
     compose_retries,
     exponential_backoff_interval,
@@ -171,15 +174,53 @@ def add_event(event, admin_tenant_id, region, log):
     return Effect(TenantScope(tenant_id=admin_tenant_id, effect=eff))
 
 
+PUBLISHED = (('outcome', 'published'),)
+FAILED = (('outcome', 'failed'),)
+DROPPED = (('outcome', 'dropped'),)
+UNSUITABLE = (('outcome', 'unsuitable'),)
+
+
 @attributes(['reactor', 'authenticator', 'tenant_id', 'region',
-             'service_configs', 'log', 'get_disp', 'add_event'],
+             'service_configs', 'log', 'get_disp', 'add_event',
+             'concurrency', 'max_queued', 'metrics'],
             defaults={'log': otter_log, 'get_disp': get_legacy_dispatcher,
-                      'add_event': add_event})
+                      'add_event': add_event, 'concurrency': 10,
+                      'max_queued': 1000, 'metrics': default_registry})
 class CloudFeedsObserver(object):
     """
     Log observer that pushes events to cloud feeds
+
+    At most ``concurrency`` events are pushed at a time, including their
+    retries, through a dispatcher created on first use. Up to ``max_queued``
+    other events wait in a queue, and events logged when it is full are
+    dropped. Only the first event dropped is logged each time the queue gets
+    full. Cloud feeds takes one entry per request, so events are not
+    batched.
+
+    The events pushed and queued are exposed as ``cloud_feeds.in_flight``
+    and ``cloud_feeds.queued`` gauges, and events are counted in the
+    ``cloud_feeds.events`` counter labeled with their outcome: published,
+    failed, dropped or unsuitable.
     """
 
+    def __init__(self):
+        self._sem = DeferredSemaphore(self.concurrency)
+        self._dispatcher = None
+        self._full = False
+        self.metrics.set_gauge('cloud_feeds.in_flight',
+                               lambda: self.in_flight)
+        self.metrics.set_gauge('cloud_feeds.queued', lambda: self.queued)
+
+    @property
+    def in_flight(self):
+        """Number of events being pushed"""
+        return self.concurrency - self._sem.tokens
+
+    @property
+    def queued(self):
+        """Number of events waiting to be pushed"""
+        return len(self._sem.waiting)
+
     def __call__(self, event_dict):
         """
         Process event and push it to Cloud feeds
@@ -196,10 +237,32 @@ class CloudFeedsObserver(object):
         try:
             eff = self.add_event(event_dict, self.tenant_id, self.region, log)
         except UnsuitableMessage as me:
+            self.metrics.increment('cloud_feeds.events', UNSUITABLE)
             log.err(None, 'cf-unsuitable-message',
                     unsuitable_message=me.unsuitable_message)
-        else:
-            return perform(
-                self.get_disp(self.reactor, self.authenticator, log,
-                              self.service_configs),
-                eff).addErrback(log.err, 'cf-add-failure')
+            return
+        if self._sem.tokens == 0 and self.queued >= self.max_queued:
+            self.metrics.increment('cloud_feeds.events', DROPPED)
+            if not self._full:
+                self._full = True
+                log.msg('cf-queue-full', isError=True, queued=self.queued)
+            return
+        self._full = False
+        return self._sem.run(self._push, eff, log)
+
+    def _push(self, eff, log):
+        if self._dispatcher is None:
+            self._dispatcher = self.get_disp(
+                self.reactor, self.authenticator,
+                self.log.bind(system='otter.cloud_feed'),
+                self.service_configs)
+
+        def published(result):
+            self.metrics.increment('cloud_feeds.events', PUBLISHED)
+            return result
+
+        def failed(failure):
+            self.metrics.increment('cloud_feeds.events', FAILED)
+            log.err(failure, 'cf-add-failure')
+
+        return perform(self._dispatcher, eff).addCallbacks(published, failed)
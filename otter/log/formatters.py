@@ -68,6 +68,10 @@ class FanoutObserver(object):
     """
     A fanout observer that emits events that it receives to all its sub
     observers.
+
+    The same event dict is given to every subobserver without being copied,
+    so subobservers must treat it as read-only: one that modifies the event
+    works on its own copy, as :func:`ObserverWrapper` does.
     """
     def __init__(self, observer):
         """
@@ -83,10 +87,10 @@ class FanoutObserver(object):
 
     def __call__(self, event_dict):
         """
-        Emit a copy of the event dict to every subobserver.
+        Emit the event dict to every subobserver.
         """
         for ob in self.subobservers:
-            ob(event_dict.copy())
+            ob(event_dict)
 
 
 class LoggingEncoder(json.JSONEncoder):
@@ -113,6 +117,42 @@ class LoggingEncoder(json.JSONEncoder):
         return repr(obj)
 
 
+_SNAPSHOT_PRIMITIVES = (basestring, int, long, float, type(None))
+_snapshot_encoder = LoggingEncoder()
+
+
+def snapshot(obj):
+    """
+    Return a copy of a JSON serializable structure that encodes to the same
+    JSON, sharing nothing that can change: dicts are copied, lists become
+    tuples and objects that are not JSON types are serialized by
+    :class:`LoggingEncoder` right away.
+    """
+    if isinstance(obj, _SNAPSHOT_PRIMITIVES):
+        return obj
+    if isinstance(obj, dict):
+        return {key: snapshot(value) for key, value in obj.iteritems()}
+    if isinstance(obj, (list, tuple)):
+        return tuple(snapshot(value) for value in obj)
+    return _snapshot_encoder.default(obj)
+
+
+def SnapshotObserverWrapper(observer):
+    """
+    Create an observer that delegates a :func:`snapshot` of the eventDict to
+    `observer`, so that it can encode the event later, e.g. from another
+    thread, while the logging code goes on changing what it logged.
+
+    :param ILogObserver observer: The observer to delegate message delivery to.
+
+    :rtype: :class:`ILogObserver`
+    """
+    def SnapshotObserver(eventDict):
+        observer(snapshot(eventDict))
+
+    return SnapshotObserver
+
+
 def JSONObserverWrapper(observer, **kwargs):
     """
     Create an observer that will format the eventDict as JSON using the
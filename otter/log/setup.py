@@ -1,6 +1,8 @@
 """
 Observer factories which will be used to configure twistd logging.
 """
+import atexit
+import os
 import socket
 import sys
 
@@ -9,6 +11,7 @@ from otter.log.formatters import (
     JSONObserverWrapper,
     ObserverWrapper,
     PEP3101FormattingWrapper,
+    SnapshotObserverWrapper,
     StreamObserverWrapper,
     SystemFilterWrapper,
     add_to_fanout,
@@ -17,19 +20,25 @@ from otter.log.formatters import (
     throttling_wrapper,
 )
 from otter.log.spec import SpecificationObserverWrapper
+from otter.log.writer import BackgroundObserver
 
 
-def make_observer_chain(ultimate_observer, indent):
+def make_observer_chain(ultimate_observer, indent, background=None):
     """
     Return our feature observers wrapped our the ultimate_observer
+
+    :param background: One-argument callable wrapping the observer that
+        encodes events as JSON and writes them, to move that work off the
+        logging thread, or None. The events are snapshotted before, so that
+        they do not change while they wait to be encoded.
     """
-    add_to_fanout(
-        ObserverWrapper(
-            JSONObserverWrapper(
-                ultimate_observer,
-                sort_keys=True,
-                indent=indent or None),
-            hostname=socket.gethostname()))
+    output = JSONObserverWrapper(
+        ultimate_observer,
+        sort_keys=True,
+        indent=indent or None)
+    if background is not None:
+        output = SnapshotObserverWrapper(background(output))
+    add_to_fanout(ObserverWrapper(output, hostname=socket.gethostname()))
 
     return throttling_wrapper(
         SpecificationObserverWrapper(
@@ -40,15 +49,47 @@ def make_observer_chain(ultimate_observer, indent):
                             get_fanout()))))))
 
 
+def background_writer(flush, environ=os.environ):
+    """
+    Return a function that wraps an observer in a started
+    :class:`BackgroundObserver`, which is stopped when the process exits so
+    that queued events are written.
+
+    The queue is configured from the environment: ``OTTER_LOG_QUEUE_SIZE``
+    is its size, ``OTTER_LOG_BATCH_SIZE`` the number of events written
+    between flushes and ``OTTER_LOG_QUEUE_FULL`` is ``drop`` (the default)
+    to drop events when it is full or ``block`` to wait for room.
+
+    :param flush: No-argument callable flushing the output.
+    """
+    def background(observer):
+        writer = BackgroundObserver(
+            observer, flush,
+            size=int(environ.get('OTTER_LOG_QUEUE_SIZE', 10000)),
+            block=environ.get('OTTER_LOG_QUEUE_FULL', 'drop') == 'block',
+            batch=int(environ.get('OTTER_LOG_BATCH_SIZE', 100)))
+        writer.start()
+        atexit.register(writer.stop)
+        return writer
+
+    return background
+
+
 def observer_factory():
     """
-    Log non-pretty JSON formatted structures to sys.stdout.
+    Log non-pretty JSON formatted structures to sys.stdout from a background
+    thread.
     """
-    return make_observer_chain(StreamObserverWrapper(sys.stdout), False)
+    return make_observer_chain(
+        StreamObserverWrapper(sys.stdout, buffered=True), False,
+        background_writer(sys.stdout.flush))
 
 
 def observer_factory_debug():
     """
-    Log pretty JSON formatted structures to sys.stdout.
+    Log pretty JSON formatted structures to sys.stdout from a background
+    thread.
     """
-    return make_observer_chain(StreamObserverWrapper(sys.stdout), 2)
+    return make_observer_chain(
+        StreamObserverWrapper(sys.stdout, buffered=True), 2,
+        background_writer(sys.stdout.flush))
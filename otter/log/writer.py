@@ -0,0 +1,166 @@
+"""
+A log observer that delivers events on a dedicated thread, so that encoding
+and writing them does not hold up the reactor.
+"""
+import sys
+import traceback
+from Queue import Empty, Full, Queue
+from threading import Lock, Thread
+
+from otter.util.metrics import registry as default_registry
+
+
+_STOP = object()
+"""Queued by :meth:`BackgroundObserver.stop` to stop the writer thread."""
+
+DROPPED_FULL = (('reason', 'full'),)
+DROPPED_ERROR = (('reason', 'error'),)
+
+
+class BackgroundObserver(object):
+    """
+    Log observer that puts events in a bounded queue, from which a writer
+    thread delivers them to another observer in batches.
+
+    When the queue is full, events are either dropped or the logging thread
+    blocks until there is room. The number of queued events is exposed as the
+    ``log.queue_depth`` gauge, and dropped events are counted in the
+    ``log.dropped`` counter, labeled with the reason: ``full`` if the queue
+    was full, or ``error`` if the observer failed on them. Failures to
+    flush are counted in the ``log.flush_errors`` counter. Each count is
+    only incremented from one thread at a time, so the counts do not race.
+    The first failure of the observer or of ``flush`` is also written to
+    stderr, since it can not be logged.
+
+    Events are delivered after the logging thread has moved on, so they
+    should not refer to anything it may still change: snapshot them before
+    queueing them, see :func:`otter.log.formatters.snapshot`.
+
+    Once stopped, events are delivered by the logging thread itself.
+
+    :param observer: The observer to deliver events to, from the writer
+        thread. It is not called from more than one thread at a time.
+    :param flush: No-argument callable called after each batch is delivered,
+        or None.
+    :param int size: Maximum number of queued events.
+    :param bool block: True to block when the queue is full, False to drop
+        the event.
+    :param int batch: Maximum number of events delivered before flushing.
+    :param registry: :obj:`MetricsRegistry` to record metrics in.
+    """
+    def __init__(self, observer, flush=None, size=10000, block=False,
+                 batch=100, registry=default_registry):
+        self.observer = observer
+        self.flush = flush
+        self.block = block
+        self.batch = batch
+        self.registry = registry
+        self.queue = Queue(size)
+        self.thread = None
+        self.stopped = False
+        self._lock = Lock()
+        self._reported = False
+        registry.set_gauge('log.queue_depth', self.queue.qsize)
+
+    def __call__(self, event):
+        """
+        Queue the event, or deliver it if stopped.
+        """
+        if self.stopped:
+            self._deliver([event])
+            return
+        try:
+            self.queue.put(event, self.block)
+        except Full:
+            self.registry.increment('log.dropped', DROPPED_FULL)
+
+    def start(self):
+        """
+        Start the writer thread.
+        """
+        self.thread = Thread(target=self._run, name='otter-log-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Deliver the queued events and stop the writer thread, then deliver
+        events as they are logged. The events are delivered by the calling
+        thread if the writer thread was not started.
+
+        :param timeout: Seconds to wait for the writer thread, or None to
+            wait until it is done. If it is not done by then, events keep
+            being queued for it.
+        """
+        if self.stopped:
+            return
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                return
+        self.stopped = True
+        while self.write_batch(block=False) or not self.queue.empty():
+            pass
+
+    def write_batch(self, block=True):
+        """
+        Deliver up to ``batch`` queued events and flush.
+
+        :param bool block: Wait for an event if the queue is empty.
+        :return: False if there were no events or the writer thread was
+            asked to stop, True otherwise.
+        """
+        events = []
+        try:
+            events.append(self.queue.get(block))
+            while len(events) < self.batch:
+                events.append(self.queue.get_nowait())
+        except Empty:
+            pass
+        running = bool(events) and not any(e is _STOP for e in events)
+        self._deliver([e for e in events if e is not _STOP])
+        return running
+
+    def _run(self):
+        """
+        Deliver queued events until asked to stop. Run by the writer thread.
+        """
+        while self.write_batch():
+            pass
+
+    def _deliver(self, events):
+        """
+        Deliver events to the observer and flush, counting the failures
+        rather than raising them.
+        """
+        if not events:
+            return
+        with self._lock:
+            for event in events:
+                try:
+                    self.observer(event)
+                except Exception:
+                    self.registry.increment('log.dropped', DROPPED_ERROR)
+                    self._report('write')
+            if self.flush is not None:
+                try:
+                    self.flush()
+                except Exception:
+                    self.registry.increment('log.flush_errors')
+                    self._report('flush')
+
+    def _report(self, action):
+        """
+        Write the exception being handled to stderr if it is the first one.
+        """
+        if self._reported:
+            return
+        self._reported = True
+        try:
+            sys.stderr.write(
+                'Could not {} log events, further failures are only '
+                'counted:\n'.format(action))
+            traceback.print_exc(file=sys.stderr)
+        except Exception:
+            pass
@@ -21,7 +21,6 @@ from silverberg.cluster import RoundRobinCassandraCluster
 
 from toolz.curried import filter, get_in
 from toolz.dicttoolz import keyfilter, merge
-from toolz.itertoolz import groupby
 from toolz.recipes import countby
 
 from twisted.application.internet import TimerService
@@ -42,13 +41,44 @@ from otter.convergence.planning import Destiny, get_destiny
 from otter.effect_dispatcher import get_legacy_dispatcher
 from otter.log import log as otter_log
 from otter.models.cass import CassScalingGroupCollection
-from otter.models.intents import GetAllValidGroups, get_model_dispatcher
+from otter.models.intents import (
+    ReconcileCounts,
+    ScanValidGroups,
+    get_model_dispatcher)
 from otter.util.fp import partition_bool
+from otter.util.metrics import flatten_snapshot
 
 
 GroupMetrics = namedtuple('GroupMetrics',
                           'tenant_id group_id desired actual pending')
 
+_GROUP_PROPS = ('tenantId', 'groupId', 'desired', 'status', 'launch_config',
+                'created_at', 'deleting')
+"""Columns of the scaling groups read to collect metrics."""
+
+_GROUP_METRICS_PROPS = ('tenantId', 'groupId', 'desired', 'status')
+"""Properties of the groups kept to compute their metrics."""
+
+
+def _group_collector(tenant_ids, tenanted_groups):
+    """
+    Return a consumer of pages of scaling groups that adds the tenant ID of
+    each group to ``tenant_ids``, and adds the ``launch_server`` groups,
+    without their launch configuration, to their tenant's ``list`` in
+    ``tenanted_groups``.
+
+    :param set tenant_ids: Tenant IDs of all the groups
+    :param defaultdict tenanted_groups: Groups by tenant ID
+    """
+    def collect(groups):
+        for group in groups:
+            tenant_ids.add(group['tenantId'])
+            if (json.loads(group['launch_config']).get('type') ==
+                    'launch_server'):
+                tenanted_groups[group['tenantId']].append(
+                    keyfilter(lambda k: k in _GROUP_METRICS_PROPS, group))
+    return collect
+
 
 def get_tenant_metrics(tenant_id, scaling_groups, grouped_servers,
                        _print=False):
@@ -224,6 +254,32 @@ def add_to_cloud_metrics(ttl, region, group_metrics, num_tenants, config,
                           'POST', 'ingest', data=data, log=log)
 
 
+@do
+def add_local_metrics_to_cloud_metrics(ttl, region, registry, log=None):
+    """
+    Add the metrics recorded in a process' registry, like the latency and
+    status codes of requests made to upstream services, to Cloud metrics.
+    otter-api pushes its registry with this when ``metrics.local_metrics`` is
+    set.
+
+    :param str region: which region's metric is collected
+    :param registry: :obj:`otter.util.metrics.MetricsRegistry` to push
+    :param log: Optional logger
+
+    :return: `Effect` with None
+    """
+    epoch = yield Effect(Func(time.time))
+    metric_part = {'collectionTime': int(epoch * 1000),
+                   'ttlInSeconds': ttl}
+    data = [merge(metric_part,
+                  {'metricValue': value,
+                   'metricName': '{}.{}'.format(region, metric)})
+            for metric, value in flatten_snapshot(registry.snapshot())]
+    if data:
+        yield service_request(ServiceType.CLOUD_METRICS_INGEST,
+                              'POST', 'ingest', data=data, log=log)
+
+
 def connect_cass_servers(reactor, config):
     """
     Connect to Cassandra servers and return the connection
@@ -267,11 +323,16 @@ def collect_metrics(reactor, config, log, client=None, authenticator=None,
     dispatcher = get_dispatcher(reactor, authenticator, log,
                                 get_service_configs(config), store)
 
-    # calculate metrics on launch_server groups
-    groups = yield perform(dispatcher, Effect(GetAllValidGroups()))
-    groups = [g for g in groups
-              if json.loads(g["launch_config"]).get("type") == "launch_server"]
-    tenanted_groups = groupby(lambda g: g["tenantId"], groups)
+    # calculate metrics on launch_server groups, keeping only what is needed
+    # of each page of groups as it is read
+    tenant_ids, tenanted_groups = set(), defaultdict(list)
+    yield perform(dispatcher, Effect(ScanValidGroups(
+        _group_collector(tenant_ids, tenanted_groups), props=_GROUP_PROPS,
+        ranges=get_in(['metrics', 'scan_ranges'], config, 16),
+        concurrency=get_in(['metrics', 'scan_concurrency'], config, 4))))
+    if get_in(['metrics', 'reconcile_counts'], config, True):
+        yield perform(dispatcher,
+                      Effect(ReconcileCounts(sorted(tenant_ids))))
     group_metrics = yield get_all_metrics(
         dispatcher, tenanted_groups, log, _print=_print)
 
@@ -2,16 +2,22 @@
 Cassandra implementation of the store for the front-end scaling groups engine
 """
 
+import base64
 import functools
 import json
 import time
 import uuid
+import zlib
+from collections import OrderedDict
+from copy import deepcopy
 from datetime import datetime
 from itertools import cycle, takewhile
+from weakref import WeakKeyDictionary
 
 from characteristic import attributes
 
-from effect import Constant, Effect, TypeDispatcher, parallel
+from effect import (
+    Constant, Effect, TypeDispatcher, parallel, parallel_all_errors)
 from effect.do import do, do_return
 
 from jsonschema import ValidationError
@@ -25,8 +31,10 @@ from silverberg.client import ConsistencyLevel
 from toolz.curried import filter, map
 from toolz.dicttoolz import keymap, merge
 from toolz.functoolz import compose
+from toolz.itertoolz import concat, groupby
 
 from twisted.internet import defer
+from twisted.python.failure import Failure
 
 from txeffect import deferred_performer
 
@@ -52,10 +60,21 @@ from otter.models.interface import (
     next_cron_occurrence)
 from otter.util import timestamp
 from otter.util.config import config_value
-from otter.util.cqlbatch import Batch, batch
-from otter.util.deferredutils import with_lock
+from otter.util.cqlbatch import (
+    Batch,
+    batch,
+    check_chunks,
+    chunked_batches,
+    execute_chunked)
+from otter.util.deferredutils import unwrap_first_error, with_lock
 from otter.util.hashkey import generate_capability, generate_key_str
-from otter.util.retry import repeating_interval, retry, retry_times
+from otter.util.retry import (
+    compose_retries,
+    random_interval,
+    repeating_interval,
+    retry,
+    retry_times,
+    terminal_errors_except)
 from otter.util.weaklocks import WeakLocks
 
 
@@ -65,6 +84,76 @@ DEFAULT_CONSISTENCY = ConsistencyLevel.QUORUM
 
 QUERY_LIMIT = 10000
 
+PARTITION_KEYS = {
+    'scaling_group': [('tenantId', 'AsciiType')],
+    'scaling_policies': [('tenantId', 'AsciiType')],
+    'policy_webhooks': [('tenantId', 'AsciiType')],
+    'webhook_keys': [('webhookKey', 'AsciiType')],
+    'scaling_schedule_v2': [('bucket', 'Int32Type')],
+    'servers_cache': [('tenantId', 'AsciiType'), ('groupId', 'AsciiType')],
+    'resource_counts': [('tenantId', 'AsciiType')],
+    'locks': [('lockId', 'AsciiType')]
+}
+"""
+Partition key columns of the tables, to route queries to the replicas of
+their partition. See :obj:`otter.util.cqlpool.TokenAwareCassandraCluster`.
+"""
+
+
+_MIN_TOKEN = -(1 << 63)
+_MAX_TOKEN = (1 << 63) - 1
+
+
+def _token_ranges(count):
+    """
+    Split the Murmur3 token ring in ranges of equal size.
+
+    :param int count: Number of ranges.
+    :return: ``list`` of ``(start, end)`` tuples of the ranges of tokens
+        greater than ``start`` and lower than or equal to ``end``.
+    """
+    size = ((1 << 64) - 1) // count
+    bounds = [_MIN_TOKEN + i * size for i in range(count)] + [_MAX_TOKEN]
+    return zip(bounds, bounds[1:])
+
+
+_pending_modifications = WeakKeyDictionary()
+"""
+State modifications waiting for the local lock of their group, by lock. See
+:meth:`CassScalingGroup.modify_state`.
+"""
+
+
+class _NothingModified(Exception):
+    """
+    Raised instead of writing the state when no modifier succeeded.
+    """
+
+
+def _fire_outcomes(outcomes):
+    """
+    Fire the Deferred of each modification with its outcome.
+
+    :param list outcomes: ``(Deferred, outcome)`` tuples, as returned by
+        :meth:`CassScalingGroup._modify_pending`.
+    """
+    for d, outcome in outcomes:
+        if isinstance(outcome, Failure):
+            d.errback(outcome)
+        else:
+            d.callback(outcome)
+
+
+class StateConflictError(Exception):
+    """
+    Error raised when the state of a group could not be written with
+    compare-and-set because it was changed since it was read.
+    """
+    def __init__(self, tenant_id, group_id):
+        super(StateConflictError, self).__init__(
+            "State of scaling group {0} for tenant {1} changed concurrently"
+            .format(group_id, tenant_id))
+
 
 @attributes(['query', 'params', 'consistency_level'])
 class CQLQueryExecute(object):
@@ -102,6 +191,23 @@ def cql_eff(query, params={}, consistency_level=DEFAULT_CONSISTENCY):
                         consistency_level=consistency_level))
 
 
+def chunked_eff(batches, consistency_level=DEFAULT_CONSISTENCY):
+    """
+    Return Effect of executing batches built by
+    :func:`otter.util.cqlbatch.chunked_batches` in parallel. It fails with
+    :obj:`otter.util.cqlbatch.ChunkedBatchError` if any batch failed.
+    """
+    def check(results):
+        return check_chunks(
+            [(True, result) if not is_error
+             else (False, Failure(result[1], result[0], result[2]))
+             for is_error, result in results])
+
+    return parallel_all_errors(
+        [cql_eff(query, params, consistency_level)
+         for query, params in batches]).on(check)
+
+
 def serialize_json_data(data, ver):
     """
     Serialize json data to cassandra by adding a version and dumping it to a
@@ -148,17 +254,40 @@ _cql_view_manifest = (
     'SELECT "tenantId", "groupId", group_config, '
     'launch_config, active, pending, "groupTouched", '
     '"policyTouched", paused, desired, created_at, status, error_reasons, '
-    'deleting FROM {cf} '
+    'deleting, policies_version, state_version FROM {cf} '
     'WHERE "tenantId" = :tenantId AND "groupId" = :groupId')
 _cql_insert_policy = (
     'INSERT INTO {cf}("tenantId", "groupId", "policyId", data, version) '
     'VALUES (:tenantId, :groupId, :{name}policyId, :{name}data, '
     ':{name}version)')
+_cql_update_policies_version = (
+    'UPDATE {cf} SET policies_version = :policies_version '
+    'WHERE "tenantId" = :tenantId AND "groupId" = :groupId IF EXISTS')
 _cql_insert_group_state = (
     'INSERT INTO {cf}("tenantId", "groupId", active, pending, "groupTouched", '
     '"policyTouched", paused, desired) VALUES(:tenantId, :groupId, :active, '
     ':pending, :groupTouched, :policyTouched, :paused, :desired) '
     'USING TIMESTAMP :ts')
+_cql_cas_group_state = (
+    'UPDATE {cf} SET active = :active, pending = :pending, '
+    '"groupTouched" = :groupTouched, "policyTouched" = :policyTouched, '
+    'paused = :paused, desired = :desired, state_version = :new_version '
+    'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
+    'IF state_version = :state_version')
+_cql_cas_first_group_state = (
+    'UPDATE {cf} SET active = :active, pending = :pending, '
+    '"groupTouched" = :groupTouched, "policyTouched" = :policyTouched, '
+    'paused = :paused, desired = :desired, state_version = :new_version '
+    'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
+    'IF state_version = null AND created_at = :created_at')
+_cql_set_deleting = (
+    'UPDATE {cf} SET deleting = true '
+    'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
+    'IF deleting IN (false, null) AND created_at != null')
+_cql_cas_mark_deleting = (
+    'UPDATE {cf} SET deleting = true, state_version = :new_version '
+    'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
+    'IF state_version = :state_version')
 
 # --- Event related queries
 _cql_insert_group_event = (
@@ -244,12 +373,86 @@ _cql_count_for_group = (
     'AND "groupId" = :groupId;')
 _cql_count_all = ('SELECT COUNT(*) FROM {cf};')
 
+# Resource counts table. Counts of each tenant are kept in rows of the tenant,
+# and counts of all tenants in rows of the '*' tenant. Only the counts of the
+# tenant are updated as resources change: the counts of all tenants are set
+# to the sums of the counts of the tenants when they are reconciled, so that
+# every change does not update the same partition. The 'reconciled' row of a
+# tenant is set once its counts have been reconciled with the tables.
+_COUNTED_RESOURCES = ('groups', 'policies', 'webhooks')
+_ALL_TENANTS = '*'
+_cql_view_counts = (
+    'SELECT resource, count FROM resource_counts WHERE "tenantId"=:tenantId;')
+_cql_update_count = (
+    'UPDATE resource_counts SET count = count + :{name} '
+    'WHERE "tenantId"={tenant} AND resource=\'{resource}\';')
+
+
+def _counter_batch(statements):
+    """Return counter batch statement wrapping given statements."""
+    return 'BEGIN COUNTER BATCH {} APPLY BATCH;'.format(' '.join(statements))
+
+
+_cql_update_counts = _counter_batch(
+    [_cql_update_count.format(name=r, tenant=':tenantId', resource=r)
+     for r in _COUNTED_RESOURCES])
+_cql_mark_reconciled = _cql_update_count.format(
+    name='reconciled', tenant=':tenantId', resource='reconciled')
+_cql_reconcile_counts = _counter_batch(
+    [_cql_update_count.format(name=r, tenant=':tenantId', resource=r)
+     for r in _COUNTED_RESOURCES] +
+    [_cql_mark_reconciled])
+_cql_counted_tenants = (
+    'SELECT DISTINCT "tenantId" FROM resource_counts {where}LIMIT :limit;')
+_cql_claim_reconcile = (
+    'UPDATE resource_count_reconciles USING TTL 300 '
+    'SET reconciler = :reconciler WHERE "tenantId" = :tenantId '
+    'IF reconciler = null')
+_cql_release_reconcile = (
+    'UPDATE resource_count_reconciles SET reconciler = null '
+    'WHERE "tenantId" = :tenantId IF reconciler = :reconciler')
+
 # seems to be pretty quick no matter the consistency - unfortunately this only
 # checks we can connect to Cassandra, and not whether the otter keyspace is
 # correct, etc.
 _cql_health_check = ('SELECT now() FROM system.local;')
 
 
+def _counts_from_rows(rows):
+    """Return ``dict`` of counts by resource from resource_counts rows."""
+    return {row['resource']: row['count'] for row in rows}
+
+
+def _update_counts(connection, log, tenant_id, query=_cql_update_counts,
+                   **deltas):
+    """
+    Add to the resource counts of a tenant.
+
+    Counts are updated after the resources were created or deleted, so
+    errors are only logged: counts that drifted are corrected by
+    :meth:`CassScalingGroupCollection.reconcile_counts`.
+
+    :param deltas: Changes of counts, by resource in ``_COUNTED_RESOURCES``
+    :return: Deferred that fires with None
+    """
+    params = merge({r: 0 for r in _COUNTED_RESOURCES}, deltas,
+                   {'tenantId': tenant_id})
+    d = defer.maybeDeferred(connection.execute, query, params,
+                            ConsistencyLevel.ONE)
+    d.addErrback(log.err, 'Could not update resource counts',
+                 tenant_id=tenant_id, deltas=deltas)
+    return d.addCallback(lambda _: None)
+
+
+def _counted(result, connection, log, tenant_id, **deltas):
+    """
+    Update resource counts like :func:`_update_counts` once a
+    Deferred has fired with ``result``, and return ``result``.
+    """
+    d = _update_counts(connection, log, tenant_id, **deltas)
+    return d.addCallback(lambda _: result)
+
+
 def _paginated_list(tenant_id, group_id=None, policy_id=None, limit=100,
                     marker=None):
     """
@@ -501,6 +704,26 @@ def _unmarshal_state(state_dict):
     )
 
 
+def _marshal_state(state):
+    """
+    Get the parameters to write the state columns of a group with.
+
+    :param GroupState state: The state of the group.
+    :return: ``dict`` of parameters of :data:`_cql_insert_group_state` and
+        :data:`_cql_cas_group_state`, except their timestamp and versions.
+    """
+    return {
+        'tenantId': state.tenant_id,
+        'groupId': state.group_id,
+        'active': serialize_json_data(state.active, 1),
+        'pending': serialize_json_data(state.pending, 1),
+        'paused': state.paused,
+        'desired': state.desired,
+        'groupTouched': state.group_touched,
+        'policyTouched': serialize_json_data(state.policy_touched, 1)
+    }
+
+
 def assemble_webhooks_in_policies(policies, webhooks):
     """
     Assemble webhooks inside policies.
@@ -593,6 +816,141 @@ def _check_deleting(group, get_deleting=False):
     return group
 
 
+class _CachedGroup(object):
+    """
+    Configuration of a group as of its last state read.
+
+    :ivar policies_version: Version of the policies of the group.
+    :ivar str group_config: Serialized group configuration.
+    :ivar str launch_config: Serialized launch configuration.
+    :ivar dict policies: Policy rows, with ``data`` and ``version``, by
+        policy ID.
+    :ivar float validated: Time of the last state read.
+    """
+    def __init__(self, policies_version):
+        self.policies_version = policies_version
+        self.group_config = None
+        self.launch_config = None
+        self.policies = {}
+        self.validated = None
+
+
+class GroupConfigCache(object):
+    """
+    Per-process cache of the configuration, launch configuration and policies
+    of the groups whose state has been read recently.
+
+    The state read gets the configuration and launch configuration of the
+    group along with its state, and the version of its policies, which
+    changes whenever one of them is updated or deleted. Policies cached under
+    an older version are then discarded. A group is served from the cache for
+    ``max_age`` seconds after its state was read, so that executing a policy
+    right after reading the state of its group does not read the group and
+    policy again. Changes made by this process remove the group from the
+    cache.
+
+    :param clock: IReactorTime provider
+    :param int size: Maximum number of groups cached, the least recently read
+        being evicted first.
+    :param float max_age: Seconds after a state read during which the group
+        is served from the cache.
+    """
+    def __init__(self, clock, size=1000, max_age=1):
+        self.clock = clock
+        self.size = size
+        self.max_age = max_age
+        self._groups = OrderedDict()
+
+    def validate(self, tenant_id, group_id, row):
+        """
+        Record the configuration of a group read with its state.
+
+        :param dict row: The ``scaling_group`` row of the group.
+        """
+        key = (tenant_id, group_id)
+        group = self._groups.pop(key, None)
+        if group is None or group.policies_version != row['policies_version']:
+            group = _CachedGroup(row['policies_version'])
+        group.group_config = row['group_config']
+        group.launch_config = row['launch_config']
+        group.validated = self.clock.seconds()
+        self._groups[key] = group
+        if len(self._groups) > self.size:
+            self._groups.popitem(last=False)
+
+    def get(self, tenant_id, group_id):
+        """
+        :return: :obj:`_CachedGroup` of the group if its state was read in the
+            last ``max_age`` seconds, otherwise None.
+        """
+        group = self._groups.get((tenant_id, group_id))
+        if (group is not None and
+                self.clock.seconds() - group.validated <= self.max_age):
+            return group
+        return None
+
+    def invalidate(self, tenant_id, group_id):
+        """Remove a group from the cache."""
+        self._groups.pop((tenant_id, group_id), None)
+
+
+class WebhookCapabilityCache(object):
+    """
+    Per-process LRU cache of the tenant, group and policy of webhook
+    capability hashes, so that executing webhooks does not read them every
+    time. Hashes that are not found are also cached, for a shorter time, so
+    that unknown hashes do not reach Cassandra every time either.
+
+    Webhooks deleted by this process are removed from the cache, and those
+    deleted by other processes are served until they expire. Executing them
+    then fails because their policy or group does not exist anymore.
+
+    :param clock: IReactorTime provider
+    :param int size: Maximum number of hashes cached, the least recently
+        looked up being evicted first.
+    :param float ttl: Seconds during which a found hash is served from the
+        cache.
+    :param float negative_ttl: Seconds during which a hash that was not found
+        is served from the cache.
+    """
+    def __init__(self, clock, size=10000, ttl=60, negative_ttl=5):
+        self.clock = clock
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._hashes = OrderedDict()
+
+    def lookup(self, capability_hash):
+        """
+        :return: ``(tenant_id, group_id, policy_id)`` of the hash, or None if
+            the hash was not found.
+        :raises KeyError: if the hash is not cached or has expired.
+        """
+        expires, info = self._hashes.pop(capability_hash)
+        if self.clock.seconds() >= expires:
+            raise KeyError(capability_hash)
+        self._hashes[capability_hash] = (expires, info)
+        return info
+
+    def add(self, capability_hash, info):
+        """
+        Cache what a hash was found to be.
+
+        :param info: ``(tenant_id, group_id, policy_id)`` of the hash, or None
+            if it was not found.
+        """
+        ttl = self.negative_ttl if info is None else self.ttl
+        self._hashes.pop(capability_hash, None)
+        self._hashes[capability_hash] = (self.clock.seconds() + ttl, info)
+        if len(self._hashes) > self.size:
+            self._hashes.popitem(last=False)
+
+    def invalidate(self, capability_hashes):
+        """Remove hashes from the cache."""
+        for capability_hash in capability_hashes:
+            self._hashes.pop(capability_hash, None)
+
+
 @implementer(IScalingGroup)
 class CassScalingGroup(object):
     """
@@ -620,6 +978,20 @@ class CassScalingGroup(object):
     :ivar local_locks: Local locks used when modifying state
     :type local_locks: :class:`WeakLocks`
 
+    :ivar config_cache: Cache of configurations filled by state reads, or
+        None to always read them
+    :type config_cache: :class:`GroupConfigCache`
+
+    :ivar cas_retries: Number of times a state modification is retried when
+        the state is changed concurrently, if the state is modified with
+        compare-and-set on its version instead of holding a ZooKeeper lock,
+        or None to lock
+    :type cas_retries: ``int``
+
+    :ivar webhook_cache: Cache of webhook capability hashes to remove the
+        webhooks deleted by this group from, or None
+    :type webhook_cache: :class:`WebhookCapabilityCache`
+
     IMPORTANT REMINDER: In CQL, update will create a new row if one doesn't
     exist.  Therefore, before doing an update, a read must be performed first
     else an entry is created where none should have been.
@@ -634,7 +1006,8 @@ class CassScalingGroup(object):
 
     """
     def __init__(self, log, tenant_id, uuid, connection, buckets, kz_client,
-                 reactor, local_locks):
+                 reactor, local_locks, config_cache=None, cas_retries=None,
+                 webhook_cache=None):
         """
         Creates a CassScalingGroup object.
         """
@@ -648,6 +1021,9 @@ class CassScalingGroup(object):
         self.kz_client = kz_client
         self.reactor = reactor
         self.local_locks = local_locks
+        self.config_cache = config_cache
+        self.cas_retries = cas_retries
+        self.webhook_cache = webhook_cache
 
         self.group_table = "scaling_group"
         self.launch_table = "launch_config"
@@ -674,6 +1050,31 @@ class CassScalingGroup(object):
             return func(get_client_ts(self.reactor), *args)
         return wrapper
 
+    def _cached_group(self):
+        """
+        :return: :obj:`_CachedGroup` of this group if it is cached, otherwise
+            None.
+        """
+        if self.config_cache is None:
+            return None
+        return self.config_cache.get(self.tenant_id, self.uuid)
+
+    def _invalidate_cache(self, result):
+        """
+        Remove this group from the config cache, passing through ``result``.
+        """
+        if self.config_cache is not None:
+            self.config_cache.invalidate(self.tenant_id, self.uuid)
+        return result
+
+    def _invalidate_webhooks(self, result, capability_hashes):
+        """
+        Remove webhooks from the webhook cache, passing through ``result``.
+        """
+        if self.webhook_cache is not None:
+            self.webhook_cache.invalidate(capability_hashes)
+        return result
+
     def view_manifest(self, with_policies=True, with_webhooks=False,
                       get_deleting=False):
         """
@@ -734,6 +1135,9 @@ class CassScalingGroup(object):
         """
         see :meth:`otter.models.interface.IScalingGroup.view_config`
         """
+        cached = self._cached_group()
+        if cached is not None:
+            return defer.succeed(_jsonloads_data(cached.group_config))
         view_query = _cql_view.format(
             cf=self.group_table, column='group_config')
         del_query = _cql_delete_all_in_group.format(
@@ -752,6 +1156,9 @@ class CassScalingGroup(object):
         """
         see :meth:`otter.models.interface.IScalingGroup.view_launch_config`
         """
+        cached = self._cached_group()
+        if cached is not None:
+            return defer.succeed(_jsonloads_data(cached.launch_config))
         view_query = _cql_view.format(
             cf=self.group_table, column='launch_config')
         del_query = _cql_delete_all_in_group.format(
@@ -770,6 +1177,15 @@ class CassScalingGroup(object):
         """
         see :meth:`otter.models.interface.IScalingGroup.view_state`
         """
+        d = self._view_state_row(consistency, get_deleting)
+        return d.addCallback(_unmarshal_state)
+
+    def _view_state_row(self, consistency=None, get_deleting=False):
+        """
+        Read the row of this group like :meth:`view_state`.
+
+        :return: Deferred that fires with the row as a ``dict``.
+        """
         if consistency is None:
             consistency = DEFAULT_CONSISTENCY
 
@@ -783,54 +1199,182 @@ class CassScalingGroup(object):
                           NoSuchScalingGroupError(self.tenant_id, self.uuid),
                           self.log)
 
+        def _cache_config(group):
+            if self.config_cache is not None and not group['deleting']:
+                self.config_cache.validate(self.tenant_id, self.uuid, group)
+            return group
+
         d.addCallback(_check_deleting, get_deleting)
-        return d.addCallback(_unmarshal_state)
+        return d.addCallback(_cache_config)
 
     def modify_state(self, modifier_callable, *args, **kwargs):
         """
         see :meth:`otter.models.interface.IScalingGroup.modify_state`
+
+        Modifications of the same group requested while another one is in
+        progress on this node are combined: once the local lock is acquired,
+        all the waiting modifiers are applied in order to a single read of
+        the state, and the result is written once. Each caller gets the
+        outcome of its own modifier. A modifier that fails does not change
+        the state given to the next one.
         """
         modify_state_reason = kwargs.pop('modify_state_reason', None)
         log = self.log.bind(
             system='CassScalingGroup.modify_state',
             modify_state_reason=modify_state_reason)
+        local_lock = self.local_locks.get_lock(self.uuid)
+        pending = _pending_modifications.setdefault(local_lock, [])
+        d = defer.Deferred()
+        pending.append((d, modifier_callable, args, kwargs))
+        local_lock.run(self._modify_pending, log, pending).addCallback(
+            _fire_outcomes)
+        return d
+
+    def _modify_pending(self, log, pending):
+        """
+        Apply the waiting modifications of the state, while holding the local
+        lock.
+
+        :param list pending: ``(Deferred, modifier, args, kwargs)`` tuples of
+            the waiting modifications, which are removed from it.
+        :return: Deferred that fires with a ``list`` of the Deferred of each
+            modification and its outcome: None or a :obj:`Failure`.
+        """
+        entries = pending[:]
+        if not entries:
+            # Already applied with an earlier modification
+            return []
+        del pending[:]
+        results = []
+
+        def _apply(state, entry):
+            _, modifier_callable, args, kwargs = entry
+            before = deepcopy(state) if len(entries) > 1 else state
+
+            def succeeded(new_state):
+                results.append(None)
+                return new_state
+
+            def failed(f):
+                results.append(f)
+                return before
+
+            d = defer.maybeDeferred(modifier_callable, self, state,
+                                    *args, **kwargs)
+            return d.addCallbacks(succeeded, failed)
+
+        def _combined(_group, state):
+            del results[:]
+            d = defer.succeed(state)
+            for entry in entries:
+                d.addCallback(_apply, entry)
+            return d.addCallback(_check_modified)
+
+        def _check_modified(state):
+            if None not in results:
+                raise _NothingModified()
+            return state
+
+        def _outcomes(result):
+            if not isinstance(result, Failure) or result.check(
+                    _NothingModified):
+                result = None
+            # Modifiers that were not applied get the failure to read or lock
+            outcomes = results + [result] * (len(entries) - len(results))
+            return [(entry[0], outcome if isinstance(outcome, Failure)
+                     else result)
+                    for entry, outcome in zip(entries, outcomes)]
+
+        if self.cas_retries is not None:
+            d = self._cas_modify_state(log, _combined)
+        else:
+            d = self._lock_modify_state(log, _combined)
+        return d.addBoth(_outcomes)
+
+    def _lock_modify_state(self, log, modifier_callable):
+        """
+        Modify the state with a modifier like :meth:`modify_state`, holding
+        the ZooKeeper lock of the group.
+        """
         consistency = DEFAULT_CONSISTENCY
 
         @self.with_timestamp
         def _write_state(timestamp, new_state):
             assert (new_state.tenant_id == self.tenant_id and
                     new_state.group_id == self.uuid)
-            params = {
-                'tenantId': new_state.tenant_id,
-                'groupId': new_state.group_id,
-                'active': serialize_json_data(new_state.active, 1),
-                'pending': serialize_json_data(new_state.pending, 1),
-                'paused': new_state.paused,
-                'desired': new_state.desired,
-                'groupTouched': new_state.group_touched,
-                'policyTouched': serialize_json_data(new_state.policy_touched,
-                                                     1),
-                'ts': timestamp
-            }
+            params = merge(_marshal_state(new_state), {'ts': timestamp})
             return self.connection.execute(
                 _cql_insert_group_state.format(cf=self.group_table),
                 params, consistency)
 
         def _modify_state():
             d = self.view_state(consistency)
-            d.addCallback(lambda state: modifier_callable(
-                self, state, *args, **kwargs))
+            d.addCallback(lambda state: modifier_callable(self, state))
             return d.addCallback(_write_state)
 
         lock = self.kz_client.Lock(LOCK_PATH + '/' + self.uuid)
         lock.acquire = functools.partial(lock.acquire, timeout=120)
-        local_lock = self.local_locks.get_lock(self.uuid)
-        return local_lock.run(
-            with_lock, self.reactor, lock, _modify_state,
+        return with_lock(
+            self.reactor, lock, _modify_state,
             log.bind(category='locking', lock_reason='modify_state'),
             acquire_timeout=150,
             release_timeout=30)
 
+    def _cas_modify_state(self, log, modifier_callable):
+        """
+        Modify the state with a modifier like :meth:`modify_state`, but
+        instead of holding a ZooKeeper lock, write the new state only if its
+        version is still the one read, with a lightweight transaction. When
+        the state changed since it was read, it is read again and the
+        modifier is called again on it, up to :attr:`cas_retries` times
+        before failing with :obj:`StateConflictError`. Modifiers must
+        therefore not have side effects other than returning the new state.
+
+        Modifications from this node are still serialized by the local lock
+        held by :meth:`modify_state`, so that they do not conflict with each
+        other.
+
+        A missing row also has no version, so the first write of a group
+        without a version also requires its creation time to be the one
+        read, so that it does not create the row of a deleted group again.
+        """
+        consistency = DEFAULT_CONSISTENCY
+
+        def _write_state(row, new_state):
+            assert (new_state.tenant_id == self.tenant_id and
+                    new_state.group_id == self.uuid)
+            params = merge(_marshal_state(new_state),
+                           {'state_version': row['state_version'],
+                            'new_version': uuid.uuid1()})
+            query = _cql_cas_group_state
+            if row['state_version'] is None:
+                query = _cql_cas_first_group_state
+                del params['state_version']
+                params['created_at'] = row['created_at']
+            d = self.connection.execute(
+                query.format(cf=self.group_table), params, consistency)
+            return d.addCallback(_check_applied)
+
+        def _check_applied(rows):
+            if not rows[0]['[applied]']:
+                log.msg('State changed concurrently', category='cas')
+                raise StateConflictError(self.tenant_id, self.uuid)
+
+        def _modify_state():
+            d = self._view_state_row(consistency)
+            d.addCallback(lambda row: defer.maybeDeferred(
+                modifier_callable, self, _unmarshal_state(row)).addCallback(
+                    functools.partial(_write_state, row)))
+            return d
+
+        return retry(
+            _modify_state,
+            can_retry=compose_retries(
+                retry_times(self.cas_retries),
+                terminal_errors_except(StateConflictError)),
+            next_interval=random_interval(0, 0.1),
+            clock=self.reactor)
+
     def update_status(self, status):
         """
         see :meth:`otter.models.interface.IScalingGroup.update_status`
@@ -849,21 +1393,35 @@ class CassScalingGroup(object):
                  'status': status.name},
                 DEFAULT_CONSISTENCY)
 
-        @self.with_timestamp
-        def set_deleting(ts, _):
-            return self.connection.execute(
-                _cql_update.format(cf=self.group_table,
-                                   column='deleting',
-                                   name=':deleting'),
-                {'tenantId': self.tenant_id,
-                 'groupId': self.uuid,
-                 'ts': ts,
-                 'deleting': True},
+        def started(rows):
+            row = rows[0]
+            if row['[applied]']:
+                return True
+            if row.get('created_at') is None:
+                raise NoSuchScalingGroupError(self.tenant_id, self.uuid)
+            self.log.msg('Group already deleting')
+            return False
+
+        def set_deleting(_):
+            # conditional, so that the group stops being counted only when
+            # it starts deleting, and is not created again if it was deleted.
+            # Groups created before "deleting" was written have it null.
+            d = self.connection.execute(
+                _cql_set_deleting.format(cf=self.group_table),
+                {'tenantId': self.tenant_id, 'groupId': self.uuid},
                 DEFAULT_CONSISTENCY)
+            return d.addCallback(started)
+
+        def count_deleting(started):
+            if started:
+                return _update_counts(self.connection, self.log,
+                                      self.tenant_id, groups=-1)
 
         d = self.view_config()
         if status == ScalingGroupStatus.DELETING:
             d.addCallback(set_deleting)
+            d.addCallback(count_deleting)
+            d.addBoth(self._invalidate_cache)
         else:
             d.addCallback(_do_update)
         return d
@@ -904,7 +1462,7 @@ class CassScalingGroup(object):
                                 "scaling": serialize_json_data(data, 1),
                                 "ts": ts},
                       consistency=DEFAULT_CONSISTENCY)
-            return b.execute(self.connection)
+            return b.execute(self.connection).addBoth(self._invalidate_cache)
 
         d = self.view_config()
         d.addCallback(_do_update_config)
@@ -927,7 +1485,7 @@ class CassScalingGroup(object):
                                 "ts": ts},
                       consistency=DEFAULT_CONSISTENCY)
             d = b.execute(self.connection)
-            return d
+            return d.addBoth(self._invalidate_cache)
 
         d = self.view_config()
         d.addCallback(_do_update_launch)
@@ -975,6 +1533,8 @@ class CassScalingGroup(object):
         """
         see :meth:`otter.models.interface.IScalingGroup.get_policy`
         """
+        cached = self._cached_group()
+
         def fetch_policy(_):
             query = _cql_view_policy.format(cf=self.policies_table)
             d = self.connection.execute(query,
@@ -982,15 +1542,26 @@ class CassScalingGroup(object):
                                          "groupId": self.uuid,
                                          "policyId": policy_id},
                                         DEFAULT_CONSISTENCY)
-            return d.addCallback(_extract_policy)
+            return d.addCallback(_cache_policy).addCallback(_extract_policy)
+
+        def _cache_policy(rows):
+            if cached is not None and len(rows) > 0:
+                cached.policies[policy_id] = rows[0]
+            return rows
 
         def _extract_policy(rows):
             if len(rows) == 0 or version and rows[0]['version'] != version:
                 raise NoSuchPolicyError(self.tenant_id, self.uuid, policy_id)
             return _jsonloads_data(rows[0]['data'])
 
-        d = self.view_config()  # Ensure group exists
-        return d.addCallback(fetch_policy)
+        if cached is None:
+            d = self.view_config()  # Ensure group exists
+            return d.addCallback(fetch_policy)
+        elif policy_id in cached.policies:
+            return defer.maybeDeferred(_extract_policy,
+                                       [cached.policies[policy_id]])
+        else:
+            return fetch_policy(None)
 
     def create_policies(self, data):
         """
@@ -1029,13 +1600,36 @@ class CassScalingGroup(object):
             b = Batch(queries, cqldata,
                       consistency=DEFAULT_CONSISTENCY)
             d = b.execute(self.connection)
-            return d.addCallback(lambda _: outpolicies)
+            d.addCallback(lambda _: outpolicies)
+            return d.addCallback(_counted, self.connection, self.log,
+                                 self.tenant_id, policies=len(data))
 
         d = self.view_config()
         d.addCallback(_do_limits_check)
         d.addCallback(_do_create_pol)
         return d
 
+    def _update_policies_version(self, result):
+        """
+        Change the version of the policies of this group, passing through
+        ``result``. The row is only updated if it exists, so that a group
+        deleted in the meantime is not created again.
+
+        :raises: :class:`NoSuchScalingGroupError` if the group does not exist
+        """
+        d = self.connection.execute(
+            _cql_update_policies_version.format(cf=self.group_table),
+            {'tenantId': self.tenant_id, 'groupId': self.uuid,
+             'policies_version': uuid.uuid1()},
+            DEFAULT_CONSISTENCY)
+
+        def _check_applied(rows):
+            if not rows[0]['[applied]']:
+                raise NoSuchScalingGroupError(self.tenant_id, self.uuid)
+            return result
+
+        return d.addCallback(_check_applied)
+
     def update_policy(self, policy_id, data):
         """
         see :meth:`otter.models.interface.IScalingGroup.update_policy`
@@ -1064,7 +1658,9 @@ class CassScalingGroup(object):
             cqldata['data'] = serialize_json_data(data, 1)
             b = Batch(queries, cqldata,
                       consistency=DEFAULT_CONSISTENCY)
-            return b.execute(self.connection)
+            d = b.execute(self.connection)
+            d.addCallback(self._update_policies_version)
+            return d.addBoth(self._invalidate_cache)
 
         d = self.get_policy(policy_id)
         d.addCallback(_do_update_schedule)
@@ -1089,7 +1685,14 @@ class CassScalingGroup(object):
                            "policyId": policy_id})
             b = Batch(queries, params,
                       consistency=DEFAULT_CONSISTENCY)
-            return b.execute(self.connection)
+            d = b.execute(self.connection)
+            d.addCallback(self._update_policies_version)
+            d.addCallback(_counted, self.connection, self.log,
+                          self.tenant_id, policies=-1,
+                          webhooks=-len(webhooks))
+            d.addBoth(self._invalidate_cache)
+            return d.addBoth(self._invalidate_webhooks,
+                             [w['capability']['hash'] for w in webhooks])
 
         d = self.get_policy(policy_id)
         d.addCallback(
@@ -1097,6 +1700,18 @@ class CassScalingGroup(object):
         d.addCallback(_do_delete)
         return d
 
+    def _naive_count_policies(self):
+        """
+        Count the policies of a group. Does not check if group exists.
+
+        :return: Deferred that fires with ``int``
+        """
+        d = self.connection.execute(
+            _cql_count_for_group.format(cf=self.policies_table),
+            {'tenantId': self.tenant_id, 'groupId': self.uuid},
+            DEFAULT_CONSISTENCY)
+        return d.addCallback(lambda rows: rows[0]['count'])
+
     def _naive_list_all_webhooks(self):
         """
         List all webhooks of a group. Does not check if group exists and
@@ -1186,7 +1801,9 @@ class CassScalingGroup(object):
             b = Batch(queries, cql_params,
                       consistency=DEFAULT_CONSISTENCY)
             d = b.execute(self.connection)
-            return d.addCallback(lambda _: output)
+            d.addCallback(lambda _: output)
+            return d.addCallback(_counted, self.connection, bound_log,
+                                 self.tenant_id, webhooks=len(data))
 
         d.addCallback(_do_create)
         return d
@@ -1260,7 +1877,10 @@ class CassScalingGroup(object):
                  "webhookId": webhook_id,
                  "webhookKey": lastRev['capability']['hash']},
                 DEFAULT_CONSISTENCY)
-            return d
+            d.addCallback(_counted, self.connection, bound_log,
+                          self.tenant_id, webhooks=-1)
+            return d.addBoth(self._invalidate_webhooks,
+                             [lastRev['capability']['hash']])
 
         return self.get_webhook(policy_id, webhook_id).addCallback(_do_delete)
 
@@ -1270,36 +1890,93 @@ class CassScalingGroup(object):
         """
         log = self.log.bind(system='CassScalingGroup.delete_group')
 
-        @self.with_timestamp
-        def _delete_everything(ts, webhooks):
-            # delete webhook keys
-            queries, params = _del_webhook_queries(
-                self.webhooks_keys_table, webhooks)
+        def _delete_keys(webhooks):
+            # webhook keys are in a partition each, so they are not deleted
+            # with the group in a multi partition batch
+            query = _cql_del_on_key.format(cf=self.webhooks_keys_table,
+                                           name='')
+            batches = chunked_batches(
+                [(webhook['webhookKey'], query,
+                  {'webhookKey': webhook['webhookKey']})
+                 for webhook in webhooks],
+                prefix='key')
+            return execute_chunked(self.connection, batches,
+                                   DEFAULT_CONSISTENCY)
 
-            queries.extend([
+        @self.with_timestamp
+        def _delete_everything(ts, state, policies, webhooks):
+            queries = [
                 _cql_delete_all_in_group.format(cf=table, name='') for table in
                 (self.policies_table, self.webhooks_table,
-                 self.servers_cache_table)])
+                 self.servers_cache_table)]
             queries.append(_cql_delete_group.format(cf=self.group_table))
-            params.update({'tenantId': self.tenant_id,
-                           'groupId': self.uuid,
-                           'ts': ts})
+            params = {'tenantId': self.tenant_id,
+                      'groupId': self.uuid,
+                      'ts': ts}
 
             b = Batch(queries, params,
                       consistency=DEFAULT_CONSISTENCY)
 
-            return b.execute(self.connection)
-
-        def _maybe_delete(state):
+            # the group is deleted once its webhook keys are, so that
+            # deleting it again deletes the keys that could not be
+            d = _delete_keys(webhooks)
+            d.addCallback(lambda _: b.execute(self.connection))
+            # groups being deleted are not counted anymore
+            deleting = state.status == ScalingGroupStatus.DELETING
+            d.addCallback(
+                _counted, self.connection, log, self.tenant_id,
+                groups=0 if deleting else -1,
+                policies=-policies, webhooks=-len(webhooks))
+            d.addBoth(self._invalidate_cache)
+            return d.addBoth(self._invalidate_webhooks,
+                             [w['webhookKey'] for w in webhooks])
+
+        def _maybe_delete(state, row=None):
             if (state.status != ScalingGroupStatus.DELETING and
                     len(state.active) + len(state.pending) > 0):
                 raise GroupNotEmptyError(self.tenant_id, self.uuid)
 
-            d = self._naive_list_all_webhooks()
-            d.addCallback(_delete_everything)
-            return d
+            d = defer.succeed(None)
+            if row is not None:
+                d.addCallback(lambda _: _mark_deleting(row))
+            d.addCallback(lambda _: defer.gatherResults(
+                [self._naive_count_policies(),
+                 self._naive_list_all_webhooks()], consumeErrors=True))
+            d.addErrback(unwrap_first_error)
+            return d.addCallback(
+                lambda (policies, webhooks): _delete_everything(
+                    state, policies, webhooks))
+
+        def _mark_deleting(row):
+            # Modifications with compare-and-set do not take the ZooKeeper
+            # lock, so the version is changed to make the ones in progress
+            # fail, and they find the group deleting when they read it again
+            d = self.connection.execute(
+                _cql_cas_mark_deleting.format(cf=self.group_table),
+                {'tenantId': self.tenant_id, 'groupId': self.uuid,
+                 'state_version': row['state_version'],
+                 'new_version': uuid.uuid1()},
+                DEFAULT_CONSISTENCY)
+            return d.addCallback(_check_marked)
+
+        def _check_marked(rows):
+            if not rows[0]['[applied]']:
+                raise StateConflictError(self.tenant_id, self.uuid)
+
+        def _cas_delete_group():
+            d = self._view_state_row(get_deleting=True)
+            return d.addCallback(
+                lambda row: _maybe_delete(_unmarshal_state(row), row))
 
         def _delete_group():
+            if self.cas_retries is not None:
+                return retry(
+                    _cas_delete_group,
+                    can_retry=compose_retries(
+                        retry_times(self.cas_retries),
+                        terminal_errors_except(StateConflictError)),
+                    next_interval=random_interval(0, 0.1),
+                    clock=self.reactor)
             d = self.view_state(get_deleting=True)
             d.addCallback(_maybe_delete)
             return d
@@ -1366,18 +2043,29 @@ class CassScalingGroupCollection:
     Also, because deletes are done as tombstones rather than actually deleting,
     deletes are also updates and hence a read must be performed before deletes.
     """
-    def __init__(self, connection, reactor, max_groups):
+    def __init__(self, connection, reactor, max_groups, config_cache=None,
+                 cas_retries=None, webhook_cache=None):
         """
         Init
 
         :param CQLClient connection: Silverberg client implementation
         :param reactor: Twisted reactor
         :param int max_groups: Maximum number of groups allowed per tenant
+        :param GroupConfigCache config_cache: Cache of group configurations
+            shared by the groups, or None to not cache them
+        :param int cas_retries: Number of retries of state modifications
+            done with compare-and-set instead of ZooKeeper locks, or None to
+            lock. See :attr:`CassScalingGroup.cas_retries`.
+        :param WebhookCapabilityCache webhook_cache: Cache of webhook
+            capability hashes, or None to always read them
         """
         self.connection = connection
         self.reactor = reactor
         self.max_groups = max_groups
         self.local_locks = WeakLocks()
+        self.config_cache = config_cache
+        self.cas_retries = cas_retries
+        self.webhook_cache = webhook_cache
         self.group_table = "scaling_group"
         self.launch_table = "launch_config"
         self.policies_table = "scaling_policies"
@@ -1458,7 +2146,8 @@ class CassScalingGroupCollection:
                 'id': scaling_group_id,
                 'state': scaling_group_state
             })
-
+            bd.addCallback(_counted, self.connection, log, tenant_id,
+                           groups=1, policies=len(outpolicies))
             return bd
 
         d.addCallback(lambda _: get_client_ts(self.reactor))
@@ -1518,46 +2207,57 @@ class CassScalingGroupCollection:
         """
         return CassScalingGroup(log, tenant_id, scaling_group_id,
                                 self.connection, self.buckets, self.kz_client,
-                                self.reactor, self.local_locks)
+                                self.reactor, self.local_locks,
+                                self.config_cache, self.cas_retries,
+                                self.webhook_cache)
+
+    def fetch_events(self, bucket, until, size=100):
+        """
+        see :meth:`IScalingScheduleCollection.fetch_events`
+        """
+        return self.connection.execute(
+            _cql_fetch_batch_of_events.format(cf=self.event_table),
+            {"size": size, "now": until, "bucket": bucket},
+            DEFAULT_CONSISTENCY)
+
+    def delete_events(self, bucket, events):
+        """
+        see :meth:`IScalingScheduleCollection.delete_events`
+        """
+        if not events:
+            return defer.succeed(None)
+        query = _cql_delete_bucket_event.format(cf=self.event_table, name='')
+        batches = chunked_batches(
+            [(bucket, query, {'policyId': event['policyId'],
+                              'trigger': event['trigger']})
+             for event in events],
+            {'bucket': bucket}, prefix='event')
+        d = execute_chunked(self.connection, batches, DEFAULT_CONSISTENCY)
+        return d.addCallback(lambda _: None)
 
     def fetch_and_delete(self, bucket, now, size=100):
         """
         Fetch events to be occurring now or before in a bucket
-        and delete them after fetching
+        and delete them after fetching, in one batch
         """
-        def delete_events(events):
-            if not events:
-                return events
-            data = {'bucket': bucket}
-            queries = []
-            for i, event in enumerate(events):
-                event_name = 'event{}'.format(i)
-                queries.append(
-                    _cql_delete_bucket_event.format(cf=self.event_table,
-                                                    name=event_name))
-                data[event_name + 'policyId'] = event['policyId']
-                data[event_name + 'trigger'] = event['trigger']
-            b = Batch(queries, data, DEFAULT_CONSISTENCY)
-            return b.execute(self.connection).addCallback(lambda _: events)
-
-        d = self.connection.execute(
-            _cql_fetch_batch_of_events.format(cf=self.event_table),
-            {"size": size, "now": now, "bucket": bucket}, DEFAULT_CONSISTENCY)
-        return d.addCallback(delete_events)
+        d = self.fetch_events(bucket, now, size)
+        return d.addCallback(
+            lambda events: self.delete_events(bucket, events).addCallback(
+                lambda _: events))
 
     def add_cron_events(self, cron_events):
         """
-        Add cron events to event table
+        Add cron events to event table, in a batch for the events of each
+        bucket, written in parallel
         """
-        queries, data = list(), dict()
-        for i, event in enumerate(cron_events):
-            event_name = 'event{}'.format(i)
-            queries.append(_cql_insert_cron_event.format(cf=self.event_table,
-                                                         name=event_name))
-            data[event_name + 'bucket'] = self.buckets.next()
-            data.update({event_name + key: event[key] for key in event})
-        b = Batch(queries, data, ConsistencyLevel.ONE)
-        return b.execute(self.connection)
+        query = _cql_insert_cron_event.format(cf=self.event_table, name='')
+        events = [merge(event, {'bucket': self.buckets.next()})
+                  for event in cron_events]
+        batches = chunked_batches(
+            [(event['bucket'], query, event) for event in events],
+            prefix='event')
+        d = execute_chunked(self.connection, batches, ConsistencyLevel.ONE)
+        return d.addCallback(lambda _: None)
 
     def get_oldest_event(self, bucket):
         """
@@ -1573,16 +2273,33 @@ class CassScalingGroupCollection:
         """
         see :meth:`IScalingGroupCollection.webhook_info_by_hash`
         """
+        def extract_info(info):
+            if info is None:
+                raise UnrecognizedCapabilityError(capability_hash, 1)
+            return info
+
+        if self.webhook_cache is not None:
+            try:
+                info = self.webhook_cache.lookup(capability_hash)
+            except KeyError:
+                pass
+            else:
+                return defer.maybeDeferred(extract_info, info)
+
         d = self.connection.execute(
             _cql_find_webhook_token.format(cf=self.webhook_keys_table),
             {"webhookKey": capability_hash}, ConsistencyLevel.ONE)
 
-        def extract_info(rows):
-            if len(rows) == 0:
-                raise UnrecognizedCapabilityError(capability_hash, 1)
-            r = rows[0]
-            return (r['tenantId'], r['groupId'], r['policyId'])
+        def cache_info(rows):
+            info = None
+            if len(rows) > 0:
+                r = rows[0]
+                info = (r['tenantId'], r['groupId'], r['policyId'])
+            if self.webhook_cache is not None:
+                self.webhook_cache.add(capability_hash, info)
+            return info
 
+        d.addCallback(cache_info)
         d.addCallback(extract_info)
         return d
 
@@ -1637,30 +2354,185 @@ class CassScalingGroupCollection:
         """
         Return number of valid (non-deleting) groups of the tenant
         """
-        d = self.connection.execute(
-            _cql_count_for_tenant.format(cf='scaling_group',
-                                         deleting='AND deleting=false'),
-            {'tenantId': tenant_id}, ConsistencyLevel.ONE)
-        return d.addCallback(self._extract_count)
+        return self.get_counts(log, tenant_id).addCallback(
+            lambda counts: counts['groups'])
 
     def get_counts(self, log, tenant_id):
         """
         see :meth:`otter.models.interface.IScalingGroupCollection.get_counts`
+
+        Counts are read from the resource counts maintained as resources are
+        created and deleted. Counts of a tenant that were never reconciled
+        are counted in the tables and reconciled first.
         """
-        deferreds = []
-        for table in ['scaling_policies', 'policy_webhooks']:
-            d = self.connection.execute(
-                _cql_count_for_tenant.format(cf=table, deleting=''),
-                {'tenantId': tenant_id}, ConsistencyLevel.ONE)
-            d.addCallback(self._extract_count)
-            deferreds.append(d)
-
-        deferreds = [self.get_groups_count(log, tenant_id)] + deferreds
-        d = defer.gatherResults(deferreds)
-        d.addCallback(lambda results: dict(zip(
-            ('groups', 'policies', 'webhooks'), results)))
+        d = self._view_counts(tenant_id)
+
+        def check_reconciled(counters):
+            if counters.get('reconciled', 0) > 0:
+                return {r: counters.get(r, 0) for r in _COUNTED_RESOURCES}
+            return self.reconcile_counts(log, tenant_id)
+
+        return d.addCallback(check_reconciled)
+
+    def _view_counts(self, tenant_id):
+        """
+        Return Deferred that fires with ``dict`` of the resource counts of a
+        tenant, including the ``reconciled`` marker.
+        """
+        d = self.connection.execute(_cql_view_counts, {'tenantId': tenant_id},
+                                    ConsistencyLevel.ONE)
+        return d.addCallback(_counts_from_rows)
+
+    def _count_resources(self, log, tenant_id):
+        """
+        Count the resources of a tenant in the tables.
+
+        :return: Deferred that fires with ``dict`` of counts by resource
+        """
+        deferreds = [
+            self.connection.execute(
+                _cql_count_for_tenant.format(cf=table, deleting=deleting),
+                {'tenantId': tenant_id}, ConsistencyLevel.ONE).addCallback(
+                    self._extract_count)
+            for table, deleting in [('scaling_group', 'AND deleting=false'),
+                                    ('scaling_policies', ''),
+                                    ('policy_webhooks', '')]]
+        d = defer.gatherResults(deferreds, consumeErrors=True)
+        d.addCallbacks(lambda results: dict(zip(_COUNTED_RESOURCES, results)),
+                       unwrap_first_error)
         return d
 
+    def _reconciling(self, log, tenant_id, correct, otherwise):
+        """
+        Correct the counts of a tenant while their reconciliation is claimed,
+        so that concurrent reconciliations do not add the same difference
+        twice. The reconciliation is claimed with a lightweight transaction,
+        and claims that are not released expire after 5 minutes.
+
+        :param correct: No-argument callable correcting the counts once the
+            reconciliation is claimed, returning a Deferred
+        :param otherwise: No-argument callable called instead if the
+            reconciliation could not be claimed
+        :return: Deferred that fires with the result of the callable called
+        """
+        params = {'tenantId': tenant_id, 'reconciler': uuid.uuid1()}
+
+        def claimed(rows):
+            if not rows[0]['[applied]']:
+                return otherwise()
+            return defer.maybeDeferred(correct).addBoth(release)
+
+        def release(result):
+            d = self.connection.execute(_cql_release_reconcile, params,
+                                        DEFAULT_CONSISTENCY)
+            d.addErrback(log.err, 'Could not release counts reconciliation',
+                         tenant_id=tenant_id)
+            return d.addCallback(lambda _: result)
+
+        d = self.connection.execute(_cql_claim_reconcile, params,
+                                    DEFAULT_CONSISTENCY)
+        return d.addCallback(claimed)
+
+    def _correct_counts(self, log, tenant_id, counts):
+        """
+        Add the differences between the maintained counts of a tenant and
+        ``counts`` to them, and mark them reconciled.
+
+        :return: Deferred that fires with ``counts``
+        """
+        def correct(counters):
+            deltas = {r: counts[r] - counters.get(r, 0)
+                      for r in _COUNTED_RESOURCES}
+            deltas['reconciled'] = 1 - counters.get('reconciled', 0)
+            if not any(deltas.values()):
+                return counts
+            log.msg('Reconciling resource counts', tenant_id=tenant_id,
+                    deltas=deltas)
+            d = _update_counts(self.connection, log, tenant_id,
+                               query=_cql_reconcile_counts, **deltas)
+            return d.addCallback(lambda _: counts)
+
+        return self._view_counts(tenant_id).addCallback(correct)
+
+    def reconcile_counts(self, log, tenant_id):
+        """
+        Correct the maintained resource counts of a tenant that drifted from
+        the resources in the tables, e.g. because some count updates failed,
+        and mark them reconciled.
+
+        The counts are only corrected by one reconciliation at a time, see
+        :meth:`_reconciling`. A reconciliation that can not claim it only
+        counts the resources in the tables.
+
+        :return: Deferred that fires with ``dict`` of counts by resource
+        """
+        def correct():
+            d = self._count_resources(log, tenant_id)
+            return d.addCallback(
+                functools.partial(self._correct_counts, log, tenant_id))
+
+        return self._reconciling(
+            log, tenant_id, correct,
+            lambda: self._count_resources(log, tenant_id))
+
+    @defer.inlineCallbacks
+    def _counted_tenant_ids(self, page_size=1000):
+        """
+        Get the IDs of the tenants that have resource counts, except the one
+        of all tenants.
+
+        :return: Deferred that fires with ``list`` of tenant IDs
+        """
+        tenant_ids = []
+        rows = yield self.connection.execute(
+            _cql_counted_tenants.format(where=''), {'limit': page_size},
+            ConsistencyLevel.ONE)
+        tenant_ids.extend(row['tenantId'] for row in rows)
+        while len(rows) == page_size:
+            rows = yield self.connection.execute(
+                _cql_counted_tenants.format(
+                    where='WHERE token("tenantId") > token(:tenantId) '),
+                {'limit': page_size, 'tenantId': rows[-1]['tenantId']},
+                ConsistencyLevel.ONE)
+            tenant_ids.extend(row['tenantId'] for row in rows)
+        defer.returnValue(
+            [tenant_id for tenant_id in tenant_ids
+             if tenant_id != _ALL_TENANTS])
+
+    def reconcile_all_counts(self, log, tenant_ids, concurrency=10):
+        """
+        Reconcile the counts of all tenants, up to ``concurrency`` at a time,
+        and set the counts of all tenants to their sums.
+
+        The tenants are the ones given and the ones that have counts, which
+        may have no groups anymore. The counts of all tenants are only set
+        by one reconciliation at a time, like the counts of a tenant.
+
+        :param tenant_ids: IDs of all the tenants that have groups
+        :return: Deferred that fires with None
+        """
+        sem = defer.DeferredSemaphore(concurrency)
+
+        def reconcile(counted_tenant_ids):
+            return defer.gatherResults(
+                [sem.run(self.reconcile_counts, log, tenant_id)
+                 for tenant_id in sorted(set(tenant_ids) |
+                                         set(counted_tenant_ids))],
+                consumeErrors=True)
+
+        def set_totals(all_counts):
+            totals = {r: sum(counts[r] for counts in all_counts)
+                      for r in _COUNTED_RESOURCES}
+            return self._reconciling(
+                log, _ALL_TENANTS,
+                lambda: self._correct_counts(log, _ALL_TENANTS, totals),
+                lambda: None)
+
+        d = self._counted_tenant_ids()
+        d.addCallback(reconcile)
+        d.addCallbacks(set_totals, unwrap_first_error)
+        return d.addCallback(lambda _: None)
+
     def kazoo_health_check(self):
         """
         Checks zookeer connection status and acquires a temporary lock to see
@@ -1710,21 +2582,46 @@ class CassScalingGroupCollection:
                               self.reactor.seconds() - start_time}))
         return d
 
-    def get_all_valid_groups(self):
+    def get_all_valid_groups(self, props=None, page_size=100, ranges=1,
+                             concurrency=1):
         """
-        Get all *valid* scaling groups
+        Get all *valid* scaling groups.
+
+        Takes the same optional arguments as :meth:`scan_valid_groups`.
 
         :return: `Deferred` fired with ``list`` of group ``dict``
         """
+        groups = []
+        d = self.scan_valid_groups(groups.extend, props=props,
+                                   page_size=page_size, ranges=ranges,
+                                   concurrency=concurrency)
+        return d.addCallback(lambda _: groups)
+
+    def scan_valid_groups(self, consumer, props=None, page_size=100,
+                          ranges=1, concurrency=1):
+        """
+        Scan the *valid* scaling groups, giving them to ``consumer`` page by
+        page as they are read, like :meth:`scan_scaling_group_rows`. Invalid
+        groups are dropped from each page.
+
+        Takes the same arguments as :meth:`scan_scaling_group_rows`.
+        ``props`` must include ``created_at``, ``desired`` and ``deleting``
+        if given.
+
+        :return: `Deferred` fired with None once all groups have been
+            consumed
+        """
         def _valid_group_row(row):
             return (row.get('created_at') is not None and
                     row.get('desired') is not None and
                     not row.get('deleting', False))
 
-        d = self.get_scaling_group_rows()
-        return d.addCallback(lambda gs: list(filter(_valid_group_row, gs)))
+        return self.scan_scaling_group_rows(
+            lambda rows: consumer([row for row in rows
+                                   if _valid_group_row(row)]),
+            props=props, page_size=page_size, ranges=ranges,
+            concurrency=concurrency)
 
-    @defer.inlineCallbacks
     def get_scaling_group_rows(self, props=None, batch_size=100):
         """
         Return scaling group rows from Cassandra as a list of ``dict`` where
@@ -1735,8 +2632,45 @@ class CassScalingGroupCollection:
         :param int batch_size: Number of groups to fetch at a time
         :return: `Deferred` fired with ``list`` of ``dict``
         """
-        # TODO: Currently returning all groups as one giant list for now.
-        # Will try to use Twisted tubes to do streaming later
+        groups = []
+        d = self.scan_scaling_group_rows(groups.extend, props=props,
+                                         page_size=batch_size)
+        return d.addCallback(lambda _: groups)
+
+    def scan_scaling_group_rows(self, consumer, props=None, page_size=100,
+                                ranges=1, concurrency=1):
+        """
+        Scan the scaling group table, giving its rows to ``consumer`` page
+        by page as they are read.
+
+        The token ring is split into ``ranges`` ranges of tenants, up to
+        ``concurrency`` of which are scanned at the same time. Rows of a
+        range are given in order, but pages of different ranges are
+        interleaved.
+
+        :param callable consumer: Called with each ``list`` of row ``dict``.
+            If it returns a Deferred, the next page of the range is only read
+            once it fires.
+        :param ``list`` props: Columns to get, or None to get all of them
+        :param int page_size: Number of rows to read at a time
+        :param int ranges: Number of token ranges to split the table into
+        :param int concurrency: Maximum number of ranges scanned at a time
+        :return: `Deferred` fired with None once all rows have been consumed
+        """
+        sem = defer.DeferredSemaphore(concurrency)
+        return defer.gatherResults(
+            [sem.run(self._scan_token_range, consumer, props, page_size,
+                     start, end)
+             for start, end in _token_ranges(ranges)],
+            consumeErrors=True).addCallbacks(lambda _: None,
+                                             unwrap_first_error)
+
+    @defer.inlineCallbacks
+    def _scan_token_range(self, consumer, props, page_size, start, end):
+        """
+        Scan the scaling group rows of tenants whose token is in the range
+        ``(start, end]``, like :meth:`scan_scaling_group_rows`.
+        """
         if props is None:
             cols = "*"
         else:
@@ -1745,40 +2679,162 @@ class CassScalingGroupCollection:
                  ' FROM scaling_group {where} LIMIT :limit;')
         where_key = 'WHERE "tenantId"=:tenantId AND "groupId">:groupId'
         where_token = 'WHERE token("tenantId") > token(:tenantId)'
+        first_where, params, end_params = [], {'limit': page_size}, {}
+        if start > _MIN_TOKEN:
+            first_where.append('token("tenantId") > :start')
+            params['start'] = start
+        if end < _MAX_TOKEN:
+            first_where.append('token("tenantId") <= :end')
+            where_token += ' AND token("tenantId") <= :end'
+            end_params['end'] = end
 
         # We first start by getting all groups limited on batch size
         # It will return groups sorted first based on hash of tenant id
         # and then based group id. Note that only tenant id is sorted
         # based on hash; group id is sorted normally
         batch = yield self.connection.execute(
-            query.format(where=''),
-            {'limit': batch_size}, ConsistencyLevel.ONE)
-        if len(batch) < batch_size:
-            defer.returnValue(batch)
+            query.format(where='WHERE ' + ' AND '.join(first_where)
+                         if first_where else ''),
+            merge(params, end_params), ConsistencyLevel.ONE)
+        yield consumer(batch)
+        if len(batch) < page_size:
+            defer.returnValue(None)
 
         # We got batch size response. That means there are probably more groups
-        groups = batch
         while batch != []:
             # We start by getting all the groups of last tenant ID we received
             # except the ones we already got. We do that by asking
             # groups > last group id since groups are sorted
             tenant_id = batch[-1]['tenantId']
-            while len(batch) == batch_size:
+            while len(batch) == page_size:
                 batch = yield self.connection.execute(
                     query.format(where=where_key),
-                    {'limit': batch_size,
+                    {'limit': page_size,
                      'tenantId': tenant_id,
                      'groupId': batch[-1]['groupId']},
                     ConsistencyLevel.ONE)
-                groups.extend(batch)
+                yield consumer(batch)
             # We then get next tenant's groups by using there hash value. i.e
-            # tenants whose hash > last tenant id we just fetched
+            # tenants whose hash > last tenant id we just fetched, up to the
+            # end of the range
             batch = yield self.connection.execute(
                 query.format(where=where_token),
-                {'limit': batch_size, 'tenantId': tenant_id},
+                merge(end_params, {'limit': page_size,
+                                   'tenantId': tenant_id}),
                 ConsistencyLevel.ONE)
-            groups.extend(batch)
-        defer.returnValue(groups)
+            yield consumer(batch)
+
+
+_SERVER_BLOB_FIELDS = (
+    'id', 'name', 'status', 'OS-EXT-STS:task_state', 'created', 'updated',
+    'image', 'flavor', 'links', 'metadata', 'addresses')
+"""
+Fields of Nova server JSON kept in servers cache rows: those read by
+:meth:`NovaServer.from_server_details_json` and the group state view.
+"""
+
+_SERVER_BLOB_VERSION = '1'
+
+
+def _project_server(server):
+    """
+    Drop the fields of a server that are never read back from the cache,
+    keeping only the id of its image and flavor and its private addresses.
+    """
+    projected = {k: server[k] for k in _SERVER_BLOB_FIELDS if k in server}
+    for key in ('image', 'flavor'):
+        if isinstance(projected.get(key), dict):
+            projected[key] = {'id': projected[key].get('id')}
+    if isinstance(projected.get('addresses'), dict):
+        projected['addresses'] = {
+            k: v for k, v in projected['addresses'].items()
+            if k == 'private'}
+    return projected
+
+
+def _encode_server_blob(server):
+    """
+    Encode a server as a servers cache row blob: the projected server as
+    compact JSON, compressed and base64 encoded since the column is ascii,
+    prefixed with the version of the encoding.
+    """
+    data = json.dumps(_project_server(server), separators=(',', ':'),
+                      sort_keys=True)
+    return '{}:{}'.format(_SERVER_BLOB_VERSION,
+                          base64.b64encode(zlib.compress(data)))
+
+
+def _decode_server_blob(blob):
+    """
+    Decode a servers cache row blob written by :func:`_encode_server_blob`,
+    or the plain server JSON written before it.
+
+    :raises ValueError: if the blob has an unknown version.
+    """
+    if blob.startswith('{'):
+        return json.loads(blob)
+    version, _, data = blob.partition(':')
+    if version != _SERVER_BLOB_VERSION:
+        raise ValueError('Unknown servers cache blob version {}'.format(
+            version))
+    return json.loads(zlib.decompress(base64.b64decode(data)))
+
+
+def _servers_from_rows(rows, only_as_active):
+    """
+    Get the servers of the latest cache of a group from its servers_cache
+    rows, sorted by last update in descending order.
+
+    :return: (servers, last update) tuple, like
+        :meth:`IScalingGroupServersCache.get_servers`
+    """
+    if len(rows) == 0:
+        return [], None
+    last_update = rows[0]['last_update']
+    rows = takewhile(lambda r: r['last_update'] == last_update, rows)
+
+    def _dict(r): return _decode_server_blob(r['server_blob'])
+    rfunc = (
+        compose(map(_dict), filter(lambda r: r['server_as_active']))
+        if only_as_active else map(_dict))
+
+    return list(rfunc(rows)), last_update
+
+
+def get_groups_servers(tenant_id, group_ids, only_as_active, chunk_size=20):
+    """
+    Get the cached servers of many groups of a tenant, like
+    :meth:`CassScalingGroupServersCache.get_servers` does for one group.
+
+    Groups are read ``chunk_size`` at a time, with a query per chunk, and the
+    queries are run in parallel.
+
+    :return: Effect of ``dict`` mapping group IDs to (servers, last update)
+        tuples. Groups without cache have ``([], None)``.
+    """
+    # No ORDER BY since it can not be used with IN on the partition key, but
+    # the rows of each group are sorted by last_update DESC in the table
+    query = ('SELECT "groupId", server_blob, server_as_active, last_update '
+             'FROM servers_cache WHERE "tenantId"=:tenantId AND '
+             '"groupId" IN ({groups});')
+    effs = []
+    for start in range(0, len(group_ids), chunk_size):
+        chunk = group_ids[start:start + chunk_size]
+        params = {'groupId{}'.format(i): group_id
+                  for i, group_id in enumerate(chunk)}
+        params['tenantId'] = tenant_id
+        effs.append(cql_eff(
+            query.format(groups=', '.join(
+                ':groupId{}'.format(i) for i in range(len(chunk)))),
+            params))
+
+    def by_group(results):
+        rows = groupby(lambda r: r['groupId'], concat(results))
+        return {group_id: _servers_from_rows(rows.get(group_id, []),
+                                             only_as_active)
+                for group_id in group_ids}
+
+    return parallel(effs).on(by_group)
 
 
 @implementer(IScalingGroupServersCache)
@@ -1807,21 +2863,16 @@ class CassScalingGroupServersCache(object):
                  'WHERE "tenantId"=:tenantId AND "groupId"=:groupId '
                  'ORDER BY last_update DESC;')
         rows = yield cql_eff(query.format(cf=self.table), self.params)
-        if len(rows) == 0:
-            yield do_return(([], None))
-        last_update = rows[0]['last_update']
-        rows = takewhile(lambda r: r['last_update'] == last_update, rows)
-
-        def _dict(r): return json.loads(r['server_blob'])
-        rfunc = (
-            compose(map(_dict), filter(lambda r: r['server_as_active']))
-            if only_as_active else map(_dict))
-
-        yield do_return((list(rfunc(rows)), last_update))
+        yield do_return(_servers_from_rows(rows, only_as_active))
 
     def insert_servers(self, last_update, servers, clear_others):
         """
         See :method:`IScalingGroupServersCache.insert_servers`
+
+        Servers are stored with :func:`_encode_server_blob`, or as plain JSON
+        if ``servers_cache.compact`` is false in the config, which is needed
+        while nodes that can only read plain JSON are still running. The
+        servers are written in one batch, since they are in one partition.
         """
         if len(servers) == 0:
             if clear_others:
@@ -1830,22 +2881,30 @@ class CassScalingGroupServersCache(object):
                 return Effect(Constant(None))
         query = ('INSERT INTO {cf} ("tenantId", "groupId", last_update, '
                  'server_id, server_blob, server_as_active) '
-                 'VALUES(:tenantId, :groupId, :last_update, :server_id{i}, '
-                 ':server_blob{i}, :server_as_active{i});')
-        params = merge(self.params, {"last_update": last_update})
-        queries = []
-        for i, server in enumerate(servers):
-            params['server_id{}'.format(i)] = server['id']
-            params['server_as_active{}'.format(i)] = server.pop(
-                '_is_as_active', False)
-            params['server_blob{}'.format(i)] = json.dumps(server)
-            queries.append(query.format(cf=self.table, i=i))
+                 'VALUES(:tenantId, :groupId, :last_update, :id, :blob, '
+                 ':as_active);').format(cf=self.table)
+        encode = (json.dumps
+                  if config_value('servers_cache.compact') is False
+                  else _encode_server_blob)
+        partition = (self.tenantId, self.groupId)
+        statements = [
+            (partition, query,
+             {'id': server['id'],
+              'as_active': server.pop('_is_as_active', False),
+              'blob': encode(server)})
+            for server in servers]
+
+        def insert():
+            params = merge(self.params, {'last_update': last_update,
+                                         'ts': get_client_ts(self.clock)})
+            return chunked_eff(chunked_batches(
+                statements, params, ':ts', prefix='server')).on(
+                    lambda _: None)
+
         if clear_others:
-            return self.delete_servers().on(
-                lambda _: cql_eff(
-                    batch(queries, get_client_ts(self.clock)), params))
+            return self.delete_servers().on(lambda _: insert())
         else:
-            return cql_eff(batch(queries, get_client_ts(self.clock)), params)
+            return insert()
 
     def delete_servers(self):
         """
@@ -1870,6 +2929,30 @@ class CassAdmin(object):
     def get_metrics(self, log):
         """
         see :meth:`otter.models.interface.IAdmin.get_metrics`
+
+        Metrics are read from the counts of all tenants once they have been
+        set by :meth:`CassScalingGroupCollection.reconcile_all_counts`, as of
+        the last time it ran, and counted in the tables otherwise.
+        """
+        d = self.connection.execute(_cql_view_counts,
+                                    {'tenantId': _ALL_TENANTS},
+                                    ConsistencyLevel.ONE)
+
+        def from_counts(rows):
+            counts = _counts_from_rows(rows)
+            if counts.get('reconciled', 0) <= 0:
+                return self._count_metrics(log)
+            now = int(time.time())
+            return [dict(id="otter.metrics.{0}".format(resource),
+                         value=counts.get(resource, 0), time=now)
+                    for resource in _COUNTED_RESOURCES]
+
+        return d.addCallback(from_counts)
+
+    def _count_metrics(self, log):
+        """
+        Count all groups, policies and webhooks in the tables, like
+        :meth:`get_metrics`.
         """
         def _get_metric(table, label):
             """
@@ -17,12 +17,51 @@ from otter.util.fp import assoc_obj
 
 @attr.s
 class GetAllValidGroups(object):
-    pass
+    """
+    Get all valid scaling groups, scanning the groups in ``ranges`` token
+    ranges, ``concurrency`` of them at a time.
+    """
+    ranges = attr.ib(default=1)
+    concurrency = attr.ib(default=1)
 
 
 @deferred_performer
 def perform_get_all_valid_groups(store, dispatcher, intent):
-    return store.get_all_valid_groups()
+    return store.get_all_valid_groups(ranges=intent.ranges,
+                                      concurrency=intent.concurrency)
+
+
+@attr.s
+class ScanValidGroups(object):
+    """
+    Scan all valid scaling groups, giving each page of them to ``consumer``
+    as it is read. See :meth:`CassScalingGroupCollection.scan_valid_groups`.
+    """
+    consumer = attr.ib()
+    props = attr.ib(default=None)
+    ranges = attr.ib(default=1)
+    concurrency = attr.ib(default=1)
+
+
+@deferred_performer
+def perform_scan_valid_groups(store, dispatcher, intent):
+    return store.scan_valid_groups(intent.consumer, props=intent.props,
+                                   ranges=intent.ranges,
+                                   concurrency=intent.concurrency)
+
+
+@attr.s
+class ReconcileCounts(object):
+    """
+    Reconcile the resource counts of all tenants with the tables. See
+    :meth:`CassScalingGroupCollection.reconcile_all_counts`.
+    """
+    tenant_ids = attr.ib()
+
+
+@deferred_performer
+def perform_reconcile_counts(log, store, dispatcher, intent):
+    return store.reconcile_all_counts(log, intent.tenant_ids)
 
 
 @attributes(['tenant_id', 'group_id'])
@@ -139,4 +178,6 @@ def get_model_dispatcher(log, store):
         UpdateGroupErrorReasons: perform_update_error_reasons,
         ModifyGroupStatePaused: perform_modify_group_state_paused,
         GetAllValidGroups: partial(perform_get_all_valid_groups, store),
+        ScanValidGroups: partial(perform_scan_valid_groups, store),
+        ReconcileCounts: partial(perform_reconcile_counts, log, store),
     })
@@ -1,7 +1,9 @@
 """
 Interface to be used by the scaling groups engine
 """
+from collections import OrderedDict
 from datetime import datetime
+from time import mktime
 
 from croniter import croniter
 
@@ -686,6 +688,28 @@ class IScalingScheduleCollection(Interface):
         :rtype: deferred :class:`list` of :class:`dict`
         """
 
+    def fetch_events(bucket, until, size=100):
+        """
+        Fetch a batch of scheduled events in a bucket without deleting them.
+
+        :param int bucket: Index of bucket from which to fetch events.
+        :param datetime until: Time up to which events are fetched.
+        :param int size: The maximum number of events to fetch.
+        :return: Deferred that fires with a sequence of events, earliest
+            first.
+        :rtype: deferred :class:`list` of :class:`dict`
+        """
+
+    def delete_events(bucket, events):
+        """
+        Delete scheduled events of a bucket.
+
+        :param int bucket: Index of bucket of the events.
+        :param events: Events as returned by :meth:`fetch_events`.
+        :type events: :class:`list` of :class:`dict`
+        :return: Deferred that fires with :data:`None`
+        """
+
     def add_cron_events(cron_events):
         """
         Add cron events equally distributed among the buckets.
@@ -705,12 +729,58 @@ class IScalingScheduleCollection(Interface):
         """
 
 
-def next_cron_occurrence(cron):
+CRON_CACHE_SIZE = 1000
+"""Maximum number of parsed cron entries kept by :func:`parsed_cron`."""
+
+_parsed_crons = OrderedDict()
+
+
+def parsed_cron(cron):
+    """
+    Return a :obj:`croniter` of given cron entry. Entries are parsed once and
+    kept in a per-process LRU cache of :data:`CRON_CACHE_SIZE` entries, since
+    most policies share a few entries.
+
+    The returned :obj:`croniter` is shared: its current time must be set
+    before each use.
+
+    :raises: whatever :obj:`croniter` raises on invalid entries, which are not
+        cached.
+    """
+    try:
+        itr = _parsed_crons.pop(cron)
+    except KeyError:
+        itr = croniter(cron)
+        if len(_parsed_crons) >= CRON_CACHE_SIZE:
+            _parsed_crons.popitem(last=False)
+    _parsed_crons[cron] = itr
+    return itr
+
+
+def next_cron_occurrence(cron, now=None):
     """
     Return next occurence of given cron entry
+
+    :param datetime now: UTC time after which the occurence is returned.
+        Defaults to the current time.
+    """
+    itr = parsed_cron(cron)
+    itr.cur = mktime((now or datetime.utcnow()).timetuple())
+    return itr.get_next(ret_type=datetime)
+
+
+def next_cron_occurrences(crons, now=None):
+    """
+    Return next occurences of given cron entries, computed once per distinct
+    entry.
+
+    :param crons: Iterable of cron entries
+    :param datetime now: UTC time after which the occurences are returned.
+        Defaults to the current time.
+    :return: ``dict`` of next occurence by cron entry
     """
-    return croniter(
-        cron, start_time=datetime.utcnow()).get_next(ret_type=datetime)
+    now = now or datetime.utcnow()
+    return {cron: next_cron_occurrence(cron, now) for cron in set(crons)}
 
 
 class IScalingGroupCollection(Interface):
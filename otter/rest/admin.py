@@ -3,6 +3,7 @@ Autoscale REST endpoints having to do with administration of Otter.
 """
 from otter.rest.metrics import OtterMetrics
 from otter.rest.otterapp import OtterApp
+from otter.util.metrics import registry as default_registry
 
 
 class OtterAdmin(object):
@@ -11,11 +12,12 @@ class OtterAdmin(object):
     """
     app = OtterApp()
 
-    def __init__(self, store):
+    def __init__(self, store, registry=default_registry):
         """
         Initialize OtterAdmin.
         """
         self.store = store
+        self.registry = registry
 
     @app.route('/', methods=['GET'])
     def root(self, request):
@@ -29,4 +31,4 @@ class OtterAdmin(object):
         """
         Routes related to metrics are delegated to OtterMetrics.
         """
-        return OtterMetrics(self.store).app.resource()
+        return OtterMetrics(self.store, self.registry).app.resource()
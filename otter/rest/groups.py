@@ -21,7 +21,8 @@ from otter.json_schema.group_schemas import (
 from otter.json_schema.rest_schemas import create_group_request
 from otter.log import log
 from otter.log.bound import bound_log_kwargs
-from otter.models.cass import CassScalingGroupServersCache
+from otter.models.cass import (
+    CassScalingGroupServersCache, get_groups_servers)
 from otter.models.interface import ScalingGroupStatus
 from otter.rest.bobby import get_bobby
 from otter.rest.configs import (
@@ -205,11 +206,9 @@ class OtterGroups(object):
         def fetch_active_caches(group_states):
             if not tenant_is_enabled(self.tenant_id, config_value):
                 return group_states, [None] * len(group_states)
-            d = gatherResults(
-                [get_active_cache(
-                    self.store.reactor, self.store.connection, self.tenant_id,
-                    state.group_id)
-                 for state in group_states])
+            d = get_active_caches(
+                self.store.reactor, self.store.connection, self.tenant_id,
+                [state.group_id for state in group_states])
             return d.addCallback(lambda cache: (group_states, cache))
 
         deferred = self.store.list_scaling_group_states(
@@ -471,6 +470,22 @@ def get_active_cache(reactor, connection, tenant_id, group_id):
     return d.addCallback(lambda (servers, _): {s['id']: s for s in servers})
 
 
+def get_active_caches(reactor, connection, tenant_id, group_ids):
+    """
+    Get active servers of many groups from servers cache table, reading the
+    groups in chunks instead of one by one
+
+    :return: Deferred fired with ``list`` of active servers by id, in the
+        order of ``group_ids``
+    """
+    eff = get_groups_servers(tenant_id, group_ids, True)
+    disp = get_working_cql_dispatcher(reactor, connection)
+    d = perform(disp, eff)
+    return d.addCallback(
+        lambda caches: [{s['id']: s for s in caches[group_id][0]}
+                        for group_id in group_ids])
+
+
 class OtterGroup(object):
     """
     REST endpoints for managing a specific scaling group.
@@ -8,6 +8,7 @@ from otter.rest.decorators import (fails_with, succeeds_with,
                                    with_transaction_id)
 from otter.rest.errors import exception_codes
 from otter.rest.otterapp import OtterApp
+from otter.util.metrics import registry as default_registry
 
 
 class OtterMetrics(object):
@@ -16,12 +17,14 @@ class OtterMetrics(object):
     """
     app = OtterApp()
 
-    def __init__(self, store):
+    def __init__(self, store, registry=default_registry):
         """
-        Initialize OtterMetrics with a data store and log.
+        Initialize OtterMetrics with a data store, log and the registry of
+        this process' metrics.
         """
         self.log = log.bind(system='otter.rest.metrics')
         self.store = store
+        self.registry = registry
 
     @app.route('/', methods=['GET'])
     @with_transaction_id()
@@ -51,3 +54,47 @@ class OtterMetrics(object):
         deferred = self.store.get_metrics(self.log)
         deferred.addCallback(lambda metrics: json.dumps({'metrics': metrics}))
         return deferred
+
+    @app.route('/local/', methods=['GET'])
+    @with_transaction_id()
+    @fails_with(exception_codes)
+    @succeeds_with(200)
+    def list_local_metrics(self, request):
+        """
+        Get the metrics recorded in this process, such as the latency and
+        status codes of requests made to upstream services.
+
+        Example response::
+
+            {
+                "metrics": {
+                    "counters": [
+                        {
+                            "name": "http.responses",
+                            "labels": {"service": "CLOUD_SERVERS",
+                                       "method": "GET",
+                                       "url": "servers/detail",
+                                       "code": 200},
+                            "value": 3207
+                        }
+                    ],
+                    "gauges": [],
+                    "histograms": [
+                        {
+                            "name": "http.request_time",
+                            "labels": {"service": "CLOUD_SERVERS",
+                                       "method": "GET",
+                                       "url": "servers/detail"},
+                            "count": 3207,
+                            "sum": 1220.5,
+                            "max": 3.2,
+                            "p50": 0.25,
+                            "p90": 1,
+                            "p99": 2.5,
+                            "buckets": [[0.005, 0], [0.01, 0], ...]
+                        }
+                    ]
+                }
+            }
+        """
+        return json.dumps({'metrics': self.registry.snapshot()})
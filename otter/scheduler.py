@@ -4,20 +4,30 @@ is right all the time and is probably what caused your regular clock to get brok
 in the first place.
 """
 
-from datetime import datetime
+import heapq
+from collections import OrderedDict, deque
+from copy import deepcopy
+from datetime import datetime, timedelta
 from functools import partial
 
+from kazoo.recipe.partitioner import PartitionState
+
+from toolz.itertoolz import groupby
+
 from twisted.application.service import MultiService
 from twisted.internet import defer
+from twisted.python.failure import Failure
 
 from otter.controller import (
     CannotExecutePolicyError, maybe_execute_scaling_policy, modify_and_trigger)
 from otter.log import log as otter_log
 from otter.log.bound import bound_log_kwargs
 from otter.models.interface import (
-    NoSuchPolicyError, NoSuchScalingGroupError, next_cron_occurrence)
+    NoSuchPolicyError, NoSuchScalingGroupError, next_cron_occurrences)
 from otter.util.deferredutils import ignore_and_log
 from otter.util.hashkey import generate_transaction_id
+from otter.util.metrics import registry as default_registry
+from otter.util.timestamp import datetime_to_epoch
 
 
 class SchedulerService(MultiService):
@@ -26,7 +36,7 @@ class SchedulerService(MultiService):
     """
 
     def __init__(self, dispatcher, batchsize, store, partitioner_factory,
-                 threshold=60):
+                 threshold=60, clock=None, lookahead=None, concurrency=100):
         """
         Initialize the scheduler service
 
@@ -35,15 +45,60 @@ class SchedulerService(MultiService):
         :param store: cassandra store
         :param partitioner_factory: Callable of (log, callback) ->
             :obj:`Partitioner`
+        :param clock: Reactor used to fire prefetched events and to time
+            them
+        :param lookahead: If given, number of seconds ahead of which events
+            are fetched and then fired at their trigger time by a
+            :obj:`EventTimer` instead of being checked on each partitioner
+            interval
+        :param int concurrency: Maximum number of events executed at a time
         """
         MultiService.__init__(self)
+        if clock is None:  # pragma: no cover
+            from twisted.internet import reactor
+            clock = reactor
+        self.clock = clock
         self.store = store
         self.threshold = threshold
         self.log = otter_log.bind(system='otter.scheduler')
-        self.partitioner = partitioner_factory(
-            self.log, partial(self._check_events, batchsize))
-        self.partitioner.setServiceParent(self)
         self.dispatcher = dispatcher
+        self.executor = EventExecutor(concurrency)
+        self.metrics = {}
+        self.timer = None
+        if lookahead:
+            self.timer = EventTimer(clock, self.log, dispatcher, store,
+                                    self._owns_bucket, lookahead, batchsize,
+                                    self.executor, self.bucket_metrics)
+            got_buckets = self.timer.refresh
+        else:
+            got_buckets = partial(self._check_events, batchsize)
+        self.partitioner = partitioner_factory(self.log, got_buckets)
+        self.partitioner.setServiceParent(self)
+
+    def stopService(self):
+        """
+        Stop the service, forgetting prefetched events
+        """
+        if self.timer is not None:
+            self.timer.stop()
+        return MultiService.stopService(self)
+
+    def _owns_bucket(self, bucket):
+        """
+        Is the bucket currently allocated to this node?
+        """
+        return (
+            self.partitioner.get_current_state() == PartitionState.ACQUIRED and
+            bucket in self.partitioner.get_current_buckets())
+
+    def bucket_metrics(self, bucket):
+        """
+        Return the :obj:`BucketMetrics` of a bucket
+        """
+        metrics = self.metrics.get(bucket)
+        if metrics is None:
+            metrics = self.metrics[bucket] = BucketMetrics(self.clock, bucket)
+        return metrics
 
     def reset(self, path):
         """
@@ -98,14 +153,349 @@ class SchedulerService(MultiService):
 
         return defer.gatherResults(
             [check_events_in_bucket(
-                log, self.dispatcher, self.store, bucket, utcnow, batchsize)
+                log, self.dispatcher, self.store, bucket, utcnow, batchsize,
+                self.executor, self.bucket_metrics(bucket))
              for bucket in buckets])
 
 
-def check_events_in_bucket(log, dispatcher, store, bucket, now, batchsize):
+class BucketMetrics(object):
+    """
+    Metrics of the events of a bucket, recorded in a
+    :obj:`otter.util.metrics.MetricsRegistry` with a ``bucket`` label:
+
+    - ``scheduler.lateness``: histogram of seconds between the trigger time
+      of events and the start of their execution
+    - ``scheduler.fetch_latency``: histogram of seconds taken to fetch a batch
+      of events
+    - ``scheduler.drain_time``: histogram of seconds taken to fetch and
+      execute all the events due in the bucket
+    - ``scheduler.events_per_second``: gauge of events executed per second
+      during the last drain
+    - ``scheduler.events``: counters of executed events, with an ``outcome``
+      label among :data:`OUTCOMES`
+    """
+
+    OUTCOMES = ('executed', 'cannot_execute', 'deleted', 'error')
+
+    def __init__(self, clock, bucket, registry=default_registry):
+        self.clock = clock
+        self.registry = registry
+        self.labels = (('bucket', str(bucket)),)
+        self.outcome_labels = dict(
+            (outcome, self.labels + (('outcome', outcome),))
+            for outcome in self.OUTCOMES)
+
+    def fetched(self, start):
+        """
+        Record that a batch of events started being fetched at ``start``
+        seconds is fetched
+        """
+        self.registry.observe('scheduler.fetch_latency',
+                              self.clock.seconds() - start, self.labels)
+
+    def drained(self, num_events, start):
+        """
+        Record that ``num_events`` events were fetched and executed since
+        ``start`` seconds
+        """
+        elapsed = self.clock.seconds() - start
+        self.registry.observe('scheduler.drain_time', elapsed, self.labels)
+        self.registry.set_gauge(
+            'scheduler.events_per_second',
+            num_events / elapsed if elapsed else 0, self.labels)
+
+    def executing(self, event):
+        """
+        Record that an event starts being executed
+        """
+        self.registry.observe(
+            'scheduler.lateness',
+            self.clock.seconds() - datetime_to_epoch(event['trigger']),
+            self.labels)
+
+    def executed(self, outcome):
+        """
+        Count an executed event
+
+        :param str outcome: One of :data:`OUTCOMES`
+        """
+        self.registry.increment('scheduler.events',
+                                self.outcome_labels[outcome])
+
+
+class EventExecutor(object):
+    """
+    Executes scheduled events with a maximum number of them in progress.
+
+    Events waiting to be executed are queued by tenant and tenants are taken
+    in turn, so that a tenant with many events triggering at the same time
+    does not delay the events of the others.
+    """
+
+    def __init__(self, concurrency):
+        """
+        :param int concurrency: Maximum number of events executed at a time
+        """
+        self.concurrency = concurrency
+        self.running = 0
+        self.queues = OrderedDict()
+        self._starting = False
+
+    @property
+    def queued(self):
+        """
+        Number of events waiting to be executed
+        """
+        return sum(len(queue) for queue in self.queues.itervalues())
+
+    def execute(self, tenant_id, func, *args, **kwargs):
+        """
+        Call ``func(*args, **kwargs)`` once fewer than ``concurrency``
+        calls are in progress and the queued events of other tenants had
+        their turn.
+
+        :return: Deferred that fires with the result of ``func``
+        """
+        d = defer.Deferred()
+        self.queues.setdefault(tenant_id, deque()).append(
+            (partial(func, *args, **kwargs), d))
+        self._start()
+        return d
+
+    def _start(self):
+        """
+        Start queued calls of tenants in turn while there is capacity
+        """
+        if self._starting:
+            return
+        self._starting = True
+        try:
+            while self.queues and self.running < self.concurrency:
+                tenant_id, queue = self.queues.popitem(last=False)
+                func, d = queue.popleft()
+                if queue:
+                    self.queues[tenant_id] = queue
+                self.running += 1
+                result = defer.maybeDeferred(func)
+                result.addBoth(self._finished)
+                result.chainDeferred(d)
+        finally:
+            self._starting = False
+
+    def _finished(self, result):
+        """
+        Start the next queued call now that one has finished
+        """
+        self.running -= 1
+        self._start()
+        return result
+
+
+def _event_key(bucket, event):
+    """
+    Identity of an event in the schedule table
+    """
+    return (bucket, event['trigger'], event['policyId'])
+
+
+class EventTimer(object):
+    """
+    Events of the buckets of this node that are due within a lookahead
+    window, kept in a heap and fired at their trigger time.
+
+    Events are fetched on each partitioner interval without being deleted.
+    When they are due, they are deleted in a batch per bucket, which claims
+    them, and then executed. Events of buckets that are not allocated to this
+    node anymore are dropped instead, and left for the new owner.
+
+    Fetches that may have started before the deletion of claimed events
+    completed can still return them, so claimed events are remembered until a
+    later fetch of their bucket.
+    """
+
+    def __init__(self, clock, log, dispatcher, store, owns_bucket, lookahead,
+                 batchsize, executor=None, bucket_metrics=lambda bucket: None):
+        """
+        :param clock: Reactor used to fire the events
+        :param log: A bound log for logging
+        :param dispatcher: Effect dispatcher
+        :param store: `IScalingScheduleCollection` provider
+        :param owns_bucket: Callable of bucket -> ``bool`` telling if the
+            bucket is still allocated to this node
+        :param lookahead: Number of seconds ahead of which events are fetched
+        :param int batchsize: Maximum number of events fetched at a time from
+            a bucket
+        :param executor: :obj:`EventExecutor` executing the events
+        :param bucket_metrics: Callable of bucket -> :obj:`BucketMetrics`, or
+            None to not record metrics
+        """
+        self.clock = clock
+        self.log = log
+        self.dispatcher = dispatcher
+        self.store = store
+        self.owns_bucket = owns_bucket
+        self.lookahead = timedelta(seconds=lookahead)
+        self.batchsize = batchsize
+        self.executor = executor
+        self.bucket_metrics = bucket_metrics
+        self.buckets = set()
+        self.heap = []
+        self.keys = set()
+        # key -> number of deletions completed before the event was deleted,
+        # or None while it is being deleted
+        self.claimed = {}
+        self.deletions = 0
+        self.truncated = set()
+        self.call = None
+
+    def utcnow(self):
+        """
+        Current time according to the clock
+        """
+        return datetime.utcfromtimestamp(self.clock.seconds())
+
+    def refresh(self, buckets):
+        """
+        Forget events of buckets that are not allocated anymore and fetch
+        the events of the given buckets due within the lookahead window.
+
+        :return: Deferred that fires with None once events are fetched
+        """
+        self.buckets = set(buckets)
+        self.heap = [entry for entry in self.heap
+                     if entry[1][0] in self.buckets]
+        heapq.heapify(self.heap)
+        self.keys = set(key for _, key, _ in self.heap)
+        self._schedule()
+        return defer.gatherResults(
+            [self._fetch(bucket) for bucket in buckets], consumeErrors=True)
+
+    def _fetch(self, bucket):
+        """
+        Fetch events of a bucket due within the lookahead window
+        """
+        started = self.deletions
+        metrics = self.bucket_metrics(bucket)
+        start = self.clock.seconds()
+        d = self.store.fetch_events(bucket, self.utcnow() + self.lookahead,
+                                    self.batchsize)
+        if metrics is not None:
+            d.addCallback(_record, metrics.fetched, start)
+        d.addCallback(self._add, bucket, started)
+        d.addErrback(self.log.err, 'sch-fetch-events-err', bucket=bucket)
+        return d
+
+    def _add(self, events, bucket, started):
+        """
+        Add fetched events of a bucket that are not known yet
+        """
+        for key, deleted in self.claimed.items():
+            if key[0] == bucket and deleted is not None and deleted < started:
+                del self.claimed[key]
+        if bucket not in self.buckets:
+            return
+        if len(events) == self.batchsize:
+            self.truncated.add(bucket)
+        else:
+            self.truncated.discard(bucket)
+        for event in events:
+            key = _event_key(bucket, event)
+            if key not in self.keys and key not in self.claimed:
+                heapq.heappush(self.heap, (event['trigger'], key, event))
+                self.keys.add(key)
+        self._schedule()
+
+    def _schedule(self):
+        """
+        Arrange for the earliest event to be fired at its trigger time
+        """
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+        if self.heap:
+            delay = (self.heap[0][0] - self.utcnow()).total_seconds()
+            self.call = self.clock.callLater(max(delay, 0), self._fire)
+
+    def _fire(self):
+        """
+        Claim and execute the events that are due
+
+        :return: Deferred that fires with None once the events are executed
+        """
+        self.call = None
+        now = self.utcnow()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            _, key, event = heapq.heappop(self.heap)
+            self.keys.discard(key)
+            due.append((key, event))
+        self._schedule()
+        log = self.log.bind(scheduler_run_id=generate_transaction_id(),
+                            utcnow=now)
+        by_bucket = groupby(lambda entry: entry[0][0], due)
+        return defer.gatherResults(
+            [self._claim(log.bind(bucket=bucket), bucket, entries)
+             for bucket, entries in sorted(by_bucket.items())
+             if self.owns_bucket(bucket)])
+
+    def _claim(self, log, bucket, entries):
+        """
+        Delete due events of a bucket and execute them
+        """
+        keys = [key for key, _ in entries]
+        events = [event for _, event in entries]
+        for key in keys:
+            self.claimed[key] = None
+        metrics = self.bucket_metrics(bucket)
+        start = self.clock.seconds()
+
+        def deleted(_):
+            for key in keys:
+                self.claimed[key] = self.deletions
+            self.deletions += 1
+            d = process_events(events, self.dispatcher, self.store, log,
+                               self.executor, metrics)
+            if metrics is not None:
+                d.addCallback(lambda num: metrics.drained(num, start))
+            return d
+
+        def not_deleted(failure):
+            for key in keys:
+                self.claimed.pop(key, None)
+            return failure
+
+        def fetch_rest(_):
+            if bucket in self.truncated:
+                return self._fetch(bucket)
+
+        d = self.store.delete_events(bucket, events)
+        d.addCallbacks(deleted, not_deleted)
+        d.addCallback(fetch_rest)
+        d.addErrback(log.err, 'sch-claim-events-err')
+        return d
+
+    def stop(self):
+        """
+        Stop firing events and forget them
+        """
+        self.refresh([])
+
+
+def _record(result, record, *args):
+    """
+    Call ``record(*args)`` and return ``result``, to record metrics in a
+    callback chain
+    """
+    record(*args)
+    return result
+
+
+def check_events_in_bucket(log, dispatcher, store, bucket, now, batchsize,
+                           executor=None, metrics=None):
     """
     Retrieves events in the given bucket that occur before or at now,
-    in batches of batchsize, for processing
+    in batches of batchsize, for processing. The next batch is fetched only
+    once the events of the previous one are executed.
 
     :param log: A bound log for logging
     :param dispatcher: Effect dispatcher
@@ -113,19 +503,30 @@ def check_events_in_bucket(log, dispatcher, store, bucket, now, batchsize):
     :param bucket: Bucket to check events in
     :param now: Time before which events are checked
     :param batchsize: Number of events to check at a time
+    :param executor: :obj:`EventExecutor` executing the events
+    :param metrics: :obj:`BucketMetrics` of the bucket
 
     :return: a deferred that fires with None
     """
 
     log = log.bind(bucket=bucket)
+    start = metrics and metrics.clock.seconds()
+    processed = [0]
 
     def check_for_more(num_events):
+        processed[0] += num_events
         if num_events == batchsize:
             return _do_check()
+        if metrics is not None:
+            metrics.drained(processed[0], start)
 
     def _do_check():
+        fetch_start = metrics and metrics.clock.seconds()
         d = store.fetch_and_delete(bucket, now, batchsize)
-        d.addCallback(process_events, dispatcher, store, log)
+        if metrics is not None:
+            d.addCallback(_record, metrics.fetched, fetch_start)
+        d.addCallback(process_events, dispatcher, store, log, executor,
+                      metrics)
         d.addCallback(check_for_more)
         d.addErrback(log.err)
         return d
@@ -133,15 +534,20 @@ def check_events_in_bucket(log, dispatcher, store, bucket, now, batchsize):
     return _do_check()
 
 
-def process_events(events, dispatcher, store, log):
+def process_events(events, dispatcher, store, log, executor=None,
+                   metrics=None):
     """
     Executes all the events and adds the next occurrence of each event
-    to the buckets
+    to the buckets. Events of the same group are executed together by
+    :func:`execute_group_events`.
 
     :param events: list of event dict to process
     :param dispatcher: Effect dispatcher
     :param store: `IScalingGroupCollection` provider
     :param log: A bound log for logging
+    :param executor: :obj:`EventExecutor` executing the events. They are all
+        executed at once if not given.
+    :param metrics: :obj:`BucketMetrics` of the bucket of the events
 
     :return: a `Deferred` that fires with number of events processed
     """
@@ -152,10 +558,20 @@ def process_events(events, dispatcher, store, log):
 
     deleted_policy_ids = set()
 
-    deferreds = [
-        execute_event(dispatcher, store, log, event, deleted_policy_ids)
-        for event in events
-    ]
+    by_group = groupby(lambda event: (event['tenantId'], event['groupId']),
+                       events)
+    deferreds = []
+    for (tenant_id, _), group_events in sorted(by_group.items()):
+        if len(group_events) == 1:
+            func, arg = execute_event, group_events[0]
+        else:
+            func, arg = execute_group_events, group_events
+        if executor is None:
+            d = func(dispatcher, store, log, arg, deleted_policy_ids, metrics)
+        else:
+            d = executor.execute(tenant_id, func, dispatcher, store, log, arg,
+                                 deleted_policy_ids, metrics)
+        deferreds.append(d)
     d = defer.gatherResults(deferreds, consumeErrors=True)
     d.addCallback(lambda _: add_cron_events(store, log, events, deleted_policy_ids))
     return d.addCallback(lambda _: len(events))
@@ -177,18 +593,43 @@ def add_cron_events(store, log, events, deleted_policy_ids):
     if not events:
         return
 
-    new_cron_events = []
-    for event in events:
-        if event['cron'] and event['policyId'] not in deleted_policy_ids:
-            event['trigger'] = next_cron_occurrence(event['cron'])
-            new_cron_events.append(event)
+    new_cron_events = [
+        event for event in events
+        if event['cron'] and event['policyId'] not in deleted_policy_ids]
+    triggers = next_cron_occurrences(
+        event['cron'] for event in new_cron_events)
+    for event in new_cron_events:
+        event['trigger'] = triggers[event['cron']]
 
     if new_cron_events:
         log.msg('Adding {new_cron_events} cron events', new_cron_events=len(new_cron_events))
         return store.add_cron_events(new_cron_events)
 
 
-def execute_event(dispatcher, store, log, event, deleted_policy_ids):
+def _event_log(log, event):
+    """
+    Bind the identity of an event to a log
+    """
+    return log.bind(tenant_id=event['tenantId'],
+                    scaling_group_id=event['groupId'],
+                    policy_id=event['policyId'],
+                    scheduled_time=event["trigger"].isoformat() + "Z")
+
+
+def _event_outcome(failure):
+    """
+    Return the :obj:`BucketMetrics` outcome of an event that failed to
+    execute
+    """
+    if failure.check(CannotExecutePolicyError):
+        return 'cannot_execute'
+    if failure.check(NoSuchScalingGroupError, NoSuchPolicyError):
+        return 'deleted'
+    return 'error'
+
+
+def execute_event(dispatcher, store, log, event, deleted_policy_ids,
+                  metrics=None):
     """
     Execute a single event
 
@@ -198,16 +639,18 @@ def execute_event(dispatcher, store, log, event, deleted_policy_ids):
     :param event: event dict to execute
     :param deleted_policy_ids: Set of policy ids that are deleted. Policy id
         will be added to this if its scaling group or policy has been deleted
+    :param metrics: :obj:`BucketMetrics` recording the lateness and outcome
+        of the execution
     :return: a deferred with None. Any error occurred during execution is
         logged
     """
     tenant_id = event['tenantId']
     group_id = event['groupId']
     policy_id = event['policyId']
-    log = log.bind(tenant_id=tenant_id, scaling_group_id=group_id,
-                   policy_id=policy_id,
-                   scheduled_time=event["trigger"].isoformat() + "Z")
+    log = _event_log(log, event)
     log.msg('sch-exec-pol', cloud_feed=True)
+    if metrics is not None:
+        metrics.executing(event)
     group = store.get_scaling_group(log, tenant_id, group_id)
     d = modify_and_trigger(
         dispatcher,
@@ -217,6 +660,10 @@ def execute_event(dispatcher, store, log, event, deleted_policy_ids):
                 log, generate_transaction_id(),
                 policy_id=policy_id, version=event['version']),
         modify_state_reason='scheduler.execute_event')
+    if metrics is not None:
+        d.addCallbacks(
+            _record, lambda f: _record(f, metrics.executed, _event_outcome(f)),
+            callbackArgs=(metrics.executed, 'executed'))
     d.addErrback(ignore_and_log, CannotExecutePolicyError,
                  log, "sch-cannot-exec", cloud_feed=True)
 
@@ -227,3 +674,96 @@ def execute_event(dispatcher, store, log, event, deleted_policy_ids):
     d.addErrback(collect_deleted_policy)
     d.addErrback(log.err, "sch-exec-pol-err", cloud_feed=True)
     return d
+
+
+def execute_group_events(dispatcher, store, log, events, deleted_policy_ids,
+                         metrics=None):
+    """
+    Execute events of the same group, in order, within a single modification
+    of its state, and trigger convergence once.
+
+    Each policy is executed on the state left by the previous ones, so
+    cooldowns are checked as if they were executed one after the other. A
+    policy that cannot be executed leaves the state unchanged for the next
+    ones, and the state is not written if no policy was executed. Each event
+    is logged like in :func:`execute_event`.
+
+    :param events: event dicts of the same group to execute, in order
+    :return: a deferred with None. Any error occurred during execution is
+        logged
+    """
+    tenant_id = events[0]['tenantId']
+    group_id = events[0]['groupId']
+    logs = [_event_log(log, event) for event in events]
+    for event_log, event in zip(logs, events):
+        event_log.msg('sch-exec-pol', cloud_feed=True)
+        if metrics is not None:
+            metrics.executing(event)
+    outcomes = {}
+    unexecuted = []
+
+    def execute(state, group, index):
+        event = events[index]
+        before = deepcopy(state)
+
+        def succeeded(new_state):
+            outcomes[index] = None
+            return new_state
+
+        def failed(failure):
+            outcomes[index] = failure
+            return before
+
+        d = defer.maybeDeferred(
+            maybe_execute_scaling_policy, logs[index],
+            generate_transaction_id(), group, state,
+            policy_id=event['policyId'], version=event['version'])
+        return d.addCallbacks(succeeded, failed)
+
+    def execute_all(group, state):
+        d = defer.succeed(state)
+        for index in range(len(events)):
+            d.addCallback(execute, group, index)
+        return d.addCallback(check_executed)
+
+    def check_executed(state):
+        if None in outcomes.values():
+            return state
+        failures = [outcomes[index] for index in range(len(events))]
+        failure = next((f for f in failures
+                        if f.check(CannotExecutePolicyError)), failures[0])
+        unexecuted.append(failure)
+        return failure
+
+    def report(result):
+        if isinstance(result, Failure) and not (
+                unexecuted and result.value is unexecuted[0].value):
+            # The state was not modified, or the group could not be
+            # converged: every event shares the error
+            for index in range(len(events)):
+                if outcomes.get(index) is None:
+                    outcomes[index] = result
+        for index, event_log in enumerate(logs):
+            failure = outcomes.get(index)
+            if metrics is not None:
+                metrics.executed('executed' if failure is None
+                                 else _event_outcome(failure))
+            if failure is None:
+                continue
+            elif failure.check(CannotExecutePolicyError):
+                event_log.msg("sch-cannot-exec", reason=failure,
+                              cloud_feed=True)
+            elif failure.check(NoSuchScalingGroupError, NoSuchPolicyError):
+                deleted_policy_ids.add(events[index]['policyId'])
+            else:
+                event_log.err(failure, "sch-exec-pol-err", cloud_feed=True)
+
+    group_log = log.bind(tenant_id=tenant_id, scaling_group_id=group_id)
+    group = store.get_scaling_group(group_log, tenant_id, group_id)
+    d = modify_and_trigger(
+        dispatcher,
+        group,
+        bound_log_kwargs(group_log),
+        execute_all,
+        modify_state_reason='scheduler.execute_group_events')
+    return d.addBoth(report)
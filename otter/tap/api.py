@@ -6,13 +6,15 @@ import os
 from copy import deepcopy
 from functools import partial
 
+from effect import Effect
+
 import jsonfig
 
 from kazoo.client import KazooClient
 
-from silverberg.cluster import RoundRobinCassandraCluster
 from silverberg.logger import LoggingCQLClient
 
+from twisted.application.internet import TimerService
 from twisted.application.service import MultiService, Service
 from twisted.application.strports import service
 from twisted.internet import reactor
@@ -23,30 +25,42 @@ from twisted.python import usage
 from twisted.python.threadpool import ThreadPool
 from twisted.web.server import Site
 
+from txeffect import perform
+
 from txkazoo import TxKazooClient
 from txkazoo.log import TxLogger
 from txkazoo.recipe.watchers import watch_children
 
 from otter.auth import generate_authenticator
 from otter.bobby import BobbyClient
+from otter.cloud_client import TenantScope
 from otter.constants import (
     CONVERGENCE_DIRTY_DIR,
     CONVERGENCE_PARTITIONER_PATH,
     get_service_configs)
 from otter.convergence.service import Converger
-from otter.effect_dispatcher import get_full_dispatcher
+from otter.effect_dispatcher import get_full_dispatcher, get_legacy_dispatcher
 from otter.log import log
 from otter.log.cloudfeeds import CloudFeedsObserver
 from otter.log.formatters import add_to_fanout
-from otter.models.cass import CassAdmin, CassScalingGroupCollection
+from otter.metrics import add_local_metrics_to_cloud_metrics
+from otter.models.cass import (
+    PARTITION_KEYS,
+    CassAdmin,
+    CassScalingGroupCollection,
+    GroupConfigCache,
+    WebhookCapabilityCache)
 from otter.rest.admin import OtterAdmin
 from otter.rest.application import Otter
 from otter.rest.bobby import set_bobby
 from otter.scheduler import SchedulerService
 from otter.supervisor import SupervisorService, set_supervisor
 from otter.util.config import config_value, set_config_data
-from otter.util.cqlbatch import TimingOutCQLClient
+from otter.util.cqlbatch import MetricsCQLClient, TimingOutCQLClient
+from otter.util.cqlpool import TokenAwareCassandraCluster, tcp_address
+from otter.util.cqlprepared import PreparingCassandraCluster
 from otter.util.deferredutils import timeout_deferred
+from otter.util.metrics import registry as local_registry
 from otter.util.zkpartitioner import Partitioner
 
 assert os.environ.get("PYRSISTENT_NO_C_EXTENSION"), (
@@ -114,6 +128,56 @@ class FunctionalService(Service, object):
             return self._stop()
 
 
+def make_cassandra_cluster(reactor, log):
+    """
+    Make the client to the Cassandra cluster of the config: a
+    :obj:`TokenAwareCassandraCluster` when ``cassandra.pool`` is configured,
+    or else a :obj:`PreparingCassandraCluster` of the seed hosts.
+
+    :return: (cluster, service) tuple, the service refreshing the token
+        ring of the pool, or None
+    """
+    pool = config_value('cassandra.pool')
+    if pool is None:
+        seed_endpoints = [
+            clientFromString(reactor, str(host))
+            for host in config_value('cassandra.seed_hosts')]
+        return PreparingCassandraCluster(
+            seed_endpoints, config_value('cassandra.keyspace'),
+            disconnect_on_cancel=True), None
+    cluster = TokenAwareCassandraCluster(
+        reactor,
+        [tcp_address(str(host))
+         for host in config_value('cassandra.seed_hosts')],
+        config_value('cassandra.keyspace'),
+        PARTITION_KEYS,
+        connections=pool.get('connections', 2),
+        max_in_flight=pool.get('max_in_flight', 64),
+        timeout=pool.get('host_timeout', 10),
+        down_interval=pool.get('down_interval', 10),
+        speculative_delay=pool.get('speculative_delay'),
+        log=log.bind(system='otter.cqlpool'))
+    ring_service = TimerService(pool.get('ring_interval', 60),
+                                cluster.refresh_ring)
+    return cluster, ring_service
+
+
+def push_local_metrics(dispatcher, metr_conf, region, log):
+    """
+    Push the metrics recorded by this process, like the latency of upstream
+    requests and CQL queries, to Cloud metrics. Failures are logged so that
+    later pushes are still made.
+
+    :param dict metr_conf: The ``metrics`` config, with the ``ttl`` of the
+        metrics and the ``tenant_id`` to push them as
+    """
+    eff = add_local_metrics_to_cloud_metrics(
+        metr_conf['ttl'], region, local_registry, log)
+    return perform(
+        dispatcher, Effect(TenantScope(eff, metr_conf['tenant_id']))
+    ).addErrback(log.err, 'push-local-metrics-error')
+
+
 def call_after_supervisor(func, supervisor):
     """
     Call function after supervisor jobs have completed
@@ -187,22 +251,32 @@ def makeService(config):
 
     region = config_value('region')
 
-    seed_endpoints = [
-        clientFromString(reactor, str(host))
-        for host in config_value('cassandra.seed_hosts')]
+    cluster, ring_service = make_cassandra_cluster(reactor, log)
+    if ring_service is not None:
+        ring_service.setServiceParent(parent)
 
     cassandra_cluster = LoggingCQLClient(
-        TimingOutCQLClient(
+        MetricsCQLClient(
             reactor,
-            RoundRobinCassandraCluster(
-                seed_endpoints,
-                config_value('cassandra.keyspace'),
-                disconnect_on_cancel=True),
-            config_value('cassandra.timeout') or 30),
+            TimingOutCQLClient(
+                reactor, cluster, config_value('cassandra.timeout') or 30)),
         log.bind(system='otter.silverberg'))
 
+    config_cache = GroupConfigCache(
+        reactor,
+        size=config_value('group_config_cache.size') or 1000,
+        max_age=config_value('group_config_cache.max_age') or 1)
+    cas_retries = None
+    if config_value('modify_state.engine') == 'cas':
+        cas_retries = config_value('modify_state.cas_retries') or 10
+    webhook_cache = WebhookCapabilityCache(
+        reactor,
+        size=config_value('webhook_cache.size') or 10000,
+        ttl=config_value('webhook_cache.ttl') or 60,
+        negative_ttl=config_value('webhook_cache.negative_ttl') or 5)
     store = CassScalingGroupCollection(
-        cassandra_cluster, reactor, config_value('limits.absolute.maxGroups'))
+        cassandra_cluster, reactor, config_value('limits.absolute.maxGroups'),
+        config_cache, cas_retries, webhook_cache)
     admin_store = CassAdmin(cassandra_cluster)
 
     bobby_url = config_value('bobby_url')
@@ -255,7 +329,19 @@ def makeService(config):
             authenticator=generate_authenticator(reactor, id_conf),
             tenant_id=cf_conf['tenant_id'],
             region=region,
-            service_configs=service_configs))
+            service_configs=service_configs,
+            concurrency=cf_conf.get('concurrency', 10),
+            max_queued=cf_conf.get('max_queued', 1000)))
+
+    # Push metrics recorded by this process to cloud metrics
+    metr_conf = config.get('metrics', None)
+    if metr_conf is not None and metr_conf.get('local_metrics', False):
+        metrics_service = TimerService(
+            metr_conf.get('interval', 60), push_local_metrics,
+            get_legacy_dispatcher(reactor, authenticator, log,
+                                  service_configs),
+            metr_conf, region, log.bind(system='otter.local_metrics'))
+        metrics_service.setServiceParent(parent)
 
     # Setup Kazoo client
     if config_value('zookeeper'):
@@ -344,6 +430,8 @@ def setup_scheduler(parent, dispatcher, store, kz_client):
         buckets, time_boundary)
     scheduler_service = SchedulerService(
         dispatcher, int(config_value('scheduler.batchsize')),
-        store, partitioner_factory)
+        store, partitioner_factory, clock=reactor,
+        lookahead=config_value('scheduler.lookahead'),
+        concurrency=config_value('scheduler.concurrency') or 100)
     scheduler_service.setServiceParent(parent)
     return scheduler_service
@@ -0,0 +1,84 @@
+"""
+Tests for :mod:`otter.benchmark.convergence`.
+"""
+from random import Random
+
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.benchmark.convergence import converge_steps, http_summaries
+from otter.benchmark.upstream import FakeUpstream
+from otter.convergence.steps import (
+    AddNodesToCLB,
+    BulkAddToRCv3,
+    BulkRemoveFromRCv3,
+    CreateServer,
+    DeleteServer,
+    RemoveNodesFromCLB,
+    SetMetadataItemOnServer)
+from otter.util.metrics import MetricsRegistry
+
+
+class ConvergeStepsTests(SynchronousTestCase):
+    """
+    Tests for :func:`converge_steps`.
+    """
+    def test_steps(self):
+        """
+        Servers, CLB nodes and RCv3 nodes of the tenant are both added and
+        removed.
+        """
+        tenant = FakeUpstream(Clock()).add_tenant(
+            't1', 'g1', servers=2, clbs=1, nodes_per_clb=1, pools=1,
+            nodes_per_pool=1)
+        steps = converge_steps(tenant, Random(0))
+        self.assertEqual(
+            [type(step) for step in steps],
+            [CreateServer, SetMetadataItemOnServer, DeleteServer,
+             AddNodesToCLB, RemoveNodesFromCLB, BulkAddToRCv3,
+             BulkRemoveFromRCv3])
+        self.assertIn(steps[2].server_id, tenant.servers)
+        [lb_id] = tenant.clbs
+        self.assertEqual(list(steps[4].node_ids), list(tenant.clbs[lb_id]))
+
+    def test_empty_tenant(self):
+        """
+        Only a server is created for a tenant without resources.
+        """
+        tenant = FakeUpstream(Clock()).add_tenant(
+            't1', 'g1', servers=0, clbs=0, nodes_per_clb=0, pools=0,
+            nodes_per_pool=0)
+        self.assertEqual(
+            [type(step) for step in converge_steps(tenant, Random(0))],
+            [CreateServer])
+
+
+class HTTPSummariesTests(SynchronousTestCase):
+    """
+    Tests for :func:`http_summaries`.
+    """
+    def test_summaries(self):
+        """
+        Responses, errors and request times are summarized per service.
+        """
+        registry = MetricsRegistry()
+        for labels, code, time in [('GET /servers', 200, 0.02),
+                                   ('POST /servers', 202, 0.2),
+                                   ('GET /servers', 500, 0.02)]:
+            method, url = labels.split()
+            labels = (('service', 'nova'), ('method', method), ('url', url))
+            registry.increment('http.responses', labels + (('code', code),))
+            registry.observe('http.request_time', time, labels)
+        registry.increment('http.errors', (('service', 'clb'),
+                                           ('error', 'ConnectionRefused')))
+        self.assertEqual(
+            http_summaries(registry, 2.0, 0.008),
+            [{'name': 'http clb', 'calls': 1, 'codes': {},
+              'errors': {'ConnectionRefused': 1}, 'calls_per_second': 0.5,
+              'p50': None, 'p90': None, 'p99': None, 'max': None,
+              'cpu_ms_per_call': 2.0},
+             {'name': 'http nova', 'calls': 3, 'codes': {200: 1, 202: 1,
+                                                         500: 1},
+              'errors': {}, 'calls_per_second': 1.5,
+              'p50': 0.025, 'p90': 0.2, 'p99': 0.2, 'max': 0.2,
+              'cpu_ms_per_call': 2.0}])
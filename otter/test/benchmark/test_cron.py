@@ -0,0 +1,45 @@
+"""
+Tests for :mod:`otter.benchmark.cron`.
+"""
+from datetime import datetime
+from random import Random
+
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.benchmark.cron import COMMON_CRONS, cron_entries, run_methods
+from otter.test.utils import patch
+
+
+class CronEntriesTests(SynchronousTestCase):
+    """
+    Tests for :func:`cron_entries`.
+    """
+    def test_entries(self):
+        """
+        Entries are common ones except for the given proportion.
+        """
+        entries = cron_entries(1000, 0.1, Random(0))
+        common = set(cron for cron, _ in COMMON_CRONS)
+        uncommon = [cron for cron in entries if cron not in common]
+        self.assertEqual(len(entries), 1000)
+        self.assertTrue(50 < len(uncommon) < 150)
+        self.assertEqual(entries.count('0 * * * *'),
+                         max(entries.count(cron) for cron in entries))
+
+
+class RunMethodsTests(SynchronousTestCase):
+    """
+    Tests for :func:`run_methods`.
+    """
+    def test_summaries(self):
+        """
+        Every method computes the batches of entries.
+        """
+        patch(self, 'otter.benchmark.measure.cpu_time', return_value=0)
+        summaries = self.successResultOf(run_methods(
+            Clock(), cron_entries(25, 0.5, Random(0)), 10,
+            datetime(2015, 3, 4, 10, 30)))
+        self.assertEqual(
+            [(summary['name'], summary['calls']) for summary in summaries],
+            [('parse_each', 3), ('cached_each', 3), ('cached_distinct', 3)])
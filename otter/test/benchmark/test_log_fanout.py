@@ -0,0 +1,59 @@
+"""
+Tests for :mod:`otter.benchmark.log_fanout`.
+"""
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.benchmark.log_fanout import (
+    CopyingFanoutObserver, convergence_events, make_fanout, run_fanouts)
+from otter.test.utils import patch
+
+
+class ConvergenceEventsTests(SynchronousTestCase):
+    """
+    Tests for :func:`convergence_events`.
+    """
+    def test_events(self):
+        """
+        Events of a convergence cycle list the servers of the group, and none
+        of them are meant for Cloud Feeds.
+        """
+        events = convergence_events(3)
+        self.assertEqual(events[2]['message'], ('execute-convergence',))
+        self.assertEqual(len(events[2]['servers']), 3)
+        self.assertFalse(any(event['cloud_feed'] for event in events))
+
+
+class MakeFanoutTests(SynchronousTestCase):
+    """
+    Tests for :func:`make_fanout`.
+    """
+    def test_copying(self):
+        """
+        :obj:`CopyingFanoutObserver` gives each observer a copy of the event.
+        """
+        fanout = make_fanout(CopyingFanoutObserver)
+        obs = []
+        fanout.subobservers = [obs.append, obs.append]
+        event = {'message': ('m',)}
+        fanout(event)
+        self.assertEqual(obs, [event, event])
+        self.assertIsNot(obs[0], event)
+        self.assertIsNot(obs[0], obs[1])
+
+
+class RunFanoutsTests(SynchronousTestCase):
+    """
+    Tests for :func:`run_fanouts`.
+    """
+    def test_summaries(self):
+        """
+        Every fanout fans out the events of each cycle.
+        """
+        patch(self, 'otter.benchmark.measure.cpu_time', return_value=0)
+        summaries = self.successResultOf(run_fanouts(
+            Clock(), convergence_events(3), 4))
+        self.assertEqual(
+            [(summary['name'], summary['calls'], summary['errors'],
+              summary['cpu_us_per_event']) for summary in summaries],
+            [('copying', 4, {}, 0), ('shared', 4, {}, 0)])
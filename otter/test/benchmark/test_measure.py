@@ -0,0 +1,87 @@
+"""
+Tests for :mod:`otter.benchmark.measure`.
+"""
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.benchmark.measure import (
+    LoadResult, format_summary, percentile, run_load)
+from otter.test.utils import patch
+
+
+class PercentileTests(SynchronousTestCase):
+    """
+    Tests for :func:`percentile`.
+    """
+    def test_percentile(self):
+        """
+        The nearest-rank percentile is returned, or None without values.
+        """
+        values = range(1, 101)
+        self.assertEqual(
+            [percentile(values, pct) for pct in (0, 50, 99, 100)],
+            [1, 50, 99, 100])
+        self.assertIsNone(percentile([], 50))
+
+
+class RunLoadTests(SynchronousTestCase):
+    """
+    Tests for :func:`run_load`.
+    """
+    def setUp(self):
+        """
+        Fake the CPU time.
+        """
+        self.cpu = [1.0]
+        patch(self, 'otter.benchmark.measure.cpu_time',
+              side_effect=lambda: self.cpu[0])
+
+    def test_concurrency(self):
+        """
+        Operations are called with their index, keeping at most
+        ``concurrency`` in progress, and their latencies and errors are
+        recorded.
+        """
+        clock = Clock()
+        calls = []
+
+        def operation(index):
+            d = Deferred()
+            calls.append((index, d))
+            return d
+
+        d = run_load(clock, 'op', operation, 3, 2)
+        self.assertEqual([index for index, _ in calls], [0, 1])
+        clock.advance(1)
+        calls[1][1].callback(None)
+        self.assertEqual([index for index, _ in calls], [0, 1, 2])
+        clock.advance(2)
+        calls[0][1].callback(None)
+        self.cpu[0] = 1.5
+        calls[2][1].errback(ValueError())
+        self.assertEqual(
+            self.successResultOf(d),
+            LoadResult(name='op', latencies=[1, 3], errors={'ValueError': 1},
+                       elapsed=3, cpu=0.5))
+
+    def test_summary(self):
+        """
+        The summary contains rates, latency percentiles and CPU per call,
+        and can be formatted.
+        """
+        d = run_load(Clock(), 'op',
+                     lambda i: succeed(None) if i else fail(ValueError()),
+                     4, 2)
+        result = self.successResultOf(d)
+        result.elapsed, result.cpu = 2.0, 0.004
+        summary = result.summary()
+        self.assertEqual(
+            summary,
+            {'name': 'op', 'calls': 4, 'errors': {'ValueError': 1},
+             'calls_per_second': 2.0, 'p50': 0, 'p90': 0, 'p99': 0, 'max': 0,
+             'cpu_ms_per_call': 1.0})
+        self.assertEqual(
+            format_summary(summary),
+            'op: 4 calls, 2.0 calls/s, latency p50 0.0000s p90 0.0000s p99 '
+            '0.0000s max 0.0000s, 1.000 ms CPU/call, errors ValueError=1')
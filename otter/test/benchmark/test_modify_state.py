@@ -0,0 +1,64 @@
+"""
+Tests for :mod:`otter.benchmark.modify_state`.
+"""
+import mock
+
+from twisted.internet.defer import succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.benchmark.modify_state import bump_desired, run_engine
+from otter.test.utils import patch
+
+
+class FakeGroup(object):
+    """
+    Group of which every other modification of the state is lost.
+    """
+    def __init__(self, groups, group_id):
+        self.groups = groups
+        self.group_id = group_id
+
+    def view_state(self, consistency):
+        return succeed(mock.Mock(desired=self.groups[self.group_id]))
+
+    def modify_state(self, modifier, modify_state_reason):
+        state = modifier(self, mock.Mock(desired=self.groups[self.group_id]))
+        if self.groups['keep']:
+            self.groups[self.group_id] = state.desired
+        self.groups['keep'] = not self.groups['keep']
+        return succeed(None)
+
+
+class RunEngineTests(SynchronousTestCase):
+    """
+    Tests for :func:`run_engine`.
+    """
+    def test_bump_desired(self):
+        """
+        :func:`bump_desired` increments the desired capacity.
+        """
+        state = mock.Mock(desired=2)
+        self.assertIs(bump_desired('group', state), state)
+        self.assertEqual(state.desired, 3)
+
+    def test_lost_updates(self):
+        """
+        Groups are modified in turn through each collection, and the
+        modifications that were not kept are counted as lost.
+        """
+        patch(self, 'otter.benchmark.measure.cpu_time', return_value=0)
+        groups = {'g1': 0, 'g2': 5, 'keep': True}
+        nodes = []
+        collections = [
+            mock.Mock(get_scaling_group=lambda log, tenant_id, group_id,
+                      node=node: nodes.append(node) or
+                      FakeGroup(groups, group_id))
+            for node in ['n1', 'n2']]
+        summary = self.successResultOf(run_engine(
+            Clock(), 'cas', collections, 'log', 't1', ['g1', 'g2'], 4, 2))
+        self.assertEqual((summary['name'], summary['calls'],
+                          summary['lost_updates']),
+                         ('cas', 4, 2))
+        self.assertEqual(nodes[2:6], ['n1', 'n2', 'n1', 'n2'])
+        self.assertEqual((groups['g1'], groups['g2']), (2, 5))
@@ -0,0 +1,178 @@
+"""
+Tests for :mod:`otter.benchmark.upstream`.
+"""
+import json
+
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.benchmark.upstream import FakeUpstream, ServiceBehavior
+from otter.test.rest.request import request
+
+
+class FakeUpstreamTests(SynchronousTestCase):
+    """
+    Tests for :obj:`FakeUpstream`.
+    """
+    def setUp(self):
+        """
+        Create fake services with a tenant.
+        """
+        self.clock = Clock()
+        self.upstream = FakeUpstream(self.clock)
+        self.tenant = self.upstream.add_tenant(
+            't1', 'g1', servers=3, clbs=1, nodes_per_clb=2, pools=1,
+            nodes_per_pool=1)
+
+    def request(self, method, path, body=None):
+        """
+        Make a request and return its response code and decoded body.
+        """
+        d = request(self.upstream, method, path,
+                    body=None if body is None else json.dumps(body))
+        response = self.successResultOf(d)
+        return (response.response.code,
+                json.loads(response.content) if response.content else None)
+
+    def test_add_tenant(self):
+        """
+        Tenants are created with servers of the group, and CLBs and RCv3
+        pools that have nodes for some of these servers.
+        """
+        self.assertEqual(len(self.tenant.servers), 3)
+        server = self.tenant.servers.values()[0]
+        self.assertEqual(server['metadata'],
+                         {'rax:autoscale:group:id': 'g1'})
+        [nodes] = self.tenant.clbs.values()
+        self.assertEqual(
+            [node['address'] for node in nodes.values()],
+            [s['addresses']['private'][0]['addr']
+             for s in self.tenant.servers.values()[:2]])
+        [pool_nodes] = self.tenant.pools.values()
+        self.assertEqual(pool_nodes.keys(), self.tenant.servers.keys()[:1])
+
+    def test_impersonation(self):
+        """
+        The identity API gives the endpoints of a tenant through
+        impersonation.
+        """
+        self.assertEqual(
+            self.request('GET', '/identity/v1.1/mosso/t1'),
+            (301, {'user': {'id': 'user-t1'}}))
+        code, body = self.request(
+            'POST', '/identity/v2.0/RAX-AUTH/impersonation-tokens',
+            {'RAX-AUTH:impersonation': {'user': {'username': 'user-t1'}}})
+        token = body['access']['token']['id']
+        code, body = self.request(
+            'GET', '/identity/v2.0/tokens/{}/endpoints'.format(token))
+        self.assertEqual(
+            [(e['name'], e['publicURL']) for e in body['endpoints']],
+            [('cloudServersOpenStack', 'http://localhost:8080/nova/t1'),
+             ('cloudLoadBalancers', 'http://localhost:8080/clb/t1'),
+             ('rackconnect', 'http://localhost:8080/rcv3/t1')])
+
+    def test_list_servers_pages(self):
+        """
+        Servers are listed in pages, with a link to the next page.
+        """
+        code, body = self.request('GET', '/nova/t1/servers/detail?limit=2')
+        ids = self.tenant.servers.keys()
+        self.assertEqual([s['id'] for s in body['servers']], ids[:2])
+        self.assertEqual(
+            body['servers_links'],
+            [{'rel': 'next', 'href': 'http://nova/servers/detail?'
+              'limit=2&marker={}'.format(ids[1])}])
+        code, body = self.request(
+            'GET', '/nova/t1/servers/detail?limit=2&marker=' + ids[1])
+        self.assertEqual([s['id'] for s in body['servers']], ids[2:])
+        self.assertNotIn('servers_links', body)
+
+    def test_create_and_delete_server(self):
+        """
+        Created servers are active, and deleted servers are not found.
+        """
+        code, body = self.request(
+            'POST', '/nova/t1/servers',
+            {'server': {'name': 'a', 'imageRef': 'i', 'flavorRef': 'f'}})
+        self.assertEqual(code, 202)
+        path = '/nova/t1/servers/' + body['server']['id']
+        code, body = self.request('GET', path)
+        self.assertEqual((code, body['server']['status']), (200, 'ACTIVE'))
+        self.assertEqual(self.request('DELETE', path), (204, None))
+        self.assertEqual(self.request('GET', path)[0], 404)
+        self.assertEqual(self.request('DELETE', path)[0], 404)
+
+    def test_clb_nodes(self):
+        """
+        Nodes can be added to and removed from CLBs, and removing missing
+        nodes fails like CLB does.
+        """
+        [lb_id] = self.tenant.clbs
+        path = '/clb/t1/loadbalancers/{}/nodes'.format(lb_id)
+        code, body = self.request(
+            'POST', path, {'nodes': [{'address': '1.1.1.1', 'port': 80,
+                                      'condition': 'ENABLED'}]})
+        node_id = body['nodes'][0]['id']
+        self.assertEqual(len(self.request('GET', path)[1]['nodes']), 3)
+        self.assertEqual(
+            self.request('DELETE', '{}?id={}'.format(path, node_id)),
+            (202, None))
+        code, body = self.request('DELETE', '{}?id={}'.format(path, node_id))
+        self.assertEqual(
+            body['validationErrors']['messages'],
+            ['Node ids {} are not a part of your loadbalancer'.format(
+                node_id)])
+
+    def test_rcv3_nodes(self):
+        """
+        Servers can be added to and removed from RCv3 pools in bulk.
+        """
+        [pool_id] = self.tenant.pools
+        server_id = self.tenant.servers.keys()[2]
+        pair = [{'load_balancer_pool': {'id': pool_id},
+                 'cloud_server': {'id': server_id}}]
+        self.assertEqual(self.request('POST', '/rcv3/t1/load_balancer_pools/'
+                                      'nodes', pair)[0], 201)
+        path = '/rcv3/t1/load_balancer_pools/{}/nodes'.format(pool_id)
+        self.assertEqual(len(self.request('GET', path)[1]), 2)
+        self.assertEqual(
+            self.request('DELETE', '/rcv3/t1/load_balancer_pools/nodes',
+                         pair),
+            (204, None))
+        self.assertEqual(len(self.request('GET', path)[1]), 1)
+
+    def test_latency(self):
+        """
+        Responses are delayed by the latency of the service.
+        """
+        self.upstream.behaviors['clb'] = ServiceBehavior(latency=2)
+        d = request(self.upstream, 'GET', '/clb/t1/loadbalancers')
+        self.clock.advance(1.9)
+        self.assertNoResult(d)
+        self.clock.advance(0.1)
+        self.assertEqual(self.successResultOf(d).response.code, 200)
+
+    def test_errors_and_rate_limit(self):
+        """
+        Requests over the rate limit of a service get 413 responses, and a
+        proportion of the others get 500 responses.
+        """
+        self.upstream.behaviors['nova'] = ServiceBehavior(rate_limit=2)
+        codes = [self.request('GET', '/nova/t1/servers/detail')[0]
+                 for _ in range(3)]
+        self.clock.advance(1)
+        codes.append(self.request('GET', '/nova/t1/servers/detail')[0])
+        self.assertEqual(codes, [200, 200, 413, 200])
+
+        self.upstream.behaviors['nova'] = ServiceBehavior(error_rate=1)
+        self.assertEqual(
+            self.request('GET', '/nova/t1/servers/detail'),
+            (500, {'computeFault': {'code': 500,
+                                    'message': 'Fake failure'}}))
+        self.assertEqual(self.upstream.requests['nova'], 5)
+
+    def test_not_found(self):
+        """
+        Unknown paths get 404 responses.
+        """
+        self.assertEqual(self.request('GET', '/nova/t1/flavors')[0], 404)
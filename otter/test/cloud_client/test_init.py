@@ -20,6 +20,7 @@ import six
 from toolz.dicttoolz import assoc
 
 from twisted.internet.task import Clock
+from twisted.python.failure import Failure
 from twisted.trial.unittest import SynchronousTestCase
 
 from txeffect import perform
@@ -43,7 +44,10 @@ from otter.cloud_client import (
     ServiceRequest,
     TenantScope,
     _Throttle,
+    _circuit_breaker,
+    _circuit_breaking_throttler,
     _default_throttler,
+    _is_service_failure,
     _perform_throttle,
     add_bind_service,
     add_clb_nodes,
@@ -71,14 +75,17 @@ from otter.log.intents import Log
 from otter.test.utils import (
     StubResponse,
     nested_sequence,
+    patch,
     raise_,
     resolve_effect,
     stub_json_response,
     stub_pure_response
 )
 from otter.test.worker.test_launch_server_v1 import fake_service_catalog
+from otter.util.circuitbreaker import CircuitBreaker, CircuitOpenError
 from otter.util.config import set_config_data
-from otter.util.http import APIError, headers
+from otter.util.http import APIError, UpstreamError, headers
+from otter.util.metrics import MetricsRegistry
 from otter.util.pure_http import Request, has_code
 from otter.util.weaklocks import WeakLocks
 
@@ -196,6 +203,18 @@ class ServiceRequestTests(SynchronousTestCase):
             )
         )
 
+    def test_metric_labels(self):
+        """
+        The metric labels of a request are its service type name, method and
+        URL template.
+        """
+        eff = service_request(ServiceType.CLOUD_LOAD_BALANCERS, 'get',
+                              'loadbalancers/12/nodes')
+        self.assertEqual(
+            eff.intent.metric_labels,
+            (('method', 'GET'), ('service', 'CLOUD_LOAD_BALANCERS'),
+             ('url', 'loadbalancers/{id}/nodes')))
+
 
 class PerformServiceRequestTests(SynchronousTestCase):
     """Tests for :func:`concretize_service_request`."""
@@ -231,7 +250,25 @@ class PerformServiceRequestTests(SynchronousTestCase):
         self.assertEqual(
             next_eff.intent,
             Request(method='GET', url='http://dfw.openstack/servers',
-                    headers=headers('token'), log=self.log))
+                    headers=headers('token'), log=self.log,
+                    metric_labels=self.svcreq.metric_labels))
+
+    def test_compressed_services(self):
+        """
+        Compressed responses are asked for from all services, or only from
+        the services configured in ``cloud_client.compressed_services``.
+        """
+        next_eff = resolve_authenticate(self._concrete(self.svcreq))
+        self.assertTrue(next_eff.intent.compress)
+        set_config_data(
+            {'cloud_client': {'compressed_services': ['CLOUD_SERVERS']}})
+        self.addCleanup(set_config_data, {})
+        next_eff = resolve_authenticate(self._concrete(self.svcreq))
+        self.assertTrue(next_eff.intent.compress)
+        clb_req = service_request(
+            ServiceType.CLOUD_LOAD_BALANCERS, 'GET', 'loadbalancers').intent
+        next_eff = resolve_authenticate(self._concrete(clb_req))
+        self.assertFalse(next_eff.intent.compress)
 
     def test_invalidate_on_auth_error_code(self):
         """
@@ -258,7 +295,8 @@ class PerformServiceRequestTests(SynchronousTestCase):
         self.assertEqual(
             next_eff.intent,
             Request(method='GET', url='myurl/servers',
-                    headers=headers('token'), log=self.log))
+                    headers=headers('token'), log=self.log,
+                    metric_labels=self.svcreq.metric_labels))
 
     def test_json(self):
         """
@@ -340,7 +378,8 @@ class PerformServiceRequestTests(SynchronousTestCase):
                                log=self.log),
                   lambda i: ('token', fake_service_catalog)),
                  (Request(method='GET', url='http://dfw.openstack/servers',
-                          headers=headers('token'), log=self.log),
+                          headers=headers('token'), log=self.log,
+                          metric_labels=svcreq.metric_labels),
                   lambda i: response),
              ])),
         ])
@@ -493,9 +532,115 @@ class DefaultThrottlerTests(SynchronousTestCase):
             'delete_clb_delay', ServiceType.CLOUD_LOAD_BALANCERS, 'delete')
 
 
+class CircuitBreakerTests(SynchronousTestCase):
+    """
+    Tests for :func:`_is_service_failure`, :func:`_circuit_breaker` and
+    :func:`_circuit_breaking_throttler`.
+    """
+
+    def test_is_service_failure(self):
+        """
+        5xx responses and connection errors count as failures of the service,
+        but 4xx responses and authentication errors do not.
+        """
+        self.assertTrue(_is_service_failure(Failure(APIError(503, ''))))
+        self.assertTrue(_is_service_failure(Failure(ValueError())))
+        self.assertFalse(_is_service_failure(Failure(APIError(404, ''))))
+        self.assertFalse(_is_service_failure(
+            Failure(UpstreamError(Failure(ValueError()), 'identity', 'auth'))))
+
+    def test_no_config(self):
+        """There is no circuit breaker if it is not configured."""
+        set_config_data({})
+        self.addCleanup(set_config_data, {})
+        self.assertIsNone(_circuit_breaker(
+            {}, Clock(), None, make_service_configs(),
+            ServiceType.CLOUD_SERVERS))
+
+    def test_configured(self):
+        """
+        Circuit breakers are created from the configuration once per service
+        and region.
+        """
+        set_config_data({'cloud_client': {'circuit_breaker': {
+            'window': 5, 'min_requests': 3, 'reset_timeout': 10}}})
+        self.addCleanup(set_config_data, {})
+        breakers = {}
+        get = partial(_circuit_breaker, breakers, Clock(), None,
+                      make_service_configs())
+        breaker = get(ServiceType.CLOUD_SERVERS)
+        self.assertEqual(
+            (breaker.name, breaker.min_calls, breaker.reset_timeout,
+             breaker.is_failure),
+            ('CLOUD_SERVERS.DFW', 3, 10, _is_service_failure))
+        self.assertIs(get(ServiceType.CLOUD_SERVERS), breaker)
+        self.assertIsNot(get(ServiceType.CLOUD_LOAD_BALANCERS), breaker)
+        self.assertEqual(len(breakers), 2)
+
+    def test_throttler_without_breaker(self):
+        """
+        Without a circuit breaker the bracket of the wrapped throttler is
+        returned.
+        """
+        bracket = object()
+        self.assertIs(
+            _circuit_breaking_throttler(
+                lambda stype: None, lambda *a: bracket,
+                ServiceType.CLOUD_SERVERS, 'get', 'tenant'),
+            bracket)
+
+    def test_throttler_without_bracket(self):
+        """
+        Without throttling, requests are run directly by the circuit breaker.
+        """
+        breaker = CircuitBreaker(Clock(), 'nova', metrics=MetricsRegistry())
+        self.assertEqual(
+            _circuit_breaking_throttler(
+                lambda stype: breaker, lambda *a: None,
+                ServiceType.CLOUD_SERVERS, 'get', 'tenant'),
+            breaker.run)
+
+    def test_throttler_composes(self):
+        """
+        The circuit breaker runs inside the bracket of the wrapped throttler,
+        which is given the request to run.
+        """
+        breaker = CircuitBreaker(Clock(), 'nova', min_calls=1,
+                                 metrics=MetricsRegistry())
+        calls = []
+
+        def bracket(f, *args):
+            calls.append(f)
+            return f(*args)
+
+        wrapped = _circuit_breaking_throttler(
+            lambda stype: breaker, lambda *a: bracket,
+            ServiceType.CLOUD_SERVERS, 'get', 'tenant')
+        self.failureResultOf(wrapped(lambda: 1 / 0), ZeroDivisionError)
+        self.failureResultOf(wrapped(lambda: 'foo'), CircuitOpenError)
+        self.assertEqual(calls, [breaker.run, breaker.run])
+
+
 class GetCloudClientDispatcherTests(SynchronousTestCase):
     """Tests for :func:`get_cloud_client_dispatcher`."""
 
+    def test_shares_circuit_breakers(self):
+        """
+        Dispatchers share the circuit breakers of the process, so that
+        failures seen through dispatchers created per request open them.
+        """
+        set_config_data({'cloud_client': {'circuit_breaker': {}}})
+        self.addCleanup(set_config_data, {})
+        patch(self, 'otter.cloud_client._breakers', new={})
+
+        def breaker():
+            dispatcher = get_cloud_client_dispatcher(
+                Clock(), None, None, make_service_configs())
+            throttler = dispatcher(TenantScope(None, 't')).args[3]
+            return throttler(ServiceType.CLOUD_SERVERS, 'get', 't').__self__
+
+        self.assertIs(breaker(), breaker())
+
     def test_performs_throttle(self):
         """:func:`_perform_throttle` performs :obj:`_Throttle`."""
         dispatcher = get_cloud_client_dispatcher(None, None, None, None)
@@ -539,7 +684,8 @@ class GetCloudClientDispatcherTests(SynchronousTestCase):
                           tenant_id='111', log=log),
              lambda i: ('token', fake_service_catalog)),
             (Request(method='POST', url='http://dfw.openstack/servers',
-                     headers=headers('token'), log=log),
+                     headers=headers('token'), log=log,
+                     metric_labels=tscope.effect.intent.metric_labels),
              lambda i: response),
         ])
 
@@ -62,9 +62,11 @@ from otter.test.utils import (
     server,
     stack
 )
+from otter.util.circuitbreaker import CircuitOpenError
 from otter.util.fp import assoc_obj
 from otter.util.retry import (
-    Retry, ShouldDelayAndRetry, exponential_backoff_interval, retry_times)
+    Retry, RetryExcept, ShouldDelayAndRetry, exponential_backoff_interval,
+    retry_times)
 from otter.util.timestamp import timestamp_to_epoch
 
 
@@ -363,7 +365,8 @@ def lb_req(url, json_response, response):
         Retry(
             effect=mock.ANY,
             should_retry=ShouldDelayAndRetry(
-                can_retry=retry_times(5),
+                can_retry=RetryExcept(exceptions=(CircuitOpenError,),
+                                      can_retry=retry_times(5)),
                 next_interval=exponential_backoff_interval(2))
         ),
         nested_sequence([
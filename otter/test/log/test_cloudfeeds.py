@@ -8,7 +8,8 @@ from effect.testing import perform_sequence
 
 import mock
 
-from twisted.internet.defer import fail, succeed
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.python import log as twisted_log
 from twisted.python.failure import Failure
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.web.client import ResponseFailed
@@ -17,6 +18,7 @@ from txeffect import deferred_performer
 
 from otter.cloud_client import TenantScope, has_code, service_request
 from otter.constants import ServiceType
+from otter.log import log as otter_log
 from otter.log.cloudfeeds import (
     CloudFeedsObserver,
     UnsuitableMessage,
@@ -37,6 +39,7 @@ from otter.test.utils import (
     stub_pure_response
 )
 from otter.util.http import APIError
+from otter.util.metrics import MetricsRegistry
 from otter.util.retry import (
     Retry,
     ShouldDelayAndRetry,
@@ -317,11 +320,41 @@ class CloudFeedsObserverTests(SynchronousTestCase):
         self.authenticator = object()
         self.service_configs = {'service': 'configs'}
         self.log = mock_log()
+        self.metrics = MetricsRegistry()
         self.make_cf = partial(
             CloudFeedsObserver, reactor=self.reactor,
             authenticator=self.authenticator, tenant_id='tid',
             region='ord', service_configs=self.service_configs,
-            log=self.log)
+            log=self.log, metrics=self.metrics)
+
+    def count(self, outcome):
+        """Return the number of events counted with the given outcome."""
+        return self.metrics.counter('cloud_feeds.events',
+                                    (('outcome', outcome),))
+
+    def make_pending_cf(self, **kwargs):
+        """
+        Return an observer whose events are pushed by firing the Deferreds
+        appended to the returned list, along with that list.
+        """
+        class AddEvent(object):
+            pass
+
+        pushes = []
+
+        def push(dispatcher, intent):
+            pushes.append(Deferred())
+            return pushes[-1]
+
+        dispatchers = []
+
+        def get_disp(*args):
+            dispatchers.append(args)
+            return TypeDispatcher({AddEvent: deferred_performer(push)})
+
+        cf = self.make_cf(add_event=lambda *a: Effect(AddEvent()),
+                          get_disp=get_disp, **kwargs)
+        return cf, pushes, dispatchers
 
     def test_no_cloud_feed(self):
         """
@@ -351,6 +384,92 @@ class CloudFeedsObserverTests(SynchronousTestCase):
 
         self.assertEqual(self.successResultOf(d), 'performed')
         self.assertFalse(self.log.err.called)
+        self.assertEqual(self.count('published'), 1)
+
+    def test_dispatcher_reused(self):
+        """
+        The dispatcher is created once, when the first event is pushed, with
+        a log that is not for cloud feeds.
+        """
+        cf, pushes, dispatchers = self.make_pending_cf()
+        self.assertEqual(dispatchers, [])
+        for _ in range(2):
+            cf({'event': 'dict', 'cloud_feed': True, 'message': ('m', )})
+        self.assertEqual(len(pushes), 2)
+        [(reactor, authenticator, log, service_configs)] = dispatchers
+        self.assertEqual((reactor, authenticator, service_configs),
+                         (self.reactor, self.authenticator,
+                          self.service_configs))
+        log.msg('hello')
+        self.log.msg.assert_called_once_with(
+            'hello', system='otter.cloud_feed')
+
+    def test_concurrency(self):
+        """
+        At most ``concurrency`` events are pushed at a time, and the others
+        are queued until one is done. The pushed and queued events are
+        exposed as gauges.
+        """
+        cf, pushes, _ = self.make_pending_cf(concurrency=2)
+        ds = [cf({'event': i, 'cloud_feed': True, 'message': ('m', )})
+              for i in range(3)]
+        self.assertEqual(len(pushes), 2)
+        self.assertEqual((cf.in_flight, cf.queued), (2, 1))
+        self.assertEqual(
+            [(g['name'], g['value'])
+             for g in self.metrics.snapshot()['gauges']],
+            [('cloud_feeds.in_flight', 2), ('cloud_feeds.queued', 1)])
+
+        pushes[0].callback('done')
+        self.assertEqual(self.successResultOf(ds[0]), 'done')
+        self.assertEqual(len(pushes), 3)
+        self.assertEqual((cf.in_flight, cf.queued), (2, 0))
+        self.assertNoResult(ds[2])
+
+    def test_queue_full(self):
+        """
+        Events logged when ``max_queued`` events are queued are dropped and
+        counted. Only the first one dropped is logged each time the queue
+        gets full.
+        """
+        cf, pushes, _ = self.make_pending_cf(concurrency=1, max_queued=1)
+        ds = [cf({'event': i, 'cloud_feed': True, 'message': ('m', )})
+              for i in range(4)]
+        self.assertIsNone(ds[2])
+        self.assertIsNone(ds[3])
+        self.assertEqual((len(pushes), cf.queued), (1, 1))
+        self.assertEqual(self.count('dropped'), 2)
+        self.log.msg.assert_called_once_with(
+            'cf-queue-full', isError=True, queued=1, event_data={'event': 2},
+            system='otter.cloud_feed', cf_msg='m')
+
+        pushes[0].callback(None)
+        cf({'event': 4, 'cloud_feed': True, 'message': ('m', )})
+        self.assertEqual((len(pushes), cf.queued), (2, 1))
+        self.assertEqual(self.count('dropped'), 2)
+
+        cf({'event': 5, 'cloud_feed': True, 'message': ('m', )})
+        self.assertEqual(self.count('dropped'), 3)
+        self.assertEqual(self.log.msg.call_count, 2)
+
+    def test_queue_full_logged(self):
+        """
+        Dropping an event when the queue is full logs an error through a
+        real logger, while no exception is being handled.
+        """
+        events = []
+        twisted_log.addObserver(events.append)
+        self.addCleanup(twisted_log.removeObserver, events.append)
+        cf, _, _ = self.make_pending_cf(concurrency=1, max_queued=0,
+                                        log=otter_log)
+        cf({'event': 0, 'cloud_feed': True, 'message': ('m', )})
+        self.assertIsNone(
+            cf({'event': 1, 'cloud_feed': True, 'message': ('m', )}))
+        [event] = [e for e in events if e.get('system') == 'otter.cloud_feed']
+        self.assertEqual(
+            (event['message'], event['isError'], event['queued']),
+            (('cf-queue-full',), True, 0))
+        self.assertNotIn('failure', event)
 
     def test_perform_fails(self):
         """
@@ -374,6 +493,7 @@ class CloudFeedsObserverTests(SynchronousTestCase):
             CheckFailure(ValueError), 'cf-add-failure',
             event_data={'event': 'dict'}, system='otter.cloud_feed',
             cf_msg='m')
+        self.assertEqual(self.count('failed'), 1)
 
     def test_unsuitable_msg_logs(self):
         """
@@ -389,3 +509,4 @@ class CloudFeedsObserverTests(SynchronousTestCase):
             None, 'cf-unsuitable-message', unsuitable_message='bad',
             event_data={'event': 'dict'}, system='otter.cloud_feed',
             cf_msg='m')
+        self.assertEqual(self.count('unsuitable'), 1)
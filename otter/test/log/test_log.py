@@ -24,8 +24,10 @@ from otter.log.formatters import (
     FanoutObserver,
     JSONObserverWrapper,
     LogLevel,
+    LoggingEncoder,
     ObserverWrapper,
     PEP3101FormattingWrapper,
+    SnapshotObserverWrapper,
     StreamObserverWrapper,
     SystemFilterWrapper,
     add_to_fanout,
@@ -182,6 +184,34 @@ class JSONObserverWrapperTests(SynchronousTestCase):
             {'message': (SameJSON({'message': 'mineyours'}),)})
 
 
+class SnapshotObserverWrapperTests(SynchronousTestCase):
+    """
+    Test the snapshot observer wrapper.
+    """
+    def test_snapshot(self):
+        """
+        SnapshotObserverWrapper passes on a copy of the eventDict that
+        encodes to the same JSON and does not change with it.
+        """
+        class NotSerializable(object):
+            def __repr__(self):
+                return "NotSerializableRepr"
+
+        observed = []
+        eventDict = {'message': ('m',), 'servers': [{'id': 's', 'n': 1}],
+                     'obj': NotSerializable(), 'none': None, 'ok': True,
+                     'time': datetime(2012, 10, 20, 5, 36, 23)}
+        encoded = json.dumps(eventDict, cls=LoggingEncoder, sort_keys=True)
+        SnapshotObserverWrapper(observed.append)(eventDict)
+        eventDict['servers'][0]['id'] = 'changed'
+        eventDict['servers'].append({})
+        [event] = observed
+        self.assertEqual(event['servers'], ({'id': 's', 'n': 1},))
+        self.assertEqual(event['obj'], 'NotSerializableRepr')
+        self.assertEqual(
+            json.dumps(event, cls=LoggingEncoder, sort_keys=True), encoded)
+
+
 class StreamObserverWrapperTests(SynchronousTestCase):
     """
     Test the StreamObserverWrapper.
@@ -628,23 +658,34 @@ class FanoutObserverTests(SynchronousTestCase):
         self.assertEqual(obs1, messages)
         self.assertEqual(obs2, messages[1:])
 
-    def test_subobservers_do_not_affect_each_other(self):
+    def test_subobservers_share_event(self):
         """
-        A subobserver that mutates events will not affect other subobservers.
+        Every subobserver is given the same event, which is not copied.
         """
-        obs, obs_mutated = [], []
-
-        def mutate(event):
-            event.pop('delete_me', None)
-            event['added'] = 'added'
-            obs_mutated.append(event)
-
-        fanout = FanoutObserver(obs.append)
-        fanout.add_observer(mutate)
-        fanout({'only': 'message', 'delete_me': 'go'})
+        obs1, obs2 = [], []
+        event = {'only': 'message'}
+        fanout = FanoutObserver(obs1.append)
+        fanout.add_observer(obs2.append)
+        fanout(event)
+        self.assertIs(obs1[0], event)
+        self.assertIs(obs2[0], event)
 
-        self.assertEqual(obs, [{'only': 'message', 'delete_me': 'go'}])
-        self.assertEqual(obs_mutated, [{'only': 'message', 'added': 'added'}])
+    def test_observer_wrapper_does_not_modify_event(self):
+        """
+        :func:`ObserverWrapper` formats the event into a dict of its own, so
+        that other subobservers see the event as it was.
+        """
+        formatted, obs = [], []
+        event = {'message': ('m',), 'system': 'otter', 'time': 0, 'id': 'i'}
+        fanout = FanoutObserver(
+            ObserverWrapper(formatted.append, hostname='host'))
+        fanout.add_observer(obs.append)
+        fanout(event)
+        self.assertEqual(
+            obs, [{'message': ('m',), 'system': 'otter', 'time': 0,
+                   'id': 'i'}])
+        self.assertEqual(formatted[0]['otter_facility'], 'otter')
+        self.assertNotIn('system', formatted[0])
 
     def test_global_fanout(self):
         """
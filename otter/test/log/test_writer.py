@@ -0,0 +1,232 @@
+"""
+Tests for :mod:`otter.log.writer`.
+"""
+import json
+from StringIO import StringIO
+
+import mock
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.log.formatters import get_fanout, set_fanout
+from otter.log.setup import background_writer, make_observer_chain
+from otter.log.writer import BackgroundObserver
+from otter.test.utils import patch
+from otter.util.metrics import MetricsRegistry
+
+
+class BackgroundObserverTests(SynchronousTestCase):
+    """
+    Tests for :class:`BackgroundObserver`.
+    """
+    def setUp(self):
+        """
+        Observer delivering to a list, with a registry of its own.
+        """
+        self.events = []
+        self.flushes = []
+        self.registry = MetricsRegistry()
+        self.observer = BackgroundObserver(
+            self.events.append, lambda: self.flushes.append(len(self.events)),
+            size=3, batch=2, registry=self.registry)
+
+    def gauge(self):
+        """Return the value of the queue depth gauge."""
+        [gauge] = self.registry.snapshot()['gauges']
+        self.assertEqual(gauge['name'], 'log.queue_depth')
+        return gauge['value']
+
+    def test_queues(self):
+        """
+        Events are queued without being delivered, and the queue depth is
+        exposed as a gauge.
+        """
+        self.observer({'message': 'a'})
+        self.observer({'message': 'b'})
+        self.assertEqual(self.events, [])
+        self.assertEqual(self.gauge(), 2)
+
+    def test_drop_when_full(self):
+        """
+        Events are dropped and counted when the queue is full.
+        """
+        for i in range(5):
+            self.observer({'i': i})
+        self.assertEqual(self.gauge(), 3)
+        self.assertEqual(
+            self.registry.counter('log.dropped', (('reason', 'full'),)), 2)
+        self.observer.stop()
+        self.assertEqual(self.events, [{'i': 0}, {'i': 1}, {'i': 2}])
+
+    def test_block_when_full(self):
+        """
+        When configured to block, events are put in the queue waiting for
+        room.
+        """
+        observer = BackgroundObserver(self.events.append, block=True,
+                                      registry=self.registry)
+        observer.queue = mock.Mock()
+        observer({'i': 0})
+        observer.queue.put.assert_called_once_with({'i': 0}, True)
+
+    def test_write_batch(self):
+        """
+        :meth:`BackgroundObserver.write_batch` delivers at most ``batch``
+        events and then flushes, and returns False once the queue is empty.
+        """
+        for i in range(3):
+            self.observer({'i': i})
+        self.assertTrue(self.observer.write_batch())
+        self.assertEqual(self.events, [{'i': 0}, {'i': 1}])
+        self.assertEqual(self.flushes, [2])
+        self.assertTrue(self.observer.write_batch())
+        self.assertEqual(self.flushes, [2, 3])
+        self.assertFalse(self.observer.write_batch(block=False))
+        self.assertEqual(self.flushes, [2, 3])
+
+    def test_observer_error(self):
+        """
+        Events the observer fails on are counted as dropped, and do not stop
+        the others from being delivered.
+        """
+        def observer(event):
+            if event['i'] == 0:
+                raise ValueError(event)
+            self.events.append(event)
+
+        self.observer.observer = observer
+        self.observer({'i': 0})
+        self.observer({'i': 1})
+        self.assertTrue(self.observer.write_batch())
+        self.assertEqual(self.events, [{'i': 1}])
+        self.assertEqual(
+            self.registry.counter('log.dropped', (('reason', 'error'),)), 1)
+
+    def test_errors_reported(self):
+        """
+        Failures of the observer and of flushing are counted, and the first
+        one is written to stderr.
+        """
+        stderr = patch(self, 'otter.log.writer.sys.stderr', StringIO())
+
+        def fail(*args):
+            raise ValueError('bad')
+
+        self.observer.observer = fail
+        self.observer.flush = fail
+        self.observer({'i': 0})
+        self.observer({'i': 1})
+        self.assertTrue(self.observer.write_batch())
+        self.assertEqual(
+            self.registry.counter('log.dropped', (('reason', 'error'),)), 2)
+        self.assertEqual(self.registry.counter('log.flush_errors'), 1)
+        output = stderr.getvalue()
+        self.assertTrue(output.startswith(
+            'Could not write log events, further failures are only '
+            'counted:\n'))
+        self.assertEqual(output.count('ValueError: bad'), 1)
+
+    def test_stop_delivers(self):
+        """
+        Stopping delivers the queued events, and events logged after are
+        delivered right away.
+        """
+        self.observer({'i': 0})
+        self.observer.stop()
+        self.assertEqual(self.events, [{'i': 0}])
+        self.observer({'i': 1})
+        self.assertEqual(self.events, [{'i': 0}, {'i': 1}])
+        self.assertEqual(self.flushes, [1, 2])
+
+    def test_stop_waits_for_thread(self):
+        """
+        Stopping waits for the writer thread before delivering events, and
+        events queued after it was asked to stop are delivered. Events
+        keep being queued if it is not done in time.
+        """
+        self.observer.thread = mock.Mock()
+        self.observer.thread.is_alive.return_value = True
+        self.observer.thread.join.side_effect = (
+            lambda timeout: self.observer({'i': 0}))
+        self.observer.stop(1)
+        self.observer.thread.join.assert_called_once_with(1)
+        self.assertFalse(self.observer.stopped)
+        self.observer({'i': 1})
+        self.assertEqual(self.events, [])
+
+        self.observer.thread.is_alive.return_value = False
+        self.observer.stop(1)
+        self.assertTrue(self.observer.stopped)
+        self.assertEqual(self.observer.thread.join.call_count, 1)
+        self.assertEqual(self.events, [{'i': 0}, {'i': 1}])
+
+    def test_thread(self):
+        """
+        The writer thread delivers queued events until stopped.
+        """
+        self.observer.start()
+        for i in range(3):
+            self.observer({'i': i})
+        self.observer.stop()
+        self.assertFalse(self.observer.thread.is_alive())
+        self.assertEqual(self.events, [{'i': 0}, {'i': 1}, {'i': 2}])
+        self.assertEqual(self.flushes[-1], 3)
+
+
+class BackgroundWriterTests(SynchronousTestCase):
+    """
+    Tests for :func:`otter.log.setup.background_writer`.
+    """
+    def setUp(self):
+        """
+        Do not start threads or register exit functions.
+        """
+        self.start = patch(self, 'otter.log.writer.BackgroundObserver.start')
+        self.register = patch(self, 'otter.log.setup.atexit.register')
+
+    def test_defaults(self):
+        """
+        Events are dropped when 10000 are queued, and are flushed every 100.
+        The observer is started and stopped at exit.
+        """
+        writer = background_writer('flush', {})('observer')
+        self.assertEqual(
+            (writer.observer, writer.flush, writer.queue.maxsize,
+             writer.block, writer.batch),
+            ('observer', 'flush', 10000, False, 100))
+        self.start.assert_called_once_with()
+        self.register.assert_called_once_with(writer.stop)
+
+    def test_environment(self):
+        """
+        The queue is configured from the environment.
+        """
+        writer = background_writer('flush', {
+            'OTTER_LOG_QUEUE_SIZE': '50', 'OTTER_LOG_QUEUE_FULL': 'block',
+            'OTTER_LOG_BATCH_SIZE': '10'})('observer')
+        self.assertEqual((writer.queue.maxsize, writer.block, writer.batch),
+                         (50, True, 10))
+
+    def test_snapshot_queued(self):
+        """
+        Snapshots of the events are queued, and encoded as JSON when they are
+        written, so that changes to the event after it is logged are not
+        written.
+        """
+        self.addCleanup(set_fanout, None)
+        writers = []
+
+        def background(observer):
+            writers.append(BackgroundObserver(observer))
+            return writers[0]
+
+        written = []
+        make_observer_chain(written.append, False, background)
+        event = {'message': ('hello',), 'data': [1]}
+        get_fanout()(event)
+        event['data'].append(2)
+        [queued] = writers[0].queue.queue
+        self.assertEqual(queued['data'], (1,))
+        writers[0].stop()
+        [entry] = written
+        self.assertEqual(json.loads(entry['message'][0])['data'], [1])
@@ -10,7 +10,8 @@ from functools import partial
 
 from effect import (
     Constant, Effect, ParallelEffects, TypeDispatcher, sync_perform)
-from effect.testing import perform_sequence, resolve_effect
+from effect.testing import (
+    parallel_sequence, perform_sequence, resolve_effect)
 
 from jsonschema import ValidationError
 
@@ -40,11 +41,18 @@ from otter.models.cass import (
     CassScalingGroup,
     CassScalingGroupCollection,
     CassScalingGroupServersCache,
+    GroupConfigCache,
+    StateConflictError,
+    WebhookCapabilityCache,
     WeakLocks,
     _assemble_webhook_from_row,
+    _decode_server_blob,
+    _encode_server_blob,
+    _token_ranges,
     assemble_webhooks_in_policies,
     cql_eff,
     get_cql_dispatcher,
+    get_groups_servers,
     perform_cql_query,
     serialize_json_data,
     verified_view
@@ -67,13 +75,16 @@ from otter.test.models.test_interface import (
     IScalingScheduleCollectionProviderMixin
 )
 from otter.test.utils import (
+    CheckFailure,
     DummyException,
     LockMixin,
     matches,
     mock_log,
     patch,
+    raise_,
     test_dispatcher)
 from otter.util.config import set_config_data
+from otter.util.cqlbatch import ChunkedBatchError
 from otter.util.timestamp import from_timestamp
 
 
@@ -98,6 +109,41 @@ def _de_identify(json_obj):
         return json.loads(json.dumps(json_obj))
 
 
+_update_counts_cql = (
+    'BEGIN COUNTER BATCH '
+    'UPDATE resource_counts SET count = count + :groups '
+    'WHERE "tenantId"=:tenantId AND resource=\'groups\'; '
+    'UPDATE resource_counts SET count = count + :policies '
+    'WHERE "tenantId"=:tenantId AND resource=\'policies\'; '
+    'UPDATE resource_counts SET count = count + :webhooks '
+    'WHERE "tenantId"=:tenantId AND resource=\'webhooks\'; '
+    'APPLY BATCH;')
+
+
+def _count_update(tenant_id, groups=0, policies=0, webhooks=0):
+    """
+    Return the call executing the update of the resource counts of a tenant
+    """
+    return mock.call(
+        _update_counts_cql,
+        {'tenantId': tenant_id, 'groups': groups, 'policies': policies,
+         'webhooks': webhooks},
+        ConsistencyLevel.ONE)
+
+
+def _policies_version_update(tenant_id, group_id):
+    """
+    Return the call executing the conditional update of the version of the
+    policies of a group
+    """
+    return mock.call(
+        'UPDATE scaling_group SET policies_version = :policies_version '
+        'WHERE "tenantId" = :tenantId AND "groupId" = :groupId IF EXISTS',
+        {'tenantId': tenant_id, 'groupId': group_id,
+         'policies_version': 'timeuuid'},
+        ConsistencyLevel.QUORUM)
+
+
 def _cassandrify_data(list_of_dicts):
     """
     To make mocked up test data less verbose, produce what cassandra would
@@ -362,7 +408,9 @@ scaling_group_entry = {
     'created_at': 23,
     'deleting': False,
     'status': 'ACTIVE',
-    'error_reasons': []
+    'error_reasons': [],
+    'policies_version': None,
+    'state_version': None
 }
 
 
@@ -530,7 +578,8 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         expectedCql = (
             'SELECT "tenantId", "groupId", group_config, launch_config, '
             'active, pending, "groupTouched", "policyTouched", paused, '
-            'desired, created_at, status, error_reasons, deleting '
+            'desired, created_at, status, error_reasons, deleting, '
+            'policies_version, state_version '
             'FROM scaling_group '
             'WHERE "tenantId" = :tenantId AND "groupId" = :groupId')
         expectedData = {"tenantId": self.tenant_id, "groupId": self.group_id}
@@ -675,7 +724,8 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         viewCql = (
             'SELECT "tenantId", "groupId", group_config, launch_config, '
             'active, pending, "groupTouched", "policyTouched", paused, '
-            'desired, created_at, status, error_reasons, deleting '
+            'desired, created_at, status, error_reasons, deleting, '
+            'policies_version, state_version '
             'FROM scaling_group '
             'WHERE "tenantId" = :tenantId AND "groupId" = :groupId')
         delCql = ('DELETE FROM scaling_group '
@@ -1001,19 +1051,55 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
                 return_value=defer.succeed({}))
     def test_update_status_deleting(self, mock_vc):
         """
-        Sets "deleting" column to true when status set is DELETING
+        Sets "deleting" column to true when status set is DELETING, and
+        stops counting the group
         """
-        self.clock.advance(10.345)
+        self.returns = [[{'[applied]': True}], None]
         d = self.group.update_status(ScalingGroupStatus.DELETING)
         self.assertIsNone(self.successResultOf(d))  # update returns None
-        expectedCql = (
-            'INSERT INTO scaling_group("tenantId", "groupId", deleting) '
-            'VALUES (:tenantId, :groupId, :deleting) USING TIMESTAMP :ts')
-        expectedData = {"deleting": True,
-                        "groupId": '12345678g',
-                        "tenantId": '11111', 'ts': 10345000}
-        self.connection.execute.assert_called_once_with(
-            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [self.set_deleting_call(),
+             _count_update(self.tenant_id, groups=-1)])
+
+    def set_deleting_call(self):
+        """
+        Call made to set the "deleting" column if it is not already set
+        """
+        return mock.call(
+            'UPDATE scaling_group SET deleting = true '
+            'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
+            'IF deleting IN (false, null) AND created_at != null',
+            {"groupId": '12345678g', "tenantId": '11111'},
+            ConsistencyLevel.QUORUM)
+
+    @mock.patch('otter.models.cass.CassScalingGroup.view_config',
+                return_value=defer.succeed({}))
+    def test_update_status_already_deleting(self, mock_vc):
+        """
+        The count of groups is not changed if the group was already deleting
+        """
+        self.returns = [[{'[applied]': False, 'deleting': True,
+                          'created_at': 23}]]
+        d = self.group.update_status(ScalingGroupStatus.DELETING)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.connection.execute.mock_calls,
+                         [self.set_deleting_call()])
+        self.group.log.msg.assert_called_with('Group already deleting')
+
+    @mock.patch('otter.models.cass.CassScalingGroup.view_config',
+                return_value=defer.succeed({}))
+    def test_update_status_deleting_deleted(self, mock_vc):
+        """
+        Setting DELETING status on a group deleted after it was viewed fails
+        with :obj:`NoSuchScalingGroupError`, and the count of groups is not
+        changed
+        """
+        self.returns = [[{'[applied]': False}]]
+        d = self.group.update_status(ScalingGroupStatus.DELETING)
+        self.failureResultOf(d, NoSuchScalingGroupError)
+        self.assertEqual(self.connection.execute.mock_calls,
+                         [self.set_deleting_call()])
 
     @mock.patch('otter.models.cass.CassScalingGroup.view_config',
                 return_value=defer.succeed({}))
@@ -1361,13 +1447,15 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
     @mock.patch('otter.models.cass.CassScalingGroup.get_policy',
                 return_value=defer.succeed({}))
     @mock.patch('otter.models.cass.CassScalingGroup._naive_list_webhooks',
-                return_value=defer.succeed([{'id': 'w1'},
-                                            {'id': 'w2'}]))
+                return_value=defer.succeed(
+                    [{'id': 'w1', 'capability': {'hash': 'h1'}},
+                     {'id': 'w2', 'capability': {'hash': 'h2'}}]))
     def test_delete_policy_valid_policy(self, mock_webhooks, mock_get_policy):
         """
         When you delete a scaling policy, it checks if the policy exists and
         if it does, deletes the policy and all its associated webhooks.
         """
+        self.returns = [None, [{'[applied]': True}], None]
         d = self.group.delete_policy('3222')
         # delete returns None
         self.assertIsNone(self.successResultOf(d))
@@ -1390,8 +1478,11 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             "key0webhookKey": 'w1',
             "key1webhookKey": 'w2'}
 
-        self.connection.execute.assert_called_once_with(
-            expected_cql, expected_data, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call(expected_cql, expected_data, ConsistencyLevel.QUORUM),
+             _policies_version_update(self.tenant_id, self.group_id),
+             _count_update(self.tenant_id, policies=-1, webhooks=-2)])
 
     @mock.patch('otter.models.cass.CassScalingGroup.get_policy',
                 return_value=defer.fail(NoSuchPolicyError('t', 'g', 'p')))
@@ -1478,7 +1569,7 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             return mock_ids.pop(0)
 
         self.mock_key.side_effect = _return_uuid
-        self.returns = [[{'count': 0}], None]
+        self.returns = [[{'count': 0}], None, None]
         policy_id = '23456789'
 
         self.validate_create_webhooks_return_value(
@@ -1524,9 +1615,10 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             [mock.call(expected_count_cql, expected_params,
                        ConsistencyLevel.QUORUM),
              mock.call(expected_insert_cql, mock.ANY,
-                       ConsistencyLevel.QUORUM)])
+                       ConsistencyLevel.QUORUM),
+             _count_update(self.tenant_id, webhooks=2)])
 
-        cql_params = self.connection.execute.call_args[0][1]
+        cql_params = self.connection.execute.mock_calls[1][1][1]
 
         for name in ('webhook0', 'webhook1'):
             cql_params[name] = json.loads(cql_params[name])
@@ -1893,8 +1985,8 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
         Tests that you can delete a scaling policy webhook, and if successful
         return value is None
         """
-        # return value for delete
-        self.returns = [None]
+        # return value for delete and count update
+        self.returns = [None, None]
         mock_gw.return_value = defer.succeed(
             {'data': '{}', 'capability': {"version": "1", "hash": "h"}})
         d = self.group.delete_webhook('3444', '4555')
@@ -1916,8 +2008,10 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
                         "webhookId": "4555",
                         'webhookKey': 'h'}
 
-        self.connection.execute.assert_called_once_with(
-            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call(expectedCql, expectedData, ConsistencyLevel.QUORUM),
+             _count_update(self.tenant_id, webhooks=-1)])
 
     @mock.patch('otter.models.cass.CassScalingGroup.get_webhook',
                 return_value=defer.fail(NoSuchWebhookError(*range(4))))
@@ -1964,12 +2058,17 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             ScalingGroupStatus.DELETING))
 
         mock_naive.return_value = defer.succeed([])
+        patch(self, 'otter.models.cass.CassScalingGroup._naive_count_policies',
+              return_value=defer.succeed(1))
 
-        self.returns = [None]
+        self.returns = [None, None]
         result = self.successResultOf(self.group.delete_group())
         self.assertIsNone(result)  # delete returns None
 
         mock_view_state.assert_called_once_with(get_deleting=True)
+        # the group was not counted anymore since it is deleting
+        self.assertEqual(self.connection.execute.mock_calls[-1],
+                         _count_update(self.tenant_id, policies=-1))
 
     @mock.patch('otter.models.cass.CassScalingGroup.view_state')
     @mock.patch('otter.models.cass.CassScalingGroup._naive_list_all_webhooks')
@@ -1984,8 +2083,10 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             ScalingGroupStatus.ACTIVE))
         mock_naive.return_value = defer.succeed(
             [{'webhookKey': 'w1'}, {'webhookKey': 'w2'}])
+        patch(self, 'otter.models.cass.CassScalingGroup._naive_count_policies',
+              return_value=defer.succeed(3))
 
-        self.returns = [None]
+        self.returns = [None, None, None, None]
         self.clock.advance(34.575)
         result = self.successResultOf(self.group.delete_group())
         self.assertIsNone(result)  # delete returns None
@@ -1993,16 +2094,10 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
 
         expected_data = {'tenantId': self.tenant_id,
                          'groupId': self.group_id,
-                         'ts': 34575000,
-                         'key0webhookKey': 'w1',
-                         'key1webhookKey': 'w2'}
+                         'ts': 34575000}
         expected_cql = (
             'BEGIN BATCH '
 
-            'DELETE FROM webhook_keys WHERE "webhookKey"=:key0webhookKey '
-
-            'DELETE FROM webhook_keys WHERE "webhookKey"=:key1webhookKey '
-
             'DELETE FROM scaling_policies '
             'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
 
@@ -2017,8 +2112,15 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
 
             'APPLY BATCH;')
 
-        self.connection.execute.assert_called_once_with(
-            expected_cql, expected_data, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call('DELETE FROM webhook_keys '
+                       'WHERE "webhookKey"=:key0webhookKey',
+                       {'key0webhookKey': key}, ConsistencyLevel.QUORUM)
+             for key in ['w1', 'w2']] +
+            [mock.call(expected_cql, expected_data, ConsistencyLevel.QUORUM),
+             _count_update(self.tenant_id, groups=-1, policies=-3,
+                           webhooks=-2)])
 
         self.kz_client.Lock.assert_called_once_with(
             '/locks/' + self.group.uuid)
@@ -2040,8 +2142,10 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             self.tenant_id, self.group_id, '', {}, {}, None, {}, False,
             ScalingGroupStatus.ACTIVE))
         mock_naive.return_value = defer.succeed([])
+        patch(self, 'otter.models.cass.CassScalingGroup._naive_count_policies',
+              return_value=defer.succeed(0))
 
-        self.returns = [None]
+        self.returns = [None, None]
         self.clock.advance(34.575)
         result = self.successResultOf(self.group.delete_group())
         self.assertIsNone(result)  # delete returns None
@@ -2066,8 +2170,10 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
             'APPLY BATCH;')
 
-        self.connection.execute.assert_called_once_with(
-            expected_cql, expected_data, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call(expected_cql, expected_data, ConsistencyLevel.QUORUM),
+             _count_update(self.tenant_id, groups=-1)])
 
         self.kz_client.Lock.assert_called_once_with(
             '/locks/' + self.group.uuid)
@@ -2133,8 +2239,9 @@ class CassScalingGroupTests(CassScalingGroupTestCase):
             return defer.fail(NotEmptyError((), {}))
 
         self.kz_client.delete.side_effect = not_empty_error
-
-        self.returns = [None]
+        patch(self, 'otter.models.cass.CassScalingGroup._naive_count_policies',
+              return_value=defer.succeed(0))
+        self.returns = [None, None]
         self.clock.advance(34.575)
         result = self.successResultOf(self.group.delete_group())
         for i in range(70):
@@ -2235,6 +2342,662 @@ class GetPolicyTests(CassScalingGroupTestCase):
         self.flushLoggedErrors(NoSuchPolicyError)
 
 
+class GroupConfigCacheTests(SynchronousTestCase):
+    """
+    Tests for :class:`GroupConfigCache`
+    """
+
+    def setUp(self):
+        """
+        Sample cache
+        """
+        self.clock = Clock()
+        self.cache = GroupConfigCache(self.clock, size=2, max_age=5)
+        self.row = {'group_config': 'c', 'launch_config': 'l',
+                    'policies_version': 'v1'}
+
+    def test_get_validated(self):
+        """
+        A group is returned for ``max_age`` seconds after being validated
+        """
+        self.assertIsNone(self.cache.get('t', 'g'))
+        self.cache.validate('t', 'g', self.row)
+        self.clock.advance(5)
+        group = self.cache.get('t', 'g')
+        self.assertEqual((group.group_config, group.launch_config),
+                         ('c', 'l'))
+        self.clock.advance(1)
+        self.assertIsNone(self.cache.get('t', 'g'))
+        self.cache.validate('t', 'g', self.row)
+        self.assertIs(self.cache.get('t', 'g'), group)
+
+    def test_policies_version(self):
+        """
+        Policies are kept while the policies version stays the same, and
+        configurations are always updated
+        """
+        self.cache.validate('t', 'g', self.row)
+        self.cache.get('t', 'g').policies['p'] = {'data': '{}'}
+        self.cache.validate('t', 'g', assoc(self.row, 'group_config', 'c2'))
+        group = self.cache.get('t', 'g')
+        self.assertEqual((group.group_config, group.policies),
+                         ('c2', {'p': {'data': '{}'}}))
+        self.cache.validate('t', 'g',
+                            assoc(self.row, 'policies_version', 'v2'))
+        self.assertEqual(self.cache.get('t', 'g').policies, {})
+
+    def test_invalidate(self):
+        """
+        Invalidated groups are not returned
+        """
+        self.cache.validate('t', 'g', self.row)
+        self.cache.invalidate('t', 'g')
+        self.assertIsNone(self.cache.get('t', 'g'))
+        self.cache.invalidate('t', 'g')
+
+    def test_evicts_least_recently_validated(self):
+        """
+        The least recently validated group is evicted when there are more
+        than ``size`` groups
+        """
+        for group_id in ['g1', 'g2', 'g1', 'g3']:
+            self.cache.validate('t', group_id, self.row)
+        self.assertEqual(
+            [self.cache.get('t', g) is not None for g in ['g1', 'g2', 'g3']],
+            [True, False, True])
+
+
+class CachedConfigTests(CassScalingGroupTestCase):
+    """
+    Tests for :class:`CassScalingGroup` with a :class:`GroupConfigCache`
+    """
+
+    def setUp(self):
+        """
+        Give a config cache to the group
+        """
+        super(CachedConfigTests, self).setUp()
+        self.group.config_cache = GroupConfigCache(self.clock)
+        self.row = merge(scaling_group_entry,
+                         {'tenantId': self.tenant_id,
+                          'groupId': self.group_id,
+                          'launch_config': '{"type": "launch_server"}',
+                          'policies_version': 'v1'})
+
+    def read_state(self, row=None):
+        """
+        Read the state of the group, and reset the recorded queries
+        """
+        self.returns = [[row or self.row]]
+        self.successResultOf(self.group.view_state())
+        self.connection.execute.reset_mock()
+
+    def test_configs_from_state_read(self):
+        """
+        The configuration and launch configuration read with the state are
+        returned without reading them again
+        """
+        self.read_state()
+        self.assertEqual(self.successResultOf(self.group.view_config()),
+                         {'name': 'a'})
+        self.assertEqual(
+            self.successResultOf(self.group.view_launch_config()),
+            {'type': 'launch_server'})
+        self.assertFalse(self.connection.execute.called)
+
+    def test_expired(self):
+        """
+        Configurations are read again once ``max_age`` has passed since the
+        state was read
+        """
+        self.read_state()
+        self.clock.advance(2)
+        self.returns = [[{'group_config': '{}', 'created_at': 24}]]
+        self.assertEqual(self.successResultOf(self.group.view_config()), {})
+        self.assertTrue(self.connection.execute.called)
+
+    def test_deleting_not_cached(self):
+        """
+        The configuration of a deleting group is not cached
+        """
+        self.returns = [[merge(self.row, {'deleting': True})]]
+        self.failureResultOf(self.group.view_state(), NoSuchScalingGroupError)
+        self.connection.execute.reset_mock()
+        self.returns = [[{'group_config': '{}', 'created_at': 24}]]
+        self.successResultOf(self.group.view_config())
+        self.assertTrue(self.connection.execute.called)
+
+    def test_policy_cached(self):
+        """
+        A policy is read without checking that the group exists, and is then
+        cached until the policies version changes
+        """
+        self.read_state()
+        self.returns = [[{'data': '{"a": 1}', 'version': 'pv'}]]
+        self.assertEqual(self.successResultOf(self.group.get_policy('p')),
+                         {'a': 1})
+        self.assertEqual(len(self.connection.execute.mock_calls), 1)
+        self.connection.execute.reset_mock()
+
+        self.read_state()
+        self.assertEqual(
+            self.successResultOf(self.group.get_policy('p', 'pv')), {'a': 1})
+        self.failureResultOf(self.group.get_policy('p', 'other'),
+                             NoSuchPolicyError)
+        self.assertFalse(self.connection.execute.called)
+
+        self.read_state(merge(self.row, {'policies_version': 'v2'}))
+        self.returns = [[{'data': '{"a": 2}', 'version': 'pv2'}]]
+        self.assertEqual(self.successResultOf(self.group.get_policy('p')),
+                         {'a': 2})
+
+    def test_missing_policy_not_cached(self):
+        """
+        Policies that are not found are not cached
+        """
+        self.read_state()
+        self.returns = [[], []]
+        self.failureResultOf(self.group.get_policy('p'), NoSuchPolicyError)
+        self.failureResultOf(self.group.get_policy('p'), NoSuchPolicyError)
+        self.assertEqual(len(self.connection.execute.mock_calls), 2)
+
+    def test_writes_invalidate(self):
+        """
+        Updating the configuration, launch configuration or a policy, or
+        deleting a policy, removes the group from the cache
+        """
+        patch(self, 'otter.models.cass.CassScalingGroup._naive_list_webhooks',
+              return_value=defer.succeed([]))
+        for update in [
+                lambda: self.group.update_config({'name': 'b'}),
+                lambda: self.group.update_launch_config({}),
+                lambda: self.group.update_policy('p', {'type': 'webhook'}),
+                lambda: self.group.delete_policy('p')]:
+            self.read_state()
+            self.returns = [[{'data': '{"type": "webhook"}'}], None,
+                            [{'[applied]': True}], None]
+            self.successResultOf(update())
+            self.assertIsNone(self.group.config_cache.get(self.tenant_id,
+                                                          self.group_id))
+
+
+class CasModifyStateTests(CassScalingGroupTestCase):
+    """
+    Tests for :meth:`CassScalingGroup.modify_state` with compare-and-set
+    """
+
+    def setUp(self):
+        """
+        Modify state with compare-and-set, and serialize values as ``_S``
+        """
+        super(CasModifyStateTests, self).setUp()
+        self.group.cas_retries = 2
+        patch(self, 'otter.models.cass.serialize_json_data',
+              side_effect=lambda *args: _S(args[0]))
+        self.row = merge(scaling_group_entry,
+                         {'tenantId': self.tenant_id,
+                          'groupId': self.group_id,
+                          'state_version': 'v1'})
+        self.cas_query = (
+            'UPDATE scaling_group SET active = :active, pending = :pending, '
+            '"groupTouched" = :groupTouched, '
+            '"policyTouched" = :policyTouched, paused = :paused, '
+            'desired = :desired, state_version = :new_version '
+            'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
+            'IF state_version = :state_version')
+
+    def modifier(self, _group, state):
+        """
+        Pause the group, recording the desired capacity of the state
+        """
+        self.seen.append(state.desired)
+        state.paused = True
+        return state
+
+    def cas_call(self, state_version, desired):
+        """
+        Call made to write the paused state
+        """
+        return mock.call(
+            self.cas_query,
+            {'tenantId': self.tenant_id, 'groupId': self.group_id,
+             'active': _S({'A': 'R'}), 'pending': _S({'P': 'R'}),
+             'groupTouched': '2014-01-01T00:00:05Z.1234',
+             'policyTouched': _S({'PT': 'R'}), 'paused': True,
+             'desired': desired, 'state_version': state_version,
+             'new_version': 'timeuuid'},
+            ConsistencyLevel.QUORUM)
+
+    def test_applied(self):
+        """
+        The state returned by the modifier is written if the version of the
+        state is still the one read, without locking in ZooKeeper
+        """
+        self.seen = []
+        self.returns = [[self.row], [{'[applied]': True}]]
+        d = self.group.modify_state(self.modifier)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.seen, [0])
+        self.assertEqual(self.connection.execute.mock_calls[1],
+                         self.cas_call('v1', 0))
+        self.assertFalse(self.kz_client.Lock.called)
+
+    def test_first_write(self):
+        """
+        The state of a group without a version is written only if the group
+        still has no version and still exists, with the same creation time
+        """
+        self.seen = []
+        self.returns = [[merge(self.row, {'state_version': None})],
+                        [{'[applied]': True}]]
+        self.successResultOf(self.group.modify_state(self.modifier))
+        query = self.cas_query.replace(
+            'IF state_version = :state_version',
+            'IF state_version = null AND created_at = :created_at')
+        [_, (_, args, _)] = self.connection.execute.mock_calls
+        self.assertEqual(args[0], query)
+        self.assertEqual(args[1]['created_at'], 23)
+        self.assertNotIn('state_version', args[1])
+
+    def delete_group(self):
+        """
+        Delete the group, which has no policies or webhooks
+        """
+        patch(self, 'otter.models.cass.CassScalingGroup._naive_count_policies',
+              return_value=defer.succeed(0))
+        patch(self,
+              'otter.models.cass.CassScalingGroup._naive_list_all_webhooks',
+              return_value=defer.succeed([]))
+        return self.group.delete_group()
+
+    def mark_deleting_call(self, state_version):
+        """
+        Call made to mark the group deleting before deleting it
+        """
+        return mock.call(
+            'UPDATE scaling_group SET deleting = true, '
+            'state_version = :new_version '
+            'WHERE "tenantId" = :tenantId AND "groupId" = :groupId '
+            'IF state_version = :state_version',
+            {'tenantId': self.tenant_id, 'groupId': self.group_id,
+             'state_version': state_version, 'new_version': 'timeuuid'},
+            ConsistencyLevel.QUORUM)
+
+    def test_delete_changes_version(self):
+        """
+        Deleting the group first marks it deleting and changes its version,
+        so that modifications in progress can not write its state again
+        """
+        self.returns = [[merge(self.row, {'active': '{}', 'pending': '{}'})],
+                        [{'[applied]': True}], None, None]
+        self.assertIsNone(self.successResultOf(self.delete_group()))
+        calls = self.connection.execute.mock_calls
+        self.assertEqual(calls[1], self.mark_deleting_call('v1'))
+        self.assertIn('DELETE FROM scaling_group', calls[2][1][0])
+
+    def test_delete_conflict_retried(self):
+        """
+        When the state changed before the group was marked deleting, the
+        group is read and checked again
+        """
+        row = merge(self.row, {'active': '{}', 'pending': '{}'})
+        self.returns = [[row], [{'[applied]': False}],
+                        [merge(row, {'state_version': 'v2'})],
+                        [{'[applied]': True}], None, None]
+        d = self.delete_group()
+        self.assertNoResult(d)
+        self.clock.advance(0.1)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.connection.execute.mock_calls[3],
+                         self.mark_deleting_call('v2'))
+
+    def test_conflict_retried(self):
+        """
+        When the state changed since it was read, it is read again and
+        modified again
+        """
+        self.seen = []
+        self.returns = [[self.row],
+                        [{'[applied]': False, 'state_version': 'v2'}],
+                        [merge(self.row, {'state_version': 'v2',
+                                          'desired': 3})],
+                        [{'[applied]': True}]]
+        d = self.group.modify_state(self.modifier)
+        self.assertNoResult(d)
+        self.clock.advance(0.1)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.seen, [0, 3])
+        self.assertEqual(self.connection.execute.mock_calls[3],
+                         self.cas_call('v2', 3))
+
+    def test_conflict_retries_exhausted(self):
+        """
+        :obj:`StateConflictError` is raised when the state keeps changing
+        after being retried ``cas_retries`` times
+        """
+        self.seen = []
+        self.returns = [[self.row], [{'[applied]': False}]] * 3
+        d = self.group.modify_state(self.modifier)
+        self.clock.pump([0.1] * 3)
+        self.failureResultOf(d, StateConflictError)
+        self.assertEqual(self.seen, [0, 0, 0])
+
+    def test_errors_not_retried(self):
+        """
+        Errors of the modifier or of the read are propagated without
+        retrying or writing anything
+        """
+        def modifier(group, state):
+            raise ValueError('bad')
+
+        self.returns = [[self.row]]
+        self.failureResultOf(self.group.modify_state(modifier), ValueError)
+        self.returns = [[]]
+        self.failureResultOf(self.group.modify_state(modifier),
+                             NoSuchScalingGroupError)
+        self.assertEqual(len(self.connection.execute.mock_calls), 2)
+
+    def test_serialized_locally(self):
+        """
+        Modifications from the same node wait for each other
+        """
+        self.seen = []
+        read = defer.Deferred()
+        self.returns = [read, [{'[applied]': True}],
+                        [self.row], [{'[applied]': True}]]
+        self.connection.execute.side_effect = lambda *a: (
+            lambda r: r if isinstance(r, defer.Deferred)
+            else defer.succeed(r))(self.returns.pop(0))
+        d1 = self.group.modify_state(self.modifier)
+        d2 = self.group.modify_state(self.modifier)
+        self.assertEqual(len(self.connection.execute.mock_calls), 1)
+        read.callback([self.row])
+        self.successResultOf(d1)
+        self.successResultOf(d2)
+        self.assertEqual(len(self.connection.execute.mock_calls), 4)
+
+
+class CombinedModifyStateTests(CassScalingGroupTestCase):
+    """
+    Tests for :meth:`CassScalingGroup.modify_state` combining modifications
+    """
+
+    def setUp(self):
+        """
+        Hold the local lock of the group, so that modifications wait
+        """
+        super(CombinedModifyStateTests, self).setUp()
+        patch(self, 'otter.models.cass.serialize_json_data',
+              side_effect=lambda *args: _S(args[0]))
+        self.row = merge(scaling_group_entry,
+                         {'tenantId': self.tenant_id,
+                          'groupId': self.group_id,
+                          'state_version': 'v1'})
+        self.local_lock = self.group.local_locks.get_lock(self.group_id)
+        self.local_lock.acquire()
+        self.seen = []
+
+        def _responses(*args):
+            result = self.returns.pop(0)
+            if isinstance(result, Exception):
+                return defer.fail(result)
+            if isinstance(result, defer.Deferred):
+                return result
+            return defer.succeed(result)
+
+        self.connection.execute.side_effect = _responses
+
+    def modifier(self, desired, _group, state):
+        """
+        Record the desired capacity of the state and set it
+        """
+        self.seen.append(state.desired)
+        state.desired = desired
+        return state
+
+    def failing(self, _group, state):
+        """
+        Change the state and fail
+        """
+        self.seen.append(state.desired)
+        state.desired = 100
+        raise ValueError(state.desired)
+
+    def modify(self, *modifiers):
+        """
+        Modify the state with all the modifiers while the local lock is held,
+        and then release it
+        """
+        ds = [self.group.modify_state(m) for m in modifiers]
+        self.assertEqual(self.connection.execute.mock_calls, [])
+        self.local_lock.release()
+        return ds
+
+    def written_desired(self):
+        """
+        Desired capacities written
+        """
+        return [c[1][1]['desired']
+                for c in self.connection.execute.mock_calls
+                if c[1][0].startswith(('INSERT', 'UPDATE'))]
+
+    def test_combined(self):
+        """
+        Waiting modifiers are applied in order to one read of the state,
+        which is written once while holding the ZooKeeper lock once
+        """
+        self.returns = [[self.row], None]
+        ds = self.modify(partial(self.modifier, 1), partial(self.modifier, 2),
+                         partial(self.modifier, 3))
+        self.assertEqual([self.successResultOf(d) for d in ds],
+                         [None] * 3)
+        self.assertEqual(self.seen, [0, 1, 2])
+        self.assertEqual(self.written_desired(), [3])
+        self.assertEqual(self.lock._acquire.call_count, 1)
+
+    def test_failed_modifier(self):
+        """
+        A modifier failing fails only its caller, and does not change the
+        state given to the next modifier
+        """
+        self.returns = [[self.row], None]
+        d1, d2, d3 = self.modify(partial(self.modifier, 1), self.failing,
+                                 partial(self.modifier, 3))
+        self.successResultOf(d1)
+        self.failureResultOf(d2, ValueError)
+        self.successResultOf(d3)
+        self.assertEqual(self.seen, [0, 1, 1])
+        self.assertEqual(self.written_desired(), [3])
+
+    def test_all_failed(self):
+        """
+        Nothing is written when all the modifiers fail, and each caller gets
+        its own failure
+        """
+        def other(_group, state):
+            raise NoSuchPolicyError('t', 'g', 'p')
+
+        self.returns = [[self.row]]
+        d1, d2 = self.modify(self.failing, other)
+        self.failureResultOf(d1, ValueError)
+        self.failureResultOf(d2, NoSuchPolicyError)
+        self.assertEqual(self.written_desired(), [])
+        self.lock.release.assert_called_once_with()
+
+    def test_read_or_write_failed(self):
+        """
+        Callers whose modifier succeeded get the failure to read or write
+        the state
+        """
+        self.returns = [[self.row], KeyError('write')]
+        d1, d2 = self.modify(self.failing, partial(self.modifier, 2))
+        self.failureResultOf(d1, ValueError)
+        self.failureResultOf(d2, KeyError)
+
+        self.local_lock.acquire()
+        self.connection.execute.reset_mock()
+        self.returns = [[]]
+        d1, d2 = self.modify(partial(self.modifier, 1),
+                             partial(self.modifier, 2))
+        self.failureResultOf(d1, NoSuchScalingGroupError)
+        self.failureResultOf(d2, NoSuchScalingGroupError)
+
+    def test_queued_while_modifying(self):
+        """
+        Modifications requested while others are being applied are combined
+        once the local lock is released again
+        """
+        read = defer.Deferred()
+        self.returns = [read, None, [self.row], None]
+        [d1] = self.modify(partial(self.modifier, 1))
+        d2 = self.group.modify_state(partial(self.modifier, 2))
+        d3 = self.group.modify_state(partial(self.modifier, 3))
+        read.callback([self.row])
+        for d in [d1, d2, d3]:
+            self.successResultOf(d)
+        self.assertEqual(self.seen, [0, 0, 2])
+        self.assertEqual(self.written_desired(), [1, 3])
+        self.assertEqual(self.lock._acquire.call_count, 2)
+
+    def test_cas_reapplied(self):
+        """
+        With compare-and-set, all the modifiers are applied again when the
+        state changed concurrently
+        """
+        self.group.cas_retries = 1
+        self.returns = [[self.row], [{'[applied]': False}],
+                        [merge(self.row, {'desired': 5})],
+                        [{'[applied]': True}]]
+        d1, d2 = self.modify(partial(self.modifier, 1),
+                             partial(self.modifier, 2))
+        self.clock.advance(0.1)
+        self.successResultOf(d1)
+        self.successResultOf(d2)
+        self.assertEqual(self.seen, [0, 1, 5, 1])
+        self.assertEqual(self.written_desired(), [2, 2])
+
+
+class WebhookCapabilityCacheTests(SynchronousTestCase):
+    """
+    Tests for :class:`WebhookCapabilityCache`
+    """
+
+    def setUp(self):
+        """
+        Sample cache
+        """
+        self.clock = Clock()
+        self.cache = WebhookCapabilityCache(self.clock, size=2, ttl=10,
+                                            negative_ttl=2)
+
+    def test_ttl(self):
+        """
+        Found hashes are cached for ``ttl`` seconds, and unknown hashes for
+        ``negative_ttl`` seconds
+        """
+        self.assertRaises(KeyError, self.cache.lookup, 'h1')
+        self.cache.add('h1', ('t', 'g', 'p'))
+        self.cache.add('h2', None)
+        self.clock.advance(1.9)
+        self.assertEqual(self.cache.lookup('h1'), ('t', 'g', 'p'))
+        self.assertIsNone(self.cache.lookup('h2'))
+        self.clock.advance(0.1)
+        self.assertRaises(KeyError, self.cache.lookup, 'h2')
+        self.clock.advance(7.9)
+        self.assertEqual(self.cache.lookup('h1'), ('t', 'g', 'p'))
+        self.clock.advance(0.1)
+        self.assertRaises(KeyError, self.cache.lookup, 'h1')
+
+    def test_evicts_least_recently_used(self):
+        """
+        The least recently looked up or added hash is evicted when there are
+        more than ``size`` hashes
+        """
+        self.cache.add('h1', ('t', 'g', 'p1'))
+        self.cache.add('h2', ('t', 'g', 'p2'))
+        self.cache.lookup('h1')
+        self.cache.add('h3', None)
+        self.assertEqual(self.cache.lookup('h1'), ('t', 'g', 'p1'))
+        self.assertRaises(KeyError, self.cache.lookup, 'h2')
+
+    def test_invalidate(self):
+        """
+        Invalidated hashes are not cached anymore
+        """
+        self.cache.add('h1', ('t', 'g', 'p'))
+        self.cache.invalidate(['h1', 'h2'])
+        self.assertRaises(KeyError, self.cache.lookup, 'h1')
+
+
+class WebhookCacheInvalidationTests(CassScalingGroupTestCase):
+    """
+    Tests for webhooks deleted by :class:`CassScalingGroup` being removed
+    from its webhook cache
+    """
+
+    def setUp(self):
+        """
+        Give a webhook cache with cached hashes to the group
+        """
+        super(WebhookCacheInvalidationTests, self).setUp()
+        self.group.webhook_cache = WebhookCapabilityCache(self.clock)
+        for capability_hash in ['h1', 'h2', 'h3']:
+            self.group.webhook_cache.add(capability_hash, ('t', 'g', 'p'))
+
+    def cached(self):
+        """
+        Hashes still cached
+        """
+        hashes = []
+        for capability_hash in ['h1', 'h2', 'h3']:
+            try:
+                self.group.webhook_cache.lookup(capability_hash)
+            except KeyError:
+                pass
+            else:
+                hashes.append(capability_hash)
+        return hashes
+
+    def test_delete_webhook(self):
+        """
+        Deleting a webhook removes its hash
+        """
+        self.group.get_webhook = lambda policy_id, webhook_id: defer.succeed(
+            {'capability': {'hash': 'h2', 'version': '1'}})
+        self.returns = [None]
+        self.successResultOf(self.group.delete_webhook('p', 'w'))
+        self.assertEqual(self.cached(), ['h1', 'h3'])
+
+    def test_delete_policy(self):
+        """
+        Deleting a policy removes the hashes of its webhooks
+        """
+        self.group.get_policy = lambda policy_id: defer.succeed({})
+        self.group._naive_list_webhooks = (
+            lambda policy_id, limit, marker: defer.succeed(
+                [{'id': 'w1', 'capability': {'hash': 'h1', 'version': '1'}},
+                 {'id': 'w2', 'capability': {'hash': 'h3', 'version': '1'}}]))
+        self.returns = [None, [{'[applied]': True}], None]
+        self.successResultOf(self.group.delete_policy('p'))
+        self.assertEqual(self.cached(), ['h2'])
+
+    def test_delete_group(self):
+        """
+        Deleting a group removes the hashes of its webhooks, even if the
+        deletion fails
+        """
+        self.group.view_state = lambda get_deleting: defer.succeed(
+            GroupState(self.tenant_id, self.group_id, 'a', {}, {}, None, {},
+                       False, ScalingGroupStatus.ACTIVE))
+        self.group._naive_list_all_webhooks = lambda: defer.succeed(
+            [{'webhookKey': 'h2'}, {'webhookKey': 'h3'}])
+        self.group._naive_count_policies = lambda: defer.succeed(1)
+        self.connection.execute.side_effect = lambda *a: defer.fail(
+            ValueError('write'))
+        self.failureResultOf(self.group.delete_group(), ChunkedBatchError)
+        self.assertEqual(self.cached(), ['h1'])
+
+
 class ViewManifestTests(CassScalingGroupTestCase):
     """
     Tests for :func:`view_manifest`
@@ -2295,7 +3058,8 @@ class ViewManifestTests(CassScalingGroupTestCase):
         view_cql = (
             'SELECT "tenantId", "groupId", group_config, launch_config, '
             'active, pending, "groupTouched", "policyTouched", paused, '
-            'desired, created_at, status, error_reasons, deleting '
+            'desired, created_at, status, error_reasons, deleting, '
+            'policies_version, state_version '
             'FROM scaling_group '
             'WHERE "tenantId" = :tenantId '
             'AND "groupId" = :groupId')
@@ -2487,15 +3251,17 @@ class CassScalingGroupUpdatePolicyTests(CassScalingGroupTestCase):
                         "policyId": '12345678',
                         "tenantId": '11111',
                         "version": "timeuuid"}
-        self.connection.execute.assert_called_with(
-            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call(expectedCql, expectedData, ConsistencyLevel.QUORUM),
+             _policies_version_update(self.tenant_id, self.group_id)])
 
     def test_update_scaling_policy(self):
         """
         Test that you can update a scaling policy, and if successful it returns
         None
         """
-        self.returns = [None]
+        self.returns = [None, [{'[applied]': True}]]
         self.get_policy.return_value = defer.succeed({"type": "helvetica"})
         d = self.group.update_policy(
             '12345678', {"b": "lah", "type": "helvetica"})
@@ -2503,12 +3269,24 @@ class CassScalingGroupUpdatePolicyTests(CassScalingGroupTestCase):
         self.validate_policy_update(
             '{"_ver": 1, "b": "lah", "type": "helvetica"}')
 
+    def test_update_scaling_policy_deleted_group(self):
+        """
+        If the group is deleted while its policy is updated, the version of
+        its policies is not written, and :class:`NoSuchScalingGroupError` is
+        raised
+        """
+        self.returns = [None, [{'[applied]': False}]]
+        self.get_policy.return_value = defer.succeed({"type": "helvetica"})
+        d = self.group.update_policy(
+            '12345678', {"b": "lah", "type": "helvetica"})
+        self.failureResultOf(d, NoSuchScalingGroupError)
+
     def test_update_scaling_policy_schedule_no_change(self):
         """
         Schedule policy update with no args difference also updates
         scaling_schedule_v2 table.
         """
-        self.returns = [None]
+        self.returns = [None, [{'[applied]': True}]]
         self.get_policy.return_value = defer.succeed(
             {"type": "schedule", "args": {"cron": "1 * * * *"}})
         d = self.group.update_policy(
@@ -2533,8 +3311,10 @@ class CassScalingGroupUpdatePolicyTests(CassScalingGroupTestCase):
             "groupId": '12345678g', "policyId": '12345678',
             "tenantId": '11111', "trigger": "next_time",
             "version": 'timeuuid', "bucket": 2, "cron": '1 * * * *'}
-        self.connection.execute.assert_called_once_with(
-            expected_cql, expected_data, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call(expected_cql, expected_data, ConsistencyLevel.QUORUM),
+             _policies_version_update(self.tenant_id, self.group_id)])
 
     def test_update_scaling_policy_type_change(self):
         """
@@ -2551,7 +3331,7 @@ class CassScalingGroupUpdatePolicyTests(CassScalingGroupTestCase):
         Updating at-style schedule policy updates respective entry in
         scaling_schedule_v2 table also
         """
-        self.returns = [None]
+        self.returns = [None, [{'[applied]': True}]]
         self.get_policy.return_value = defer.succeed(
             {"type": "schedule",
              "args": {"at": "2013-07-30T19:03:12Z"}})
@@ -2580,15 +3360,17 @@ class CassScalingGroupUpdatePolicyTests(CassScalingGroupTestCase):
             "trigger": from_timestamp("2015-09-20T10:00:12Z"),
             "version": 'timeuuid',
             "bucket": 2}
-        self.connection.execute.assert_called_once_with(
-            expected_cql, expected_data, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call(expected_cql, expected_data, ConsistencyLevel.QUORUM),
+             _policies_version_update(self.tenant_id, self.group_id)])
 
     def test_update_scaling_policy_cron_schedule_change(self):
         """
         Updating cron-style schedule policy updates respective entry in
         scaling_schedule_v2 table also
         """
-        self.returns = [None]
+        self.returns = [None, [{'[applied]': True}]]
         self.get_policy.return_value = defer.succeed(
             {"type": "schedule", "args": {"cron": "1 * * * *"}})
         d = self.group.update_policy(
@@ -2613,8 +3395,10 @@ class CassScalingGroupUpdatePolicyTests(CassScalingGroupTestCase):
             "groupId": '12345678g', "policyId": '12345678',
             "tenantId": '11111', "trigger": "next_time",
             "version": 'timeuuid', "bucket": 2, "cron": '2 0 * * *'}
-        self.connection.execute.assert_called_once_with(
-            expected_cql, expected_data, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call(expected_cql, expected_data, ConsistencyLevel.QUORUM),
+             _policies_version_update(self.tenant_id, self.group_id)])
 
     def test_update_scaling_policy_bad(self):
         """
@@ -2693,7 +3477,7 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
         that there is such a scaling group
         """
         self.group.view_config = mock.MagicMock(return_value=defer.succeed({}))
-        self.returns = [[{'count': 0}], None]
+        self.returns = [[{'count': 0}], None, None]
         d = self.group.create_policies([{"b": "lah"}])
         self.successResultOf(d)
         self.group.view_config.assert_called_once_with()
@@ -2703,7 +3487,7 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
         Test that you can add a scaling policy, and what is returned is a
         list of the scaling policies with their ids
         """
-        self.returns = [[{'count': 0}], None]
+        self.returns = [[{'count': 0}], None, None]
         d = self.group.create_policies([{"b": "lah"}])
         result = self.successResultOf(d)
         expectedCql = (
@@ -2720,8 +3504,10 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
                         "groupId": '12345678g',
                         "policy0policyId": '12345678',
                         "tenantId": '11111'}
-        self.connection.execute.assert_called_with(
-            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls[1:],
+            [mock.call(expectedCql, expectedData, ConsistencyLevel.QUORUM),
+             _count_update(self.tenant_id, policies=1)])
 
         self.assertEqual(result, [{'b': 'lah',
                                    'id': self.mock_key.return_value}])
@@ -2733,7 +3519,7 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
         Test that you can add a scaling policy with 'at' schedule and what is
         returned is a list of the scaling policies with their ids
         """
-        self.returns = [[{'count': 0}], None]
+        self.returns = [[{'count': 0}], None, None]
         expected_at = '2012-10-20T03:23:45'
         pol = {'cooldown': 5,
                'type': 'schedule',
@@ -2767,8 +3553,10 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
             "tenantId": '11111',
             "policy0bucket": 2,
             "policy0version": 'timeuuid'}
-        self.connection.execute.assert_called_with(
-            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls[1:],
+            [mock.call(expectedCql, expectedData, ConsistencyLevel.QUORUM),
+             _count_update(self.tenant_id, policies=1)])
 
         pol['id'] = self.mock_key.return_value
         self.assertEqual(result, [pol])
@@ -2778,7 +3566,7 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
         Test that you can add a scaling policy with 'cron' schedule and what is
         returned is a list of the scaling policies with their ids
         """
-        self.returns = [[{'count': 0}], None]
+        self.returns = [[{'count': 0}], None, None]
         pol = {'cooldown': 5,
                'type': 'schedule',
                'name': 'scale up by 10',
@@ -2813,8 +3601,10 @@ class ScalingGroupAddPoliciesTests(CassScalingGroupTestCase):
                         "policy0cron": "* * * * *",
                         "policy0bucket": 2,
                         "policy0version": "timeuuid"}
-        self.connection.execute.assert_called_with(
-            expectedCql, expectedData, ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls[1:],
+            [mock.call(expectedCql, expectedData, ConsistencyLevel.QUORUM),
+             _count_update(self.tenant_id, policies=1)])
 
         pol['id'] = self.mock_key.return_value
         self.assertEqual(result, [pol])
@@ -2962,49 +3752,110 @@ class CassScalingScheduleCollectionTestCase(
             [mock.call(fetch_cql, fetch_data, ConsistencyLevel.QUORUM),
              mock.call(del_cql, del_data, ConsistencyLevel.QUORUM)])
 
-    def test_add_cron_events(self):
+    def test_fetch_and_delete_padded(self):
+        """
+        The batch deleting fetched events repeats the last event to delete a
+        power of two number of events, so that few distinct queries are
+        prepared
+        """
+        events = [{'tenantId': '1d2', 'groupId': 'gr2', 'policyId': p,
+                   'trigger': t, 'cron': None, 'version': 'v'}
+                  for p, t in [('ef', 100), ('ex', 122), ('ey', 125)]]
+        self.returns = [events, None]
+        self.assertEqual(self.validate_fetch_and_delete(2, 1234, 100), events)
+        del_cql, del_data, _ = self.connection.execute.mock_calls[1][1]
+        self.assertEqual(del_cql.count('DELETE FROM'), 4)
+        self.assertEqual(
+            [(del_data['event{}policyId'.format(i)],
+              del_data['event{}trigger'.format(i)]) for i in range(4)],
+            [('ef', 100), ('ex', 122), ('ey', 125), ('ey', 125)])
+
+    def test_fetch_events(self):
+        """
+        `fetch_events` fetches events up to the given time without deleting
+        them
+        """
+        events = [{'tenantId': '1d2', 'groupId': 'gr2', 'policyId': 'ef',
+                   'trigger': 100, 'cron': None, 'version': 'v'}]
+        self.returns = [events]
+        self.assertEqual(
+            self.successResultOf(self.collection.fetch_events(2, 1264, 10)),
+            events)
+        self.connection.execute.assert_called_once_with(
+            'SELECT "tenantId", "groupId", "policyId", "trigger", '
+            'cron, version FROM scaling_schedule_v2 '
+            'WHERE bucket = :bucket AND trigger <= :now LIMIT :size;',
+            {'bucket': 2, 'now': 1264, 'size': 10}, ConsistencyLevel.QUORUM)
+
+    def test_delete_events(self):
         """
-        Tests for `add_cron_events`
+        `delete_events` deletes events of a bucket in a batch, and nothing
+        when there are no events
         """
+        self.successResultOf(self.collection.delete_events(2, []))
+        self.assertFalse(self.connection.execute.called)
         self.returns = [None]
+        self.assertIsNone(self.successResultOf(
+            self.collection.delete_events(
+                2, [{'policyId': 'ef', 'trigger': 100}])))
+        self.connection.execute.assert_called_once_with(
+            'DELETE FROM scaling_schedule_v2 WHERE bucket = :bucket '
+            'AND trigger = :event0trigger AND "policyId" = :event0policyId;',
+            {'bucket': 2, 'event0trigger': 100, 'event0policyId': 'ef'},
+            ConsistencyLevel.QUORUM)
+
+    def test_add_cron_events_padded(self):
+        """
+        `add_cron_events` repeats the last event of a bucket to insert a
+        power of two number of events
+        """
+        events = [{'tenantId': '1d2', 'groupId': 'gr2', 'policyId': p,
+                   'trigger': 100, 'cron': 'c1', 'version': 'v1'}
+                  for p in ['ef', 'ex', 'ey']]
+        self.collection.buckets = iter([2, 2, 2])
+        self.successResultOf(self.collection.add_cron_events(events))
+        cql, data, _ = self.connection.execute.mock_calls[0][1]
+        self.assertEqual(cql.count('INSERT INTO'), 4)
+        self.assertEqual(
+            [(data['event{}policyId'.format(i)],
+              data['event{}bucket'.format(i)]) for i in range(4)],
+            [('ef', 2), ('ex', 2), ('ey', 2), ('ey', 2)])
+
+    def test_add_cron_events(self):
+        """
+        `add_cron_events` inserts the events of every bucket separately
+        """
+        self.returns = [None, None]
         events = [{'tenantId': '1d2', 'groupId': 'gr2', 'policyId': 'ef',
                    'trigger': 100, 'cron': 'c1', 'version': 'v1'},
                   {'tenantId': '1d3', 'groupId': 'gr3', 'policyId': 'ex',
                    'trigger': 122, 'cron': 'c2', 'version': 'v2'}]
         cql = (
-            'BEGIN BATCH '
-
             'INSERT INTO scaling_schedule_v2(bucket, "tenantId", "groupId", '
             '"policyId", trigger, cron, version) '
             'VALUES (:event0bucket, :event0tenantId, :event0groupId, '
-            ':event0policyId, :event0trigger, :event0cron, :event0version); '
-            'INSERT INTO scaling_schedule_v2(bucket, "tenantId", "groupId", '
-            '"policyId", trigger, cron, version) '
-            'VALUES (:event1bucket, :event1tenantId, :event1groupId, '
-            ':event1policyId, :event1trigger, :event1cron, :event1version); '
-
-            'APPLY BATCH;')
-        data = {'event0bucket': 2,
-                'event0tenantId': '1d2',
-                'event0groupId': 'gr2',
-                'event0policyId': 'ef',
-                'event0trigger': 100,
-                'event0cron': 'c1',
-                'event0version': 'v1',
-
-                'event1bucket': 3,
-                'event1tenantId': '1d3',
-                'event1groupId': 'gr3',
-                'event1policyId': 'ex',
-                'event1trigger': 122,
-                'event1cron': 'c2',
-                'event1version': 'v2'}
+            ':event0policyId, :event0trigger, :event0cron, :event0version);')
+        data = [{'event0bucket': 2,
+                 'event0tenantId': '1d2',
+                 'event0groupId': 'gr2',
+                 'event0policyId': 'ef',
+                 'event0trigger': 100,
+                 'event0cron': 'c1',
+                 'event0version': 'v1'},
+                {'event0bucket': 3,
+                 'event0tenantId': '1d3',
+                 'event0groupId': 'gr3',
+                 'event0policyId': 'ex',
+                 'event0trigger': 122,
+                 'event0cron': 'c2',
+                 'event0version': 'v2'}]
         self.collection.buckets = iter(range(2, 4))
 
         result = self.successResultOf(self.collection.add_cron_events(events))
         self.assertEqual(result, None)
-        self.connection.execute.assert_called_once_with(
-            cql, data, ConsistencyLevel.ONE)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call(cql, d, ConsistencyLevel.ONE) for d in data])
 
     def test_get_oldest_event(self):
         """
@@ -3044,7 +3895,7 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         set_config_data({'limits': {'absolute': {'maxGroups': 1000}}})
         self.addCleanup(set_config_data, {})
 
-        self.returns = [[{"count": 0}], None]
+        self.returns = [[{'resource': 'reconciled', 'count': 1}], None, None]
 
         def _responses(*args):
             result = self.returns.pop(0)
@@ -3146,13 +3997,14 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
 
         # Verify data argument seperately since data in actual call will have
         # datetime.utcnow which cannot be mocked or predicted.
-        data = self.connection.execute.call_args[0][1]
+        data = self.connection.execute.mock_calls[1][1][1]
         self.assertTrue(isinstance(data.pop('created_at'), datetime))
         self.assertEqual(expectedData, data)
 
-        self.connection.execute.assert_called_with(expectedCql,
-                                                   mock.ANY,
-                                                   ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls[1:],
+            [mock.call(expectedCql, mock.ANY, ConsistencyLevel.QUORUM),
+             _count_update('123', groups=1)])
 
     def test_create_with_policy(self):
         """
@@ -3206,13 +4058,14 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         self.assertEqual(result['id'], self.mock_key.return_value)
         self.assertTrue(isinstance(result['state'], GroupState))
 
-        called_data = self.connection.execute.call_args[0][1]
+        called_data = self.connection.execute.mock_calls[1][1][1]
         self.assertTrue(isinstance(called_data.pop('created_at'), datetime))
         self.assertEqual(called_data, expectedData)
 
-        self.connection.execute.assert_called_with(expectedCql,
-                                                   mock.ANY,
-                                                   ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls[1:],
+            [mock.call(expectedCql, mock.ANY, ConsistencyLevel.QUORUM),
+             _count_update('123', groups=1, policies=1)])
 
     def test_create_with_policy_multiple(self):
         """
@@ -3281,29 +4134,31 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         self.assertEqual(result['id'], '1')
         self.assertTrue(isinstance(result['state'], GroupState))
 
-        called_data = self.connection.execute.call_args[0][1]
+        called_data = self.connection.execute.mock_calls[1][1][1]
         self.assertTrue(isinstance(called_data.pop('created_at'), datetime))
         self.assertEqual(called_data, expectedData)
 
-        self.connection.execute.assert_called_with(expectedCql,
-                                                   mock.ANY,
-                                                   ConsistencyLevel.QUORUM)
+        self.assertEqual(
+            self.connection.execute.mock_calls[1:],
+            [mock.call(expectedCql, mock.ANY, ConsistencyLevel.QUORUM),
+             _count_update('123', groups=1, policies=2)])
 
     def test_max_groups_underlimit(self):
         """
         test scaling group creation when below maxGroups limit
         """
-        self.returns = [[{'count': 1}], None]
+        self.returns = [[{'resource': 'groups', 'count': 1},
+                         {'resource': 'reconciled', 'count': 1}], None, None]
 
         expectedData = {'tenantId': '1234'}
-        expectedCQL = ('SELECT COUNT(*) FROM scaling_group '
-                       'WHERE "tenantId"=:tenantId AND deleting=false;')
+        expectedCQL = ('SELECT resource, count FROM resource_counts '
+                       'WHERE "tenantId"=:tenantId;')
 
         d = self.collection.create_scaling_group(
             mock.Mock(), '1234', self.config, self.launch)
         self.assertTrue(isinstance(self.successResultOf(d), dict))
 
-        self.assertEqual(len(self.connection.execute.mock_calls), 2)
+        self.assertEqual(len(self.connection.execute.mock_calls), 3)
         self.assertEqual(
             self.connection.execute.mock_calls[0],
             mock.call(expectedCQL, expectedData, ConsistencyLevel.ONE))
@@ -3313,12 +4168,13 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         test scaling group creation when at maxGroups limit
         """
         self.collection.max_groups = 1
-        self.returns = [[{'count': 1}]]
+        self.returns = [[{'resource': 'groups', 'count': 1},
+                         {'resource': 'reconciled', 'count': 1}]]
 
         expectedData = {'tenantId': '1234'}
         expectedCQL = (
-            'SELECT COUNT(*) FROM scaling_group '
-            'WHERE "tenantId"=:tenantId AND deleting=false;')
+            'SELECT resource, count FROM resource_counts '
+            'WHERE "tenantId"=:tenantId;')
 
         d = self.collection.create_scaling_group(
             mock.Mock(), '1234', self.config, self.launch)
@@ -3557,6 +4413,18 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         self.assertEqual(g.uuid, '12345678')
         self.assertEqual(g.tenant_id, '123')
         self.assertIs(g.local_locks, self.collection.local_locks)
+        self.assertIsNone(g.cas_retries)
+
+    def test_get_scaling_group_shares_config(self):
+        """
+        The config cache and compare-and-set retries of the collection are
+        given to the group.
+        """
+        self.collection.config_cache = cache = GroupConfigCache(Clock())
+        self.collection.cas_retries = 3
+        g = self.collection.get_scaling_group(self.mock_log, '123', '12345678')
+        self.assertIs(g.config_cache, cache)
+        self.assertEqual(g.cas_retries, 3)
 
     def test_webhook_info_by_hash(self):
         """
@@ -3590,15 +4458,55 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
         self.connection.execute.assert_called_once_with(
             expectedCql, expectedData, ConsistencyLevel.ONE)
 
+    def test_webhook_info_cached(self):
+        """
+        With a webhook cache, found and unknown hashes are read once and then
+        served from the cache
+        """
+        self.collection.webhook_cache = WebhookCapabilityCache(Clock())
+        self.returns = [_cassandrify_data([
+            {'tenantId': '123', 'groupId': 'group1', 'policyId': 'pol1'}]),
+            []]
+        for _ in range(2):
+            self.assertEqual(
+                self.successResultOf(
+                    self.collection.webhook_info_by_hash(self.mock_log, 'x')),
+                ('123', 'group1', 'pol1'))
+            self.failureResultOf(
+                self.collection.webhook_info_by_hash(self.mock_log, 'y'),
+                UnrecognizedCapabilityError)
+        self.assertEqual(self.connection.execute.call_count, 2)
+
     def test_get_counts(self):
         """
-        Check get_count returns dictionary in proper format
+        ``get_counts`` returns the maintained counts of the tenant once they
+        have been reconciled
+        """
+        self.returns = [[{'resource': 'groups', 'count': 100},
+                         {'resource': 'webhooks', 'count': 102},
+                         {'resource': 'reconciled', 'count': 1}]]
+        d = self.collection.get_counts(self.mock_log, '123')
+        self.assertEqual(self.successResultOf(d),
+                         {'groups': 100, 'policies': 0, 'webhooks': 102})
+        self.connection.execute.assert_called_once_with(
+            'SELECT resource, count FROM resource_counts '
+            'WHERE "tenantId"=:tenantId;',
+            {'tenantId': '123'}, ConsistencyLevel.ONE)
+
+    def test_get_counts_not_reconciled(self):
+        """
+        ``get_counts`` counts the resources of a tenant whose counts were
+        never reconciled in the tables, and reconciles its counts
         """
         self.returns = [
+            [{'resource': 'groups', 'count': 2}],
+            [{'[applied]': True}],
+            [{'count': 100}],
             [{'count': 101}],
             [{'count': 102}],
-            [{'count': 100}],
-        ]
+            [{'resource': 'groups', 'count': 2}],
+            None,
+            [{'[applied]': True}]]
 
         expectedData = {'tenantId': '123'}
         expectedResults = {
@@ -3612,16 +4520,190 @@ class CassScalingGroupsCollectionTestCase(IScalingGroupCollectionProviderMixin,
                         'WHERE "tenantId"=:tenantId ;')
         webhook_query = ('SELECT COUNT(*) FROM policy_webhooks '
                          'WHERE "tenantId"=:tenantId ;')
-
-        calls = [
-            mock.call(policy_query, expectedData, ConsistencyLevel.ONE),
-            mock.call(webhook_query, expectedData, ConsistencyLevel.ONE),
-            mock.call(config_query, expectedData, ConsistencyLevel.ONE)]
+        reconcile_query = (
+            _update_counts_cql[:-len(' APPLY BATCH;')] +
+            ' UPDATE resource_counts SET count = count + :reconciled '
+            'WHERE "tenantId"=:tenantId AND resource=\'reconciled\'; '
+            'APPLY BATCH;')
 
         d = self.collection.get_counts(self.mock_log, '123')
         result = self.successResultOf(d)
         self.assertEquals(result, expectedResults)
-        self.connection.execute.assert_has_calls(calls)
+        self.assertEqual(
+            self.connection.execute.mock_calls[1:],
+            [self.claim_call('123'),
+             mock.call(config_query, expectedData, ConsistencyLevel.ONE),
+             mock.call(policy_query, expectedData, ConsistencyLevel.ONE),
+             mock.call(webhook_query, expectedData, ConsistencyLevel.ONE),
+             mock.call('SELECT resource, count FROM resource_counts '
+                       'WHERE "tenantId"=:tenantId;',
+                       expectedData, ConsistencyLevel.ONE),
+             mock.call(reconcile_query,
+                       {'tenantId': '123', 'groups': 98, 'policies': 101,
+                        'webhooks': 102, 'reconciled': 1},
+                       ConsistencyLevel.ONE),
+             mock.call('UPDATE resource_count_reconciles '
+                       'SET reconciler = null WHERE "tenantId" = :tenantId '
+                       'IF reconciler = :reconciler',
+                       {'tenantId': '123', 'reconciler': 'timeuuid'},
+                       ConsistencyLevel.QUORUM)])
+
+    def claim_call(self, tenant_id):
+        """
+        Call made to claim the reconciliation of the counts of a tenant
+        """
+        return mock.call(
+            'UPDATE resource_count_reconciles USING TTL 300 '
+            'SET reconciler = :reconciler WHERE "tenantId" = :tenantId '
+            'IF reconciler = null',
+            {'tenantId': tenant_id, 'reconciler': 'timeuuid'},
+            ConsistencyLevel.QUORUM)
+
+    def test_reconcile_counts(self):
+        """
+        ``reconcile_counts`` corrects the counts of a tenant that drifted,
+        and does not update counts that did not
+        """
+        counts = [[{'count': 3}], [{'count': 4}], [{'count': 5}]]
+        self.returns = [[{'[applied]': True}]] + counts + [
+            [{'resource': 'groups', 'count': 3},
+             {'resource': 'policies', 'count': 6},
+             {'resource': 'webhooks', 'count': 5},
+             {'resource': 'reconciled', 'count': 1}],
+            None, [{'[applied]': True}]]
+        d = self.collection.reconcile_counts(self.mock_log, '123')
+        self.assertEqual(self.successResultOf(d),
+                         {'groups': 3, 'policies': 4, 'webhooks': 5})
+        self.assertEqual(
+            self.connection.execute.mock_calls[-2][1][1],
+            {'tenantId': '123', 'groups': 0, 'policies': -2, 'webhooks': 0,
+             'reconciled': 0})
+
+        self.connection.execute.reset_mock()
+        self.returns = [[{'[applied]': True}]] + counts + [
+            [{'resource': 'groups', 'count': 3},
+             {'resource': 'policies', 'count': 4},
+             {'resource': 'webhooks', 'count': 5},
+             {'resource': 'reconciled', 'count': 1}],
+            [{'[applied]': True}]]
+        d = self.collection.reconcile_counts(self.mock_log, '123')
+        self.assertEqual(self.successResultOf(d),
+                         {'groups': 3, 'policies': 4, 'webhooks': 5})
+        self.assertEqual(self.connection.execute.call_count, 6)
+
+    def test_reconcile_counts_claimed(self):
+        """
+        ``reconcile_counts`` only counts the resources in the tables when
+        the counts of the tenant are already being reconciled
+        """
+        self.returns = [[{'[applied]': False, 'reconciler': 'other'}],
+                        [{'count': 3}], [{'count': 4}], [{'count': 5}]]
+        d = self.collection.reconcile_counts(self.mock_log, '123')
+        self.assertEqual(self.successResultOf(d),
+                         {'groups': 3, 'policies': 4, 'webhooks': 5})
+        self.assertEqual(self.connection.execute.call_count, 4)
+
+    def test_reconcile_counts_released_on_error(self):
+        """
+        The reconciliation of the counts of a tenant is released if it fails
+        """
+        self.returns = [[{'[applied]': True}], ValueError('counts'),
+                        [{'count': 4}], [{'count': 5}],
+                        [{'[applied]': True}]]
+        d = self.collection.reconcile_counts(self.mock_log, '123')
+        self.failureResultOf(d, ValueError)
+        self.assertIn('SET reconciler = null',
+                      self.connection.execute.mock_calls[-1][1][0])
+
+    def test_count_update_error_logged(self):
+        """
+        Failing to update the counts once a group is created is logged, and
+        the group is still created
+        """
+        self.returns = [[{'resource': 'reconciled', 'count': 1}], None,
+                        ValueError('counter')]
+        self.mock_key.return_value = 'g1'
+        log = mock_log()
+        d = self.collection.create_scaling_group(
+            log, '1234', self.config, self.launch)
+        self.assertTrue(isinstance(self.successResultOf(d), dict))
+        log.err.assert_called_once_with(
+            CheckFailure(ValueError), 'Could not update resource counts',
+            tenant_id='1234', scaling_group_id='g1',
+            deltas={'groups': 1, 'policies': 0})
+
+    def test_reconcile_all_counts(self):
+        """
+        ``reconcile_all_counts`` reconciles the counts of every tenant given
+        or that has counts, and then sets the counts of all tenants to their
+        sums and marks them reconciled
+        """
+        reconciled = []
+
+        def reconcile_counts(log, tenant_id):
+            reconciled.append(tenant_id)
+            return {'groups': 1, 'policies': len(reconciled), 'webhooks': 0}
+
+        self.collection.reconcile_counts = reconcile_counts
+        self.returns = [[{'tenantId': 't3'}, {'tenantId': '*'}],
+                        [{'[applied]': True}],
+                        [{'resource': 'groups', 'count': 1}], None,
+                        [{'[applied]': True}]]
+        d = self.collection.reconcile_all_counts(self.mock_log, ['t2', 't1'])
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(reconciled, ['t1', 't2', 't3'])
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call('SELECT DISTINCT "tenantId" FROM resource_counts '
+                       'LIMIT :limit;', {'limit': 1000},
+                       ConsistencyLevel.ONE),
+             self.claim_call('*'),
+             mock.call('SELECT resource, count FROM resource_counts '
+                       'WHERE "tenantId"=:tenantId;',
+                       {'tenantId': '*'}, ConsistencyLevel.ONE),
+             mock.call(_update_counts_cql[:-len(' APPLY BATCH;')] +
+                       ' UPDATE resource_counts SET count = count + '
+                       ':reconciled WHERE "tenantId"=:tenantId AND '
+                       'resource=\'reconciled\'; APPLY BATCH;',
+                       {'tenantId': '*', 'groups': 2, 'policies': 6,
+                        'webhooks': 0, 'reconciled': 1},
+                       ConsistencyLevel.ONE),
+             mock.call('UPDATE resource_count_reconciles '
+                       'SET reconciler = null WHERE "tenantId" = :tenantId '
+                       'IF reconciler = :reconciler',
+                       {'tenantId': '*', 'reconciler': 'timeuuid'},
+                       ConsistencyLevel.QUORUM)])
+
+    def test_reconcile_all_counts_claimed(self):
+        """
+        ``reconcile_all_counts`` does not set the counts of all tenants if
+        another reconciliation is setting them
+        """
+        self.collection.reconcile_counts = (
+            lambda log, tenant_id: {'groups': 1, 'policies': 0,
+                                    'webhooks': 0})
+        self.returns = [[], [{'[applied]': False}]]
+        d = self.collection.reconcile_all_counts(self.mock_log, ['t1'])
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.connection.execute.call_count, 2)
+
+    def test_counted_tenants_paged(self):
+        """
+        The tenants that have counts are read page by page
+        """
+        self.collection.reconcile_counts = (
+            lambda log, tenant_id: dict.fromkeys(
+                ('groups', 'policies', 'webhooks'), 0))
+        self.returns = [[{'tenantId': 't{}'.format(i)} for i in range(1000)],
+                        [{'tenantId': 'u'}], [{'[applied]': False}]]
+        self.successResultOf(
+            self.collection.reconcile_all_counts(self.mock_log, []))
+        self.assertEqual(
+            self.connection.execute.mock_calls[1],
+            mock.call('SELECT DISTINCT "tenantId" FROM resource_counts '
+                      'WHERE token("tenantId") > token(:tenantId) '
+                      'LIMIT :limit;', {'limit': 1000, 'tenantId': 't999'},
+                      ConsistencyLevel.ONE))
 
 
 class CassScalingGroupsCollectionHealthCheckTestCase(
@@ -3813,25 +4895,44 @@ class CassGroupServersCacheTests(SynchronousTestCase):
               "server_as_active": True}],
             ([{"d": "e"}], self.dt))
 
-    def _test_insert_servers(self, eff, ts=2500000):
-        query = (
-            'BEGIN BATCH USING TIMESTAMP {} '
-            'INSERT INTO servers_cache ("tenantId", "groupId", last_update, '
-            'server_id, server_blob, server_as_active) '
-            'VALUES(:tenantId, :groupId, :last_update, :server_id0, '
-            ':server_blob0, :server_as_active0); '
-            'INSERT INTO servers_cache ("tenantId", "groupId", last_update, '
-            'server_id, server_blob, server_as_active) '
-            'VALUES(:tenantId, :groupId, :last_update, :server_id1, '
-            ':server_blob1, :server_as_active1); APPLY BATCH;').format(ts)
+    def test_get_servers_compact(self):
+        """
+        `get_servers` decodes compact rows as well as plain JSON rows
+        """
+        self._test_get_servers(
+            False,
+            [{"server_blob": _encode_server_blob({"id": "a"}),
+              "last_update": self.dt, "server_as_active": False},
+             {"server_blob": '{"id": "b", "c": "d"}', "last_update": self.dt,
+              "server_as_active": False}],
+            ([{"id": "a"}, {"id": "b", "c": "d"}], self.dt))
+
+    def _insert_query(self, count):
+        return (
+            'BEGIN BATCH USING TIMESTAMP :ts ' +
+            ''.join(
+                'INSERT INTO servers_cache ("tenantId", "groupId", '
+                'last_update, server_id, server_blob, server_as_active) '
+                'VALUES(:tenantId, :groupId, :last_update, :server{i}id, '
+                ':server{i}blob, :server{i}as_active); '.format(i=i)
+                for i in range(count)) +
+            'APPLY BATCH;')
+
+    def _test_insert_servers(self, eff, ts=2500000,
+                             blob_encoder=_encode_server_blob):
         self.params.update(
-            {"server_id0": "a", "server_blob0": '{"id": "a"}',
-             "server_as_active0": True,
-             "server_id1": "b", "server_blob1": '{"id": "b"}',
-             "server_as_active1": False,
-             "last_update": self.dt})
-        self.assertEqual(eff, cql_eff(query, self.params))
-        self.assertEqual(resolve_effect(eff, None), None)
+            {"server0id": "a",
+             "server0blob": blob_encoder({"id": "a"}),
+             "server0as_active": True,
+             "server1id": "b",
+             "server1blob": blob_encoder({"id": "b"}),
+             "server1as_active": False,
+             "last_update": self.dt, "ts": ts})
+        seq = [parallel_sequence([[
+            (CQLQueryExecute(query=self._insert_query(2), params=self.params,
+                             consistency_level=ConsistencyLevel.QUORUM),
+             lambda i: None)]])]
+        self.assertIsNone(perform_sequence(seq, eff))
 
     def test_insert_servers(self):
         """
@@ -3842,6 +4943,18 @@ class CassGroupServersCacheTests(SynchronousTestCase):
             clear_others=False)
         self._test_insert_servers(eff)
 
+    def test_insert_servers_plain_json(self):
+        """
+        `insert_servers` stores servers as plain JSON when
+        servers_cache.compact is false in the config
+        """
+        set_config_data({'servers_cache': {'compact': False}})
+        self.addCleanup(set_config_data, {})
+        eff = self.cache.insert_servers(
+            self.dt, [{"id": "a", "_is_as_active": True}, {"id": "b"}],
+            clear_others=False)
+        self._test_insert_servers(eff, blob_encoder=json.dumps)
+
     def test_insert_servers_delete(self):
         """
         `insert_servers` deletes existing caches before inserting
@@ -3856,6 +4969,39 @@ class CassGroupServersCacheTests(SynchronousTestCase):
         eff = resolve_effect(eff, None)
         self._test_insert_servers(eff, 3500000)
 
+    def test_insert_servers_padded(self):
+        """
+        `insert_servers` repeats the last server to insert a power of two
+        number of servers, so that few distinct queries are prepared
+        """
+        eff = self.cache.insert_servers(
+            self.dt, [{"id": "a"}, {"id": "b"}, {"id": "c"}],
+            clear_others=False)
+        [batch_eff] = eff.intent.effects
+        self.assertEqual(batch_eff.intent.query, self._insert_query(4))
+        self.assertEqual(
+            [(batch_eff.intent.params['server{}id'.format(i)],
+              batch_eff.intent.params['server{}as_active'.format(i)])
+             for i in range(4)],
+            [('a', False), ('b', False), ('c', False), ('c', False)])
+
+    def test_insert_servers_one_batch(self):
+        """
+        `insert_servers` writes many servers in one batch, since they are in
+        one partition, and fails if it failed
+        """
+        set_config_data({'servers_cache': {'compact': False}})
+        self.addCleanup(set_config_data, {})
+        servers = [{"id": str(i), "name": "x" * 1000} for i in range(8)]
+        eff = self.cache.insert_servers(self.dt, servers, clear_others=False)
+        queries = [e.intent.query for e in eff.intent.effects]
+        self.assertEqual(queries, [self._insert_query(8)])
+        seq = [parallel_sequence([
+            [(mock.ANY, lambda i: raise_(ValueError('write')))]])]
+        err = self.assertRaises(ChunkedBatchError, perform_sequence, seq, eff)
+        self.assertEqual([(i, f.type) for i, f in err.failures],
+                         [(0, ValueError)])
+
     def test_insert_empty(self):
         """
         `insert_servers` does nothing if called with empty servers list
@@ -3885,6 +5031,139 @@ class CassGroupServersCacheTests(SynchronousTestCase):
                     merge(self.params, {"ts": 2500000})))
 
 
+class GetGroupsServersTests(SynchronousTestCase):
+    """
+    Tests for :func:`get_groups_servers`
+    """
+
+    def setUp(self):
+        self.dt1 = datetime(2010, 10, 20, 10, 0, 0)
+        self.dt2 = datetime(2010, 10, 20, 11, 0, 0)
+
+    def _query(self, group_ids, rows):
+        """
+        Return the expected query of a chunk of groups and its result
+        """
+        params = {'groupId{}'.format(i): group_id
+                  for i, group_id in enumerate(group_ids)}
+        params['tenantId'] = 'tid'
+        return (
+            CQLQueryExecute(
+                query=('SELECT "groupId", server_blob, server_as_active, '
+                       'last_update FROM servers_cache WHERE '
+                       '"tenantId"=:tenantId AND "groupId" IN ({});'.format(
+                           ', '.join(':groupId{}'.format(i)
+                                     for i in range(len(group_ids))))),
+                params=params, consistency_level=ConsistencyLevel.QUORUM),
+            lambda i: rows)
+
+    def _row(self, group_id, blob, last_update, as_active=True):
+        return {'groupId': group_id, 'server_blob': blob,
+                'last_update': last_update, 'server_as_active': as_active}
+
+    def test_chunks_in_parallel(self):
+        """
+        Groups are read in chunks with a query per chunk performed in
+        parallel, and the latest servers of each group are returned
+        """
+        rows1 = [self._row('g1', '{"id": "a"}', self.dt2),
+                 self._row('g1', '{"id": "b"}', self.dt2, False),
+                 self._row('g1', '{"id": "c"}', self.dt1),
+                 self._row('g2', '{"id": "d"}', self.dt1)]
+        rows2 = [self._row('g3', '{"id": "e"}', self.dt1)]
+        seq = [parallel_sequence([[self._query(['g1', 'g2'], rows1)],
+                                  [self._query(['g3'], rows2)]])]
+        self.assertEqual(
+            perform_sequence(
+                seq, get_groups_servers('tid', ['g1', 'g2', 'g3'], True,
+                                        chunk_size=2)),
+            {'g1': ([{'id': 'a'}], self.dt2),
+             'g2': ([{'id': 'd'}], self.dt1),
+             'g3': ([{'id': 'e'}], self.dt1)})
+
+    def test_no_cache(self):
+        """
+        Groups without cache get ``([], None)``, and all servers are returned
+        when not only getting the active ones
+        """
+        rows = [self._row('g1', '{"id": "a"}', self.dt1),
+                self._row('g1', '{"id": "b"}', self.dt1, False)]
+        seq = [parallel_sequence([[self._query(['g1', 'g2'], rows)]])]
+        self.assertEqual(
+            perform_sequence(
+                seq, get_groups_servers('tid', ['g1', 'g2'], False)),
+            {'g1': ([{'id': 'a'}, {'id': 'b'}], self.dt1),
+             'g2': ([], None)})
+
+    def test_no_groups(self):
+        """
+        Nothing is queried when there are no groups
+        """
+        self.assertEqual(
+            perform_sequence([parallel_sequence([])],
+                             get_groups_servers('tid', [], True)),
+            {})
+
+
+class ServerBlobTests(SynchronousTestCase):
+    """
+    Tests for :func:`_encode_server_blob` and :func:`_decode_server_blob`
+    """
+
+    def test_round_trip(self):
+        """
+        Servers are projected to the fields read from the cache, with only
+        the id of their image and flavor and their private addresses, and
+        are stored compressed.
+        """
+        links = [{"href": "http://nova/servers/a", "rel": "self"}]
+        server = {
+            "id": "a", "name": "s", "status": "ACTIVE",
+            "OS-EXT-STS:task_state": None,
+            "created": "2015-01-01T00:00:00Z", "updated": "now",
+            "image": {"id": "i", "links": links},
+            "flavor": {"id": "f", "links": links},
+            "links": links, "metadata": {"rax:auto_scaling_group_id": "g"},
+            "addresses": {
+                "private": [{"addr": "10.0.0.1", "version": 4}],
+                "public": [{"addr": "1.1.1.1", "version": 4}]},
+            "accessIPv4": "1.1.1.1", "key_name": None, "tenant_id": "t",
+            "OS-DCF:diskConfig": "AUTO", "hostId": "h" * 50}
+        blob = _encode_server_blob(server)
+        self.assertTrue(blob.startswith('1:'))
+        self.assertLess(len(blob), len(json.dumps(server)))
+        self.assertEqual(
+            _decode_server_blob(blob),
+            {"id": "a", "name": "s", "status": "ACTIVE",
+             "OS-EXT-STS:task_state": None,
+             "created": "2015-01-01T00:00:00Z", "updated": "now",
+             "image": {"id": "i"}, "flavor": {"id": "f"}, "links": links,
+             "metadata": {"rax:auto_scaling_group_id": "g"},
+             "addresses": {
+                 "private": [{"addr": "10.0.0.1", "version": 4}]}})
+
+    def test_missing_fields(self):
+        """
+        Fields missing from the server, or not dicts, are kept as they are
+        """
+        server = {"id": "a", "image": ""}
+        self.assertEqual(_decode_server_blob(_encode_server_blob(server)),
+                         server)
+
+    def test_plain_json(self):
+        """
+        Rows stored as plain JSON are decoded
+        """
+        self.assertEqual(_decode_server_blob('{"id": "a", "b": 2}'),
+                         {"id": "a", "b": 2})
+
+    def test_unknown_version(self):
+        """
+        ValueError is raised for rows of unknown encoding version
+        """
+        self.assertRaises(ValueError, _decode_server_blob, '2:abcd')
+
+
 class CassAdminTestCase(SynchronousTestCase):
     """
     Tests for :class:`CassAdmin`
@@ -3910,11 +5189,13 @@ class CassAdminTestCase(SynchronousTestCase):
     @mock.patch('otter.models.cass.time')
     def test_get_metrics(self, time):
         """
-        Check get_metrics returns dictionary in proper format
+        Check get_metrics returns dictionary in proper format, counting
+        resources in the tables until counts of all tenants are reconciled
         """
         time.time.return_value = 1234567890
 
         self.returns = [
+            [{'resource': 'groups', 'count': 3}],
             [{'count': 190}],
             [{'count': 191}],
             [{'count': 192}],
@@ -3951,13 +5232,36 @@ class CassAdminTestCase(SynchronousTestCase):
         self.assertEquals(result, expectedResults)
         self.connection.execute.assert_has_calls(calls)
 
+    @mock.patch('otter.models.cass.time')
+    def test_get_metrics_from_counts(self, time):
+        """
+        Metrics are the counts of all tenants once they are reconciled
+        """
+        time.time.return_value = 1234567890
+        self.returns = [[{'resource': 'groups', 'count': 190},
+                         {'resource': 'webhooks', 'count': 192},
+                         {'resource': 'reconciled', 'count': 1}]]
+        d = self.collection.get_metrics(self.mock_log)
+        self.assertEqual(
+            self.successResultOf(d),
+            [{'id': 'otter.metrics.groups', 'value': 190,
+              'time': 1234567890},
+             {'id': 'otter.metrics.policies', 'value': 0,
+              'time': 1234567890},
+             {'id': 'otter.metrics.webhooks', 'value': 192,
+              'time': 1234567890}])
+        self.connection.execute.assert_called_once_with(
+            'SELECT resource, count FROM resource_counts '
+            'WHERE "tenantId"=:tenantId;',
+            {'tenantId': '*'}, ConsistencyLevel.ONE)
+
 
 class GetScalingGroupsTests(SynchronousTestCase):
     """Tests for ``get_all_valid_groups``."""
 
     @mock.patch("otter.models.cass.CassScalingGroupCollection"
-                ".get_scaling_group_rows")
-    def test_success(self, mock_gsgr):
+                ".scan_scaling_group_rows")
+    def test_success(self, mock_scan):
         clock = Clock()
         client = mock.Mock(spec=CQLClient)
         collection = CassScalingGroupCollection(client, clock, 1)
@@ -3970,10 +5274,44 @@ class GetScalingGroupsTests(SynchronousTestCase):
             {'created_at': '0', 'desired': 'some', 'deleting': 'True', },
             {'created_at': '0', 'desired': 'some', 'status': 'ERROR'}]
         rows = [assoc(row, "tenantId", "t1") for row in rows]
-        mock_gsgr.return_value = defer.succeed(rows)
-        results = self.successResultOf(collection.get_all_valid_groups())
+
+        def scan(consumer, **kwargs):
+            consumer(rows[:4])
+            consumer(rows[4:])
+            return defer.succeed(None)
+
+        mock_scan.side_effect = scan
+        results = self.successResultOf(collection.get_all_valid_groups(
+            props=['desired'], ranges=4, concurrency=2))
         self.assertEqual(results, [rows[0], rows[3], rows[4], rows[6]])
-        mock_gsgr.assert_called_once_with()
+        mock_scan.assert_called_once_with(
+            mock.ANY, props=['desired'], page_size=100, ranges=4,
+            concurrency=2)
+
+    @mock.patch("otter.models.cass.CassScalingGroupCollection"
+                ".scan_scaling_group_rows")
+    def test_scan_valid_groups(self, mock_scan):
+        """
+        ``scan_valid_groups`` gives the valid groups of each page to the
+        consumer as the page is read, and waits for the consumer
+        """
+        collection = CassScalingGroupCollection(
+            mock.Mock(spec=CQLClient), Clock(), 1)
+        rows = [{'created_at': '0', 'desired': 1, 'tenantId': 't1'},
+                {'desired': 1, 'tenantId': 't1'}]
+        consumed = defer.Deferred()
+        pages = []
+
+        def consumer(page):
+            pages.append(page)
+            return consumed
+
+        mock_scan.side_effect = lambda consumer, **kwargs: consumer(rows)
+        d = collection.scan_valid_groups(consumer, ranges=2)
+        self.assertEqual(pages, [rows[:1]])
+        self.assertNoResult(d)
+        consumed.callback(None)
+        self.successResultOf(d)
 
 
 class GetScalingGroupRowsTests(SynchronousTestCase):
@@ -4076,3 +5414,113 @@ class GetScalingGroupRowsTests(SynchronousTestCase):
             {'limit': 5, 'tenantId': 2}, [])
         d = self.collection.get_scaling_group_rows(batch_size=5)
         self.assertEqual(list(self.successResultOf(d)), groups1 + groups2)
+
+
+class ScanScalingGroupRowsTests(SynchronousTestCase):
+    """Tests for ``scan_scaling_group_rows``."""
+
+    def setUp(self):
+        """Mock client returning Deferreds of each query"""
+        self.client = mock.Mock(spec=CQLClient)
+        self.collection = CassScalingGroupCollection(self.client, Clock(), 1)
+        self.results = {}
+        self.client.execute.side_effect = (
+            lambda query, params, c: self.results[freeze((query, params))])
+        self.select = 'SELECT groupId,tenantId FROM scaling_group '
+        self.where_key = ('WHERE "tenantId"=:tenantId AND "groupId">:groupId'
+                          ' LIMIT :limit;')
+        self.pages = []
+
+    def test_token_ranges(self):
+        """
+        The token ring is split into contiguous ranges of about equal size
+        """
+        ranges = _token_ranges(4)
+        self.assertEqual(ranges[0][0], -(1 << 63))
+        self.assertEqual(ranges[-1][1], (1 << 63) - 1)
+        self.assertEqual([r[1] for r in ranges[:-1]],
+                         [r[0] for r in ranges[1:]])
+        self.assertEqual(
+            set(end - start for start, end in ranges[:-1]),
+            set([((1 << 64) - 1) // 4]))
+        self.assertEqual(_token_ranges(1), [(-(1 << 63), (1 << 63) - 1)])
+
+    def test_ranges_scanned_concurrently(self):
+        """
+        Each token range is scanned with token bounds, up to ``concurrency``
+        at a time, and pages are given to the consumer as they are read
+        """
+        (_, mid), _ = _token_ranges(2)
+        first = defer.Deferred()
+        self.results[freeze((
+            self.select + 'WHERE token("tenantId") <= :end LIMIT :limit;',
+            {'limit': 2, 'end': mid}))] = first
+        self.results[freeze((
+            self.select + 'WHERE token("tenantId") > :start LIMIT :limit;',
+            {'limit': 2, 'start': mid}))] = defer.succeed(
+                [{'tenantId': 't2', 'groupId': 'g1'}])
+        self.results[freeze((
+            self.select + self.where_key,
+            {'limit': 2, 'tenantId': 't1', 'groupId': 'g2'}))] = (
+                defer.succeed([]))
+        self.results[freeze((
+            self.select + 'WHERE token("tenantId") > token(:tenantId) AND '
+            'token("tenantId") <= :end LIMIT :limit;',
+            {'limit': 2, 'tenantId': 't1', 'end': mid}))] = defer.succeed([])
+
+        d = self.collection.scan_scaling_group_rows(
+            self.pages.append, props=['tenantId', 'groupId'], page_size=2,
+            ranges=2, concurrency=1)
+        self.assertEqual(self.client.execute.call_count, 1)
+        first.callback([{'tenantId': 't1', 'groupId': 'g1'},
+                        {'tenantId': 't1', 'groupId': 'g2'}])
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(
+            self.pages,
+            [[{'tenantId': 't1', 'groupId': 'g1'},
+              {'tenantId': 't1', 'groupId': 'g2'}],
+             [], [], [{'tenantId': 't2', 'groupId': 'g1'}]])
+
+    def test_consumer_backpressure(self):
+        """
+        The next page of a range is read once the Deferred returned by the
+        consumer fires
+        """
+        self.results[freeze((self.select + ' LIMIT :limit;',
+                             {'limit': 2}))] = defer.succeed(
+            [{'tenantId': 't1', 'groupId': 'g1'},
+             {'tenantId': 't1', 'groupId': 'g2'}])
+        self.results[freeze((
+            self.select + self.where_key,
+            {'limit': 2, 'tenantId': 't1', 'groupId': 'g2'}))] = (
+                defer.succeed([{'tenantId': 't1', 'groupId': 'g3'}]))
+        self.results[freeze((
+            self.select + 'WHERE token("tenantId") > token(:tenantId)'
+            ' LIMIT :limit;',
+            {'limit': 2, 'tenantId': 't1'}))] = defer.succeed([])
+        consumed = []
+
+        def consumer(rows):
+            consumed.append(defer.Deferred())
+            return consumed[-1]
+
+        d = self.collection.scan_scaling_group_rows(
+            consumer, props=['tenantId', 'groupId'], page_size=2)
+        self.assertEqual((len(consumed), self.client.execute.call_count),
+                         (1, 1))
+        consumed[0].callback(None)
+        self.assertEqual((len(consumed), self.client.execute.call_count),
+                         (2, 2))
+        consumed[1].callback(None)
+        consumed[2].callback(None)
+        self.assertIsNone(self.successResultOf(d))
+
+    def test_error(self):
+        """
+        Errors reading rows are propagated
+        """
+        self.results[freeze((self.select + ' LIMIT :limit;',
+                             {'limit': 2}))] = defer.fail(ValueError('a'))
+        d = self.collection.scan_scaling_group_rows(
+            self.pages.append, props=['tenantId', 'groupId'], page_size=2)
+        self.failureResultOf(d, ValueError)
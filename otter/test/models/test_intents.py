@@ -11,8 +11,8 @@ from twisted.trial.unittest import SynchronousTestCase
 from otter.log.intents import get_log_dispatcher
 from otter.models.intents import (
     DeleteGroup, GetScalingGroupInfo, ModifyGroupStatePaused,
-    UpdateGroupErrorReasons, UpdateGroupStatus, UpdateServersCache,
-    get_model_dispatcher)
+    ReconcileCounts, ScanValidGroups, UpdateGroupErrorReasons,
+    UpdateGroupStatus, UpdateServersCache, get_model_dispatcher)
 from otter.models.interface import (
     GroupState, IScalingGroupCollection, ScalingGroupStatus)
 from otter.test.utils import (
@@ -170,3 +170,30 @@ class ScalingGroupIntentsTests(SynchronousTestCase):
         self.assertEqual(modified_state.paused, False)
         modified_state.paused = True
         self.assertEqual(self.state, modified_state)
+
+    def test_reconcile_counts(self):
+        """
+        Performing :obj:`ReconcileCounts` reconciles the resource counts of
+        all the tenants
+        """
+        store = mock.Mock(spec=['reconcile_all_counts'])
+        store.reconcile_all_counts.return_value = succeed(None)
+        self.assertIsNone(sync_perform(
+            self.get_dispatcher(store),
+            Effect(ReconcileCounts(['t1', 't2']))))
+        store.reconcile_all_counts.assert_called_once_with(
+            self.log, ['t1', 't2'])
+
+    def test_scan_valid_groups(self):
+        """
+        Performing :obj:`ScanValidGroups` scans the valid groups of the store
+        with the consumer
+        """
+        store = mock.Mock(spec=['scan_valid_groups'])
+        store.scan_valid_groups.return_value = succeed(None)
+        self.assertIsNone(sync_perform(
+            self.get_dispatcher(store),
+            Effect(ScanValidGroups('consumer', props=['a'], ranges=4,
+                                   concurrency=2))))
+        store.scan_valid_groups.assert_called_once_with(
+            'consumer', props=['a'], ranges=4, concurrency=2)
@@ -1,7 +1,8 @@
 """
 Tests for :mod:`otter.models.interface`
 """
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
+from datetime import datetime
 
 from twisted.trial.unittest import SynchronousTestCase
 
@@ -11,7 +12,9 @@ from otter.json_schema import model_schemas, validate
 from otter.json_schema.group_schemas import launch_config
 from otter.models.interface import (
     GroupState, IScalingGroup, IScalingGroupCollection,
-    IScalingScheduleCollection, ScalingGroupStatus)
+    IScalingScheduleCollection, ScalingGroupStatus, next_cron_occurrence,
+    next_cron_occurrences, parsed_cron)
+from otter.test.utils import patch
 
 
 class GroupStateTestCase(SynchronousTestCase):
@@ -216,6 +219,67 @@ class GroupStateTestCase(SynchronousTestCase):
         })
 
 
+class CronTests(SynchronousTestCase):
+    """
+    Tests for :func:`parsed_cron`, :func:`next_cron_occurrence` and
+    :func:`next_cron_occurrences`.
+    """
+    def setUp(self):
+        """
+        Use an empty cache of 2 entries.
+        """
+        self.crons = patch(self, 'otter.models.interface._parsed_crons',
+                           new=OrderedDict())
+        patch(self, 'otter.models.interface.CRON_CACHE_SIZE', new=2)
+
+    def test_parsed_once(self):
+        """
+        Entries are parsed once and the least recently used entry is evicted
+        from the cache.
+        """
+        itr = parsed_cron('0 * * * *')
+        self.assertIs(parsed_cron('0 * * * *'), itr)
+        parsed_cron('*/5 * * * *')
+        parsed_cron('0 * * * *')
+        parsed_cron('0 0 * * *')
+        self.assertEqual(list(self.crons), ['0 * * * *', '0 0 * * *'])
+        self.assertIs(parsed_cron('0 * * * *'), itr)
+
+    def test_invalid(self):
+        """
+        Invalid entries raise and are not cached.
+        """
+        self.assertRaises(ValueError, parsed_cron, '* * *')
+        self.assertEqual(self.crons, {})
+
+    def test_next_occurrence(self):
+        """
+        The next occurrence is computed from the given time, with a shared
+        parsed entry.
+        """
+        now = datetime(2015, 3, 4, 10, 30, 20)
+        self.assertEqual(next_cron_occurrence('0 * * * *', now),
+                         datetime(2015, 3, 4, 11, 0))
+        self.assertEqual(next_cron_occurrence('0 * * * *', now),
+                         datetime(2015, 3, 4, 11, 0))
+        self.assertEqual(
+            next_cron_occurrence('0 8 * * *', datetime(2015, 3, 4, 11, 0)),
+            datetime(2015, 3, 5, 8, 0))
+        self.assertTrue(next_cron_occurrence('0 * * * *') >
+                        datetime.utcnow())
+
+    def test_next_occurrences(self):
+        """
+        The next occurrences of distinct entries are computed once.
+        """
+        now = datetime(2015, 3, 4, 10, 30, 20)
+        self.assertEqual(
+            next_cron_occurrences(['0 * * * *', '*/5 * * * *', '0 * * * *'],
+                                  now),
+            {'0 * * * *': datetime(2015, 3, 4, 11, 0),
+             '*/5 * * * *': datetime(2015, 3, 4, 10, 35)})
+
+
 class IScalingGroupProviderMixin(object):
     """
     Mixin that tests for anything that provides
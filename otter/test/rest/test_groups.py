@@ -254,6 +254,34 @@ class GetActiveCacheTests(SynchronousTestCase):
             ConsistencyLevel.QUORUM)
 
 
+class GetActiveCachesTests(SynchronousTestCase):
+    """
+    Tests for :func:`get_active_caches`
+    """
+
+    def test_success(self):
+        """
+        Returns active servers of each group as dict keyed on id, in the
+        order of the groups, with one query for all of them
+        """
+        connection = mock.Mock(spec=CQLClient)
+        dt = datetime(1970, 1, 1)
+        connection.execute.return_value = defer.succeed(
+            [{'groupId': 'g2', 'server_blob': json.dumps({'id': 's1'}),
+              'last_update': dt, 'server_as_active': True},
+             {'groupId': 'g2', 'server_blob': json.dumps({'id': 's2'}),
+              'last_update': dt, 'server_as_active': False}])
+
+        d = groups.get_active_caches('reactor', connection, 'tid',
+                                     ['g1', 'g2'])
+        self.assertEqual(self.successResultOf(d),
+                         [{}, {'s1': {'id': 's1'}}])
+        connection.execute.assert_called_once_with(
+            mock.ANY, {"tenantId": "tid", "groupId0": "g1",
+                       "groupId1": "g2"},
+            ConsistencyLevel.QUORUM)
+
+
 class AllGroupsEndpointTestCase(RestAPITestMixin, SynchronousTestCase):
     """
     Tests for ``/{tenantId}/groups/`` endpoints (create, list)
@@ -395,7 +423,7 @@ class AllGroupsEndpointTestCase(RestAPITestMixin, SynchronousTestCase):
             "groups_links": []
         })
 
-    @mock.patch('otter.rest.groups.get_active_cache')
+    @mock.patch('otter.rest.groups.get_active_caches')
     def test_list_group_convergence(self, mock_gac):
         """
         ``list_all_scaling_groups`` returns state that has active servers
@@ -404,7 +432,7 @@ class AllGroupsEndpointTestCase(RestAPITestMixin, SynchronousTestCase):
         set_config_data({'convergence-tenants': ['11111'], 'url_root': 'root'})
         self.addCleanup(set_config_data, {})
 
-        mock_gac.return_value = defer.succeed({'s1': {'links': 'l'}})
+        mock_gac.return_value = defer.succeed([{'s1': {'links': 'l'}}])
         self.mock_store.connection = 'connection'
         self.mock_store.reactor = 'reactor'
 
@@ -420,7 +448,7 @@ class AllGroupsEndpointTestCase(RestAPITestMixin, SynchronousTestCase):
         self.assertEqual(resp['groups'][0]['state']['active'],
                          [{'id': 's1', 'links': 'l'}])
         mock_gac.assert_called_once_with(
-            'reactor', 'connection', '11111', 'one')
+            'reactor', 'connection', '11111', ['one'])
 
     def test_list_group_passes_limit_query(self):
         """
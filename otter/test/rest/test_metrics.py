@@ -7,7 +7,9 @@ import mock
 from twisted.internet import defer
 from twisted.trial.unittest import SynchronousTestCase
 
+from otter.rest.admin import OtterAdmin
 from otter.test.rest.request import AdminRestAPITestMixin
+from otter.util.metrics import MetricsRegistry
 
 
 class MetricsEndpointsTestCase(AdminRestAPITestMixin, SynchronousTestCase):
@@ -40,3 +42,22 @@ class MetricsEndpointsTestCase(AdminRestAPITestMixin, SynchronousTestCase):
         self.assertEqual(response_body, {'metrics': metrics})
 
         self.mock_store.get_metrics.assert_called_once_with(mock.ANY)
+
+
+class LocalMetricsEndpointTestCase(AdminRestAPITestMixin,
+                                   SynchronousTestCase):
+    """
+    Tests for '/metrics/local' endpoint, which contains the metrics recorded
+    in this process.
+    """
+    endpoint = '/metrics/local'
+
+    def test_local_metrics(self):
+        """
+        Returns a snapshot of the registry given to :obj:`OtterAdmin`.
+        """
+        registry = MetricsRegistry()
+        registry.increment('c', (('a', 'b'),))
+        self.root = OtterAdmin(self.mock_store, registry).app.resource()
+        response_body = json.loads(self.assert_status_code(200))
+        self.assertEqual(response_body, {'metrics': registry.snapshot()})
@@ -4,35 +4,44 @@ Tests for the otter-api tap plugin.
 
 import json
 from copy import deepcopy
+from datetime import timedelta
+
+from effect import (
+    ComposedDispatcher, Constant, Effect, Error, TypeDispatcher,
+    base_dispatcher, sync_perform, sync_performer)
 
 import mock
 
 from testtools.matchers import Contains, IsInstance
 
+from twisted.application.internet import TimerService
 from twisted.application.service import MultiService
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from twisted.internet.task import Clock
 from twisted.trial.unittest import SynchronousTestCase
 
 from otter.auth import CachingAuthenticator, SingleTenantAuthenticator
+from otter.cloud_client import TenantScope
 from otter.constants import (
     CONVERGENCE_DIRTY_DIR, ServiceType, get_service_configs)
 from otter.convergence.service import Converger
 from otter.log.cloudfeeds import CloudFeedsObserver
 from otter.log.formatters import get_fanout, set_fanout
-from otter.models.cass import CassScalingGroupCollection as OriginalStore
+from otter.models.cass import (
+    CassScalingGroupCollection as OriginalStore, PARTITION_KEYS)
 from otter.supervisor import SupervisorService, get_supervisor, set_supervisor
 from otter.tap.api import (
     HealthChecker,
     Options,
     call_after_supervisor,
     makeService,
+    push_local_metrics,
     setup_converger,
     setup_scheduler
 )
 from otter.test.test_auth import identity_config
 from otter.test.test_effect_dispatcher import full_intents
-from otter.test.utils import CheckFailure, matches, patch
+from otter.test.utils import CheckFailure, matches, mock_log, patch
 from otter.util.config import set_config_data
 from otter.util.deferredutils import DeferredPool
 from otter.util.zkpartitioner import Partitioner
@@ -276,12 +285,13 @@ class APIMakeServiceTests(SynchronousTestCase):
         self.Site = patch(self, 'otter.tap.api.Site')
         self.clientFromString = patch(self, 'otter.tap.api.clientFromString')
 
-        self.RoundRobinCassandraCluster = patch(
-            self, 'otter.tap.api.RoundRobinCassandraCluster')
+        self.PreparingCassandraCluster = patch(
+            self, 'otter.tap.api.PreparingCassandraCluster')
         self.LoggingCQLClient = patch(
             self, 'otter.tap.api.LoggingCQLClient')
         self.TimingOutCQLClient = patch(
             self, 'otter.tap.api.TimingOutCQLClient')
+        self.MetricsCQLClient = patch(self, 'otter.tap.api.MetricsCQLClient')
         self.log = patch(self, 'otter.tap.api.log')
 
         Otter_patcher = mock.patch('otter.tap.api.Otter')
@@ -381,14 +391,67 @@ class APIMakeServiceTests(SynchronousTestCase):
 
     def test_cassandra_cluster_with_endpoints_and_keyspace(self):
         """
-        makeService configures a RoundRobinCassandraCluster with the
+        makeService configures a PreparingCassandraCluster with the
         seed_endpoints and the keyspace from the config.
         """
         makeService(test_config)
-        self.RoundRobinCassandraCluster.assert_called_once_with(
+        self.PreparingCassandraCluster.assert_called_once_with(
             [self.clientFromString.return_value],
             'otter_test', disconnect_on_cancel=True)
 
+    def test_cassandra_pool(self):
+        """
+        makeService configures a TokenAwareCassandraCluster of the seed hosts
+        when ``cassandra.pool`` is in the config, and refreshes its ring
+        periodically.
+        """
+        cluster = patch(self, 'otter.tap.api.TokenAwareCassandraCluster')
+        config = deepcopy(test_config)
+        config['cassandra']['pool'] = {'max_in_flight': 10,
+                                       'speculative_delay': 0.05}
+        parent = makeService(config)
+        cluster.assert_called_once_with(
+            self.reactor, [('127.0.0.1', 9160)], 'otter_test',
+            PARTITION_KEYS, connections=2, max_in_flight=10, timeout=10,
+            down_interval=10, speculative_delay=0.05,
+            log=self.log.bind.return_value)
+        self.assertFalse(self.PreparingCassandraCluster.called)
+        self.TimingOutCQLClient.assert_called_once_with(
+            self.reactor, cluster.return_value, 10)
+        [ring_service] = [s for s in parent if isinstance(s, TimerService)]
+        self.assertEqual(ring_service.call,
+                         (cluster.return_value.refresh_ring, (), {}))
+        self.assertEqual(ring_service.step, 60)
+
+    def test_local_metrics(self):
+        """
+        makeService pushes the metrics recorded by the process to cloud
+        metrics periodically when ``metrics.local_metrics`` is set.
+        """
+        get_disp = patch(self, 'otter.tap.api.get_legacy_dispatcher')
+        config = deepcopy(test_config)
+        config['metrics'] = dict(config['metrics'], local_metrics=True,
+                                 ttl=100, tenant_id='tid', interval=30)
+        parent = makeService(config)
+        [metrics_service] = [s for s in parent
+                             if isinstance(s, TimerService)]
+        self.assertEqual(
+            metrics_service.call,
+            (push_local_metrics,
+             (get_disp.return_value, config['metrics'], 'ord',
+              self.log.bind.return_value), {}))
+        self.assertEqual(metrics_service.step, 30)
+        self.log.bind.assert_any_call(system='otter.local_metrics')
+
+    def test_no_local_metrics(self):
+        """
+        makeService does not push the metrics recorded by the process unless
+        ``metrics.local_metrics`` is set.
+        """
+        parent = makeService(test_config)
+        self.assertEqual(
+            [s for s in parent if isinstance(s, TimerService)], [])
+
     def test_cassandra_scaling_group_collection_with_cluster(self):
         """
         makeService configures a CassScalingGroupCollection with the
@@ -398,10 +461,12 @@ class APIMakeServiceTests(SynchronousTestCase):
         self.log.bind.assert_called_once_with(system='otter.silverberg')
         self.TimingOutCQLClient.assert_called_once_with(
             self.reactor,
-            self.RoundRobinCassandraCluster.return_value,
+            self.PreparingCassandraCluster.return_value,
             10)
+        self.MetricsCQLClient.assert_called_once_with(
+            self.reactor, self.TimingOutCQLClient.return_value)
         self.LoggingCQLClient.assert_called_once_with(
-            self.TimingOutCQLClient.return_value,
+            self.MetricsCQLClient.return_value,
             self.log.bind.return_value)
 
         self.assertEqual(self.store.connection,
@@ -435,6 +500,50 @@ class APIMakeServiceTests(SynchronousTestCase):
         makeService(test_config)
         self.assertEqual(self.store.max_groups, 100)
 
+    def test_config_cache(self):
+        """
+        CassScalingGroupCollection is created with a config cache whose size
+        and max age are taken from config, with defaults
+        """
+        makeService(test_config)
+        cache = self.store.config_cache
+        self.assertEqual((cache.clock, cache.size, cache.max_age),
+                         (self.reactor, 1000, 1))
+        makeService(dict(test_config,
+                         group_config_cache={'size': 10, 'max_age': 5}))
+        cache = self.store.config_cache
+        self.assertEqual((cache.size, cache.max_age), (10, 5))
+
+    def test_webhook_cache(self):
+        """
+        CassScalingGroupCollection is created with a webhook cache whose size
+        and TTLs are taken from config, with defaults
+        """
+        makeService(test_config)
+        cache = self.store.webhook_cache
+        self.assertEqual(
+            (cache.clock, cache.size, cache.ttl, cache.negative_ttl),
+            (self.reactor, 10000, 60, 5))
+        makeService(dict(test_config,
+                         webhook_cache={'size': 10, 'ttl': 30,
+                                        'negative_ttl': 1}))
+        cache = self.store.webhook_cache
+        self.assertEqual((cache.size, cache.ttl, cache.negative_ttl),
+                         (10, 30, 1))
+
+    def test_cas_modify_state(self):
+        """
+        State is modified with locks by default, and with compare-and-set if
+        configured, retrying 10 times by default
+        """
+        makeService(test_config)
+        self.assertIsNone(self.store.cas_retries)
+        makeService(dict(test_config, modify_state={'engine': 'cas'}))
+        self.assertEqual(self.store.cas_retries, 10)
+        makeService(dict(test_config,
+                         modify_state={'engine': 'cas', 'cas_retries': 3}))
+        self.assertEqual(self.store.cas_retries, 3)
+
     @mock.patch('otter.tap.api.reactor')
     @mock.patch('otter.tap.api.generate_authenticator')
     @mock.patch('otter.tap.api.SupervisorService', wraps=SupervisorService)
@@ -509,6 +618,21 @@ class APIMakeServiceTests(SynchronousTestCase):
             authenticator._authenticator._authenticator._authenticator,
             SingleTenantAuthenticator)
 
+    def test_cloudfeeds_queue(self):
+        """
+        The number of events pushed to cloud feeds at a time and queued are
+        taken from the config.
+        """
+        self.addCleanup(set_fanout, None)
+        conf = deepcopy(test_config)
+        conf['cloudfeeds'] = {'service': 'cloudFeeds', 'tenant_id': 'tid',
+                              'url': 'url', 'concurrency': 3,
+                              'max_queued': 20}
+        makeService(conf)
+        cf_observer = get_fanout().subobservers[0]
+        self.assertEqual((cf_observer.concurrency, cf_observer.max_queued),
+                         (3, 20))
+
     def test_cloudfeeds_no_setup(self):
         """
         Cloud feeds observer is not setup if it is not there in config
@@ -777,6 +901,21 @@ class SchedulerSetupTests(SynchronousTestCase):
         self.assertEqual(svc.partitioner.kz_client, self.kz_client)
         self.assertEqual(svc.partitioner.partitioner_path, '/part_path')
         self.assertEqual(svc.dispatcher, "disp")
+        self.assertIsNone(svc.timer)
+        self.assertEqual(svc.executor.concurrency, 100)
+
+    def test_lookahead(self):
+        """
+        Events are prefetched by an `EventTimer` when the scheduler
+        lookahead is configured, and executed with the configured concurrency
+        """
+        self.config['scheduler'].update({'lookahead': 30, 'concurrency': 5})
+        set_config_data(self.config)
+        svc = setup_scheduler(self.parent, "disp", self.store, self.kz_client)
+        self.assertEqual(svc.executor.concurrency, 5)
+        self.assertEqual(svc.timer.lookahead, timedelta(seconds=30))
+        self.assertIs(svc.timer.clock, reactor)
+        self.assertEqual(svc.partitioner.got_buckets, svc.timer.refresh)
 
     def test_mock_store_with_scheduler(self):
         """
@@ -788,3 +927,48 @@ class SchedulerSetupTests(SynchronousTestCase):
             setup_scheduler(self.parent, "disp", self.store, self.kz_client),
             None)
         self.assertFalse(self.store.set_scheduler_buckets.called)
+
+
+class PushLocalMetricsTests(SynchronousTestCase):
+    """
+    Tests for :func:`push_local_metrics`.
+    """
+    def setUp(self):
+        """
+        Sample metrics config and fake pushing effect.
+        """
+        self.metr_conf = {'ttl': 100, 'tenant_id': 'tid'}
+        self.add = patch(
+            self, 'otter.tap.api.add_local_metrics_to_cloud_metrics',
+            return_value=Effect(Constant('pushed')))
+        patch(self, 'otter.tap.api.local_registry', new='registry')
+        self.scopes = []
+
+        @sync_performer
+        def perform_scope(dispatcher, intent):
+            self.scopes.append(intent.tenant_id)
+            return sync_perform(dispatcher, intent.effect)
+
+        self.dispatcher = ComposedDispatcher(
+            [TypeDispatcher({TenantScope: perform_scope}), base_dispatcher])
+
+    def test_push(self):
+        """
+        The process' registry is pushed as the configured tenant.
+        """
+        log = mock_log()
+        d = push_local_metrics(self.dispatcher, self.metr_conf, 'ord', log)
+        self.assertEqual(self.successResultOf(d), 'pushed')
+        self.add.assert_called_once_with(100, 'ord', 'registry', log)
+        self.assertEqual(self.scopes, ['tid'])
+
+    def test_error_logged(self):
+        """
+        Errors pushing the metrics are logged.
+        """
+        self.add.return_value = Effect(Error(ValueError('bad')))
+        log = mock_log()
+        d = push_local_metrics(self.dispatcher, self.metr_conf, 'ord', log)
+        self.assertIsNone(self.successResultOf(d))
+        log.err.assert_called_once_with(
+            CheckFailure(ValueError), 'push-local-metrics-error')
@@ -21,6 +21,7 @@ from otter.auth import (
     ICachingAuthenticator,
     ImpersonatingAuthenticator,
     NoSuchEndpoint,
+    ServiceCatalog,
     SingleTenantAuthenticator,
     InvalidateToken,
     RetryingAuthenticator,
@@ -360,6 +361,66 @@ class HelperTests(SynchronousTestCase):
         self.assertRaises(NoSuchEndpoint, public_endpoint_url,
                           [], 'cloudServersOpenstack', 'DFW')
 
+    def test_public_endpoint_url_indexed_catalog(self):
+        """
+        ``public_endpoint_url`` looks up the URL in the index of a
+        :class:`ServiceCatalog` without scanning the services.
+        """
+        catalog = ServiceCatalog(fake_service_catalog)
+        catalog.public_urls[('cloudServersOpenStack', 'DFW')] = 'http://idx/'
+        self.assertEqual(
+            public_endpoint_url(catalog, 'cloudServersOpenStack', 'DFW'),
+            'http://idx/')
+        self.assertRaises(NoSuchEndpoint, public_endpoint_url,
+                          catalog, 'cloudLoadBalancers', 'ORD')
+
+
+class ServiceCatalogTests(SynchronousTestCase):
+    """
+    Tests for :class:`ServiceCatalog`.
+    """
+    def test_equal_to_list(self):
+        """
+        A :class:`ServiceCatalog` compares equal to the list of services it
+        was built from.
+        """
+        self.assertEqual(ServiceCatalog(fake_service_catalog),
+                         fake_service_catalog)
+
+    def test_indexes_first_public_url(self):
+        """
+        The index maps every (service name, region) pair to the first public
+        URL found for it in the catalog.
+        """
+        catalog = ServiceCatalog(fake_service_catalog + [
+            {'type': 'compute',
+             'name': 'cloudServersOpenStack',
+             'endpoints': [
+                 {'region': 'DFW', 'publicURL': 'http://dfw2.openstack/'}]}])
+        self.assertEqual(
+            catalog.public_urls,
+            {('cloudServersOpenStack', 'DFW'): 'http://dfw.openstack/',
+             ('cloudServersOpenStack', 'ORD'): 'http://ord.openstack/',
+             ('cloudLoadBalancers', 'DFW'): 'http://dfw.lbaas/'})
+
+    def test_skips_incomplete_endpoints(self):
+        """
+        Endpoints without a region, like those of global services, or without
+        a public URL are not indexed.
+        """
+        catalog = ServiceCatalog([
+            {'type': 'rax:dns',
+             'name': 'cloudDNS',
+             'endpoints': [{'publicURL': 'http://dns/', 'tenantId': 't'}]},
+            {'type': 'compute',
+             'name': 'cloudServersOpenStack',
+             'endpoints': [
+                 {'region': 'ORD', 'internalURL': 'http://internal/'},
+                 {'region': 'ORD', 'publicURL': 'http://ord.openstack/'}]}])
+        self.assertEqual(
+            catalog.public_urls,
+            {('cloudServersOpenStack', 'ORD'): 'http://ord.openstack/'})
+
 
 class SingleTenantAuthenticatorTests(SynchronousTestCase):
     """
@@ -647,7 +708,9 @@ class CachingAuthenticatorTests(SynchronousTestCase):
         """
         Configure a clock and a fake auth function.
         """
-        self.result = ('auth-token', 'catalog')
+        self.catalog2 = deepcopy(fake_service_catalog)
+        self.catalog2[0]['endpoints'].pop()
+        self.result = ('auth-token', fake_service_catalog)
         self.resps = {1: self.result}
 
         class FakeAuthenticator(object):
@@ -674,6 +737,17 @@ class CachingAuthenticatorTests(SynchronousTestCase):
         result = self.successResultOf(self.ca.authenticate_tenant(1, mock.Mock()))
         self.assertEqual(result, self.result)
 
+    def test_caches_indexed_catalog(self):
+        """
+        authenticate_tenant returns and caches the catalog as a
+        :class:`ServiceCatalog`, so the same endpoint index is reused for as
+        long as the token is cached.
+        """
+        _, catalog = self.successResultOf(self.ca.authenticate_tenant(1))
+        self.assertIsInstance(catalog, ServiceCatalog)
+        _, catalog2 = self.successResultOf(self.ca.authenticate_tenant(1))
+        self.assertIs(catalog2, catalog)
+
     def test_returns_token_from_cache(self):
         """
         authenticate_tenant returns tokens from the cache without calling
@@ -697,10 +771,10 @@ class CachingAuthenticatorTests(SynchronousTestCase):
 
         self.clock.advance(20)
 
-        self.resps[1] = ('auth-token2', 'catalog2')
+        self.resps[1] = ('auth-token2', self.catalog2)
 
         result = self.successResultOf(self.ca.authenticate_tenant(1))
-        self.assertEqual(result, ('auth-token2', 'catalog2'))
+        self.assertEqual(result, ('auth-token2', self.catalog2))
 
     def test_serialize_auth_requests(self):
         """
@@ -718,13 +792,13 @@ class CachingAuthenticatorTests(SynchronousTestCase):
         self.assertNotIdentical(d1, d2)
 
         del self.resps[1]
-        auth_d.callback(('auth-token2', 'catalog2'))
+        auth_d.callback(('auth-token2', self.catalog2))
 
         r1 = self.successResultOf(d1)
         r2 = self.successResultOf(d2)
 
         self.assertEqual(r1, r2)
-        self.assertEqual(r1, ('auth-token2', 'catalog2'))
+        self.assertEqual(r1, ('auth-token2', self.catalog2))
 
     def test_cached_value_per_tenant(self):
         """
@@ -735,11 +809,11 @@ class CachingAuthenticatorTests(SynchronousTestCase):
         self.assertEqual(r1, self.result)
 
         del self.resps[1]
-        self.resps[2] = ('auth-token2', 'catalog2')
+        self.resps[2] = ('auth-token2', self.catalog2)
 
         r2 = self.successResultOf(self.ca.authenticate_tenant(2))
 
-        self.assertEqual(r2, ('auth-token2', 'catalog2'))
+        self.assertEqual(r2, ('auth-token2', self.catalog2))
 
     def test_auth_failure_propagated_to_waiters(self):
         """
@@ -777,9 +851,10 @@ class CachingAuthenticatorTests(SynchronousTestCase):
         d = self.ca.authenticate_tenant(1)
         self.assertEqual(self.successResultOf(d), self.result)
         self.ca.invalidate(1)
-        self.resps[1] = 'r2'
+        self.resps[1] = ('auth-token2', self.catalog2)
         d = self.ca.authenticate_tenant(1)
-        self.assertEqual(self.successResultOf(d), 'r2')
+        self.assertEqual(self.successResultOf(d),
+                         ('auth-token2', self.catalog2))
 
 
 class RetryingAuthenticatorTests(SynchronousTestCase):
@@ -6,8 +6,18 @@ from twisted.internet.task import Clock
 
 from silverberg.client import ConsistencyLevel
 
-from otter.util.cqlbatch import Batch, TimingOutCQLClient
+from otter.util.cqlbatch import (
+    Batch,
+    ChunkedBatchError,
+    MetricsCQLClient,
+    TimingOutCQLClient,
+    chunk_statements,
+    chunked_batches,
+    execute_chunked,
+    padded,
+    statement_template)
 from otter.util.deferredutils import TimedOutError
+from otter.util.metrics import MetricsRegistry
 
 
 class CqlBatchTestCase(SynchronousTestCase):
@@ -74,6 +84,125 @@ class CqlBatchTestCase(SynchronousTestCase):
             expected, {}, ConsistencyLevel.QUORUM)
 
 
+class PaddedTests(SynchronousTestCase):
+    """
+    Tests for :func:`padded`
+    """
+
+    def test_padded(self):
+        """
+        The last item is repeated until the length is a power of two
+        """
+        self.assertEqual(padded([]), [])
+        self.assertEqual(padded([1]), [1])
+        self.assertEqual(padded([1, 2]), [1, 2])
+        self.assertEqual(padded([1, 2, 3]), [1, 2, 3, 3])
+        self.assertEqual(padded(range(5)), [0, 1, 2, 3, 4, 4, 4, 4])
+
+
+class ChunkStatementsTests(SynchronousTestCase):
+    """
+    Tests for :func:`chunk_statements`
+    """
+
+    def test_by_partition(self):
+        """
+        Statements are chunked by partition, in their order
+        """
+        stmts = [('p1', 'a', {}), ('p2', 'b', {}), ('p1', 'c', {})]
+        self.assertEqual(chunk_statements(stmts),
+                         [[stmts[0], stmts[2]], [stmts[1]]])
+
+    def test_partition_not_split(self):
+        """
+        All the statements of a partition are in one chunk, however many
+        there are
+        """
+        stmts = [('p', 'q' * 1000, {'a': i}) for i in range(100)]
+        self.assertEqual(chunk_statements(stmts), [stmts])
+
+
+class ChunkedBatchesTests(SynchronousTestCase):
+    """
+    Tests for :func:`chunked_batches`
+    """
+
+    def test_batches(self):
+        """
+        A padded batch is built for every chunk, with the bind variables of
+        the statements renamed, and the shared ones kept
+        """
+        query = 'DELETE FROM t WHERE k = :k AND c = :c;'
+        stmts = [('p1', query, {'c': 1}), ('p2', query, {'c': 2}),
+                 ('p1', query, {'c': 3}), ('p1', query, {'c': 4})]
+        self.assertEqual(
+            chunked_batches(stmts, {'k': 'v'}, prefix='e'),
+            [('BEGIN BATCH '
+              'DELETE FROM t WHERE k = :k AND c = :e0c; '
+              'DELETE FROM t WHERE k = :k AND c = :e1c; '
+              'DELETE FROM t WHERE k = :k AND c = :e2c; '
+              'DELETE FROM t WHERE k = :k AND c = :e3c; '
+              'APPLY BATCH;',
+              {'k': 'v', 'e0c': 1, 'e1c': 3, 'e2c': 4, 'e3c': 4}),
+             ('DELETE FROM t WHERE k = :k AND c = :e0c;',
+              {'k': 'v', 'e0c': 2})])
+
+    def test_timestamp(self):
+        """
+        Chunks are batches using the timestamp when given, even with one
+        statement
+        """
+        self.assertEqual(
+            chunked_batches([('p', 'INSERT :a', {'a': 1})], timestamp=':ts'),
+            [('BEGIN BATCH USING TIMESTAMP :ts INSERT :s0a APPLY BATCH;',
+              {'s0a': 1})])
+
+
+class ExecuteChunkedTests(SynchronousTestCase):
+    """
+    Tests for :func:`execute_chunked`
+    """
+
+    def setUp(self):
+        self.connection = mock.Mock(spec=['execute'])
+        self.results = {}
+        self.connection.execute.side_effect = (
+            lambda query, params, consistency: self.results[query])
+
+    def test_bounded_concurrency(self):
+        """
+        Up to ``concurrency`` batches are executed at a time, and their
+        results are returned in order
+        """
+        self.results = {'a': defer.Deferred(), 'b': defer.Deferred(),
+                        'c': defer.succeed(3)}
+        d = execute_chunked(self.connection, [('a', {}), ('b', {}), ('c', {})],
+                            ConsistencyLevel.ONE, concurrency=2)
+        self.assertEqual(
+            self.connection.execute.mock_calls,
+            [mock.call(q, {}, ConsistencyLevel.ONE) for q in 'ab'])
+        self.results['b'].callback(2)
+        self.assertEqual(self.connection.execute.call_count, 3)
+        self.assertNoResult(d)
+        self.results['a'].callback(1)
+        self.assertEqual(self.successResultOf(d), [1, 2, 3])
+
+    def test_partial_failures(self):
+        """
+        Every batch is executed even when some fail, and the failures of the
+        chunks are reported in :obj:`ChunkedBatchError`
+        """
+        self.results = {'a': defer.fail(ValueError('a')),
+                        'b': defer.succeed(2),
+                        'c': defer.fail(KeyError('c'))}
+        d = execute_chunked(self.connection, [('a', {}), ('b', {}), ('c', {})],
+                            ConsistencyLevel.ONE)
+        err = self.failureResultOf(d, ChunkedBatchError).value
+        self.assertEqual(err.chunks, 3)
+        self.assertEqual([(i, f.type) for i, f in err.failures],
+                         [(0, ValueError), (2, KeyError)])
+
+
 class TimingOutCQLClientTests(SynchronousTestCase):
     """
     Tests for `:py:class:TimingOutCQLClient`
@@ -114,3 +243,115 @@ class TimingOutCQLClientTests(SynchronousTestCase):
         self.assertNoResult(d)
         self.clock.advance(10)
         self.failureResultOf(d, TimedOutError)
+
+
+class StatementTemplateTests(SynchronousTestCase):
+    """
+    Tests for :func:`statement_template`
+    """
+
+    def test_simple(self):
+        """
+        Whitespace is collapsed and queries are otherwise kept
+        """
+        self.assertEqual(
+            statement_template('SELECT * FROM t\n  WHERE k = :k;'),
+            'SELECT * FROM t WHERE k = :k;')
+
+    def test_numbered_binds(self):
+        """
+        Numbers in bind variable names and literal timestamps are replaced,
+        and lists of the same bind variable are shortened
+        """
+        self.assertEqual(
+            statement_template(
+                'SELECT * FROM t WHERE k IN (:groupId0, :groupId1, '
+                ':groupId12) AND c = :c2x'),
+            'SELECT * FROM t WHERE k IN (:groupId#, ...) AND c = :c#x')
+
+    def test_batch(self):
+        """
+        Consecutive identical statements of batches are kept once
+        """
+        stmts = ['DELETE FROM t WHERE k = :event{}k;'.format(i)
+                 for i in range(4)]
+        self.assertEqual(
+            statement_template(
+                Batch(stmts + ['INSERT INTO u (a) VALUES (:a);'], {},
+                      timestamp=1234)._generate()),
+            'BEGIN BATCH USING TIMESTAMP # '
+            'DELETE FROM t WHERE k = :event#k; '
+            'INSERT INTO u (a) VALUES (:a); APPLY BATCH;')
+        self.assertEqual(
+            statement_template(
+                'BEGIN COUNTER BATCH UPDATE c SET n = n + :n0 WHERE k = :k; '
+                'UPDATE c SET n = n + :n1 WHERE k = :k; APPLY BATCH;'),
+            'BEGIN COUNTER BATCH UPDATE c SET n = n + :n# WHERE k = :k; '
+            'APPLY BATCH;')
+
+
+class MetricsCQLClientTests(SynchronousTestCase):
+    """
+    Tests for :obj:`MetricsCQLClient`
+    """
+
+    def setUp(self):
+        """
+        Sample client, clock and registry
+        """
+        self.client = mock.Mock(spec=['execute', 'disconnect'])
+        self.clock = Clock()
+        self.metrics = MetricsRegistry()
+        self.mclient = MetricsCQLClient(self.clock, self.client,
+                                        self.metrics)
+        self.labels = (('statement', 'SELECT * FROM t WHERE k = :k#;'),)
+
+    def test_success(self):
+        """
+        Latency and rows of queries are recorded by statement template, and
+        queries in flight are gauged
+        """
+        self.client.execute.return_value = d = defer.Deferred()
+        rd = self.mclient.execute('SELECT * FROM t WHERE k = :k0;',
+                                  {'k0': 1}, ConsistencyLevel.ONE)
+        self.client.execute.assert_called_once_with(
+            'SELECT * FROM t WHERE k = :k0;', {'k0': 1}, ConsistencyLevel.ONE)
+        self.assertEqual(self.metrics.snapshot()['gauges'],
+                         [{'name': 'cql.in_flight', 'value': 1,
+                           'labels': dict(self.labels)}])
+        self.clock.advance(0.02)
+        d.callback([{'a': 1}, {'a': 2}])
+        self.assertEqual(self.successResultOf(rd), [{'a': 1}, {'a': 2}])
+        histogram = self.metrics.histogram('cql.latency', self.labels)
+        self.assertEqual((histogram.count, histogram.max), (1, 0.02))
+        self.assertEqual(self.metrics.counter('cql.rows', self.labels), 2)
+        self.assertEqual(self.metrics.snapshot()['gauges'][0]['value'], 0)
+
+        self.client.execute.return_value = defer.succeed(None)
+        self.mclient.execute('SELECT * FROM t WHERE k = :k1;', {},
+                             ConsistencyLevel.ONE)
+        self.assertEqual(histogram.count, 2)
+        self.assertEqual(self.metrics.counter('cql.rows', self.labels), 2)
+
+    def test_failures(self):
+        """
+        Failed queries are counted as timeouts or errors
+        """
+        for error in [TimedOutError(1, 'q'), defer.CancelledError(),
+                      ValueError('bad')]:
+            self.client.execute.return_value = defer.fail(error)
+            self.failureResultOf(
+                self.mclient.execute('SELECT * FROM t WHERE k = :k0;', {},
+                                     ConsistencyLevel.ONE),
+                type(error))
+        self.assertEqual(self.metrics.counter('cql.timeouts', self.labels), 2)
+        self.assertEqual(self.metrics.counter('cql.errors', self.labels), 1)
+        self.assertEqual(
+            self.metrics.histogram('cql.latency', self.labels).count, 3)
+
+    def test_disconnect(self):
+        """
+        `disconnect()` is delegated to the client
+        """
+        self.client.disconnect.return_value = defer.succeed(5)
+        self.assertEqual(self.successResultOf(self.mclient.disconnect()), 5)
@@ -10,9 +10,10 @@ from twisted.internet.task import Clock
 from twisted.python.failure import Failure
 from twisted.trial.unittest import SynchronousTestCase
 
+from otter.test.utils import CheckFailure, DummyException, mock_log, patch
 from otter.util import logging_treq
 from otter.util.deferredutils import TimedOutError
-from otter.test.utils import CheckFailure, DummyException, mock_log, patch
+from otter.util.metrics import MetricsRegistry, http_labels
 
 
 class LoggingTreqTest(SynchronousTestCase):
@@ -174,6 +175,65 @@ class LoggingTreqTest(SynchronousTestCase):
         self.assertIs(self.successResultOf(d), self.response)
         self._assert_success_logging('patch', 204, 0, body='this is the body')
 
+    def test_request_uncompressed(self):
+        """
+        With ``compress=False``, the request is made with
+        :func:`logging_treq.uncompressed_request` instead of treq.
+        """
+        uncompressed = patch(
+            self, 'otter.util.logging_treq.uncompressed_request',
+            mock.MagicMock(__name__='uncompressed_request',
+                           return_value=succeed(self.response)))
+        d = logging_treq.request('get', self.url, log=self.log,
+                                 clock=self.clock, compress=False)
+        self.assertIs(self.successResultOf(d), self.response)
+        uncompressed.assert_called_once_with(
+            method='get', url=self.url,
+            headers={'x-otter-request-id': ['uuid']})
+        self.assertFalse(self.treq.request.called)
+
+    def test_metrics(self):
+        """
+        The request time, response code and bytes sent and received are
+        recorded in the metrics registry under labels derived from the URL.
+        """
+        registry = MetricsRegistry()
+        ltreq = logging_treq.LoggingTreq(metrics=registry)
+        self.response.length = 20
+        d = ltreq.request('post', 'http://host/v2/123/servers', data='data',
+                          log=self.log, clock=self.clock)
+        self.clock.advance(5)
+        self.treq.request.return_value.callback(self.response)
+        self.successResultOf(d)
+
+        labels = http_labels('host', 'POST', '/v2/123/servers')
+        self.assertEqual(labels[2], ('url', '/v2/{id}/servers'))
+        self.assertEqual(registry.histogram('http.request_time', labels).sum,
+                         5)
+        self.assertEqual(
+            registry.counter('http.responses', labels + (('code', 204),)), 1)
+        self.assertEqual(registry.counter('http.bytes_out', labels), 4)
+        self.assertEqual(registry.counter('http.bytes_in', labels), 20)
+
+    def test_metrics_given_labels(self):
+        """
+        The labels passed as ``metric_labels`` are used instead of the URL,
+        and are not passed on to treq. Errors are counted by type.
+        """
+        registry = MetricsRegistry()
+        ltreq = logging_treq.LoggingTreq(metrics=registry)
+        d = ltreq.request('get', self.url, log=self.log, clock=self.clock,
+                          metric_labels=(('l', 'v'),))
+        self.treq.request.assert_called_once_with(
+            method='get', url=self.url,
+            headers={'x-otter-request-id': ['uuid']})
+        self.treq.request.return_value.errback(Failure(DummyException('e')))
+        self.failureResultOf(d, DummyException)
+        self.assertEqual(
+            registry.snapshot()['counters'],
+            [{'name': 'http.errors', 'value': 1,
+              'labels': {'l': 'v', 'error': 'DummyException'}}])
+
     def _test_method_success(self, method):
         """
         On successful call to ``method``, response is returned and request
@@ -368,3 +428,33 @@ class LoggingTreqTest(SynchronousTestCase):
                           "{0}.{1} ({2}) is not treq.{1} ({3})"
                           .format(ltreq_instance.__name__, name, actual,
                                   expected))
+
+
+class UncompressedRequestTests(SynchronousTestCase):
+    """
+    Tests for :func:`logging_treq.uncompressed_request`.
+    """
+    def test_no_accept_encoding(self):
+        """
+        The request is made without the ``accept-encoding`` header treq
+        adds, and other headers are kept.
+        """
+        requests = []
+
+        class Agent(object):
+            def __init__(self, reactor, pool):
+                pass
+
+            def request(self, *args):
+                requests.append(args)
+                return Deferred()
+
+        patch(self, 'otter.util.logging_treq.Agent', Agent)
+        d = logging_treq.uncompressed_request(
+            'GET', 'http://host/', headers={'x-a': ['b']}, reactor=Clock(),
+            persistent=False)
+        self.assertNoResult(d)
+        [(method, url, headers, _)] = requests
+        self.assertEqual((method, url), ('GET', 'http://host/'))
+        self.assertFalse(headers.hasHeader('accept-encoding'))
+        self.assertEqual(headers.getRawHeaders('x-a'), ['b'])
@@ -24,10 +24,12 @@ from otter.auth import IAuthenticator
 from otter.cloud_client import TenantScope, service_request
 from otter.constants import ServiceType
 from otter.metrics import (
-    GetAllValidGroups,
     GroupMetrics,
     MetricsService,
     Options,
+    ReconcileCounts,
+    ScanValidGroups,
+    add_local_metrics_to_cloud_metrics,
     add_to_cloud_metrics,
     collect_metrics,
     get_all_metrics,
@@ -50,6 +52,7 @@ from otter.test.utils import (
     patch,
     resolve_effect
 )
+from otter.util.metrics import MetricsRegistry
 
 
 class GetTenantMetricsTests(SynchronousTestCase):
@@ -305,6 +308,43 @@ class UnchangedDivergentGroupsTests(SynchronousTestCase):
             [(metrics[1], 3603), (metrics[2], 7203)])
 
 
+class AddLocalMetricsToCloudMetricsTests(SynchronousTestCase):
+    """
+    Tests for :func:`add_local_metrics_to_cloud_metrics`
+    """
+
+    def test_added(self):
+        """
+        The flattened registry snapshot is added to cloud metrics.
+        """
+        registry = MetricsRegistry()
+        registry.increment('http.responses', (('code', 200),), 3)
+        registry.set_gauge('queue', 2)
+        m = {'collectionTime': 100000, 'ttlInSeconds': 200}
+        log = mock_log()
+        seq = [
+            (Func(time.time), const(100)),
+            (service_request(
+                ServiceType.CLOUD_METRICS_INGEST, "POST", "ingest",
+                data=[merge(m, {'metricValue': 3,
+                                'metricName': 'ord.http.responses.200'}),
+                      merge(m, {'metricValue': 2,
+                                'metricName': 'ord.queue'})],
+                log=log).intent, noop)
+        ]
+        eff = add_local_metrics_to_cloud_metrics(200, 'ord', registry, log)
+        self.assertIsNone(perform_sequence(seq, eff))
+
+    def test_empty(self):
+        """
+        Nothing is added if the registry is empty.
+        """
+        eff = add_local_metrics_to_cloud_metrics(
+            200, 'ord', MetricsRegistry())
+        self.assertIsNone(
+            perform_sequence([(Func(time.time), const(100))], eff))
+
+
 class CollectMetricsTests(SynchronousTestCase):
     """
     Tests for :func:`collect_metrics`
@@ -335,7 +375,10 @@ class CollectMetricsTests(SynchronousTestCase):
              "launch_config": '{"type": "launch_stack"}'},
             {"tenantId": "t2", "groupId": "g11",
              "launch_config": '{"type": "launch_server"}'}]
-        self.lc_groups = {"t1": self.groups[:2], "t2": [self.groups[-1]]}
+        self.lc_groups = {
+            "t1": [{"tenantId": "t1", "groupId": "g1"},
+                   {"tenantId": "t1", "groupId": "g2"}],
+            "t2": [{"tenantId": "t2", "groupId": "g11"}]}
 
         self.add_to_cloud_metrics = patch(
             self, 'otter.metrics.add_to_cloud_metrics',
@@ -352,7 +395,8 @@ class CollectMetricsTests(SynchronousTestCase):
                        "non-convergence-tenants": ["ct"]}
 
         self.sequence = SequenceDispatcher([
-            (GetAllValidGroups(), const(self.groups)),
+            (self.scan(), self.consume_groups),
+            (ReconcileCounts(['t1', 't2', 't3']), noop),
             (TenantScope(mock.ANY, "tid"),
              nested_sequence([
                  (("atcm", 200, "r", "metrics", 2, self.config,
@@ -362,10 +406,27 @@ class CollectMetricsTests(SynchronousTestCase):
         self.get_dispatcher = patch(self, "otter.metrics.get_dispatcher",
                                     return_value=self.sequence)
 
+    def scan(self, ranges=16, concurrency=4):
+        """
+        Return the intent scanning the groups
+        """
+        return ScanValidGroups(
+            mock.ANY, props=('tenantId', 'groupId', 'desired', 'status',
+                             'launch_config', 'created_at', 'deleting'),
+            ranges=ranges, concurrency=concurrency)
+
+    def consume_groups(self, intent):
+        """
+        Give the groups to the consumer of the scan in two pages
+        """
+        intent.consumer(self.groups[:2])
+        intent.consumer(self.groups[2:])
+
     def test_metrics_collected(self):
         """
-        Metrics is collected after getting groups from cass and servers
-        from nova and it is added to blueflood
+        Metrics is collected after getting groups from cass page by page and
+        servers from nova and it is added to blueflood. Only the properties
+        needed are kept of the launch_server groups.
         """
         _reactor = mock.Mock()
 
@@ -379,6 +440,29 @@ class CollectMetricsTests(SynchronousTestCase):
             _print=False)
         self.client.disconnect.assert_called_once_with()
 
+    def test_scan_settings(self):
+        """
+        Groups are scanned in the token ranges and with the concurrency given
+        in the metrics config.
+        """
+        self.config['metrics'].update(scan_ranges=64, scan_concurrency=8)
+        self.sequence.sequence[0] = (self.scan(ranges=64, concurrency=8),
+                                     self.consume_groups)
+        with self.sequence.consume():
+            d = collect_metrics(mock.Mock(), self.config, self.log)
+            self.assertEqual(self.successResultOf(d), "metrics")
+
+    def test_without_reconciling_counts(self):
+        """
+        Resource counts of the tenants are not reconciled if disabled in the
+        metrics config.
+        """
+        self.config['metrics']['reconcile_counts'] = False
+        del self.sequence.sequence[1]
+        with self.sequence.consume():
+            d = collect_metrics(mock.Mock(), self.config, self.log)
+            self.assertEqual(self.successResultOf(d), "metrics")
+
     def test_with_client(self):
         """
         Uses client provided and does not disconnect it before returning
@@ -407,7 +491,8 @@ class CollectMetricsTests(SynchronousTestCase):
         Doesnt add metrics to blueflood if metrics config is not there
         """
         sequence = SequenceDispatcher([
-            (GetAllValidGroups(), const(self.groups))
+            (self.scan(), self.consume_groups),
+            (ReconcileCounts(['t1', 't2', 't3']), noop)
         ])
         self.get_dispatcher.return_value = sequence
         del self.config["metrics"]
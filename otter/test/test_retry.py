@@ -5,7 +5,7 @@ import sys
 
 from effect import (
     ComposedDispatcher, Constant, Delay, Effect, Func, TypeDispatcher,
-    base_dispatcher, sync_perform)
+    base_dispatcher, sync_perform, sync_performer)
 from effect.testing import Stub
 
 import mock
@@ -16,9 +16,12 @@ from twisted.python.failure import Failure
 from twisted.trial.unittest import SynchronousTestCase
 
 from otter.test.utils import (
-    CheckFailure, CheckFailureValue, DummyException, resolve_effect)
+    CheckFailure, CheckFailureValue, DummyException, patch, resolve_effect)
+from otter.util.metrics import MetricsRegistry
+from otter.util.pure_http import Request
 from otter.util.retry import (
     Retry,
+    RetryExcept,
     ShouldDelayAndRetry,
     compose_retries,
     exponential_backoff_interval,
@@ -336,6 +339,17 @@ class CanRetryHelperTests(SynchronousTestCase):
             self.assertTrue(can_retry(Failure(exception)))
         self.assertFalse(can_retry(Failure(DummyException())))
 
+    def test_retry_except(self):
+        """
+        :obj:`RetryExcept` does not retry the given exceptions, and defers to
+        its ``can_retry`` function for other failures.
+        """
+        can_retry = RetryExcept(exceptions=(DummyException,),
+                                can_retry=retry_times(1))
+        self.assertFalse(can_retry(Failure(DummyException())))
+        self.assertTrue(can_retry(Failure(ValueError())))
+        self.assertFalse(can_retry(Failure(ValueError())))
+
     def test_compose_retries(self):
         """
         `compose_retries` returns True only if all its function returns True
@@ -494,6 +508,30 @@ class EffectfulRetryTests(SynchronousTestCase):
         result = sync_perform(self.dispatcher, Effect(retry))
         self.assertEqual(result, "final")
 
+    def test_perform_retry_counts_retries(self):
+        """
+        When the retried effect's intent has metric labels, like a labeled
+        :obj:`Request`, every retry is counted in the metrics registry under
+        those labels.
+        """
+        registry = MetricsRegistry()
+        patch(self, 'otter.util.retry.metrics_registry', new=registry)
+        func = _repeated_effect_func(
+            lambda: _raise(RuntimeError("foo")),
+            lambda: _raise(RuntimeError("foo")),
+            lambda: "final")
+
+        request = Request(method='get', url='http://x/', metric_labels=(
+            ('l', 'v'),))
+        dispatcher = ComposedDispatcher([
+            TypeDispatcher({Request: sync_performer(lambda d, i: func())}),
+            self.dispatcher])
+        retry = Retry(effect=Effect(request),
+                      should_retry=lambda e: Effect(Constant(True)))
+        result = sync_perform(dispatcher, Effect(retry))
+        self.assertEqual(result, "final")
+        self.assertEqual(registry.counter('http.retries', (('l', 'v'),)), 2)
+
 
 def get_exc_info():
     """Get the exc_info tuple representing a ZeroDivisionError('foo')"""
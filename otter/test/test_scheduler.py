@@ -3,9 +3,12 @@ Tests for :mod:`otter.scheduler`
 """
 from datetime import datetime, timedelta
 
+from kazoo.recipe.partitioner import PartitionState
+
 import mock
 
 from twisted.internet import defer
+from twisted.internet.task import Clock
 from twisted.trial.unittest import SynchronousTestCase
 
 from otter.controller import CannotExecutePolicyError
@@ -17,10 +20,14 @@ from otter.models.interface import (
     NoSuchScalingGroupError
 )
 from otter.scheduler import (
+    BucketMetrics,
+    EventExecutor,
+    EventTimer,
     SchedulerService,
     add_cron_events,
     check_events_in_bucket,
     execute_event,
+    execute_group_events,
     process_events
 )
 from otter.test.utils import (
@@ -33,6 +40,7 @@ from otter.test.utils import (
     mock_log,
     patch
 )
+from otter.util.metrics import MetricsRegistry
 
 
 class SchedulerTests(SynchronousTestCase):
@@ -194,11 +202,15 @@ class SchedulerServiceTests(SchedulerTests, DeferredFunctionMixin):
         self.scheduler_service.log.bind.assert_called_once_with(
             scheduler_run_id='transaction-id', utcnow='utcnow')
         log = self.scheduler_service.log.bind.return_value
+        executor = self.scheduler_service.executor
+        self.assertEqual(executor.concurrency, 100)
         self.assertEqual(self.check_events_in_bucket.mock_calls,
                          [mock.call(log, "disp", self.mock_store, 2,
-                                    'utcnow', 100),
+                                    'utcnow', 100, executor,
+                                    self.scheduler_service.metrics[2]),
                           mock.call(log, "disp", self.mock_store, 3,
-                                    'utcnow', 100)])
+                                    'utcnow', 100, executor,
+                                    self.scheduler_service.metrics[3])])
 
 
 class CheckEventsInBucketTests(SchedulerTests):
@@ -223,7 +235,7 @@ class CheckEventsInBucketTests(SchedulerTests):
         self.mock_store.fetch_and_delete.side_effect = _responses
         self.process_events = patch(
             self, 'otter.scheduler.process_events',
-            side_effect=lambda e, d, s, l: defer.succeed(len(e)))
+            side_effect=lambda e, d, s, l, x, m: defer.succeed(len(e)))
         self.log = mock.Mock()
 
     def test_fetch_called(self):
@@ -243,7 +255,7 @@ class CheckEventsInBucketTests(SchedulerTests):
                                    'utcnow', 100)
         self.successResultOf(d)
         self.process_events.assert_called_once_with(
-            [], "disp", self.mock_store, self.log.bind())
+            [], "disp", self.mock_store, self.log.bind(), None, None)
 
     def test_events_in_limit(self):
         """
@@ -266,7 +278,36 @@ class CheckEventsInBucketTests(SchedulerTests):
         self.mock_store.fetch_and_delete.assert_called_once_with(
             1, 'utcnow', 100)
         self.process_events.assert_called_once_with(
-            events, "disp", self.mock_store, self.log.bind())
+            events, "disp", self.mock_store, self.log.bind(), None, None)
+
+    def test_metrics(self):
+        """
+        The latency of each fetch and the time taken to drain the bucket are
+        recorded
+        """
+        clock = Clock()
+        registry = MetricsRegistry()
+        metrics = BucketMetrics(clock, 1, registry)
+        batches = [[{'tenantId': 't'}] * 100, [{'tenantId': 't'}] * 10]
+
+        def fetch_and_delete(*args):
+            clock.advance(2)
+            return defer.succeed(batches.pop(0))
+
+        self.mock_store.fetch_and_delete.side_effect = fetch_and_delete
+        clock.advance(1)
+        self.successResultOf(check_events_in_bucket(
+            self.log, "disp", self.mock_store, 1, 'now', 100, 'ex', metrics))
+        self.assertEqual(self.process_events.mock_calls[0][1][4:],
+                         ('ex', metrics))
+        labels = (('bucket', '1'),)
+        histogram = registry.histogram('scheduler.fetch_latency', labels)
+        self.assertEqual((histogram.count, histogram.max), (2, 2))
+        self.assertEqual(
+            registry.histogram('scheduler.drain_time', labels).max, 4)
+        self.assertEqual(registry.snapshot()['gauges'],
+                         [{'name': 'scheduler.events_per_second',
+                           'labels': {'bucket': '1'}, 'value': 27.5}])
 
     def test_events_process_error(self):
         """
@@ -310,11 +351,11 @@ class CheckEventsInBucketTests(SchedulerTests):
                          [mock.call(events1,
                                     "disp",
                                     self.mock_store,
-                                    self.log.bind()),
+                                    self.log.bind(), None, None),
                           mock.call(events2,
                                     "disp",
                                     self.mock_store,
-                                    self.log.bind())])
+                                    self.log.bind(), None, None)])
 
     def test_events_batch_error(self):
         """
@@ -338,9 +379,8 @@ class CheckEventsInBucketTests(SchedulerTests):
             CheckFailure(ValueError))
         self.assertEqual(self.mock_store.fetch_and_delete.mock_calls,
                          [mock.call(1, 'now', 100)] * 2)
-        self.process_events.assert_called_once_with(events, "disp",
-                                                    self.mock_store,
-                                                    self.log.bind())
+        self.process_events.assert_called_once_with(
+            events, "disp", self.mock_store, self.log.bind(), None, None)
 
     def test_events_batch_process(self):
         """
@@ -375,10 +415,311 @@ class CheckEventsInBucketTests(SchedulerTests):
                          [mock.call(1, 'now', 100)] * 3)
         self.assertEqual(self.process_events.mock_calls,
                          [mock.call(events, "disp", self.mock_store,
-                                    self.log.bind())
+                                    self.log.bind(), None, None)
                           for events in [events1, events2, events3]])
 
 
+class LookaheadSchedulerServiceTests(SchedulerTests):
+    """
+    Tests for `SchedulerService` with a lookahead
+    """
+
+    def setUp(self):
+        """
+        Scheduler service with a lookahead
+        """
+        super(LookaheadSchedulerServiceTests, self).setUp()
+
+        def pfactory(log, callable):
+            self.fake_partitioner = FakePartitioner(log, callable)
+            return self.fake_partitioner
+
+        self.clock = Clock()
+        self.scheduler_service = SchedulerService(
+            "disp", 100, self.mock_store, pfactory, clock=self.clock,
+            lookahead=30)
+
+    def test_timer(self):
+        """
+        Buckets got from the partitioner are refreshed in an `EventTimer`
+        which fires events only while the buckets are acquired
+        """
+        timer = self.scheduler_service.timer
+        self.assertEqual(
+            (timer.clock, timer.dispatcher, timer.store, timer.batchsize),
+            (self.clock, "disp", self.mock_store, 100))
+        self.assertEqual(self.fake_partitioner.got_buckets, timer.refresh)
+        self.assertIs(timer.executor, self.scheduler_service.executor)
+        self.fake_partitioner.my_buckets = [2]
+        self.assertFalse(timer.owns_bucket(2))
+        self.fake_partitioner.current_state = PartitionState.ACQUIRED
+        self.assertTrue(timer.owns_bucket(2))
+        self.assertFalse(timer.owns_bucket(3))
+
+    def test_stop(self):
+        """
+        Stopping the service forgets prefetched events
+        """
+        timer = self.scheduler_service.timer
+        timer.buckets = set([2])
+        timer.heap = [(datetime(1970, 1, 1, 0, 0, 5), (2, 'k'), {})]
+        timer._schedule()
+        self.scheduler_service.startService()
+        self.scheduler_service.stopService()
+        self.assertEqual((timer.heap, timer.buckets), ([], set()))
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class BucketMetricsTests(SynchronousTestCase):
+    """
+    Tests for `BucketMetrics`
+    """
+
+    def setUp(self):
+        """
+        Metrics of bucket 3 in a new registry
+        """
+        self.clock = Clock()
+        self.registry = MetricsRegistry()
+        self.metrics = BucketMetrics(self.clock, 3, self.registry)
+        self.labels = (('bucket', '3'),)
+
+    def test_lateness(self):
+        """
+        The time from the trigger of an event to its execution is recorded
+        """
+        self.clock.advance(12.5)
+        self.metrics.executing({'trigger': datetime(1970, 1, 1, 0, 0, 10)})
+        self.assertEqual(
+            self.registry.histogram('scheduler.lateness', self.labels).max,
+            2.5)
+
+    def test_outcomes(self):
+        """
+        Executed events are counted by outcome
+        """
+        self.metrics.executed('executed')
+        self.metrics.executed('executed')
+        self.metrics.executed('error')
+        self.assertEqual(
+            [(c['labels'], c['value'])
+             for c in self.registry.snapshot()['counters']],
+            [({'bucket': '3', 'outcome': 'error'}, 1),
+             ({'bucket': '3', 'outcome': 'executed'}, 2)])
+
+    def test_drained_immediately(self):
+        """
+        The rate of a drain that took no time is 0
+        """
+        self.metrics.drained(5, 0)
+        self.assertEqual(self.registry.snapshot()['gauges'][0]['value'], 0)
+        self.assertEqual(
+            self.registry.histogram('scheduler.drain_time', self.labels).max,
+            0)
+
+    def test_service_bucket_metrics(self):
+        """
+        `SchedulerService` keeps the metrics of each bucket, timed with its
+        clock
+        """
+        service = SchedulerService(
+            "disp", 100, None, FakePartitioner, clock=self.clock)
+        metrics = service.bucket_metrics(2)
+        self.assertIs(service.bucket_metrics(2), metrics)
+        self.assertEqual((metrics.clock, metrics.labels),
+                         (self.clock, (('bucket', '2'),)))
+
+
+class EventTimerTests(SchedulerTests):
+    """
+    Tests for `EventTimer`
+    """
+
+    def setUp(self):
+        """
+        Timer of bucket 2 with store returning events from `self.events`
+        """
+        super(EventTimerTests, self).setUp()
+        self.clock = Clock()
+        self.log = mock_log()
+        self.owned = set([2, 3])
+        self.events = {2: [], 3: []}
+        self.mock_store.fetch_events.side_effect = (
+            lambda bucket, until, size: defer.succeed(self.events[bucket]))
+        self.deletes = []
+
+        def delete_events(bucket, events):
+            self.deletes.append((bucket, events))
+            return defer.succeed(None)
+
+        self.mock_store.delete_events.side_effect = delete_events
+        self.process_events = patch(
+            self, 'otter.scheduler.process_events',
+            side_effect=lambda e, d, s, l, x, m: defer.succeed(len(e)))
+        self.timer = EventTimer(self.clock, self.log, "disp",
+                                self.mock_store, self.owned.__contains__, 30,
+                                3)
+
+    def event(self, policy_id, seconds):
+        """
+        Event of a policy triggering after some seconds from the epoch
+        """
+        return {'tenantId': 't', 'groupId': 'g', 'policyId': policy_id,
+                'trigger': datetime(1970, 1, 1) + timedelta(seconds=seconds),
+                'cron': None, 'version': 'v'}
+
+    def test_fires_at_trigger(self):
+        """
+        Events fetched within the lookahead window are deleted and executed
+        at their trigger time
+        """
+        events = [self.event('p1', 5), self.event('p2', 20)]
+        self.events[2] = events
+        self.successResultOf(self.timer.refresh([2]))
+        self.mock_store.fetch_events.assert_called_once_with(
+            2, datetime(1970, 1, 1, 0, 0, 30), 3)
+        self.clock.advance(4.9)
+        self.assertEqual(self.deletes, [])
+        self.clock.advance(0.1)
+        self.assertEqual(self.deletes, [(2, events[:1])])
+        self.process_events.assert_called_once_with(
+            events[:1], "disp", self.mock_store,
+            matches(IsBoundWith(bucket=2, scheduler_run_id='transaction-id',
+                                utcnow=datetime(1970, 1, 1, 0, 0, 5))),
+            None, None)
+        self.clock.advance(15)
+        self.assertEqual(self.deletes, [(2, events[:1]), (2, events[1:])])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_due_events_of_buckets(self):
+        """
+        Events already due are fired right away, in a batch per bucket
+        """
+        self.clock.advance(10)
+        self.events = {2: [self.event('p1', 5), self.event('p2', 10)],
+                       3: [self.event('p3', 8)]}
+        self.successResultOf(self.timer.refresh([2, 3]))
+        self.clock.advance(0)
+        self.assertEqual(self.deletes, [(2, self.events[2]),
+                                        (3, self.events[3])])
+        self.assertEqual(self.process_events.call_count, 2)
+
+    def test_known_and_claimed_events(self):
+        """
+        Events fetched again are not added twice, and claimed events are not
+        added again by fetches that may have started before they were
+        deleted
+        """
+        event = self.event('p1', 5)
+        self.events[2] = [event]
+        self.successResultOf(self.timer.refresh([2]))
+        self.successResultOf(self.timer.refresh([2]))
+        self.assertEqual(len(self.timer.heap), 1)
+
+        fetch = defer.Deferred()
+        self.mock_store.fetch_events.side_effect = lambda *a: fetch
+        self.timer.refresh([2])
+        self.clock.advance(5)
+        self.assertEqual(self.deletes, [(2, [event])])
+        fetch.callback([event])
+        self.assertEqual(self.timer.heap, [])
+
+        # a fetch started after the deletion does not return the event
+        self.mock_store.fetch_events.side_effect = (
+            lambda *a: defer.succeed([]))
+        self.successResultOf(self.timer.refresh([2]))
+        self.assertEqual(self.timer.claimed, {})
+        self.assertEqual(len(self.deletes), 1)
+
+    def test_partition_changed(self):
+        """
+        Events of buckets that are not allocated anymore are forgotten on
+        refresh and not claimed when they are due
+        """
+        self.events = {2: [self.event('p1', 5)], 3: [self.event('p3', 8)]}
+        self.successResultOf(self.timer.refresh([2, 3]))
+        self.successResultOf(self.timer.refresh([3]))
+        self.assertEqual([key for _, key, _ in self.timer.heap],
+                         [(3, self.events[3][0]['trigger'], 'p3')])
+        self.owned.remove(3)
+        self.clock.advance(10)
+        self.assertEqual(self.deletes, [])
+        self.assertEqual(self.timer.heap, [])
+        self.assertFalse(self.process_events.called)
+
+    def test_delete_fails(self):
+        """
+        Events that could not be deleted are not executed and can be fetched
+        again
+        """
+        self.events[2] = [self.event('p1', 5)]
+        self.mock_store.delete_events.side_effect = (
+            lambda *a: defer.fail(ValueError('bad')))
+        self.successResultOf(self.timer.refresh([2]))
+        self.clock.advance(5)
+        self.assertFalse(self.process_events.called)
+        self.log.err.assert_called_once_with(
+            CheckFailure(ValueError), 'sch-claim-events-err', bucket=2,
+            scheduler_run_id='transaction-id', utcnow=mock.ANY)
+        self.assertEqual(self.timer.claimed, {})
+        self.successResultOf(self.timer.refresh([2]))
+        self.assertEqual(len(self.timer.heap), 1)
+
+    def test_fetch_fails(self):
+        """
+        Failures to fetch events of a bucket are logged
+        """
+        self.mock_store.fetch_events.side_effect = (
+            lambda *a: defer.fail(ValueError('bad')))
+        self.successResultOf(self.timer.refresh([2]))
+        self.log.err.assert_called_once_with(
+            CheckFailure(ValueError), 'sch-fetch-events-err', bucket=2)
+
+    def test_truncated_fetch(self):
+        """
+        When a fetch returns a full batch, the rest of the events of the bucket
+        are fetched once the batch is claimed
+        """
+        first = [self.event('p{}'.format(i), 5) for i in range(3)]
+        rest = [self.event('p4', 5), self.event('p5', 40)]
+        self.events[2] = first
+        self.successResultOf(self.timer.refresh([2]))
+        self.events[2] = rest
+        self.clock.advance(5)
+        self.assertEqual(self.mock_store.fetch_events.call_count, 2)
+        self.clock.advance(0)
+        self.assertEqual(self.deletes, [(2, first), (2, rest[:1])])
+        self.assertEqual(self.timer.truncated, set())
+
+    def test_metrics(self):
+        """
+        Fetches of buckets are timed, and claiming and executing due events
+        of a bucket are recorded as drains
+        """
+        registry = MetricsRegistry()
+        metrics = BucketMetrics(self.clock, 2, registry)
+        self.timer.bucket_metrics = {2: metrics}.get
+        self.events[2] = [self.event('p1', 5), self.event('p2', 5)]
+        self.successResultOf(self.timer.refresh([2]))
+        self.clock.advance(5)
+        labels = (('bucket', '2'),)
+        self.assertEqual(
+            registry.histogram('scheduler.fetch_latency', labels).count, 1)
+        self.assertEqual(
+            registry.histogram('scheduler.drain_time', labels).count, 1)
+        self.assertIs(self.process_events.mock_calls[0][1][5], metrics)
+
+    def test_stop(self):
+        """
+        `stop` forgets the events and cancels firing them
+        """
+        self.events[2] = [self.event('p1', 5)]
+        self.successResultOf(self.timer.refresh([2]))
+        self.timer.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(self.timer.heap, [])
+
+
 class ProcessEventsTests(SchedulerTests):
     """
     Tests for `process_events`.
@@ -415,18 +756,127 @@ class ProcessEventsTests(SchedulerTests):
         Test success path: Logs number of events, calls `execute_event` on
         each event and calls `add_cron_events.`
         """
-        events = range(10)
+        events = [{'tenantId': 't', 'groupId': 'g{}'.format(i)}
+                  for i in range(10)]
         d = process_events(events, "disp", self.mock_store, self.log)
         self.assertEqual(self.successResultOf(d), 10)
         self.log.msg.assert_called_once_with(
             'Processing {num_events} events', num_events=10)
         self.assertEqual(
             self.execute_event.mock_calls,
-            [mock.call("disp", self.mock_store, self.log, event, set())
+            [mock.call("disp", self.mock_store, self.log, event, set(),
+                       None)
              for event in events])
         self.add_cron_events.assert_called_once_with(
             self.mock_store, self.log, events, set())
 
+    def test_executor(self):
+        """
+        Events are executed through the executor when given, and cron events
+        are added once they are all executed
+        """
+        events = [{'tenantId': 't{}'.format(i), 'groupId': 'g'}
+                  for i in range(3)]
+        executions = [defer.Deferred() for _ in events]
+        self.execute_event.side_effect = executions
+        executor = EventExecutor(2)
+        d = process_events(events, "disp", self.mock_store, self.log,
+                           executor)
+        self.assertEqual(len(self.execute_event.mock_calls), 2)
+        executions[0].callback(None)
+        self.assertEqual(
+            self.execute_event.mock_calls,
+            [mock.call("disp", self.mock_store, self.log, event, set(),
+                       None)
+             for event in events])
+        executions[1].callback(None)
+        self.assertNoResult(d)
+        executions[2].callback(None)
+        self.assertEqual(self.successResultOf(d), 3)
+        self.add_cron_events.assert_called_once_with(
+            self.mock_store, self.log, events, set())
+
+    def test_same_group(self):
+        """
+        Events of the same group are executed together, in order
+        """
+        execute_group_events = patch(
+            self, 'otter.scheduler.execute_group_events',
+            return_value=defer.succeed(None))
+        events = [{'tenantId': 't', 'groupId': g, 'policyId': p}
+                  for g, p in [('g1', 'p1'), ('g2', 'p2'), ('g1', 'p3')]]
+        d = process_events(events, "disp", self.mock_store, self.log)
+        self.assertEqual(self.successResultOf(d), 3)
+        execute_group_events.assert_called_once_with(
+            "disp", self.mock_store, self.log, [events[0], events[2]], set(),
+            None)
+        self.execute_event.assert_called_once_with(
+            "disp", self.mock_store, self.log, events[1], set(), None)
+
+
+class EventExecutorTests(SynchronousTestCase):
+    """
+    Tests for `EventExecutor`
+    """
+
+    def setUp(self):
+        """
+        Executor of 2 events at a time, recording calls
+        """
+        self.executor = EventExecutor(2)
+        self.calls = []
+
+    def call(self, name):
+        """
+        Record the call and return a Deferred that fires when it is finished
+        """
+        d = defer.Deferred()
+        self.calls.append((name, d))
+        return d
+
+    def test_concurrency(self):
+        """
+        At most `concurrency` calls are in progress, and queued calls are
+        started as the others finish, with their results returned
+        """
+        results = [self.executor.execute('t1', self.call, i)
+                   for i in range(3)]
+        self.assertEqual([name for name, _ in self.calls], [0, 1])
+        self.assertEqual((self.executor.running, self.executor.queued),
+                         (2, 1))
+        self.calls[1][1].callback('r1')
+        self.assertEqual(self.successResultOf(results[1]), 'r1')
+        self.assertEqual([name for name, _ in self.calls], [0, 1, 2])
+        self.calls[0][1].errback(ValueError('bad'))
+        self.failureResultOf(results[0], ValueError)
+        self.calls[2][1].callback('r2')
+        self.assertEqual(self.successResultOf(results[2]), 'r2')
+        self.assertEqual((self.executor.running, self.executor.queued),
+                         (0, 0))
+
+    def test_tenants_in_turn(self):
+        """
+        Queued calls of tenants are started in turn
+        """
+        for name in ['a1', 'a2', 'a3', 'a4', 'a5']:
+            self.executor.execute('a', self.call, name)
+        for name in ['b1', 'b2']:
+            self.executor.execute('b', self.call, name)
+        self.executor.execute('c', self.call, 'c1')
+        for _, d in self.calls:
+            d.callback(None)
+        self.assertEqual([name for name, _ in self.calls],
+                         ['a1', 'a2', 'a3', 'b1', 'c1', 'a4', 'b2', 'a5'])
+
+    def test_synchronous(self):
+        """
+        Many calls finishing synchronously do not recurse
+        """
+        results = [self.executor.execute('t', lambda i: i, i)
+                   for i in range(5000)]
+        self.assertEqual(self.successResultOf(results[-1]), 4999)
+        self.assertEqual(self.executor.running, 0)
+
 
 class AddCronEventsTests(SchedulerTests):
     """
@@ -435,13 +885,20 @@ class AddCronEventsTests(SchedulerTests):
 
     def setUp(self):
         """
-        Mock store.add_cron_events and next_cron_occurrence.
+        Mock store.add_cron_events and next_cron_occurrences.
         """
         super(AddCronEventsTests, self).setUp()
         self.mock_store.add_cron_events.return_value = defer.succeed(None)
-        self.next_cron_occurrence = patch(
-            self, 'otter.scheduler.next_cron_occurrence',
-            return_value='next')
+        self.crons = []
+
+        def next_cron_occurrences(crons):
+            crons = list(crons)
+            self.crons.append(crons)
+            return dict((cron, 'next ' + cron) for cron in crons)
+
+        self.next_cron_occurrences = patch(
+            self, 'otter.scheduler.next_cron_occurrences',
+            side_effect=next_cron_occurrences)
         self.log = mock_log()
 
     def test_no_events(self):
@@ -451,7 +908,7 @@ class AddCronEventsTests(SchedulerTests):
         d = add_cron_events(self.mock_store, self.log, [], set())
         self.assertIsNone(d)
         self.assertFalse(self.log.msg.called)
-        self.assertFalse(self.next_cron_occurrence.called)
+        self.assertFalse(self.next_cron_occurrences.called)
         self.assertFalse(self.mock_store.add_cron_events.called)
 
     def test_no_events_to_add(self):
@@ -469,32 +926,35 @@ class AddCronEventsTests(SchedulerTests):
                             set(['pol4{}'.format(i) for i in range(3)]))
         self.assertIsNone(d)
         self.assertFalse(self.log.msg.called)
-        self.assertFalse(self.next_cron_occurrence.called)
+        self.assertEqual(self.crons, [[]])
         self.assertFalse(self.mock_store.add_cron_events.called)
 
     def test_store_add_cron_called(self):
         """
         Updates cron events for non-deleted policies by calling
-        store.add_cron_events.
+        store.add_cron_events, with next occurrences of their cron entries
+        computed once per batch.
         """
         events = [{'tenantId': '1234',
                    'groupId': 'scal44',
                    'policyId': 'pol4{}'.format(i),
                    'trigger': 'now',
-                   'cron': '*',
+                   'cron': '* {}'.format(i % 2),
                    'bucket': 1}
                   for i in range(10)]
         deleted_policy_ids = set(['pol41', 'pol45'])
         new_events = events[:]
         new_events.pop(1)
         new_events.pop(4)
-        [event.update({'trigger': 'next'}) for event in new_events]
+        [event.update({'trigger': 'next ' + event['cron']})
+         for event in new_events]
 
         d = add_cron_events(
             self.mock_store, self.log, events, deleted_policy_ids)
 
         self.assertIsNone(self.successResultOf(d), None)
-        self.assertEqual(self.next_cron_occurrence.call_count, 8)
+        self.assertEqual(self.next_cron_occurrences.call_count, 1)
+        self.assertEqual(self.crons, [[e['cron'] for e in new_events]])
         self.mock_store.add_cron_events.assert_called_once_with(new_events)
 
 
@@ -565,6 +1025,30 @@ class ExecuteEventTests(SchedulerTests):
         self.assertEqual(self.new_state, 'newstate')
         self.assertEqual(len(del_pol_ids), 0)
 
+    def test_metrics(self):
+        """
+        The lateness and outcome of executions are recorded
+        """
+        clock = Clock()
+        clock.advance(3)
+        registry = MetricsRegistry()
+        metrics = BucketMetrics(clock, 1, registry)
+        errors = [None, CannotExecutePolicyError('t', 'g', 'p', 'w'),
+                  NoSuchPolicyError('t', 'g', 'p'), ValueError('bad')]
+        for error in errors:
+            self.mock_mt.side_effect = (
+                lambda *_, **__: defer.succeed(None) if error is None
+                else defer.fail(error))
+            self.assertIsNone(self.successResultOf(execute_event(
+                "disp", self.mock_store, self.log, self.event, set(),
+                metrics)))
+        self.assertEqual(
+            dict((c['labels']['outcome'], c['value'])
+                 for c in registry.snapshot()['counters']),
+            {'executed': 1, 'cannot_execute': 1, 'deleted': 1, 'error': 1})
+        lateness = registry.histogram('scheduler.lateness', (('bucket', '1'),))
+        self.assertEqual((lateness.count, lateness.max), (4, 3))
+
     def test_deleted_group_event(self):
         """This event's group has been deleted.
 
@@ -631,3 +1115,145 @@ class ExecuteEventTests(SchedulerTests):
         self.log.err.assert_called_with(
             CheckFailure(ValueError), "sch-exec-pol-err", cloud_feed=True,
             **self.log_args)
+
+
+class ExecuteGroupEventsTests(SchedulerTests):
+    """
+    Tests for `execute_group_events`.
+    """
+
+    def setUp(self):
+        """
+        Mock execution of scaling policies on a state listing the executed
+        policies.
+        """
+        super(ExecuteGroupEventsTests, self).setUp()
+        self.mock_group = iMock(IScalingGroup)
+        self.mock_store.get_scaling_group.return_value = self.mock_group
+        self.states = []
+
+        def modify_and_trigger(disp, group, logargs, modifier,
+                               modify_state_reason=None):
+            self.assertEqual((disp, group, modify_state_reason),
+                             ("disp", self.mock_group,
+                              'scheduler.execute_group_events'))
+            self.assertEqual(logargs, {'tenant_id': 't',
+                                       'scaling_group_id': 'g'})
+            d = modifier(group, [])
+            return d.addCallback(self.states.append)
+
+        self.mock_mt = patch(self, 'otter.scheduler.modify_and_trigger',
+                             side_effect=modify_and_trigger)
+        self.errors = {}
+
+        def maybe_execute(log, transaction_id, group, state, policy_id,
+                          version):
+            state.append(policy_id)
+            if policy_id in self.errors:
+                raise self.errors[policy_id]
+            return defer.succeed(state)
+
+        self.maybe_exec_policy = patch(
+            self, 'otter.scheduler.maybe_execute_scaling_policy',
+            side_effect=maybe_execute)
+        self.log = mock_log()
+        self.events = [
+            {'tenantId': 't', 'groupId': 'g', 'policyId': p,
+             'trigger': datetime(1970, 1, 1), 'cron': None, 'version': 'v'}
+            for p in ['p1', 'p2', 'p3', 'p4']]
+        self.clock = Clock()
+        self.registry = MetricsRegistry()
+        self.metrics = BucketMetrics(self.clock, 1, self.registry)
+
+    def execute(self):
+        """
+        Execute the events and return the deleted policy ids
+        """
+        deleted = set()
+        self.assertIsNone(self.successResultOf(execute_group_events(
+            "disp", self.mock_store, self.log, self.events, deleted,
+            self.metrics)))
+        return deleted
+
+    def outcomes(self):
+        """
+        Counted outcomes
+        """
+        return dict((c['labels']['outcome'], c['value'])
+                    for c in self.registry.snapshot()['counters'])
+
+    def logged(self, method, msg):
+        """
+        Policy ids of events for which ``msg`` was logged
+        """
+        return [kwargs['policy_id']
+                for args, kwargs in getattr(self.log, method).call_args_list
+                if msg in args]
+
+    def test_executed_in_order(self):
+        """
+        Policies are executed in order in one modification of the state, each
+        on the state left by the previous ones, and convergence is triggered
+        once. Policies that fail leave the state unchanged and are logged like
+        separate events.
+        """
+        self.errors = {'p2': CannotExecutePolicyError('t', 'g', 'p2', 'no'),
+                       'p3': NoSuchPolicyError('t', 'g', 'p3'),
+                       'p4': ValueError('bad')}
+        self.events.append(dict(self.events[0], policyId='p5'))
+        self.assertEqual(self.execute(), set(['p3']))
+        self.assertEqual(self.states, [['p1', 'p5']])
+        self.assertEqual(self.mock_mt.call_count, 1)
+        self.assertEqual(self.logged('msg', 'sch-exec-pol'),
+                         ['p1', 'p2', 'p3', 'p4', 'p5'])
+        self.assertEqual(self.logged('msg', 'sch-cannot-exec'), ['p2'])
+        self.assertEqual(self.logged('err', 'sch-exec-pol-err'), ['p4'])
+        self.assertEqual(self.outcomes(),
+                         {'executed': 2, 'cannot_execute': 1, 'deleted': 1,
+                          'error': 1})
+        self.assertEqual(
+            self.registry.histogram('scheduler.lateness',
+                                    (('bucket', '1'),)).count, 5)
+
+    def test_nothing_executed(self):
+        """
+        When no policy is executed, the state is not written and the
+        execution of each event is logged
+        """
+        self.errors = {
+            'p1': NoSuchPolicyError('t', 'g', 'p1'),
+            'p2': CannotExecutePolicyError('t', 'g', 'p2', 'no'),
+            'p3': CannotExecutePolicyError('t', 'g', 'p3', 'no'),
+            'p4': ValueError('bad')}
+        self.assertEqual(self.execute(), set(['p1']))
+        self.assertEqual(self.states, [])
+        self.assertEqual(self.logged('msg', 'sch-cannot-exec'), ['p2', 'p3'])
+        self.assertEqual(self.logged('err', 'sch-exec-pol-err'), ['p4'])
+
+    def test_group_deleted(self):
+        """
+        When the group does not exist, all the policies are deleted
+        """
+        self.mock_mt.side_effect = (
+            lambda *a, **k: defer.fail(NoSuchScalingGroupError('t', 'g')))
+        self.assertEqual(self.execute(), set(['p1', 'p2', 'p3', 'p4']))
+        self.assertEqual(self.outcomes(), {'deleted': 4})
+
+    def test_modification_failed(self):
+        """
+        When the state could not be modified or convergence not triggered,
+        the error is logged for every executed event
+        """
+        self.errors = {'p2': CannotExecutePolicyError('t', 'g', 'p2', 'no')}
+
+        def modify_and_trigger(disp, group, logargs, modifier, **kwargs):
+            d = modifier(group, [])
+            return d.addCallback(lambda _: defer.fail(ValueError('write')))
+
+        self.mock_mt.side_effect = modify_and_trigger
+        self.assertEqual(self.execute(), set())
+        self.assertEqual(self.logged('msg', 'sch-cannot-exec'), ['p2'])
+        self.assertEqual(self.logged('err', 'sch-exec-pol-err'),
+                         ['p1', 'p3', 'p4'])
+        self.assertEqual(self.outcomes(),
+                         {'cannot_execute': 1, 'error': 3})
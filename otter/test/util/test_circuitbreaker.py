@@ -0,0 +1,145 @@
+"""
+Tests for :mod:`otter.util.circuitbreaker`.
+"""
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.test.utils import mock_log
+from otter.util.circuitbreaker import (
+    CLOSED, CircuitBreaker, CircuitOpenError, HALF_OPEN, OPEN)
+from otter.util.metrics import MetricsRegistry
+
+
+def fail():
+    """Fail a call."""
+    raise ValueError('bad')
+
+
+class CircuitBreakerTests(SynchronousTestCase):
+    """
+    Tests for :obj:`CircuitBreaker`.
+    """
+    def setUp(self):
+        """
+        Create a circuit breaker that opens after 2 failures out of 4 calls.
+        """
+        self.clock = Clock()
+        self.log = mock_log()
+        self.metrics = MetricsRegistry()
+        self.breaker = CircuitBreaker(
+            self.clock, 'nova', window=4, min_calls=4, error_rate=0.5,
+            slow_call_time=10, reset_timeout=30, log=self.log,
+            metrics=self.metrics)
+
+    def open_circuit(self):
+        """Open the circuit with failed calls."""
+        for f in [fail, fail, lambda: 'ok', lambda: 'ok']:
+            self.breaker.run(f).addErrback(lambda f: None)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def gauge(self):
+        """Current value of the open circuit gauge."""
+        return self.metrics.snapshot()['gauges'][0]['value']
+
+    def test_closed(self):
+        """
+        While the circuit is closed, calls are made and their results
+        returned, and failures below the error rate do not open it.
+        """
+        self.assertEqual(self.successResultOf(self.breaker.run(
+            lambda a, b=0: a + b, 1, b=2)), 3)
+        self.failureResultOf(self.breaker.run(fail), ValueError)
+        for _ in range(4):
+            self.breaker.run(lambda: 'ok')
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.gauge(), 0)
+
+    def test_min_calls(self):
+        """
+        The circuit does not open until ``min_calls`` outcomes are known.
+        """
+        for _ in range(3):
+            self.failureResultOf(self.breaker.run(fail), ValueError)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.failureResultOf(self.breaker.run(fail), ValueError)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_open_fails_fast(self):
+        """
+        Once the error rate is reached, the circuit opens and calls fail with
+        :obj:`CircuitOpenError` without being made.
+        """
+        self.open_circuit()
+        calls = []
+        f = self.failureResultOf(
+            self.breaker.run(calls.append, 1), CircuitOpenError)
+        self.assertEqual(f.value, CircuitOpenError(name='nova'))
+        self.assertEqual(calls, [])
+        self.assertEqual(self.gauge(), 1)
+        self.assertEqual(
+            self.metrics.counter('circuit_breaker.rejected',
+                                 (('circuit', 'nova'),)),
+            1)
+        self.log.msg.assert_called_once_with(
+            'circuit-breaker-state-changed', circuit='nova',
+            old_state=CLOSED, new_state=OPEN)
+
+    def test_slow_calls(self):
+        """
+        Calls that succeed after ``slow_call_time`` count as failures.
+        """
+        for _ in range(2):
+            d = Deferred()
+            self.breaker.run(lambda: d)
+            self.clock.advance(10)
+            d.callback('slow')
+            self.assertEqual(self.successResultOf(d), 'slow')
+        self.breaker.run(lambda: 'ok')
+        self.breaker.run(lambda: 'ok')
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_is_failure(self):
+        """
+        Failed calls for which ``is_failure`` returns False do not count
+        against the dependency.
+        """
+        self.breaker.is_failure = lambda f: not f.check(ValueError)
+        for _ in range(4):
+            self.failureResultOf(self.breaker.run(fail), ValueError)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_open_probe_closes(self):
+        """
+        After ``reset_timeout`` a single probe call is let through, and the
+        circuit closes once it succeeds.
+        """
+        self.open_circuit()
+        self.clock.advance(30)
+        d = Deferred()
+        probe = self.breaker.run(lambda: d)
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.failureResultOf(self.breaker.run(lambda: 'ok'), CircuitOpenError)
+        d.callback('ok')
+        self.assertEqual(self.successResultOf(probe), 'ok')
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.gauge(), 0)
+        # outcomes from before the circuit opened are forgotten
+        self.failureResultOf(self.breaker.run(fail), ValueError)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_open_probe_reopens(self):
+        """
+        If the probe call fails, the circuit opens again for another
+        ``reset_timeout``.
+        """
+        self.open_circuit()
+        self.clock.advance(30)
+        self.failureResultOf(self.breaker.run(fail), ValueError)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.clock.advance(29)
+        self.failureResultOf(self.breaker.run(lambda: 'ok'), CircuitOpenError)
+        self.clock.advance(1)
+        self.assertEqual(self.successResultOf(self.breaker.run(lambda: 'ok')),
+                         'ok')
+        self.assertEqual(self.breaker.state, CLOSED)
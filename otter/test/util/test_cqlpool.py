@@ -0,0 +1,389 @@
+"""
+Tests for :mod:`otter.util.cqlpool`.
+"""
+import mock
+
+from silverberg.cassandra import ttypes
+from silverberg.client import ConsistencyLevel
+
+from twisted.internet import defer
+from twisted.internet.error import ConnectError
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.test.utils import mock_log
+from otter.util.cqlpool import (
+    HostPool,
+    TokenAwareCassandraCluster,
+    TokenRing,
+    murmur3_token,
+    routing_key,
+    tcp_address)
+from otter.util.deferredutils import TimedOutError
+from otter.util.metrics import MetricsRegistry
+
+
+class FakeClient(object):
+    """
+    CQL client whose queries are answered by the test.
+    """
+    def __init__(self, address):
+        self.address = address
+        self.queries = []
+        self.disconnected = False
+
+    def execute(self, query, params, consistency):
+        d = defer.Deferred()
+        self.queries.append((query, params, d))
+        return d
+
+    def disconnect(self):
+        self.disconnected = True
+        return defer.succeed(None)
+
+
+class Cluster(TokenAwareCassandraCluster):
+    """
+    Cluster of :obj:`FakeClient`, with one connection per host.
+    """
+    def _make_client(self, address, port):
+        return FakeClient(address)
+
+    def queries(self, address):
+        """Return the queries sent to a host."""
+        return self._pools[address].clients[0].queries
+
+
+class MurmurTokenTests(SynchronousTestCase):
+    """
+    Tests for :func:`murmur3_token`.
+    """
+    def test_tokens(self):
+        """
+        Tokens are the ones Cassandra's Murmur3Partitioner computes, with
+        keys having full blocks and tails of bytes with the high bit set.
+        """
+        for key, token in [
+                ('', 0),
+                ('123', -7468325962851647638),
+                ('\x00\xff\x10\xfa\x99' * 10, 5837342703291459765),
+                ('\xfe' * 8, -8927430733708461935),
+                ('\x10' * 8, 1446172840243228796)]:
+            self.assertEqual(murmur3_token(key), token)
+
+
+class RoutingKeyTests(SynchronousTestCase):
+    """
+    Tests for :func:`routing_key`.
+    """
+    def test_single_column(self):
+        """
+        A key of one column is the serialized value of the column.
+        """
+        self.assertEqual(
+            routing_key([('bucket', 'Int32Type')], {'bucket': 2, 'a': 3}),
+            '\x00\x00\x00\x02')
+
+    def test_composite(self):
+        """
+        A key of many columns is the length, value and a null byte of every
+        column.
+        """
+        key = routing_key(
+            [('tenantId', 'AsciiType'), ('groupId', 'AsciiType')],
+            {'tenantId': 't1', 'groupId': 'g1'})
+        self.assertEqual(key, '\x00\x02t1\x00\x00\x02g1\x00')
+        self.assertEqual(murmur3_token(key), -8567781149213814862)
+
+    def test_no_key(self):
+        """
+        None is returned when a value is missing or has the wrong type.
+        """
+        columns = [('tenantId', 'AsciiType')]
+        self.assertIsNone(routing_key(columns, {}))
+        self.assertIsNone(routing_key(columns, {'tenantId': 1}))
+
+
+class TokenRingTests(SynchronousTestCase):
+    """
+    Tests for :obj:`TokenRing`.
+    """
+    def test_replicas(self):
+        """
+        The replicas of a token are those of the range ending at or after
+        it, wrapping around after the last range.
+        """
+        ring = TokenRing([(100, ['b']), (-100, ['a'])])
+        self.assertEqual(ring.replicas(-200), ['a'])
+        self.assertEqual(ring.replicas(-100), ['a'])
+        self.assertEqual(ring.replicas(0), ['b'])
+        self.assertEqual(ring.replicas(200), ['a'])
+        self.assertEqual(TokenRing([]).replicas(0), [])
+
+    def test_from_thrift(self):
+        """
+        Rings are built from Thrift's token ranges, with their RPC
+        addresses when given.
+        """
+        ring = TokenRing.from_thrift([
+            ttypes.TokenRange(start_token='0', end_token='100',
+                              endpoints=['10.0.0.1'],
+                              rpc_endpoints=['1.1.1.1']),
+            ttypes.TokenRange(start_token='100', end_token='0',
+                              endpoints=['10.0.0.2'])])
+        self.assertEqual(ring.replicas(50), ['1.1.1.1'])
+        self.assertEqual(ring.replicas(-50), ['10.0.0.2'])
+
+
+class TCPAddressTests(SynchronousTestCase):
+    """
+    Tests for :func:`tcp_address`.
+    """
+    def test_address(self):
+        """
+        Host and port are taken from positional or keyword arguments.
+        """
+        self.assertEqual(tcp_address('tcp:127.0.0.1:9160'),
+                         ('127.0.0.1', 9160))
+        self.assertEqual(tcp_address('tcp:host=cass:port=9161:timeout=3'),
+                         ('cass', 9161))
+        self.assertEqual(tcp_address('tcp:9162:host=cass'), ('cass', 9162))
+
+    def test_invalid(self):
+        """
+        :obj:`ValueError` is raised for other descriptions.
+        """
+        for description in ['unix:/a', 'tcp:host', 'tcp:host:port']:
+            self.assertRaises(ValueError, tcp_address, description)
+
+
+class HostPoolTests(SynchronousTestCase):
+    """
+    Tests for :obj:`HostPool`.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.metrics = MetricsRegistry()
+        self.clients = [FakeClient('h'), FakeClient('h')]
+        self.pool = HostPool(self.clock, 'h', self.clients, 2, 5,
+                             self.metrics)
+
+    def test_in_flight(self):
+        """
+        At most ``max_in_flight`` queries are sent at a time, in turn through
+        each connection, and the others are queued.
+        """
+        ds = [self.pool.execute('q', {'i': i}, ConsistencyLevel.ONE)
+              for i in range(3)]
+        self.assertEqual([len(c.queries) for c in self.clients], [1, 1])
+        self.assertEqual(self.pool.stats(),
+                         {'in_flight': 2, 'queued': 1, 'up': True,
+                          'p50': None, 'p99': None})
+        self.clock.advance(0.02)
+        self.clients[1].queries[0][2].callback('r')
+        self.assertEqual(self.successResultOf(ds[1]), 'r')
+        self.assertEqual(self.clients[0].queries[1][1], {'i': 2})
+        self.assertEqual(self.pool.load, 2)
+        self.assertEqual(
+            self.metrics.histogram('cassandra.latency',
+                                   (('host', 'h'),)).count, 1)
+        gauges = {g['name']: g['value']
+                  for g in self.metrics.snapshot()['gauges']}
+        self.assertEqual(gauges, {'cassandra.in_flight': 2,
+                                  'cassandra.queued': 0})
+
+    def test_timeout(self):
+        """
+        Queries time out after ``timeout`` seconds.
+        """
+        d = self.pool.execute('q', {}, ConsistencyLevel.ONE)
+        self.clock.advance(5)
+        self.failureResultOf(d, TimedOutError)
+        self.assertEqual(self.pool.in_flight, 0)
+
+    def test_mark_down(self):
+        """
+        Hosts marked down are up again after the interval.
+        """
+        self.pool.mark_down(10)
+        self.assertFalse(self.pool.is_up())
+        self.assertEqual(
+            self.metrics.counter('cassandra.host_down', (('host', 'h'),)), 1)
+        self.clock.advance(10)
+        self.assertTrue(self.pool.is_up())
+
+
+class TokenAwareCassandraClusterTests(SynchronousTestCase):
+    """
+    Tests for :obj:`TokenAwareCassandraCluster`.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.metrics = MetricsRegistry()
+        self.log = mock_log()
+        self.cluster = Cluster(
+            self.clock, [('h1', 9160), ('h2', 9160)], 'otter',
+            {'t': [('k', 'AsciiType')]}, connections=1, timeout=5,
+            down_interval=10, metrics=self.metrics, log=self.log)
+        # 'a' is in the range of h2 and 'b' in the range of h1
+        self.cluster._ring = TokenRing([
+            (murmur3_token('a'), ['h2']), (murmur3_token('b'), ['h1'])])
+        self.query = 'SELECT * FROM t WHERE k=:k;'
+
+    def test_token_aware(self):
+        """
+        Queries on partitioned tables are sent to the replicas of their
+        partition.
+        """
+        self.cluster.execute(self.query, {'k': 'a'}, ConsistencyLevel.ONE)
+        self.cluster.execute(self.query, {'k': 'b'}, ConsistencyLevel.ONE)
+        self.cluster.execute('UPDATE "t" SET v=1 WHERE k=:k', {'k': 'a'},
+                             ConsistencyLevel.ONE)
+        self.assertEqual([q[1] for q in self.cluster.queries('h1')],
+                         [{'k': 'b'}])
+        self.assertEqual([q[1] for q in self.cluster.queries('h2')],
+                         [{'k': 'a'}, {'k': 'a'}])
+
+    def test_least_loaded(self):
+        """
+        Queries that can not be routed are sent to the least loaded host.
+        """
+        for _ in range(3):
+            self.cluster.execute('SELECT * FROM other;', {},
+                                 ConsistencyLevel.ONE)
+        self.cluster.execute(self.query, {}, ConsistencyLevel.ONE)
+        self.assertEqual(len(self.cluster.queries('h1')), 2)
+        self.assertEqual(len(self.cluster.queries('h2')), 2)
+
+    def test_connect_error(self):
+        """
+        Queries that could not connect are sent to the next host, and the
+        host is marked down and not preferred anymore.
+        """
+        d = self.cluster.execute('INSERT INTO t (k) VALUES (:k);', {'k': 'a'},
+                                 ConsistencyLevel.ONE)
+        self.cluster.queries('h2')[0][2].errback(ConnectError())
+        self.cluster.queries('h1')[0][2].callback('r')
+        self.assertEqual(self.successResultOf(d), 'r')
+        self.assertFalse(self.cluster._pools['h2'].is_up())
+        self.cluster.execute(self.query, {'k': 'a'}, ConsistencyLevel.ONE)
+        self.assertEqual(len(self.cluster.queries('h1')), 2)
+
+    def test_all_fail(self):
+        """
+        The failure of the last host is returned when no host can connect.
+        """
+        d = self.cluster.execute(self.query, {'k': 'a'}, ConsistencyLevel.ONE)
+        self.cluster.queries('h2')[0][2].errback(ConnectError())
+        self.cluster.queries('h1')[0][2].errback(ConnectError('last'))
+        self.assertEqual(self.failureResultOf(d, ConnectError).value.osError,
+                         'last')
+
+    def test_timeout(self):
+        """
+        Hosts on which queries time out are marked down. Reads are retried
+        on the next host, but not writes.
+        """
+        read = self.cluster.execute(self.query, {'k': 'a'},
+                                    ConsistencyLevel.ONE)
+        write = self.cluster.execute('INSERT INTO t (k) VALUES (:k);',
+                                     {'k': 'b'}, ConsistencyLevel.ONE)
+        self.clock.advance(5)
+        self.failureResultOf(write, TimedOutError)
+        self.assertNoResult(read)
+        self.assertEqual(len(self.cluster.queries('h1')), 2)
+        self.cluster.queries('h1')[1][2].callback('r')
+        self.assertEqual(self.successResultOf(read), 'r')
+        self.assertEqual(
+            self.cluster.stats(),
+            {'h1': {'in_flight': 0, 'queued': 0, 'up': False, 'p50': 0.005,
+                    'p99': 5},
+             'h2': {'in_flight': 0, 'queued': 0, 'up': False, 'p50': 5,
+                    'p99': 5}})
+
+    def test_other_errors(self):
+        """
+        Queries failing otherwise are not retried.
+        """
+        d = self.cluster.execute(self.query, {'k': 'a'}, ConsistencyLevel.ONE)
+        self.cluster.queries('h2')[0][2].errback(ValueError('bad'))
+        self.failureResultOf(d, ValueError)
+        self.assertEqual(self.cluster.queries('h1'), [])
+        self.assertTrue(self.cluster._pools['h2'].is_up())
+
+    def test_speculative_retry(self):
+        """
+        With a speculative delay, reads not answered in time are sent to the
+        next host too, and the first answer is used.
+        """
+        self.cluster._speculative_delay = 0.1
+        d = self.cluster.execute(self.query, {'k': 'a'}, ConsistencyLevel.ONE)
+        self.cluster.execute('INSERT INTO t (k) VALUES (:k);', {'k': 'a'},
+                             ConsistencyLevel.ONE)
+        self.clock.advance(0.1)
+        self.assertEqual(len(self.cluster.queries('h1')), 1)
+        self.cluster.queries('h1')[0][2].callback('fast')
+        self.assertEqual(self.successResultOf(d), 'fast')
+        self.cluster.queries('h2')[0][2].callback('slow')
+        self.assertEqual(
+            self.metrics.counter('cassandra.speculative_retries'), 1)
+        self.assertEqual(self.clock.getDelayedCalls()[0].getTime(), 5)
+
+    def test_cancel(self):
+        """
+        Cancelling a query cancels the queries sent to every host, and the
+        speculative retry not sent yet.
+        """
+        self.cluster._speculative_delay = 0.1
+        d = self.cluster.execute(self.query, {'k': 'a'}, ConsistencyLevel.ONE)
+        self.clock.advance(0.1)
+        d2 = self.cluster.execute(self.query, {'k': 'b'},
+                                  ConsistencyLevel.ONE)
+        d.cancel()
+        d2.cancel()
+        self.failureResultOf(d, defer.CancelledError)
+        self.failureResultOf(d2, defer.CancelledError)
+        self.assertTrue(all(query[2].called
+                            for host in ('h1', 'h2')
+                            for query in self.cluster.queries(host)))
+        self.assertEqual(len(self.cluster.queries('h1')), 2)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertTrue(self.cluster._pools['h2'].is_up())
+
+    def test_refresh_ring(self):
+        """
+        The ring is read from a seed, and the hosts that were not known are
+        connected to.
+        """
+        thrift = mock.Mock(spec=['describe_ring'])
+        thrift.describe_ring.return_value = defer.succeed([
+            ttypes.TokenRange(start_token='0', end_token='0',
+                              endpoints=['h3'])])
+        self.cluster._seeds[0].clients[0]._connection = (
+            lambda: defer.succeed(thrift))
+        self.successResultOf(self.cluster.refresh_ring())
+        thrift.describe_ring.assert_called_once_with('otter')
+        self.assertEqual(sorted(self.cluster._pools), ['h1', 'h2', 'h3'])
+        self.cluster.execute(self.query, {'k': 'b'}, ConsistencyLevel.ONE)
+        self.assertEqual(len(self.cluster.queries('h3')), 1)
+
+    def test_refresh_ring_error(self):
+        """
+        Errors reading the ring are logged and the ring is kept.
+        """
+        self.cluster._seeds[0].mark_down(10)
+        self.cluster._seeds[1].clients[0]._connection = (
+            lambda: defer.fail(ConnectError()))
+        self.successResultOf(self.cluster.refresh_ring())
+        self.log.err.assert_called_once_with(
+            mock.ANY, 'Could not refresh Cassandra ring', host='h2')
+        self.assertEqual(self.cluster._ring.replicas(murmur3_token('a')),
+                         ['h2'])
+
+    def test_disconnect(self):
+        """
+        Every connection is disconnected.
+        """
+        self.successResultOf(self.cluster.disconnect())
+        self.assertTrue(all(pool.clients[0].disconnected
+                            for pool in self.cluster._pools.values()))
@@ -0,0 +1,261 @@
+"""
+Tests for :mod:`otter.util.cqlprepared`.
+"""
+from datetime import datetime
+from uuid import UUID
+
+import mock
+
+from silverberg.cassandra import Cassandra, ttypes
+from silverberg.client import ConsistencyLevel
+
+from twisted.internet import defer
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.util.cqlprepared import (
+    PreparingCQLClient,
+    PreparingCassandraCluster,
+    bind_values,
+    marshal_value)
+
+
+M = 'org.apache.cassandra.db.marshal.'
+
+
+class MarshalValueTests(SynchronousTestCase):
+    """
+    Tests for :func:`marshal_value`.
+    """
+    def test_simple_types(self):
+        """
+        Values are serialized like Cassandra does for their type.
+        """
+        uuid = UUID('7b3a9a5e-86ae-11e5-9c8a-0800200c9a66')
+        for cql_type, value, serialized in [
+                ('AsciiType', 'abc', 'abc'),
+                ('AsciiType', u'abc', 'abc'),
+                ('UTF8Type', u'\xe9', '\xc3\xa9'),
+                ('BooleanType', True, '\x01'),
+                ('BooleanType', False, '\x00'),
+                ('Int32Type', 100, '\x00\x00\x00\x64'),
+                ('LongType', -1, '\xff' * 8),
+                ('IntegerType', 0, '\x00'),
+                ('IntegerType', 127, '\x7f'),
+                ('IntegerType', 128, '\x00\x80'),
+                ('IntegerType', -129, '\xff\x7f'),
+                ('DateType', 1000, '\x00\x00\x00\x00\x00\x00\x03\xe8'),
+                ('DateType', datetime(1970, 1, 1, 0, 0, 1, 500),
+                 '\x00\x00\x00\x00\x00\x00\x03\xe8'),
+                ('TimeUUIDType', uuid, uuid.bytes),
+                ('TimeUUIDType', str(uuid), uuid.bytes),
+                ('ReversedType({}DateType)'.format(M), 1000,
+                 '\x00\x00\x00\x00\x00\x00\x03\xe8')]:
+            self.assertEqual(marshal_value(M + cql_type, value), serialized)
+
+    def test_collections(self):
+        """
+        Lists, sets and maps are serialized with the number of elements
+        followed by the length and value of each element.
+        """
+        self.assertEqual(
+            marshal_value('{0}ListType({0}UTF8Type)'.format(M), [u'a', u'bc']),
+            '\x00\x02\x00\x01a\x00\x02bc')
+        self.assertEqual(
+            marshal_value('{0}SetType({0}Int32Type)'.format(M), set([1])),
+            '\x00\x01\x00\x04\x00\x00\x00\x01')
+        self.assertEqual(
+            marshal_value('{0}MapType({0}AsciiType,{0}BooleanType)'.format(M),
+                          {'a': True}),
+            '\x00\x01\x00\x01a\x00\x01\x01')
+
+    def test_unserializable(self):
+        """
+        :obj:`ValueError` is raised for ``None``, values of the wrong type and
+        unsupported types.
+        """
+        for cql_type, value in [('AsciiType', None), ('AsciiType', 1),
+                                ('Int32Type', 'a'), ('Int32Type', 1 << 40),
+                                ('BooleanType', 1), ('DecimalType', 1),
+                                ('ListType({}Int32Type)'.format(M), 'ab')]:
+            self.assertRaises(ValueError, marshal_value, M + cql_type, value)
+
+
+class BindValuesTests(SynchronousTestCase):
+    """
+    Tests for :func:`bind_values`.
+    """
+    def test_bind_by_name(self):
+        """
+        Values are serialized in the order of the bind variables, and names
+        appearing more than once are bound every time.
+        """
+        prepared = ttypes.CqlPreparedResult(
+            itemId=1, count=3,
+            variable_names=['a', 'b', 'a'],
+            variable_types=[M + 'AsciiType', M + 'BooleanType',
+                            M + 'AsciiType'])
+        self.assertEqual(bind_values(prepared, {'a': 'x', 'b': True}),
+                         ['x', '\x01', 'x'])
+
+    def test_not_bindable(self):
+        """
+        :obj:`ValueError` is raised when a value is missing, or the variables
+        are not named.
+        """
+        prepared = ttypes.CqlPreparedResult(
+            itemId=1, count=1, variable_names=['a'],
+            variable_types=[M + 'AsciiType'])
+        self.assertRaises(ValueError, bind_values, prepared, {'b': 'x'})
+        prepared.variable_names = None
+        self.assertRaises(ValueError, bind_values, prepared, {'a': 'x'})
+
+
+class PreparingCQLClientTests(SynchronousTestCase):
+    """
+    Tests for :obj:`PreparingCQLClient`.
+    """
+    def setUp(self):
+        """
+        Create a client whose connection is a mock Thrift client.
+        """
+        self.thrift = self.thrift_client()
+        self.client = PreparingCQLClient(mock.Mock(), 'otter')
+        self.client._connection = lambda: defer.succeed(self.thrift)
+        self.query = 'SELECT a FROM t WHERE k = :k;'
+
+    def thrift_client(self):
+        """Return a mock Thrift Cassandra client."""
+        thrift = mock.Mock(spec=Cassandra.Client)
+        thrift.prepare_cql3_query.side_effect = lambda *a: defer.succeed(
+            ttypes.CqlPreparedResult(itemId=5, count=1, variable_names=['k'],
+                                     variable_types=[M + 'AsciiType']))
+        thrift.execute_prepared_cql3_query.side_effect = (
+            lambda *a: defer.succeed(
+                ttypes.CqlResult(type=ttypes.CqlResultType.VOID)))
+        thrift.execute_cql3_query.side_effect = lambda *a: defer.succeed(
+            ttypes.CqlResult(type=ttypes.CqlResultType.INT, num=3))
+        return thrift
+
+    def execute(self, params={'k': 'v'}):
+        """Execute the query and return its result."""
+        return self.successResultOf(
+            self.client.execute(self.query, params, ConsistencyLevel.ONE))
+
+    def test_prepares_once_per_connection(self):
+        """
+        A query is prepared the first time it is executed on a connection,
+        and executed by id with its values bound.
+        """
+        self.assertIsNone(self.execute())
+        self.assertIsNone(self.execute({'k': 'w'}))
+        self.thrift.prepare_cql3_query.assert_called_once_with(
+            self.query, ttypes.Compression.NONE)
+        self.assertEqual(
+            self.thrift.execute_prepared_cql3_query.mock_calls,
+            [mock.call(5, ['v'], ConsistencyLevel.ONE),
+             mock.call(5, ['w'], ConsistencyLevel.ONE)])
+
+        self.thrift = self.thrift_client()
+        self.execute()
+        self.assertEqual(self.thrift.prepare_cql3_query.call_count, 1)
+
+    def test_rows(self):
+        """
+        Rows are unmarshalled with the schema in the result.
+        """
+        self.thrift.execute_prepared_cql3_query.side_effect = None
+        self.thrift.execute_prepared_cql3_query.return_value = defer.succeed(
+            ttypes.CqlResult(
+                type=ttypes.CqlResultType.ROWS,
+                schema=ttypes.CqlMetadata(value_types={'a': M + 'UTF8Type'}),
+                rows=[ttypes.CqlRow(columns=[
+                    ttypes.Column(name='a', value='\xc3\xa9')])]))
+        self.assertEqual(self.execute(), [{'a': u'\xe9'}])
+
+    def test_unbound_values_not_prepared(self):
+        """
+        Queries without parameters, or with values that can not be bound,
+        are executed with the values in the query text.
+        """
+        self.assertEqual(self.execute({}), 3)
+        self.assertFalse(self.thrift.prepare_cql3_query.called)
+        self.assertEqual(self.execute({'k': None}), 3)
+        self.thrift.execute_cql3_query.assert_called_with(
+            'SELECT a FROM t WHERE k = null;', ttypes.Compression.NONE,
+            ConsistencyLevel.ONE)
+        self.assertFalse(self.thrift.execute_prepared_cql3_query.called)
+
+    def test_refused(self):
+        """
+        Queries that Cassandra refuses to prepare are not prepared again, and
+        are executed with the values in the query text.
+        """
+        self.thrift.prepare_cql3_query.side_effect = None
+        self.thrift.prepare_cql3_query.return_value = defer.fail(
+            ttypes.InvalidRequestException(why='no'))
+        self.assertEqual(self.execute(), 3)
+        self.assertEqual(self.execute(), 3)
+        self.assertEqual(self.thrift.prepare_cql3_query.call_count, 1)
+        self.thrift.execute_cql3_query.assert_called_with(
+            "SELECT a FROM t WHERE k = 'v';", ttypes.Compression.NONE,
+            ConsistencyLevel.ONE)
+
+    def test_unknown_id_prepared_again(self):
+        """
+        If Cassandra rejects the id of a prepared query, the query is
+        prepared again and executed once more with the new id.
+        """
+        self.execute()
+        results = [defer.fail(ttypes.InvalidRequestException(why='unknown')),
+                   defer.succeed(
+                       ttypes.CqlResult(type=ttypes.CqlResultType.INT, num=2))]
+        self.thrift.execute_prepared_cql3_query.side_effect = (
+            lambda *a: results.pop(0))
+        self.assertEqual(self.execute(), 2)
+        self.assertEqual(self.thrift.prepare_cql3_query.call_count, 2)
+        self.assertEqual(
+            self.thrift.execute_prepared_cql3_query.call_count, 3)
+
+    def test_retried_once(self):
+        """
+        A query is retried only once if its id is rejected again.
+        """
+        self.thrift.execute_prepared_cql3_query.side_effect = (
+            lambda *a: defer.fail(ttypes.InvalidRequestException(why='no')))
+        d = self.client.execute(self.query, {'k': 'v'}, ConsistencyLevel.ONE)
+        self.failureResultOf(d, ttypes.InvalidRequestException)
+        self.assertEqual(self.thrift.prepare_cql3_query.call_count, 2)
+        self.assertEqual(
+            self.thrift.execute_prepared_cql3_query.call_count, 2)
+
+    def test_disconnect_on_cancel(self):
+        """
+        When allowed, cancelling a prepared query disconnects.
+        """
+        self.client._disconnect_on_cancel = True
+        self.client.disconnect = mock.Mock()
+        self.thrift.execute_prepared_cql3_query.side_effect = (
+            lambda *a: defer.Deferred())
+        d = self.client.execute(self.query, {'k': 'v'}, ConsistencyLevel.ONE)
+        d.cancel()
+        self.failureResultOf(d, defer.CancelledError)
+        self.client.disconnect.assert_called_once_with()
+
+
+class PreparingCassandraClusterTests(SynchronousTestCase):
+    """
+    Tests for :obj:`PreparingCassandraCluster`.
+    """
+    def test_clients(self):
+        """
+        A :obj:`PreparingCQLClient` is created for every endpoint.
+        """
+        cluster = PreparingCassandraCluster(['e1', 'e2'], 'otter',
+                                            disconnect_on_cancel=True)
+        self.assertEqual(
+            [type(client) for client in cluster._seed_clients],
+            [PreparingCQLClient, PreparingCQLClient])
+        self.assertEqual(
+            [(client._keyspace, client._disconnect_on_cancel)
+             for client in cluster._seed_clients],
+            [('otter', True), ('otter', True)])
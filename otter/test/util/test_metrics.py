@@ -0,0 +1,163 @@
+"""
+Tests for :mod:`otter.util.metrics`.
+"""
+from twisted.trial.unittest import SynchronousTestCase
+
+from otter.util.metrics import (
+    Histogram,
+    MetricsRegistry,
+    flatten_snapshot,
+    http_labels,
+    url_template)
+
+
+class HistogramTests(SynchronousTestCase):
+    """
+    Tests for :obj:`Histogram`.
+    """
+    def test_empty(self):
+        """
+        An empty histogram has no percentiles or max.
+        """
+        self.assertEqual(
+            Histogram((1, 2)).snapshot(),
+            {'count': 0, 'sum': 0, 'max': None, 'p50': None, 'p90': None,
+             'p99': None, 'buckets': [[1, 0], [2, 0]]})
+
+    def test_observe(self):
+        """
+        Observed values are counted in their bucket, and the snapshot
+        contains cumulative bucket counts and estimated percentiles.
+        """
+        h = Histogram((1, 2, 5))
+        for value in [0.5] * 5 + [1.5] * 4 + [4]:
+            h.observe(value)
+        self.assertEqual(
+            h.snapshot(),
+            {'count': 10, 'sum': 12.5, 'max': 4, 'p50': 1, 'p90': 2,
+             'p99': 4, 'buckets': [[1, 5], [2, 9], [5, 10]]})
+
+    def test_overflow(self):
+        """
+        Values above the last bound go in an overflow bucket and percentiles
+        in it are estimated as the maximum value.
+        """
+        h = Histogram((1,))
+        h.observe(0.5)
+        h.observe(30)
+        self.assertEqual(h.percentile(50), 1)
+        self.assertEqual(h.percentile(99), 30)
+        self.assertEqual(h.snapshot()['buckets'], [[1, 1]])
+
+    def test_update(self):
+        """
+        :meth:`Histogram.update` adds the values of another histogram.
+        """
+        h1, h2 = Histogram((1, 2)), Histogram((1, 2))
+        h1.observe(0.5)
+        h2.observe(1.5)
+        h2.observe(3)
+        h1.update(h2)
+        self.assertEqual(
+            h1.snapshot(),
+            {'count': 3, 'sum': 5, 'max': 3, 'p50': 2, 'p90': 3, 'p99': 3,
+             'buckets': [[1, 1], [2, 2]]})
+        h2.update(Histogram((1, 2)))
+        self.assertEqual(h2.max, 3)
+
+
+class MetricsRegistryTests(SynchronousTestCase):
+    """
+    Tests for :obj:`MetricsRegistry`.
+    """
+    def setUp(self):
+        """
+        Create a registry.
+        """
+        self.registry = MetricsRegistry(bounds=(1, 2))
+        self.labels = (('a', 'b'),)
+
+    def test_counters(self):
+        """
+        Counters are incremented per name and labels.
+        """
+        self.registry.increment('c', self.labels)
+        self.registry.increment('c', self.labels, 5)
+        self.registry.increment('c')
+        self.assertEqual(self.registry.counter('c', self.labels), 6)
+        self.assertEqual(self.registry.counter('c'), 1)
+        self.assertEqual(self.registry.counter('d'), 0)
+
+    def test_snapshot(self):
+        """
+        The snapshot contains every counter, gauge and histogram with its
+        labels as a dict. Callable gauges are called.
+        """
+        self.registry.increment('c', self.labels)
+        self.registry.set_gauge('g', 3)
+        self.registry.set_gauge('f', lambda: 4, self.labels)
+        self.registry.observe('h', 1.5, self.labels)
+        self.assertEqual(
+            self.registry.snapshot(),
+            {'counters': [{'name': 'c', 'labels': {'a': 'b'}, 'value': 1}],
+             'gauges': [{'name': 'f', 'labels': {'a': 'b'}, 'value': 4},
+                        {'name': 'g', 'labels': {}, 'value': 3}],
+             'histograms': [
+                 {'name': 'h', 'labels': {'a': 'b'}, 'count': 1,
+                  'sum': 1.5, 'max': 1.5, 'p50': 1.5, 'p90': 1.5,
+                  'p99': 1.5, 'buckets': [[1, 0], [2, 1]]}]})
+        self.assertEqual(self.registry.histogram('h', self.labels).count, 1)
+        self.assertEqual(
+            self.registry.histograms('h'),
+            [(self.labels, self.registry.histogram('h', self.labels))])
+
+    def test_clear(self):
+        """
+        :meth:`MetricsRegistry.clear` forgets all metrics.
+        """
+        self.registry.increment('c')
+        self.registry.observe('h', 1)
+        self.registry.set_gauge('g', 1)
+        self.registry.clear()
+        self.assertEqual(self.registry.snapshot(),
+                         {'counters': [], 'gauges': [], 'histograms': []})
+
+    def test_flatten_snapshot(self):
+        """
+        :func:`flatten_snapshot` names metrics after their name and label
+        values, and reduces histograms to count, max and percentiles.
+        """
+        self.registry.increment('c', (('z', 'l2'), ('y', 'l1')))
+        self.registry.set_gauge('g', 3)
+        self.registry.observe('h', 1.5)
+        self.assertEqual(
+            sorted(flatten_snapshot(self.registry.snapshot())),
+            [('c.l1.l2', 1), ('g', 3), ('h.count', 1), ('h.max', 1.5),
+             ('h.p50', 1.5), ('h.p90', 1.5), ('h.p99', 1.5)])
+
+
+class HTTPLabelsTests(SynchronousTestCase):
+    """
+    Tests for :func:`url_template` and :func:`http_labels`.
+    """
+    def test_url_template(self):
+        """
+        Host, scheme and query are dropped and ID-like segments are replaced.
+        """
+        self.assertEqual(
+            url_template('https://dfw.servers/v2/123456/servers/'
+                         'a0b1c2d3-e4f5-a6b7-c8d9-e0f1a2b3c4d5/ips?a=b'),
+            '/v2/{id}/servers/{id}/ips')
+        self.assertEqual(
+            url_template('loadbalancers/12/nodes/3ab4f5e6a7b8c9d0'),
+            'loadbalancers/{id}/nodes/{id}')
+        self.assertEqual(url_template('servers/detail'), 'servers/detail')
+
+    def test_http_labels(self):
+        """
+        Labels contain the upper-cased method, service and URL template.
+        """
+        self.assertEqual(
+            http_labels('CLOUD_SERVERS', 'get', 'servers/12'),
+            (('method', 'GET'), ('service', 'CLOUD_SERVERS'),
+             ('url', 'servers/{id}')))
@@ -82,6 +82,24 @@ class RequestEffectTests(SynchronousTestCase):
             self.successResultOf(perform(dispatcher, Effect(req))),
             (response, "content"))
 
+    def test_metric_labels(self):
+        """
+        The metric labels specified in the Request are passed on to the treq
+        implementation.
+        """
+        req = ('GET', 'http://google.com/', None, None, None,
+               {'log': default_log, 'metric_labels': (('l', 'v'),)})
+        response = StubResponse(200, {})
+        treq = StubTreq(reqs=[(req, response)],
+                        contents=[(response, "content")])
+        req = Request(method="get", url="http://google.com/",
+                      metric_labels=(('l', 'v'),))
+        req.treq = treq
+        dispatcher = get_simple_dispatcher(None)
+        self.assertEqual(
+            self.successResultOf(perform(dispatcher, Effect(req))),
+            (response, "content"))
+
     def test_log_effectful_fields(self):
         """
         The log passed to treq is bound with the fields from BoundFields.
@@ -131,6 +149,28 @@ class RequestEffectTests(SynchronousTestCase):
             (response, "content"))
 
 
+class CompressRequestTests(SynchronousTestCase):
+    """
+    Tests for performing a :obj:`Request` with ``compress=False``.
+    """
+    def test_not_compressed(self):
+        """
+        treq is told not to ask for a compressed response.
+        """
+        req = ('GET', 'http://nova/servers', None, None, None,
+               {'log': default_log, 'compress': False})
+        response = StubResponse(200, {})
+        treq = StubTreq(reqs=[(req, response)],
+                        contents=[(response, "content")])
+        req = Request(method='get', url='http://nova/servers',
+                      compress=False)
+        req.treq = treq
+        self.assertEqual(
+            self.successResultOf(
+                perform(get_simple_dispatcher(None), Effect(req))),
+            (response, "content"))
+
+
 class AddErrorHandlingTests(SynchronousTestCase):
     """Tests :func:`add_error_handling`."""
     def test_error(self):
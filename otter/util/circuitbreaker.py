@@ -0,0 +1,127 @@
+"""
+A circuit breaker that stops calling a dependency which keeps failing or
+responding slowly, and lets a few probe calls through after a while to find
+out if it has recovered.
+"""
+from collections import deque
+
+from characteristic import attributes
+
+from twisted.internet import defer
+
+from otter.util.metrics import registry as default_registry
+
+
+@attributes(['name'])
+class CircuitOpenError(Exception):
+    """
+    Raised instead of making a call while the circuit of the dependency it
+    would be made to is open.
+    """
+    def __str__(self):
+        return repr(self)
+
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half-open', 'open'
+
+
+class CircuitBreaker(object):
+    """
+    Run calls to a dependency, keeping track of the outcome of the last
+    ``window`` calls. The circuit opens when at least ``min_calls`` outcomes
+    are known and the proportion of them that failed, or took at least
+    ``slow_call_time`` seconds, reaches ``error_rate``.
+
+    While the circuit is open, calls fail immediately with
+    :obj:`CircuitOpenError`. After ``reset_timeout`` seconds the circuit is
+    half-open: up to ``probes`` concurrent calls are let through, and the
+    circuit closes again if a probe succeeds quickly or re-opens if it fails.
+
+    The :meth:`run` method has the same signature as
+    :meth:`DeferredLock.run`, so it can be used as a "Deferred bracket".
+
+    :param IReactorTime clock: Used to time calls and the reset timeout.
+    :param str name: Name of the dependency, used in errors, logs and metrics.
+    :param callable is_failure: Function of :obj:`Failure` -> ``bool``
+        telling if a failed call counts as a failure of the dependency.
+        Defaults to counting all failed calls.
+    :param log: Optional BoundLog to which state changes are logged.
+    :param metrics: :obj:`MetricsRegistry` in which the circuit state and
+        rejected calls are recorded.
+    """
+    def __init__(self, clock, name, window=20, min_calls=10, error_rate=0.5,
+                 slow_call_time=20, reset_timeout=30, probes=1,
+                 is_failure=None, log=None, metrics=default_registry):
+        self.clock = clock
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_time = slow_call_time
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.is_failure = is_failure or (lambda failure: True)
+        self.log = log
+        self.metrics = metrics
+
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._probing = 0
+        self._labels = (('circuit', name),)
+        metrics.set_gauge('circuit_breaker.open',
+                          lambda: int(self.state != CLOSED), self._labels)
+
+    def _change_state(self, state):
+        """Change state and log it."""
+        if self.log is not None:
+            self.log.msg('circuit-breaker-state-changed', circuit=self.name,
+                         old_state=self.state, new_state=state)
+        self.state = state
+        if state == OPEN:
+            self._opened_at = self.clock.seconds()
+        elif state == CLOSED:
+            self._outcomes.clear()
+
+    def _record(self, probe, failed):
+        """Record the outcome of a call."""
+        if probe:
+            self._probing -= 1
+            if self.state == HALF_OPEN:
+                self._change_state(OPEN if failed else CLOSED)
+        elif self.state == CLOSED:
+            self._outcomes.append(failed)
+            failures = sum(self._outcomes)
+            if (len(self._outcomes) >= self.min_calls and
+                    failures >= self.error_rate * len(self._outcomes)):
+                self._change_state(OPEN)
+
+    def run(self, f, *args, **kwargs):
+        """
+        Call ``f`` if the circuit allows it, and record its outcome.
+
+        :return: Deferred that fires with the result of ``f``, or fails with
+            :obj:`CircuitOpenError` without calling ``f``.
+        """
+        if (self.state == OPEN and
+                self.clock.seconds() - self._opened_at >= self.reset_timeout):
+            self._change_state(HALF_OPEN)
+        probe = self.state == HALF_OPEN
+        if self.state == OPEN or (probe and self._probing >= self.probes):
+            self.metrics.increment('circuit_breaker.rejected', self._labels)
+            return defer.fail(CircuitOpenError(name=self.name))
+        if probe:
+            self._probing += 1
+
+        start = self.clock.seconds()
+
+        def succeeded(result):
+            self._record(
+                probe, self.clock.seconds() - start >= self.slow_call_time)
+            return result
+
+        def failed(failure):
+            self._record(probe, bool(self.is_failure(failure)))
+            return failure
+
+        return defer.maybeDeferred(f, *args, **kwargs).addCallbacks(
+            succeeded, failed)
@@ -1,8 +1,18 @@
 """ CQL Batch wrapper"""
 
+import re
+
 from silverberg.client import ConsistencyLevel
 
-from otter.util.deferredutils import timeout_deferred
+from twisted.internet.defer import (
+    CancelledError, DeferredList, DeferredSemaphore, maybeDeferred)
+
+from otter.util.deferredutils import TimedOutError, timeout_deferred
+from otter.util.metrics import registry as default_registry
+
+
+MAX_CONCURRENT_BATCHES = 8
+"""Default number of chunks executed at the same time"""
 
 
 class Batch(object):
@@ -39,6 +49,135 @@ def batch(statements, timestamp=None):
     return Batch(statements, {}, None, timestamp)._generate()
 
 
+def padded(items):
+    """
+    Pad a list to a power of two length by repeating its last item.
+
+    A batch with a statement per item is a distinct query for every number of
+    items, each of which has to be prepared. Building it from padded items
+    bounds the number of distinct queries to the logarithm of the largest
+    batch. The repeated statements must be idempotent, like inserting or
+    deleting the same row again.
+    """
+    size = 1
+    while size < len(items):
+        size *= 2
+    if not items or size == len(items):
+        return items
+    return items + [items[-1]] * (size - len(items))
+
+
+def chunk_statements(statements):
+    """
+    Split statements into chunks of the statements of each partition, so
+    that the statements written to a partition are written atomically.
+
+    :param statements: iterable of (partition key, query, params) tuples.
+        Partition keys can be any hashable identifying the partition written.
+    :return: ``list`` of ``list`` of statements, in the order the partitions
+        are first written, with the statements of every chunk in their given
+        order
+    """
+    chunks = []
+    by_partition = {}
+    for statement in statements:
+        partition = statement[0]
+        if partition not in by_partition:
+            by_partition[partition] = []
+            chunks.append(by_partition[partition])
+        by_partition[partition].append(statement)
+    return chunks
+
+
+_bind_re = re.compile(r':(\w+)')
+
+
+def chunked_batches(statements, params=None, timestamp=None, prefix='s'):
+    """
+    Build a batch for each partition written by statements, split with
+    :func:`chunk_statements`.
+
+    The bind variables of a statement that are in its params are renamed
+    with ``prefix`` and the index of the statement in its batch, e.g.
+    ``:trigger`` of the second statement becomes ``:s1trigger``. Other bind
+    variables are bound to ``params``, shared by all batches. The
+    statements of every chunk are :func:`padded`, so they must be
+    idempotent. Chunks of one statement are not wrapped in a batch.
+
+    :param statements: iterable of (partition key, query, params) tuples
+    :param dict params: Values shared by all statements
+    :param timestamp: Timestamp of the batches, see :func:`batch`
+
+    :return: ``list`` of (query, params) tuples
+    """
+    batches = []
+    for chunk in chunk_statements(statements):
+        queries, batch_params = [], dict(params or {})
+        for i, (_, query, stmt_params) in enumerate(padded(chunk)):
+            name = '{}{}'.format(prefix, i)
+            queries.append(_bind_re.sub(
+                lambda m: (':' + name + m.group(1)
+                           if m.group(1) in stmt_params else m.group(0)),
+                query))
+            batch_params.update(
+                (name + key, value) for key, value in stmt_params.items())
+        if len(queries) == 1 and timestamp is None:
+            batches.append((queries[0], batch_params))
+        else:
+            batches.append((batch(queries, timestamp), batch_params))
+    return batches
+
+
+class ChunkedBatchError(Exception):
+    """
+    Raised when some chunks of a chunked batch failed. The other chunks
+    have been written.
+
+    :ivar list failures: (chunk index, :obj:`Failure`) of the failed chunks
+    :ivar int chunks: Number of chunks
+    """
+    def __init__(self, failures, chunks):
+        super(ChunkedBatchError, self).__init__(
+            '{} of {} batch chunks failed: {}'.format(
+                len(failures), chunks,
+                ', '.join('{}: {!r}'.format(i, f.value) for i, f in failures)))
+        self.failures = failures
+        self.chunks = chunks
+
+
+def check_chunks(results):
+    """
+    Check the results of executing chunked batches.
+
+    :param list results: (success, result or :obj:`Failure`) of every chunk,
+        like the result of :obj:`DeferredList`
+    :return: ``list`` of the results of the chunks
+    :raises ChunkedBatchError: if any chunk failed
+    """
+    failures = [(i, result) for i, (success, result) in enumerate(results)
+                if not success]
+    if failures:
+        raise ChunkedBatchError(failures, len(results))
+    return [result for _, result in results]
+
+
+def execute_chunked(client, batches, consistency,
+                    concurrency=MAX_CONCURRENT_BATCHES):
+    """
+    Execute batches built by :func:`chunked_batches` in parallel, up to
+    ``concurrency`` of them at a time.
+
+    :return: Deferred fired with the ``list`` of the results of the batches,
+        or failed with :obj:`ChunkedBatchError` once all batches are done
+    """
+    sem = DeferredSemaphore(concurrency)
+    d = DeferredList(
+        [sem.run(client.execute, query, params, consistency)
+         for query, params in batches],
+        consumeErrors=True)
+    return d.addCallback(check_chunks)
+
+
 # TODO: This should ideally goto silverberg but is here due to `timeout_deferred`
 # implementation. It should be coming out in Twisted itself.
 # See http://twistedmatrix.com/trac/changeset/42627
@@ -69,3 +208,113 @@ class TimingOutCQLClient(object):
         See :py:func:`silverberg.client.CQLClient.disconnect`
         """
         return self._client.disconnect()
+
+
+_spaces_re = re.compile(r'\s+')
+_numbered_bind_re = re.compile(r'(:[A-Za-z_]*)\d+')
+_timestamp_re = re.compile(r'USING TIMESTAMP \d+')
+_bind_list_re = re.compile(r'(:\w+#\w*)(?:, \1)+')
+_batch_re = re.compile(r'^(BEGIN (?:\w+ )?BATCH (?:USING TIMESTAMP \S+ )?)'
+                       r'(.*)( APPLY BATCH;?)$')
+_statement_start_re = re.compile(r' (?=(?:INSERT|UPDATE|DELETE)\b)')
+
+
+def statement_template(query):
+    """
+    Normalize a query into a low-cardinality template suitable as a metric
+    label, like :func:`otter.util.metrics.url_template` does for URLs:
+    whitespace is collapsed, numbers in bind variable names and literal
+    timestamps are replaced by ``#``, lists of the same bind variable are
+    shortened, and consecutive identical statements of a batch are kept
+    once.
+
+    For example, a batch of ``DELETE FROM t WHERE k = :event0k;`` and
+    ``DELETE FROM t WHERE k = :event1k;`` becomes
+    ``BEGIN BATCH DELETE FROM t WHERE k = :event#k; APPLY BATCH;``.
+    """
+    query = _spaces_re.sub(' ', query).strip()
+    query = _numbered_bind_re.sub(r'\1#', query)
+    query = _timestamp_re.sub('USING TIMESTAMP #', query)
+    query = _bind_list_re.sub(r'\1, ...', query)
+    match = _batch_re.match(query)
+    if match is None:
+        return query
+    begin, body, end = match.groups()
+    statements = []
+    for statement in _statement_start_re.split(body):
+        if not statements or statements[-1] != statement:
+            statements.append(statement)
+    return begin + ' '.join(statements) + end
+
+
+class MetricsCQLClient(object):
+    """
+    A CQLClient implementation recording metrics of the queries, labeled
+    with their :func:`statement_template`:
+
+    * ``cql.latency`` histogram of the seconds taken by the queries
+    * ``cql.rows`` counter of the rows returned by the queries
+    * ``cql.errors`` and ``cql.timeouts`` counters of the failed queries,
+      timeouts being the queries that timed out or were cancelled
+    * ``cql.in_flight`` gauge of the queries not answered yet
+
+    :param IReactorTime clock: A IReactorTime provider
+    :param CQLClient client: An implementation of CQLClient
+    :param metrics: :obj:`MetricsRegistry` to record metrics in
+    """
+
+    max_templates = 1000
+    """Number of query templates remembered"""
+
+    def __init__(self, clock, client, metrics=default_registry):
+        self._clock = clock
+        self._client = client
+        self._metrics = metrics
+        self._templates = {}
+        self._in_flight = {}
+
+    def _labels(self, query):
+        labels = self._templates.get(query)
+        if labels is None:
+            if len(self._templates) >= self.max_templates:
+                self._templates.clear()
+            labels = (('statement', statement_template(query)),)
+            self._templates[query] = labels
+            if labels not in self._in_flight:
+                self._in_flight[labels] = 0
+                self._metrics.set_gauge(
+                    'cql.in_flight',
+                    lambda: self._in_flight[labels], labels)
+        return labels
+
+    def execute(self, query, params, consistency):
+        """
+        See :py:func:`silverberg.client.CQLClient.execute`
+        """
+        labels = self._labels(query)
+        start = self._clock.seconds()
+        self._in_flight[labels] += 1
+        d = maybeDeferred(self._client.execute, query, params, consistency)
+
+        def record(result):
+            self._in_flight[labels] -= 1
+            self._metrics.observe('cql.latency',
+                                  self._clock.seconds() - start, labels)
+            if isinstance(result, list):
+                self._metrics.increment('cql.rows', labels, len(result))
+            return result
+
+        def failed(failure):
+            if failure.check(TimedOutError, CancelledError):
+                self._metrics.increment('cql.timeouts', labels)
+            else:
+                self._metrics.increment('cql.errors', labels)
+            return failure
+
+        return d.addBoth(record).addErrback(failed)
+
+    def disconnect(self):
+        """
+        See :py:func:`silverberg.client.CQLClient.disconnect`
+        """
+        return self._client.disconnect()
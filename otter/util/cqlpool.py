@@ -0,0 +1,452 @@
+"""
+A CQL client keeping a pool of connections to every host of a Cassandra
+cluster, and sending queries to the replicas of the partition they read or
+write, least loaded first.
+"""
+import re
+import struct
+from bisect import bisect_left
+
+from twisted.internet.defer import Deferred, DeferredList, DeferredSemaphore
+from twisted.internet.endpoints import TCP4ClientEndpoint
+from twisted.internet.error import ConnectError
+from twisted.python.failure import Failure
+
+from otter.util.cqlprepared import PreparingCQLClient, marshal_value
+from otter.util.deferredutils import TimedOutError, timeout_deferred
+from otter.util.metrics import registry as default_registry
+
+
+_MASK = (1 << 64) - 1
+_MIN_TOKEN = -(1 << 63)
+_MAX_TOKEN = (1 << 63) - 1
+_C1 = 0x87c37b91114253d5
+_C2 = 0x4cf5ad432745937f
+
+_blocks = struct.Struct('<QQ')
+_short = struct.Struct('>H')
+
+
+def _rotl(x, r):
+    return ((x << r) | (x >> (64 - r))) & _MASK
+
+
+def _fmix(k):
+    k ^= k >> 33
+    k = (k * 0xff51afd7ed558ccd) & _MASK
+    k ^= k >> 33
+    k = (k * 0xc4ceb9fe1a85ec53) & _MASK
+    return k ^ (k >> 33)
+
+
+def murmur3_token(key):
+    """
+    Get the token of a partition key like Cassandra's ``Murmur3Partitioner``:
+    the first 64 bits of its MurmurHash3 x64 128 bits hash, with the bytes of
+    the tail sign extended like Cassandra does.
+
+    :param str key: The serialized partition key, see :func:`routing_key`.
+    :return: ``int`` token
+    """
+    length = len(key)
+    nblocks = length // 16
+    h1 = h2 = 0
+    for i in range(nblocks):
+        k1, k2 = _blocks.unpack_from(key, i * 16)
+        h1 ^= (_rotl((k1 * _C1) & _MASK, 31) * _C2) & _MASK
+        h1 = (_rotl(h1, 27) + h2) & _MASK
+        h1 = (h1 * 5 + 0x52dce729) & _MASK
+        h2 ^= (_rotl((k2 * _C2) & _MASK, 33) * _C1) & _MASK
+        h2 = (_rotl(h2, 31) + h1) & _MASK
+        h2 = (h2 * 5 + 0x38495ab5) & _MASK
+
+    tail = struct.unpack_from('{}b'.format(length % 16), key, nblocks * 16)
+    k1 = k2 = 0
+    for i, byte in enumerate(tail):
+        if i < 8:
+            k1 ^= (byte << (8 * i)) & _MASK
+        else:
+            k2 ^= (byte << (8 * (i - 8))) & _MASK
+    if len(tail) > 8:
+        h2 ^= (_rotl((k2 * _C2) & _MASK, 33) * _C1) & _MASK
+    if tail:
+        h1 ^= (_rotl((k1 * _C1) & _MASK, 31) * _C2) & _MASK
+
+    h1 ^= length
+    h2 ^= length
+    h1 = (h1 + h2) & _MASK
+    h2 = (h2 + h1) & _MASK
+    h1 = (_fmix(h1) + _fmix(h2)) & _MASK
+    token = h1 - (1 << 64) if h1 > _MAX_TOKEN else h1
+    return _MAX_TOKEN if token == _MIN_TOKEN else token
+
+
+def routing_key(columns, params):
+    """
+    Serialize a partition key like Cassandra does: the value of its column,
+    or the length, value and a null byte of each of its columns when it has
+    many.
+
+    :param list columns: (name, marshal type) of the partition key columns,
+        like ``[('tenantId', 'AsciiType')]``
+    :param dict params: Values by column name
+    :return: ``str`` key, or None if a value is missing or can not be
+        serialized
+    """
+    try:
+        values = [marshal_value(cql_type, params[name])
+                  for name, cql_type in columns]
+    except (KeyError, ValueError):
+        return None
+    if len(values) == 1:
+        return values[0]
+    return ''.join(_short.pack(len(value)) + value + '\x00'
+                   for value in values)
+
+
+class TokenRing(object):
+    """
+    The hosts replicating each token range of a keyspace.
+
+    :param ranges: iterable of (end token, hosts) of the ranges, each
+        range going from the end of the previous one (excluded) to its end
+        (included), and the first one wrapping around from the last one.
+    """
+    def __init__(self, ranges):
+        ranges = sorted(ranges)
+        self._ends = [end for end, _ in ranges]
+        self._hosts = [hosts for _, hosts in ranges]
+
+    @classmethod
+    def from_thrift(cls, ranges):
+        """
+        Build the ring from the ``TokenRange`` returned by Thrift's
+        ``describe_ring``, using their RPC addresses when given.
+        """
+        return cls((int(r.end_token), list(r.rpc_endpoints or r.endpoints))
+                   for r in ranges)
+
+    def replicas(self, token):
+        """
+        Get the hosts replicating a token.
+
+        :return: ``list`` of hosts, empty if the ring is empty
+        """
+        if not self._ends:
+            return []
+        index = bisect_left(self._ends, token)
+        return self._hosts[index % len(self._ends)]
+
+
+class HostPool(object):
+    """
+    Connections to a host, with at most ``max_in_flight`` queries sent at a
+    time through them. Other queries wait in a queue.
+
+    The latency of queries is recorded in the ``cassandra.latency`` histogram
+    labeled with the host, and the queries in flight and queued are exposed
+    as ``cassandra.in_flight`` and ``cassandra.queued`` gauges.
+
+    :param clock: IReactorTime provider
+    :param str host: Address of the host
+    :param list clients: CQL clients connected to the host, used in turn
+    :param int max_in_flight: Queries sent at a time
+    :param timeout: Seconds after which a query sent to the host fails with
+        :obj:`TimedOutError`
+    :param metrics: :obj:`MetricsRegistry` to record statistics in
+    """
+    def __init__(self, clock, host, clients, max_in_flight, timeout,
+                 metrics=default_registry):
+        self.clock = clock
+        self.host = host
+        self.clients = clients
+        self.timeout = timeout
+        self.down_until = None
+        self._next = 0
+        self._max_in_flight = max_in_flight
+        self._sem = DeferredSemaphore(max_in_flight)
+        self._metrics = metrics
+        self._labels = (('host', host),)
+        metrics.set_gauge('cassandra.in_flight', lambda: self.in_flight,
+                          self._labels)
+        metrics.set_gauge('cassandra.queued', lambda: self.queued,
+                          self._labels)
+
+    @property
+    def in_flight(self):
+        """Number of queries sent to the host and not answered yet"""
+        return self._max_in_flight - self._sem.tokens
+
+    @property
+    def queued(self):
+        """Number of queries waiting to be sent"""
+        return len(self._sem.waiting)
+
+    @property
+    def load(self):
+        """Number of queries sent or waiting to be"""
+        return self.in_flight + self.queued
+
+    def is_up(self):
+        """Is the host not marked down, or was it long enough ago?"""
+        return (self.down_until is None or
+                self.down_until <= self.clock.seconds())
+
+    def mark_down(self, interval):
+        """Do not prefer this host for ``interval`` seconds."""
+        self.down_until = self.clock.seconds() + interval
+        self._metrics.increment('cassandra.host_down', self._labels)
+
+    def stats(self):
+        """
+        :return: ``dict`` of queries in flight and queued, whether the host
+            is up and estimated latency percentiles
+        """
+        latency = self._metrics.histogram('cassandra.latency', self._labels)
+        return {'in_flight': self.in_flight, 'queued': self.queued,
+                'up': self.is_up(),
+                'p50': latency and latency.percentile(50),
+                'p99': latency and latency.percentile(99)}
+
+    def _send(self, query, params, consistency):
+        client = self.clients[self._next % len(self.clients)]
+        self._next += 1
+        start = self.clock.seconds()
+        d = client.execute(query, params, consistency)
+        timeout_deferred(d, self.timeout, self.clock,
+                         'CQL query to {}'.format(self.host))
+
+        def observe(result):
+            self._metrics.observe('cassandra.latency',
+                                  self.clock.seconds() - start, self._labels)
+            return result
+
+        return d.addBoth(observe)
+
+    def execute(self, query, params, consistency):
+        """
+        See :py:func:`silverberg.client.CQLClient.execute`
+        """
+        return self._sem.run(self._send, query, params, consistency)
+
+    def disconnect(self):
+        """Disconnect every connection to the host."""
+        return DeferredList([client.disconnect() for client in self.clients])
+
+
+_table_re = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+"?(\w+)"?', re.I)
+
+
+class TokenAwareCassandraCluster(object):
+    """
+    A CQL client sending queries to a pool of connections per host of the
+    cluster, like :obj:`silverberg.cluster.RoundRobinCassandraCluster` but
+    choosing the host:
+
+    * Queries on a table of ``partition_keys`` whose params have values for
+      all the partition key columns, under the columns' names, are sent to
+      the replicas of their partition, after :meth:`refresh_ring`. Batches
+      are routed by their first statement.
+    * Among the candidate hosts, those marked down are tried last and the
+      least loaded first.
+    * Hosts on which a query times out or can not connect are marked down
+      for ``down_interval`` seconds. Queries that could not connect are
+      retried on the next host, and so are reads that timed out.
+    * When ``speculative_delay`` is given, reads not answered by then are
+      also sent to the next host, and the first answer is used.
+
+    :param reactor: IReactorTime and IReactorTCP provider
+    :param list seed_hosts: (address, port) of the hosts to connect to
+        before knowing the ring. Hosts found in the ring are connected to
+        on the port of the first seed.
+    :param str keyspace: The keyspace to use
+    :param dict partition_keys: Partition key columns by table, as given to
+        :func:`routing_key`
+    :param int connections: Connections per host
+    :param int max_in_flight: Queries sent at a time per host
+    :param timeout: Seconds after which a query sent to a host times out
+    :param down_interval: Seconds during which hosts are marked down
+    :param speculative_delay: Seconds after which reads are sent to another
+        host, or None to not send them again
+    :param metrics: :obj:`MetricsRegistry` to record statistics in
+    """
+    def __init__(self, reactor, seed_hosts, keyspace, partition_keys=None,
+                 connections=2, max_in_flight=64, timeout=30,
+                 down_interval=10, speculative_delay=None, user=None,
+                 password=None, metrics=default_registry, log=None):
+        self._reactor = reactor
+        self._keyspace = keyspace
+        self._partition_keys = partition_keys or {}
+        self._connections = connections
+        self._max_in_flight = max_in_flight
+        self._timeout = timeout
+        self._down_interval = down_interval
+        self._speculative_delay = speculative_delay
+        self._user = user
+        self._password = password
+        self._metrics = metrics
+        self._log = log
+        self._port = seed_hosts[0][1]
+        self._ring = TokenRing([])
+        self._pools = {}
+        self._seeds = [self._pool(address, port)
+                       for address, port in seed_hosts]
+
+    def _make_client(self, address, port):
+        return PreparingCQLClient(
+            TCP4ClientEndpoint(self._reactor, address, port), self._keyspace,
+            self._user, self._password, True)
+
+    def _pool(self, address, port=None):
+        """Get the pool of connections to a host, creating it if needed."""
+        if address not in self._pools:
+            self._pools[address] = HostPool(
+                self._reactor, address,
+                [self._make_client(address, port or self._port)
+                 for _ in range(self._connections)],
+                self._max_in_flight, self._timeout, self._metrics)
+        return self._pools[address]
+
+    def refresh_ring(self):
+        """
+        Get the replicas of the keyspace's token ranges from a seed, and
+        connect to the hosts that were not known.
+
+        :return: Deferred fired with None. Errors are logged, and the
+            previous ring kept.
+        """
+        seed = min(self._seeds, key=lambda pool: not pool.is_up())
+        d = seed.clients[0]._connection()
+        d.addCallback(lambda client: client.describe_ring(self._keyspace))
+
+        def got_ring(ranges):
+            self._ring = TokenRing.from_thrift(ranges)
+            for r in ranges:
+                for address in r.rpc_endpoints or r.endpoints:
+                    self._pool(address)
+
+        def failed(failure):
+            if self._log is not None:
+                self._log.err(failure, 'Could not refresh Cassandra ring',
+                              host=seed.host)
+
+        return d.addCallbacks(got_ring, failed)
+
+    def stats(self):
+        """
+        :return: ``dict`` of :meth:`HostPool.stats` by host
+        """
+        return {address: pool.stats() for address, pool in self._pools.items()}
+
+    def _token(self, query, params):
+        match = _table_re.search(query)
+        columns = match and self._partition_keys.get(match.group(1))
+        key = columns and routing_key(columns, params)
+        return None if key is None else murmur3_token(key)
+
+    def _candidates(self, query, params):
+        """
+        Get the hosts to send a query to, in order of preference.
+        """
+        token = self._token(query, params)
+        replicas = set() if token is None else set(self._ring.replicas(token))
+        return sorted(
+            self._pools.values(),
+            key=lambda pool: (not pool.is_up(), pool.host not in replicas,
+                              pool.load))
+
+    def execute(self, query, params, consistency):
+        """
+        See :py:func:`silverberg.client.CQLClient.execute`
+        """
+        hosts = self._candidates(query, params)
+        is_read = query.lstrip()[:6].upper() == 'SELECT'
+        state = {'tried': 0, 'pending': 0, 'speculation': None,
+                 'attempts': []}
+
+        def cancel(_):
+            if state['speculation'] is not None:
+                state['speculation'].cancel()
+                state['speculation'] = None
+            for d in state['attempts']:
+                d.cancel()
+
+        result = Deferred(cancel)
+
+        def retriable(failure):
+            return (failure.check(ConnectError) or
+                    (is_read and failure.check(TimedOutError)))
+
+        def attempt():
+            host = hosts[state['tried']]
+            state['tried'] += 1
+            state['pending'] += 1
+            d = host.execute(query, params, consistency)
+            state['attempts'].append(d)
+            d.addBoth(finished, host)
+            if (is_read and self._speculative_delay is not None and
+                    state['tried'] < len(hosts)):
+                state['speculation'] = self._reactor.callLater(
+                    self._speculative_delay, speculate)
+
+        def speculate():
+            state['speculation'] = None
+            self._metrics.increment('cassandra.speculative_retries')
+            attempt()
+
+        def finished(outcome, host):
+            state['pending'] -= 1
+            failed = isinstance(outcome, Failure)
+            if failed and outcome.check(ConnectError, TimedOutError):
+                host.mark_down(self._down_interval)
+            if result.called:
+                return
+            if failed and retriable(outcome):
+                if state['tried'] < len(hosts):
+                    if state['speculation'] is not None:
+                        state['speculation'].cancel()
+                        state['speculation'] = None
+                    attempt()
+                    return
+                if state['pending'] > 0:
+                    return
+            if state['speculation'] is not None:
+                state['speculation'].cancel()
+                state['speculation'] = None
+            if failed:
+                result.errback(outcome)
+            else:
+                result.callback(outcome)
+
+        attempt()
+        return result
+
+    def disconnect(self):
+        """
+        Disconnect from every host.
+
+        :return: :obj:`DeferredList` fired when every connection is closed
+        """
+        return DeferredList([pool.disconnect()
+                             for pool in self._pools.values()])
+
+
+def tcp_address(description):
+    """
+    Get the host and port of a ``tcp:`` client endpoint description, like
+    ``tcp:127.0.0.1:9160`` or ``tcp:host=cass1:port=9160``.
+
+    :return: (address, port) tuple
+    :raises ValueError: if it is not such a description
+    """
+    parts = description.split(':')
+    if parts[0] != 'tcp':
+        raise ValueError(description)
+    kwargs = dict(part.split('=', 1) for part in parts[1:] if '=' in part)
+    positional = [part for part in parts[1:] if '=' not in part]
+    try:
+        address = kwargs['host'] if 'host' in kwargs else positional.pop(0)
+        port = kwargs['port'] if 'port' in kwargs else positional.pop(0)
+        return address, int(port)
+    except (IndexError, ValueError):
+        raise ValueError(description)
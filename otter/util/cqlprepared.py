@@ -0,0 +1,332 @@
+"""
+CQL clients that prepare each distinct query once per connection and then
+execute it by id with bound values, so that Cassandra does not parse the
+query again and the query text is not sent with every request.
+"""
+import calendar
+import re
+import struct
+from datetime import datetime
+from uuid import UUID
+from weakref import WeakKeyDictionary
+
+from silverberg.cassandra import ttypes
+from silverberg.client import CQLClient
+from silverberg.cluster import RoundRobinCassandraCluster
+from silverberg.marshal import unmarshallers
+
+from twisted.internet.defer import Deferred, succeed
+
+
+_MARSHAL = 'org.apache.cassandra.db.marshal.'
+
+_int32 = struct.Struct('>i')
+_int64 = struct.Struct('>q')
+_float = struct.Struct('>f')
+_double = struct.Struct('>d')
+_short = struct.Struct('>H')
+
+
+def _marshal_ascii(value):
+    if isinstance(value, unicode):
+        return value.encode('ascii')
+    if isinstance(value, str):
+        return value
+    raise ValueError(value)
+
+
+def _marshal_utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    if isinstance(value, str):
+        return value
+    raise ValueError(value)
+
+
+def _marshal_bool(value):
+    if not isinstance(value, bool):
+        raise ValueError(value)
+    return '\x01' if value else '\x00'
+
+
+def _packer(packer, types):
+    def marshal(value):
+        if isinstance(value, bool) or not isinstance(value, types):
+            raise ValueError(value)
+        try:
+            return packer.pack(value)
+        except struct.error:
+            raise ValueError(value)
+    return marshal
+
+
+def _marshal_varint(value):
+    if isinstance(value, bool) or not isinstance(value, (int, long)):
+        raise ValueError(value)
+    size = 1
+    while not -(1 << (8 * size - 1)) <= value < (1 << (8 * size - 1)):
+        size += 1
+    value &= (1 << (8 * size)) - 1
+    return ('%0*x' % (2 * size, value)).decode('hex')
+
+
+def _marshal_timestamp(value):
+    if isinstance(value, datetime):
+        value = (calendar.timegm(value.utctimetuple()) * 1000 +
+                 value.microsecond // 1000)
+    return _marshal_long(value)
+
+
+def _marshal_uuid(value):
+    if isinstance(value, basestring):
+        value = UUID(value)
+    if not isinstance(value, UUID):
+        raise ValueError(value)
+    return value.bytes
+
+
+def _marshal_collection(marshallers, items):
+    """
+    Serialize the number of items followed by the length and value of each
+    element, with the items of lists and sets having one element and the
+    items of maps having two.
+    """
+    parts = [_short.pack(len(items))]
+    for item in items:
+        for marshal, element in zip(marshallers, item):
+            element = marshal(element)
+            parts.extend([_short.pack(len(element)), element])
+    return ''.join(parts)
+
+
+_marshal_long = _packer(_int64, (int, long))
+
+_marshallers = {
+    'AsciiType': _marshal_ascii,
+    'UTF8Type': _marshal_utf8,
+    'BytesType': _marshal_ascii,
+    'BooleanType': _marshal_bool,
+    'Int32Type': _packer(_int32, (int, long)),
+    'LongType': _marshal_long,
+    'CounterColumnType': _marshal_long,
+    'IntegerType': _marshal_varint,
+    'FloatType': _packer(_float, (int, long, float)),
+    'DoubleType': _packer(_double, (int, long, float)),
+    'DateType': _marshal_timestamp,
+    'TimestampType': _marshal_timestamp,
+    'UUIDType': _marshal_uuid,
+    'TimeUUIDType': _marshal_uuid,
+}
+
+_type_re = re.compile(r'^([^(]+)(?:\((.*)\))?$')
+
+_type_marshallers = {}
+
+
+def _split_types(types):
+    """Split comma separated types, ignoring commas inside parentheses."""
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(types):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(types[start:i])
+            start = i + 1
+    parts.append(types[start:])
+    return parts
+
+
+def _marshaller(cql_type):
+    """
+    Get the function serializing values of a Cassandra marshal type, like
+    ``org.apache.cassandra.db.marshal.ListType(...UTF8Type)``.
+
+    :raises ValueError: if the type is not supported.
+    """
+    match = _type_re.match(cql_type)
+    if match is None:
+        raise ValueError(cql_type)
+    name, args = match.groups()
+    name = name[len(_MARSHAL):] if name.startswith(_MARSHAL) else name
+    if name == 'ReversedType':
+        return _marshaller(args)
+    if name in ('ListType', 'SetType'):
+        marshal_item = _marshaller(args)
+
+        def marshal_items(value):
+            if not isinstance(value, (list, tuple, set, frozenset)):
+                raise ValueError(value)
+            return _marshal_collection([marshal_item],
+                                       [(item,) for item in value])
+        return marshal_items
+    if name == 'MapType':
+        marshal_pair = map(_marshaller, _split_types(args))
+
+        def marshal_map(value):
+            if not isinstance(value, dict):
+                raise ValueError(value)
+            return _marshal_collection(marshal_pair, value.items())
+        return marshal_map
+    if args is not None or name not in _marshallers:
+        raise ValueError(cql_type)
+    return _marshallers[name]
+
+
+def marshal_value(cql_type, value):
+    """
+    Serialize a value bound to a prepared statement.
+
+    :param str cql_type: Cassandra marshal type of the bind variable, as
+        given in :obj:`CqlPreparedResult.variable_types`.
+    :param value: The value. Timestamps can be given as ``datetime`` or
+        milliseconds since epoch, and UUIDs as :obj:`UUID` or ``str``.
+
+    :return: ``str`` of the serialized value.
+    :raises ValueError: if the value can not be serialized to the type.
+        Note that ``None`` can not be bound through Thrift.
+    """
+    if value is None:
+        raise ValueError(value)
+    if cql_type not in _type_marshallers:
+        _type_marshallers[cql_type] = _marshaller(cql_type)
+    return _type_marshallers[cql_type](value)
+
+
+def bind_values(prepared, params):
+    """
+    Get the serialized values to execute a prepared statement with.
+
+    :param prepared: :obj:`CqlPreparedResult` of the statement.
+    :param dict params: Values by name of the bind variables.
+
+    :return: ``list`` of ``str`` in the order of the bind variables.
+    :raises ValueError: if the statement does not have named bind variables,
+        or a value is missing or can not be serialized.
+    """
+    if prepared.variable_names is None:
+        raise ValueError('Unnamed bind variables')
+    try:
+        return [marshal_value(cql_type, params[name])
+                for name, cql_type in zip(prepared.variable_names,
+                                          prepared.variable_types)]
+    except KeyError as e:
+        raise ValueError('Missing value for {}'.format(e))
+
+
+class PreparingCQLClient(CQLClient):
+    """
+    A :obj:`CQLClient` that executes queries as prepared statements.
+
+    Each distinct query text is prepared the first time it is executed on a
+    connection, and its id is kept for as long as the connection is. Queries
+    are executed as before, with their values substituted in the query text,
+    when they have no parameters, when some parameter can not be bound
+    (e.g. ``None``, which Thrift can not send), or when Cassandra refuses to
+    prepare them. A query whose id Cassandra rejects is prepared again and
+    retried once.
+
+    Takes the same arguments as :obj:`CQLClient`.
+    """
+    def __init__(self, *args, **kwargs):
+        super(PreparingCQLClient, self).__init__(*args, **kwargs)
+        self._statements = WeakKeyDictionary()
+        self._unpreparable = set()
+
+    def execute(self, query, args, consistency):
+        """
+        See :py:func:`silverberg.client.CQLClient.execute`
+        """
+        if not args or query in self._unpreparable:
+            return super(PreparingCQLClient, self).execute(
+                query, args, consistency)
+        d = self._connection()
+        d.addCallback(self._execute_prepared, query, args, consistency)
+        return d
+
+    def _prepare(self, client, query):
+        """
+        Prepare a query on the given connection, unless it has been already.
+
+        :return: Deferred fired with :obj:`CqlPreparedResult`, or None if
+            Cassandra refused to prepare it.
+        """
+        statements = self._statements.setdefault(client, {})
+        if query in statements:
+            return succeed(statements[query])
+
+        def prepared(result):
+            statements[query] = result
+            return result
+
+        def refused(failure):
+            failure.trap(ttypes.InvalidRequestException)
+            self._unpreparable.add(query)
+
+        d = client.prepare_cql3_query(query, ttypes.Compression.NONE)
+        return d.addCallbacks(prepared, refused)
+
+    def _execute_prepared(self, client, query, args, consistency,
+                          reprepare=True):
+        """
+        Execute a query as a prepared statement on the given connection.
+
+        If Cassandra does not know the statement's id anymore, for instance
+        after it restarted or evicted the statement from its cache, the query
+        is prepared again and executed once more when ``reprepare`` is True.
+        """
+        def execute(prepared):
+            try:
+                values = None if prepared is None else bind_values(
+                    prepared, args)
+            except ValueError:
+                values = None
+            if values is None:
+                return super(PreparingCQLClient, self).execute(
+                    query, args, consistency)
+            d = client.execute_prepared_cql3_query(
+                prepared.itemId, values, consistency)
+            if self._disconnect_on_cancel:
+                cancellable_d = Deferred(lambda d: self.disconnect())
+                d.chainDeferred(cancellable_d)
+                d = cancellable_d
+            d.addCallback(self._process_result)
+            if reprepare:
+                d.addErrback(prepare_again)
+            return d
+
+        def prepare_again(failure):
+            failure.trap(ttypes.InvalidRequestException)
+            self._statements.get(client, {}).pop(query, None)
+            return self._execute_prepared(client, query, args, consistency,
+                                          reprepare=False)
+
+        return self._prepare(client, query).addCallback(execute)
+
+    def _process_result(self, result):
+        """
+        Convert a :obj:`CqlResult` like :meth:`CQLClient.execute` does.
+        """
+        if result.type == ttypes.CqlResultType.ROWS:
+            return self._unmarshal_result(result.schema, result.rows,
+                                          unmarshallers)
+        elif result.type == ttypes.CqlResultType.INT:
+            return result.num
+        else:
+            return None
+
+
+class PreparingCassandraCluster(RoundRobinCassandraCluster):
+    """
+    A :obj:`RoundRobinCassandraCluster` of :obj:`PreparingCQLClient`.
+
+    Takes the same arguments as :obj:`RoundRobinCassandraCluster`.
+    """
+    def __init__(self, seed_endpoints, keyspace, user=None, password=None,
+                 disconnect_on_cancel=False):
+        self._seed_clients = [
+            PreparingCQLClient(endpoint, keyspace, user, password,
+                               disconnect_on_cancel)
+            for endpoint in seed_endpoints]
+        self._client_idx = 0
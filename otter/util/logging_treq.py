@@ -3,22 +3,59 @@ A wrapper around treq to log all requests along with the status code and time
 it took.
 """
 from functools import wraps
+from urlparse import urlsplit
 from uuid import uuid4
 
 import attr
 
 import treq
+from treq._utils import default_pool, default_reactor
+from treq.client import HTTPClient
 
 from twisted.internet import reactor
+from twisted.web.client import Agent
+from twisted.web.iweb import IAgent
+
+from zope.interface import implementer
 
 from otter.log import log as default_log
 from otter.util.deferredutils import timeout_deferred
+from otter.util.metrics import http_labels, registry as default_registry
 
 
 _treq_request_methods = ('get', 'head', 'post', 'put', 'delete',
                          'patch', 'request')
 
 
+@implementer(IAgent)
+class _IdentityAgent(object):
+    """
+    Agent that does not ask for compressed responses, by removing the
+    ``accept-encoding`` header that treq adds to every request.
+    """
+    def __init__(self, agent):
+        self._agent = agent
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        """Make the request without an ``accept-encoding`` header."""
+        if headers is not None:
+            headers = headers.copy()
+            headers.removeHeader('accept-encoding')
+        return self._agent.request(method, uri, headers, bodyProducer)
+
+
+def uncompressed_request(method, url, **kwargs):
+    """
+    Like :py:func:`treq.request`, but without asking for the response to be
+    gzip-encoded, so that it does not need to be decoded.
+    """
+    _reactor = default_reactor(kwargs.get('reactor'))
+    pool = default_pool(_reactor, kwargs.get('pool'),
+                        kwargs.get('persistent'))
+    client = HTTPClient(_IdentityAgent(Agent(_reactor, pool=pool)))
+    return client.request(method, url, **kwargs)
+
+
 @attr.s
 class LoggingTreq(object):
     """
@@ -33,10 +70,14 @@ class LoggingTreq(object):
     :ivar log_response: - a boolean as to whether or not the response bodies
         should be logged as bytes.  Defaults to False, because this can be
         dangerous as it may log secret information such as admin passwords.
+    :ivar metrics: - a :obj:`MetricsRegistry` in which request times, status
+        codes, errors and bytes sent and received are recorded - will use
+        the default registry in :obj:`otter.util.metrics` if not provided.
     """
     clock = attr.ib(default=reactor)
     log = attr.ib(default=default_log)
     log_response = attr.ib(default=False)
+    metrics = attr.ib(default=default_registry)
 
     def __getattr__(self, name):
         """
@@ -44,9 +85,14 @@ class LoggingTreq(object):
         """
         return getattr(treq, name)
 
-    def request(self, method, url, **kwargs):
-        """Wrapper around :py:func:`treq.request` that logs the request."""
-        return self.log_request(treq.request)(url, method=method, **kwargs)
+    def request(self, method, url, compress=True, **kwargs):
+        """
+        Wrapper around :py:func:`treq.request` that logs the request. If
+        ``compress`` is False, the response is not asked to be gzip-encoded,
+        see :func:`uncompressed_request`.
+        """
+        treq_call = treq.request if compress else uncompressed_request
+        return self.log_request(treq_call)(url, method=method, **kwargs)
 
     def head(self, url, headers=None, **kwargs):
         """Wrapper around :py:func:`treq.head` that logs the request."""
@@ -82,6 +128,9 @@ class LoggingTreq(object):
             default reactor if not provided.
         - ``log`` - a BoundLog instance - will use the default BoundLog
             instance in :obj:`otter.log` if not provided.
+        - ``metric_labels`` - labels under which the request is recorded in
+            :attr:`metrics`, as built by :func:`http_labels`. Defaults to
+            labels using the host of the URL as the service.
 
         Note that the `headers` are modified to include a treq-specific request
         ID.
@@ -93,6 +142,13 @@ class LoggingTreq(object):
 
             method = kwargs.get('method', treq_call.__name__)
 
+            labels = kwargs.pop('metric_labels', None)
+            if labels is None:
+                labels = http_labels(urlsplit(url).netloc, method, url)
+            data = kwargs.get('data')
+            if isinstance(data, str):
+                self.metrics.increment('http.bytes_out', labels, len(data))
+
             kwargs.setdefault('headers', {})
             if kwargs['headers'] is None:
                 kwargs['headers'] = {}
@@ -114,6 +170,13 @@ class LoggingTreq(object):
                 kwargs = {'request_time': clock.seconds() - start_time,
                           'status_code': response.code,
                           'headers': response.headers}
+                self.metrics.observe('http.request_time',
+                                     kwargs['request_time'], labels)
+                self.metrics.increment(
+                    'http.responses', labels + (('code', response.code),))
+                length = getattr(response, 'length', None)
+                if isinstance(length, (int, long)):
+                    self.metrics.increment('http.bytes_in', labels, length)
                 message = (
                     "Request to {method} {url} resulted in a {status_code} "
                     "response after {request_time} seconds.")
@@ -131,6 +194,9 @@ class LoggingTreq(object):
 
             def log_failure(failure):
                 request_time = clock.seconds() - start_time
+                self.metrics.increment(
+                    'http.errors',
+                    labels + (('error', failure.type.__name__),))
                 log.msg("Request to {method} {url} failed after "
                         "{request_time} seconds.",
                         reason=failure, request_time=request_time)
@@ -0,0 +1,210 @@
+"""
+An in-process registry of counters, gauges and histograms, cheap enough to be
+updated on every request and exposed through the admin API or pushed to
+Cloud Metrics.
+"""
+import re
+from bisect import bisect_left
+from urlparse import urlsplit
+
+
+DEFAULT_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                  20, 30, 45, 60)
+"""Default histogram bucket upper bounds, in seconds."""
+
+
+class Histogram(object):
+    """
+    A histogram of observed values with fixed bucket boundaries.
+
+    Observing is O(log(buckets)) and does not keep the individual values, so
+    percentiles in :meth:`snapshot` are estimated as the upper bound of the
+    bucket in which they fall.
+
+    :param tuple bounds: Sorted upper bounds of the buckets. Values greater
+        than the last bound are counted in an extra overflow bucket.
+    """
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = None
+
+    def observe(self, value):
+        """Record a value."""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def update(self, other):
+        """Add the values observed by a histogram with the same bounds."""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        if other.max is not None and (self.max is None or
+                                      other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, pct):
+        """
+        Estimate the given percentile as the upper bound of the bucket it
+        falls in, or the maximum value if it falls in the overflow bucket.
+
+        :param float pct: Percentile between 0 and 100.
+        :return: estimated value, or None if nothing has been observed.
+        """
+        if self.count == 0:
+            return None
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        """
+        :return: ``dict`` with count, sum, max, estimated 50th, 90th and
+            99th percentiles, and cumulative counts per bucket bound.
+        """
+        cumulative, buckets = 0, []
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            buckets.append([bound, cumulative])
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99), 'buckets': buckets}
+
+
+class MetricsRegistry(object):
+    """
+    Collection of named metrics. Each metric is further keyed by labels,
+    given as a tuple of ``(name, value)`` pairs, which callers on hot paths
+    are expected to build once and reuse.
+    """
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self._bounds = bounds
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def increment(self, name, labels=(), amount=1):
+        """Add ``amount`` to a counter."""
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, labels=()):
+        """
+        Set a gauge to the given value. ``value`` can also be a no-argument
+        callable, which is called whenever a snapshot is taken.
+        """
+        self._gauges[(name, labels)] = value
+
+    def observe(self, name, value, labels=()):
+        """Record a value in a histogram."""
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(self._bounds)
+        histogram.observe(value)
+
+    def counter(self, name, labels=()):
+        """Return the current value of a counter."""
+        return self._counters.get((name, labels), 0)
+
+    def histogram(self, name, labels=()):
+        """Return the :obj:`Histogram` for a metric, or None."""
+        return self._histograms.get((name, labels))
+
+    def histograms(self, name):
+        """
+        Return ``(labels, Histogram)`` pairs of every histogram of a metric.
+        """
+        return [(labels, histogram)
+                for (name_, labels), histogram in self._histograms.items()
+                if name_ == name]
+
+    def snapshot(self):
+        """
+        Get the current value of every metric.
+
+        :return: ``dict`` with ``counters``, ``gauges`` and ``histograms``
+            keys, each a list of ``dict`` with the ``name`` and ``labels``
+            (as a ``dict``) of the metric along with its value(s).
+        """
+        def entries(metrics, get_values):
+            return [dict(get_values(value), name=name, labels=dict(labels))
+                    for (name, labels), value in sorted(metrics.items())]
+
+        return {
+            'counters': entries(self._counters, lambda v: {'value': v}),
+            'gauges': entries(
+                self._gauges,
+                lambda v: {'value': v() if callable(v) else v}),
+            'histograms': entries(self._histograms, Histogram.snapshot)}
+
+    def clear(self):
+        """Forget all metrics."""
+        self._counters.clear()
+        self._gauges.clear()
+        self._histograms.clear()
+
+
+def flatten_snapshot(snapshot):
+    """
+    Flatten a :meth:`MetricsRegistry.snapshot` into ``(name, value)`` pairs
+    suitable for pushing to Cloud Metrics. Label values are appended to the
+    metric name in the sorted order of the label names, and histograms are
+    reduced to their count, max and percentiles.
+    """
+    def name_of(entry, *suffix):
+        labels = [entry['labels'][k] for k in sorted(entry['labels'])]
+        return '.'.join(map(str, [entry['name']] + labels + list(suffix)))
+
+    for entry in snapshot['counters'] + snapshot['gauges']:
+        yield name_of(entry), entry['value']
+    for entry in snapshot['histograms']:
+        for stat in ('count', 'max', 'p50', 'p90', 'p99'):
+            if entry[stat] is not None:
+                yield name_of(entry, stat), entry[stat]
+
+
+_ID_SEGMENT = re.compile(
+    r'^(\d+|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+    r'|[0-9a-f]{16,})$', re.I)
+
+
+def url_template(url):
+    """
+    Normalize a URL into a low-cardinality template suitable as a metric
+    label: scheme, host and query string are dropped and path segments that
+    look like IDs (numbers, UUIDs and long hex strings) are replaced by
+    ``{id}``.
+
+    For example, ``https://host/v2/123/servers/<uuid>?a=b`` becomes
+    ``/v2/{id}/servers/{id}``.
+    """
+    path = urlsplit(url).path
+    return '/'.join('{id}' if _ID_SEGMENT.match(segment) else segment
+                    for segment in path.split('/'))
+
+
+def http_labels(service, method, url):
+    """
+    Build the labels used by HTTP request metrics.
+
+    :param service: Name of the service (or host) that is requested.
+    :param str method: HTTP method.
+    :param str url: Absolute or relative URL, which will be normalized with
+        :func:`url_template`.
+    """
+    return (('method', method.upper()), ('service', service),
+            ('url', url_template(url)))
+
+
+registry = MetricsRegistry()
+"""The default, process-wide registry."""
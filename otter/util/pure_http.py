@@ -22,14 +22,22 @@ from otter.util import logging_treq
 from otter.util.http import APIError
 
 
-@attributes(['method', 'url', 'headers', 'data', 'params', 'log'],
+@attributes(['method', 'url', 'headers', 'data', 'params', 'log',
+             'metric_labels', 'compress'],
             defaults={'headers': None, 'data': None, 'params': None,
-                      'log': None})
+                      'log': None, 'metric_labels': None, 'compress': True})
 class Request(object):
     """
     An effect request for performing HTTP requests.
 
     The effect results in a two-tuple of (response, content).
+
+    ``metric_labels``, if given, are the labels under which the request is
+    recorded in the metrics registry, as built by
+    :func:`otter.util.metrics.http_labels`.
+
+    As treq does, a gzip-encoded response is asked for and decoded, unless
+    ``compress`` is False.
     """
 
     treq = logging_treq
@@ -50,11 +58,16 @@ def perform_request(dispatcher, intent):
     :return: A two-tuple of (HTTP Response, content as bytes)
     """
     log = merge_effectful_fields(dispatcher, intent.log)
+    kwargs = {}
+    if intent.metric_labels is not None:
+        kwargs['metric_labels'] = intent.metric_labels
+    if not intent.compress:
+        kwargs['compress'] = False
     response = yield intent.treq.request(intent.method.upper(), intent.url,
                                          headers=intent.headers,
                                          data=intent.data,
                                          params=intent.params,
-                                         log=log)
+                                         log=log, **kwargs)
     content = yield intent.treq.content(response)
     returnValue((response, content))
 
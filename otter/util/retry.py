@@ -3,6 +3,7 @@ Module that provides retrying-at-a-particular-interval functionality.
 """
 
 import random
+from functools import partial
 
 from characteristic import Attribute, attributes
 
@@ -12,6 +13,8 @@ from effect.retry import retry as effect_retry
 from twisted.internet import defer
 from twisted.python.failure import Failure
 
+from otter.util.metrics import registry as metrics_registry
+
 
 class _Retrier(object):
     """
@@ -297,6 +300,20 @@ class RetryTimes(object):
         return self.tries <= self.max_retries
 
 
+@attributes(['exceptions', 'can_retry'])
+class RetryExcept(object):
+    """
+    A callable that never retries failures wrapping one of ``exceptions``,
+    and otherwise defers to another ``can_retry`` function.
+
+    :param tuple exceptions: Exception types that are not retried.
+    :param can_retry: ``can_retry`` function for other failures.
+    """
+    def __call__(self, failure):
+        """Return False if ``failure`` wraps one of ``exceptions``."""
+        return not failure.check(*self.exceptions) and self.can_retry(failure)
+
+
 @attributes(['can_retry', 'next_interval'])
 class ShouldDelayAndRetry(object):
     """
@@ -342,13 +359,33 @@ class Retry(object):
     """
 
 
+def _count_retry(labels, should_retry, exc_info):
+    """
+    Call ``should_retry`` and count a ``http.retries`` metric with the given
+    labels if it decides to retry.
+    """
+    def count(retrying):
+        if retrying:
+            metrics_registry.increment('http.retries', labels)
+        return retrying
+    return should_retry(exc_info).on(count)
+
+
 @sync_performer
 def perform_retry(dispatcher, intent):
     """
     Invoke :func:`effect.retry.retry` with the effect and the
     should_retry function.
+
+    If the effect is a request that can be labeled for metrics (like
+    :obj:`otter.cloud_client.ServiceRequest`), every retry is counted in the
+    metrics registry.
     """
-    return effect_retry(intent.effect, intent.should_retry)
+    should_retry = intent.should_retry
+    labels = getattr(intent.effect.intent, 'metric_labels', None)
+    if labels is not None:
+        should_retry = partial(_count_retry, labels, should_retry)
+    return effect_retry(intent.effect, should_retry)
 
 
 def retry_effect(effect, can_retry, next_interval):